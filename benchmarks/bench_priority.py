@@ -0,0 +1,140 @@
+""" @package benchmarks.bench_priority
+Measures the dispatch latency of emergency commands while the command path is saturated.
+
+This script saturates a set of device command queues (see hwm.command.executor) with routine commands that each make a
+blocking call, so that every queue has a backlog and the reactor's thread pool is fully occupied. While the system is
+saturated, it periodically submits probe commands to one of the busy devices and measures:
+* dispatch latency: the time from submitting the probe until its device queue starts it
+* completion latency: the time from submitting the probe until its blocking call has completed
+
+The probes are run once as 'normal' commands (i.e. without priority lanes) and once as 'emergency' commands, and the
+mean, 99th percentile, and worst case latencies are printed for each. Run it from the repository root with:
+
+  python benchmarks/bench_priority.py [duration]
+"""
+
+# Import required modules
+import sys, time
+from twisted.internet import reactor, defer, task
+from hwm.command import executor
+
+## The number of busy devices
+device_count = 16
+
+## The number of routine commands kept waiting in each device's queue
+backlog_size = 50
+
+## How long (in seconds) each routine command blocks its thread for
+service_time = 0.02
+
+## How often (in seconds) a probe command is submitted
+probe_interval = 0.1
+
+class SaturationScenario(object):
+  """ Saturates a set of device queues with routine commands and measures the latency of probe commands.
+  """
+
+  def __init__(self, probe_priority):
+    """ Sets up the scenario.
+
+    @param probe_priority  The priority class to submit the probe commands with.
+    """
+
+    self.probe_priority = probe_priority
+    self.command_executor = executor.CommandExecutor()
+    self.device_queues = [self.command_executor.get_queue('device_'+str(device_index), 1)
+                          for device_index in range(device_count)]
+    self.dispatch_latencies = []
+    self.completion_latencies = []
+    self.running = False
+    self._probe_deferreds = []
+
+  @defer.inlineCallbacks
+  def run(self, duration):
+    """ Runs the scenario.
+
+    @param duration  How long (in seconds) to submit probe commands for.
+    @return Returns a deferred that will be fired once every probe has completed.
+    """
+
+    # Fill the queues with routine commands
+    self.running = True
+    for device_queue in self.device_queues:
+      for command_index in range(backlog_size):
+        self._submit_routine_command(device_queue)
+
+    # Submit the probes
+    probe_loop = task.LoopingCall(self._submit_probe)
+    probe_loop.start(probe_interval, now = False)
+    yield task.deferLater(reactor, duration, lambda: None)
+    probe_loop.stop()
+    yield defer.DeferredList(self._probe_deferreds)
+    self.running = False
+
+  def _submit_routine_command(self, device_queue):
+    """ Submits a routine command that makes a blocking call and then resubmits itself.
+
+    @param device_queue  The DeviceCommandQueue to submit the command to.
+    """
+
+    if not self.running:
+      return
+
+    command_deferred = device_queue.execute(self._run_routine_command, None)
+    command_deferred.addCallback(lambda command_results: self._submit_routine_command(device_queue))
+
+  def _run_routine_command(self, active_command):
+    return executor.defer_to_thread('normal', time.sleep, service_time)
+
+  def _submit_probe(self):
+    """ Submits a probe command to the first device.
+    """
+
+    submitted_at = time.time()
+    probe_deferred = self.device_queues[0].execute(self._run_probe, submitted_at, priority = self.probe_priority)
+    probe_deferred.addCallback(lambda probe_results: self.completion_latencies.append(time.time()-submitted_at))
+    self._probe_deferreds.append(probe_deferred)
+
+  def _run_probe(self, submitted_at):
+    self.dispatch_latencies.append(time.time()-submitted_at)
+    return executor.defer_to_thread(self.probe_priority, lambda: None)
+
+def summarize(latencies):
+  """ Summarizes a list of latencies.
+
+  @param latencies  A list of latencies in seconds.
+  @return Returns a (mean, 99th percentile, maximum) tuple in milliseconds.
+  """
+
+  sorted_latencies = sorted(latencies)
+  percentile_index = min(len(sorted_latencies)-1, int(len(sorted_latencies)*0.99))
+
+  return (sum(sorted_latencies)/len(sorted_latencies)*1000, sorted_latencies[percentile_index]*1000,
+          sorted_latencies[-1]*1000)
+
+@defer.inlineCallbacks
+def run_benchmarks(duration):
+  """ Runs the benchmark for each probe priority and prints the results.
+
+  @param duration  How long (in seconds) to run each scenario for.
+  """
+
+  try:
+    print "Saturating "+str(device_count)+" device queues ("+str(backlog_size)+" waiting commands each) for "+\
+          str(duration)+" seconds per scenario (latencies in milliseconds):"
+    print "%-10s %-11s %10s %10s %10s %7s" % ("probe", "latency", "mean", "p99", "max", "probes")
+
+    for probe_priority in ['normal', 'emergency']:
+      scenario = SaturationScenario(probe_priority)
+      yield scenario.run(duration)
+
+      for latency_name, latencies in [('dispatch', scenario.dispatch_latencies),
+                                      ('completion', scenario.completion_latencies)]:
+        print "%-10s %-11s %10.2f %10.2f %10.2f %7d" % ((probe_priority, latency_name)+summarize(latencies)+
+                                                        (len(latencies),))
+  finally:
+    reactor.stop()
+
+if __name__ == '__main__':
+  reactor.callWhenRunning(run_benchmarks, float(sys.argv[1]) if len(sys.argv) > 1 else 5)
+  reactor.run()
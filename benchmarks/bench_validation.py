@@ -0,0 +1,91 @@
+""" @package benchmarks.bench_validation
+Benchmarks the schema validators provided by hwm.core.validation.
+
+This script compares, for each registered schema, the cost of validating a representative document by constructing a
+new jsonschema.Draft3Validator (the previous behavior) against the cached validators provided by the validator registry.
+For the command envelope it also benchmarks the specialized fast validator. Run it from the repository root with:
+
+  python benchmarks/bench_validation.py [iterations]
+"""
+
+# Import required modules
+import os, sys, json, timeit, yaml, jsonschema
+from hwm.core import configuration
+from hwm.core.validation import Validators
+from hwm.command import command
+from hwm.network.security import permissions
+from hwm.sessions import schedule
+from hwm.hardware.pipelines import manager as pipeline_manager
+from hwm.hardware.devices import manager as device_manager
+
+## The directory containing the hardware manager package (and its test data)
+hwm_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hwm")
+
+def load_sample_documents():
+  """ Loads a representative document for each registered schema from the test data files.
+
+  @return Returns a dictionary containing the sample documents, keyed by schema name.
+  """
+
+  def load_json(relative_path):
+    with open(os.path.join(hwm_directory, relative_path)) as json_file:
+      return json.load(json_file)
+
+  def load_yaml(relative_path):
+    with open(os.path.join(hwm_directory, relative_path)) as yaml_file:
+      return yaml.safe_load(yaml_file)
+
+  # Load the configuration, which registers the 'configuration' schema
+  config = configuration.Configuration
+  config.verbose_startup = False
+  config.read_configuration(os.path.join(hwm_directory, "core/tests/data/test_config_basic.yml"))
+  config.validate_configuration()
+
+  return {
+    'command': {
+      'command': 'set_rx_freq',
+      'destination': 'test_pipeline.test_device',
+      'parameters': {'frequency': 145800000}
+    },
+    'permissions': load_json("network/security/tests/data/test_permissions_valid.json"),
+    'schedule': load_json("sessions/tests/data/test_schedule_valid.json"),
+    'pipeline': load_yaml("hardware/pipelines/tests/data/pipeline_configuration_valid.yml")['pipelines'],
+    'device': load_yaml("hardware/devices/tests/data/devices_configuration_valid.yml")['devices'],
+    'configuration': dict(config.options)
+  }
+
+def run_benchmarks(iterations):
+  """ Runs the validator benchmarks and prints the results.
+
+  @param iterations  The number of validations to time for each method.
+  """
+
+  sample_documents = load_sample_documents()
+
+  print "Validating each document "+str(iterations)+" times (microseconds per validation):"
+  print "%-14s %14s %14s %14s %9s" % ("schema", "new validator", "cached", "fast", "speedup")
+
+  for schema_name in sorted(sample_documents):
+    document = sample_documents[schema_name]
+    schema = Validators.get_schema(schema_name)
+
+    # Make sure the sample document is actually valid
+    Validators.get_validator(schema_name).validate(document)
+
+    # Time the uncached validator
+    uncached_time = timeit.timeit(lambda: jsonschema.Draft3Validator(schema).validate(document), number = iterations)
+
+    # Time the cached generic validator
+    cached_validator = Validators.get_validator(schema_name)
+    cached_time = timeit.timeit(lambda: cached_validator.validate(document), number = iterations)
+
+    # Time the registry, which will use the fast validator if available
+    registry_time = timeit.timeit(lambda: Validators.validate(schema_name, document), number = iterations)
+
+    per_call = lambda total_time: (total_time/iterations)*1000000
+    print "%-14s %14.1f %14.1f %14s %8.1fx" % (schema_name, per_call(uncached_time), per_call(cached_time),
+                                              ("%.1f" % per_call(registry_time)) if schema_name == 'command' else "-",
+                                              uncached_time/min(cached_time, registry_time))
+
+if __name__ == '__main__':
+  run_benchmarks(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,273 @@
+""" @package hwm.command.audit
+Contains an append-only log of every command executed by the hardware manager.
+
+This module contains the command audit log, which records every command that the command parser executes along with
+its response. Records are buffered in memory and written to disk in batches ("group commits") by a background writer
+thread so that the reactor never has to wait for the disk. The log files are rotated once they reach a configurable
+size, and an index of each written batch allows records to be looked up by time, user, and device without reading every
+log file.
+"""
+
+# Import required modules
+import os, json, time, logging, threading, re
+from twisted.internet import threads
+
+class CommandAuditLog(object):
+  """ An append-only, size rotated log of executed commands and their responses.
+
+  The audit log directory contains the following files:
+  * commands.NNNNNN.jsonl: The log files. Each line contains a JSON object describing a single command (see
+    CommandAuditLog.record). A new file is started once the current one reaches the maximum file size.
+  * index.jsonl: The index. Each line describes one batch of records written to a log file, including its location in
+    the file, the time range that it covers, and the users and devices that appear in it.
+
+  @note Only records that have been written to disk can be found using find_records. Records are written at least every
+        flush_interval seconds, or sooner if enough records are waiting.
+  """
+
+  def __init__(self, log_directory, max_file_size = 10485760, flush_interval = 0.25, max_batch_size = 1000):
+    """ Sets up the audit log and starts its writer thread.
+
+    @param log_directory   The directory to store the log files and index in. It will be created if it doesn't exist.
+    @param max_file_size   The size (in bytes) after which a new log file will be started.
+    @param flush_interval  The maximum amount of time (in seconds) that records will be buffered before being written.
+    @param max_batch_size  The number of buffered records that will cause the writer thread to write them immediately.
+    """
+
+    self.log_directory = os.path.join(log_directory, '')
+    self.max_file_size = max_file_size
+    self.flush_interval = flush_interval
+    self.max_batch_size = max_batch_size
+    self.written_count = 0
+    self.commit_count = 0
+    self._buffer = []
+    self._buffered_count = 0
+    self._stopping = False
+    self._buffer_condition = threading.Condition()
+
+    # Continue writing to the newest log file if there is one
+    if not os.path.exists(self.log_directory):
+      os.makedirs(self.log_directory)
+    existing_files = sorted(self._get_log_files())
+    self._file_number = existing_files[-1][0] if len(existing_files) > 0 else 1
+
+    # Start the writer thread
+    self._writer_thread = threading.Thread(target = self._write_records, name = "command-audit-log")
+    self._writer_thread.daemon = True
+    self._writer_thread.start()
+
+  def record(self, audited_command, command_response):
+    """ Adds a completed command to the audit log.
+
+    This method is called by the command parser on the reactor thread. It serializes the record and adds it to the
+    write buffer without touching the disk.
+
+    @param audited_command   The Command that was executed (successfully or not).
+    @param command_response  The command's response dictionary (as returned to the user).
+    """
+
+    audit_record = {
+      'recorded_at': time.time(),
+      'user_id': audited_command.user_id,
+      'kernel_mode': audited_command.kernel_mode,
+      'destination': audited_command.full_destination,
+      'command': audited_command.command,
+      'parameters': audited_command.parameters,
+      'response': command_response['response']
+    }
+    serialized_record = json.dumps(audit_record, default = str)+"\n"
+
+    with self._buffer_condition:
+      self._buffer.append((audit_record['recorded_at'], audit_record['user_id'], audit_record['destination'],
+                           serialized_record))
+      self._buffered_count += 1
+      if len(self._buffer) >= self.max_batch_size:
+        self._buffer_condition.notify_all()
+
+  def flush(self):
+    """ Waits until every record added before this call has been written to disk.
+
+    @note This method blocks. It should not be called from the reactor thread except during shutdown or in tests.
+    """
+
+    with self._buffer_condition:
+      target_count = self._buffered_count
+      self._buffer_condition.notify_all()
+      while self.written_count < target_count and self._writer_thread.is_alive():
+        self._buffer_condition.wait(self.flush_interval)
+
+  def stop(self):
+    """ Writes any buffered records and stops the writer thread.
+    """
+
+    with self._buffer_condition:
+      self._stopping = True
+      self._buffer_condition.notify_all()
+    self._writer_thread.join()
+
+  def find_records(self, start_time = None, end_time = None, user_id = None, destination = None):
+    """ Searches the audit log for matching records.
+
+    This method uses the index to locate the batches that could contain matching records and only reads those parts of
+    the log files.
+
+    @note This method reads from the disk and should be called using query() from the reactor thread.
+
+    @param start_time   If set, only records recorded at or after this UNIX timestamp will be returned.
+    @param end_time     If set, only records recorded at or before this UNIX timestamp will be returned.
+    @param user_id      If set, only commands submitted by this user will be returned.
+    @param destination  If set, only commands sent to this (full) destination will be returned.
+    @return Returns a list containing the matching records, in the order that they were recorded.
+    """
+
+    matching_records = []
+    for index_entry in self._read_index():
+      if start_time is not None and index_entry['end'] < start_time:
+        continue
+      if end_time is not None and index_entry['start'] > end_time:
+        continue
+      if user_id is not None and user_id not in index_entry['users']:
+        continue
+      if destination is not None and destination not in index_entry['destinations']:
+        continue
+
+      # Read the batch from its log file
+      with open(self.log_directory+index_entry['file'], 'rb') as log_file:
+        log_file.seek(index_entry['offset'])
+        batch_lines = log_file.read(index_entry['length']).splitlines()
+
+      for batch_line in batch_lines:
+        audit_record = json.loads(batch_line)
+        if start_time is not None and audit_record['recorded_at'] < start_time:
+          continue
+        if end_time is not None and audit_record['recorded_at'] > end_time:
+          continue
+        if user_id is not None and audit_record['user_id'] != user_id:
+          continue
+        if destination is not None and audit_record['destination'] != destination:
+          continue
+        matching_records.append(audit_record)
+
+    return matching_records
+
+  def query(self, start_time = None, end_time = None, user_id = None, destination = None):
+    """ Searches the audit log for matching records in a separate thread.
+
+    @see CommandAuditLog.find_records
+    @return Returns a deferred that will be fired with the list of matching records.
+    """
+
+    return threads.deferToThread(self.find_records, start_time, end_time, user_id, destination)
+
+  def _write_records(self):
+    """ Writes buffered records to disk until the audit log is stopped.
+
+    @note This method runs in the writer thread.
+    """
+
+    while True:
+      # Wait for records to write
+      with self._buffer_condition:
+        if not self._stopping and len(self._buffer) < self.max_batch_size:
+          self._buffer_condition.wait(self.flush_interval)
+        pending_records = self._buffer
+        self._buffer = []
+        stopping = self._stopping
+
+      if len(pending_records) > 0:
+        try:
+          self._commit_batch(pending_records)
+        except (IOError, OSError) as write_error:
+          logging.error("Failed to write "+str(len(pending_records))+" records to the command audit log: "+
+                        str(write_error))
+
+        with self._buffer_condition:
+          self.written_count += len(pending_records)
+          self._buffer_condition.notify_all()
+
+      if stopping:
+        break
+
+  def _commit_batch(self, pending_records):
+    """ Writes a batch of records to the current log file and adds it to the index.
+
+    The batch is written and synced with a single write, then its index entry is written. If the hardware manager stops
+    between the two, the batch will still be in the log file but won't be found by find_records.
+
+    @param pending_records  A list of (recorded_at, user_id, destination, serialized_record) tuples.
+    """
+
+    # Start a new log file if the current one is full
+    log_file_path = self.log_directory+self._get_log_file_name(self._file_number)
+    if os.path.exists(log_file_path) and os.path.getsize(log_file_path) >= self.max_file_size:
+      self._file_number += 1
+      log_file_path = self.log_directory+self._get_log_file_name(self._file_number)
+
+    batch_data = "".join(pending_record[3] for pending_record in pending_records)
+    with open(log_file_path, 'ab') as log_file:
+      batch_offset = log_file.tell()
+      log_file.write(batch_data)
+      log_file.flush()
+      os.fsync(log_file.fileno())
+
+    # Index the batch
+    index_entry = {
+      'file': self._get_log_file_name(self._file_number),
+      'offset': batch_offset,
+      'length': len(batch_data),
+      'count': len(pending_records),
+      'start': min(pending_record[0] for pending_record in pending_records),
+      'end': max(pending_record[0] for pending_record in pending_records),
+      'users': sorted(set(pending_record[1] for pending_record in pending_records if pending_record[1] is not None)),
+      'destinations': sorted(set(pending_record[2] for pending_record in pending_records
+                                 if pending_record[2] is not None))
+    }
+    with open(self.log_directory+'index.jsonl', 'ab') as index_file:
+      index_file.write(json.dumps(index_entry)+"\n")
+      index_file.flush()
+      os.fsync(index_file.fileno())
+
+    self.commit_count += 1
+
+  def _read_index(self):
+    """ Loads the audit log index.
+
+    @return Returns a list containing the index entry for every written batch.
+    """
+
+    if not os.path.exists(self.log_directory+'index.jsonl'):
+      return []
+
+    index_entries = []
+    with open(self.log_directory+'index.jsonl', 'rb') as index_file:
+      for index_line in index_file:
+        try:
+          index_entries.append(json.loads(index_line))
+        except ValueError:
+          # Skip partially written entries
+          continue
+
+    return index_entries
+
+  def _get_log_files(self):
+    """ Lists the existing log files.
+
+    @return Returns a list of (file_number, file_name) tuples for each log file in the log directory.
+    """
+
+    log_files = []
+    for file_name in os.listdir(self.log_directory):
+      file_match = re.match(r'^commands\.(\d+)\.jsonl$', file_name)
+      if file_match:
+        log_files.append((int(file_match.group(1)), file_name))
+
+    return log_files
+
+  def _get_log_file_name(self, file_number):
+    """ Returns the name of the specified log file.
+
+    @param file_number  The log file's number.
+    @return Returns the name of the log file.
+    """
+
+    return "commands.%06d.jsonl" % file_number
@@ -0,0 +1,145 @@
+""" @package hwm.command.cache
+Contains a cache used to share the results of read-only commands.
+
+This module contains a class that caches the results of commands that declare a cache TTL in their meta-data (see
+hwm.command.metadata.build_metadata_dict). It allows the command parser to answer repeated identical requests, such as
+several user interface clients polling the same device's state, without querying the device each time.
+"""
+
+# Import required modules
+import copy, json
+from twisted.internet import defer, reactor
+
+class CommandResultCache(object):
+  """ Caches the results of read-only commands for a limited amount of time.
+
+  This class executes commands on behalf of the command parser and stores their results for the amount of time
+  specified by the command's 'cache_ttl' meta-data. Identical requests received before the TTL expires are answered
+  from the cache, and identical requests received while the command is still executing will wait for (and share) the
+  result of that execution instead of executing the command again.
+
+  @note Only successful results are cached. If a command fails, the error will be passed to every request that was
+        waiting for it and the next request will execute the command again.
+  @note Because collapsed requests share a single execution, the command function will only be passed the Command
+        object of the first request. Commands should only be made cacheable if their results don't depend on the user
+        that submitted them.
+  """
+
+  def __init__(self, max_entries = 1024, clock = None):
+    """ Sets up the result cache.
+
+    @param max_entries  The maximum number of results to store. When this limit is reached the expired results will be
+                        removed, and if that isn't enough, the cache will be cleared.
+    @param clock        An object that provides a seconds() method (typically the reactor) that will be used to
+                        determine if cached results have expired.
+    """
+
+    self.max_entries = max_entries
+    self.clock = clock if clock is not None else reactor
+    self.hits = 0
+    self.misses = 0
+    self.collapsed = 0
+    self._results = {}
+    self._in_flight = {}
+
+  def build_key(self, pipeline_id, destination, command_name, parameters):
+    """ Builds the cache key for a command.
+
+    @param pipeline_id   The ID of the pipeline that the command was sent through (None for system commands).
+    @param destination   The destination of the command (the system command handler name or the device ID).
+    @param command_name  The name of the command.
+    @param parameters    A dictionary containing the command's parameters.
+    @return Returns a hashable key that identifies the command and its parameters.
+    """
+
+    return (pipeline_id, destination, command_name, json.dumps(parameters, sort_keys = True))
+
+  def execute(self, cache_key, cache_ttl, command_function, active_command):
+    """ Returns the results of the specified command, executing it only if needed.
+
+    @param cache_key         The command's cache key (see build_key).
+    @param cache_ttl         How long (in seconds) a successful result should be cached for.
+    @param command_function  The function that executes the command.
+    @param active_command    The Command object that will be passed to command_function if it gets executed.
+    @return Returns a deferred that will be fired with a copy of the command's results (or the command's error).
+    """
+
+    # Check for a cached result
+    if cache_key in self._results:
+      expires_at, cached_results = self._results[cache_key]
+      if expires_at > self.clock.seconds():
+        self.hits += 1
+        return defer.succeed(copy.deepcopy(cached_results))
+
+      del self._results[cache_key]
+
+    # Wait for the command if it's already executing
+    result_deferred = defer.Deferred()
+    if cache_key in self._in_flight:
+      self.collapsed += 1
+      self._in_flight[cache_key].append(result_deferred)
+      return result_deferred
+
+    # Execute the command
+    self.misses += 1
+    self._in_flight[cache_key] = [result_deferred]
+    command_deferred = defer.maybeDeferred(command_function, active_command)
+    command_deferred.addCallbacks(self._command_complete, self._command_failed, callbackArgs = (cache_key, cache_ttl),
+                                  errbackArgs = (cache_key,))
+
+    return result_deferred
+
+  def clear(self):
+    """ Removes all cached results.
+
+    @note Commands that are currently executing will not be affected.
+    """
+
+    self._results = {}
+
+  def get_statistics(self):
+    """ Returns statistics about the cache's usage.
+
+    @return Returns a dictionary containing the cache hit, miss, and collapsed request counts, the number of cached
+            results, and the number of commands that are currently executing.
+    """
+
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'collapsed': self.collapsed,
+      'entries': len(self._results),
+      'in_flight': len(self._in_flight)
+    }
+
+  def _command_complete(self, command_results, cache_key, cache_ttl):
+    """ Stores a command's results and passes them to every waiting request.
+
+    @param command_results  The results of the command.
+    @param cache_key        The command's cache key.
+    @param cache_ttl        How long the results should be cached for.
+    """
+
+    # Make room for the results if needed
+    if len(self._results) >= self.max_entries:
+      current_time = self.clock.seconds()
+      for expired_key in [key for key, (expires_at, results) in self._results.iteritems() if expires_at <= current_time]:
+        del self._results[expired_key]
+
+      if len(self._results) >= self.max_entries:
+        self._results = {}
+
+    self._results[cache_key] = (self.clock.seconds()+cache_ttl, command_results)
+
+    for waiting_deferred in self._in_flight.pop(cache_key):
+      waiting_deferred.callback(copy.deepcopy(command_results))
+
+  def _command_failed(self, failure, cache_key):
+    """ Passes a command's error to every waiting request.
+
+    @param failure    A Failure describing the error.
+    @param cache_key  The command's cache key.
+    """
+
+    for waiting_deferred in self._in_flight.pop(cache_key):
+      waiting_deferred.errback(failure)
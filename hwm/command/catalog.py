@@ -0,0 +1,67 @@
+""" @package hwm.command.catalog
+Contains a class that stores the meta-data of every command offered by the hardware manager.
+
+This module contains the command catalog, which collects the frozen meta-data of every system and device command when
+the command parser builds its routing table. The user interface downloads the catalog (using the list_commands system
+command) to build its command forms, and can use the catalog's ETag to skip downloading it again if it hasn't changed.
+"""
+
+# Import required modules
+import hashlib, json
+
+class CommandCatalog(object):
+  """ Stores the meta-data for every available command.
+
+  The catalog is organized as follows:
+  * system: A dictionary containing the commands offered by each system command handler, keyed by handler name.
+  * devices: A dictionary containing the commands offered by each device, keyed by device ID.
+  * pipelines: A dictionary containing a sorted list of the IDs of the devices in each pipeline, keyed by pipeline ID.
+
+  Each handler's commands are stored in a dictionary that maps command names to their meta-data (as returned by the
+  command's "settings_" method).
+
+  @note Commands that don't specify any meta-data (i.e. don't have a "settings_" method) are not included in the catalog.
+  """
+
+  def __init__(self):
+    """ Sets up the empty command catalog.
+    """
+
+    self.catalog = {'system': {}, 'devices': {}, 'pipelines': {}}
+    self.etag = self._build_etag(self.catalog)
+
+  def build(self, routing_table):
+    """ Rebuilds the catalog from the command parser's routing table.
+
+    @param routing_table  The routing table to build the catalog from. Maps (pipeline_id, destination, command) keys to
+                          CommandRoute objects (see hwm.command.parser.CommandParser.build_routing_table).
+    """
+
+    new_catalog = {'system': {}, 'devices': {}, 'pipelines': {}}
+
+    for (pipeline_id, destination, command_name), command_route in routing_table.iteritems():
+      if pipeline_id is not None:
+        pipeline_devices = new_catalog['pipelines'].setdefault(pipeline_id, [])
+        if destination not in pipeline_devices:
+          pipeline_devices.append(destination)
+
+      if command_route.metadata is None:
+        continue
+
+      handler_commands = new_catalog['system' if pipeline_id is None else 'devices'].setdefault(destination, {})
+      handler_commands[command_name] = command_route.metadata
+
+    for pipeline_devices in new_catalog['pipelines'].itervalues():
+      pipeline_devices.sort()
+
+    self.catalog = new_catalog
+    self.etag = self._build_etag(new_catalog)
+
+  def _build_etag(self, catalog):
+    """ Generates the ETag for the catalog.
+
+    @param catalog  The catalog dictionary.
+    @return Returns a string that will change whenever the content of the catalog changes.
+    """
+
+    return hashlib.sha1(json.dumps(catalog, sort_keys = True)).hexdigest()
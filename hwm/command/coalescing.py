@@ -0,0 +1,142 @@
+""" @package hwm.command.coalescing
+Contains a queue that coalesces repeated schedulable device commands.
+
+This module contains a class that limits how many copies of the same schedulable command (e.g. an antenna controller's
+"move" command) can be waiting for a device at once. Services such as trackers issue these commands every time they
+have new information, and only the most recent one matters if the device is still busy with an earlier one.
+"""
+
+# Import required modules
+import functools
+from twisted.internet import defer
+
+class CommandCoalescer(object):
+  """ A latest-wins command queue for schedulable commands.
+
+  For each (pipeline, device, command) combination, this class allows one command to execute at a time and keeps at
+  most one more waiting behind it. If another command arrives while one is already waiting, the waiting command is
+  dropped and resolved immediately with a CommandSuperseded result, and the new command takes its place. When the
+  executing command completes, the waiting command (if any) is executed.
+
+  @note Only commands marked as 'schedulable' in their meta-data should be passed to this class. These commands set a
+        target state on the device, so executing an older one after a newer one has arrived has no value.
+  """
+
+  def __init__(self):
+    """ Sets up the command coalescer.
+    """
+
+    self.superseded_count = 0
+    self._queues = {}
+
+  def execute(self, queue_key, command_function, active_command):
+    """ Executes the command or queues it behind the currently executing command for the same key.
+
+    @param queue_key         A hashable key identifying the queue (typically (pipeline, device, command)).
+    @param command_function  The function that executes the command.
+    @param active_command    The Command object that will be passed to command_function.
+    @return Returns a deferred that will be fired with the command's results (or error), or with a CommandSuperseded
+            instance if the command is replaced by a newer one before it is executed. If the deferred is cancelled while
+            the command is still waiting, the command will be removed from the queue.
+    """
+
+    result_deferred = defer.Deferred(functools.partial(self._cancel_waiting_command, queue_key))
+
+    if queue_key not in self._queues:
+      # Nothing is executing, run the command now
+      self._queues[queue_key] = None
+      self._execute_command(queue_key, command_function, active_command, result_deferred)
+    else:
+      # Replace the waiting command (if there is one)
+      superseded_command = self._queues[queue_key]
+      self._queues[queue_key] = (command_function, active_command, result_deferred)
+
+      if superseded_command is not None:
+        self.superseded_count += 1
+        superseded_command[2].callback(CommandSuperseded(superseded_command[1], active_command))
+
+    return result_deferred
+
+  def get_pending_count(self):
+    """ Returns the number of commands that are currently waiting to be executed.
+
+    @return Returns the number of waiting commands across every queue.
+    """
+
+    return len([pending_command for pending_command in self._queues.itervalues() if pending_command is not None])
+
+  def _cancel_waiting_command(self, queue_key, result_deferred):
+    """ Removes a cancelled command from its queue if it hasn't been started yet.
+
+    @param queue_key        The command's queue key.
+    @param result_deferred  The deferred of the cancelled command.
+    """
+
+    waiting_command = self._queues.get(queue_key, None)
+    if waiting_command is not None and waiting_command[2] is result_deferred:
+      self._queues[queue_key] = None
+
+  def _execute_command(self, queue_key, command_function, active_command, result_deferred):
+    """ Executes a command and passes its results to the command's deferred.
+
+    @param queue_key         The command's queue key.
+    @param command_function  The function that executes the command.
+    @param active_command    The Command object that will be passed to command_function.
+    @param result_deferred   The deferred that should be fired with the command's results.
+    """
+
+    command_deferred = defer.maybeDeferred(command_function, active_command)
+    command_deferred.addBoth(self._command_complete, queue_key)
+    command_deferred.addBoth(self._pass_results, result_deferred)
+
+  def _pass_results(self, command_results, result_deferred):
+    """ Passes the results of an executing command to the deferred returned for it, unless that deferred was cancelled
+    while the command was executing (e.g. because it timed out).
+
+    @param command_results  The results of the command (or a Failure).
+    @param result_deferred  The deferred that was returned for the command.
+    """
+
+    if not result_deferred.called:
+      result_deferred.callback(command_results)
+
+  def _command_complete(self, command_results, queue_key):
+    """ Starts the next waiting command once the executing command completes.
+
+    @param command_results  The results of the command that just completed (or a Failure).
+    @param queue_key        The command's queue key.
+    @return Returns command_results so that they can be passed on to the command's deferred.
+    """
+
+    next_command = self._queues.pop(queue_key)
+    if next_command is not None:
+      self._queues[queue_key] = None
+      self._execute_command(queue_key, *next_command)
+
+    return command_results
+
+class CommandSuperseded(object):
+  """ The result of a command that was replaced by a newer command before it could be executed.
+  """
+
+  def __init__(self, superseded_command, newer_command):
+    """ Sets up the result.
+
+    @param superseded_command  The Command object that was not executed.
+    @param newer_command       The Command object that replaced it.
+    """
+
+    self.superseded_command = superseded_command
+    self.newer_command = newer_command
+
+  def build_results(self):
+    """ Builds the result dictionary that will be included in the superseded command's response.
+
+    @return Returns a dictionary describing why the command wasn't executed.
+    """
+
+    return {
+      'message': "The command was not executed because it was superseded by a newer '"+
+                 self.newer_command.command+"' command for the same device.",
+      'superseded_by': self.newer_command.parameters
+    }
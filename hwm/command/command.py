@@ -3,8 +3,11 @@ Contains a class used to store the state of submitted ground station commands.
 """
 
 # Import the required modules
-import time, json, jsonschema
+import time, jsonschema, collections
 from twisted.internet import defer 
+from hwm.core.validation import Validators, validate_command_envelope
+from hwm.command.latency import monotonic
+from hwm.network import codec
 
 # Define the command schema
 schema = {
@@ -28,9 +31,31 @@ schema = {
       "type": "object",
       "additionalProperties": True,
       "required": False
+    },
+    "debug": {
+      "type": "boolean",
+      "required": False
+    },
+    "timeout": {
+      "type": "number",
+      "minimum": 0,
+      "exclusiveMinimum": True,
+      "required": False
+    },
+    "execute_at": {
+      "type": "number",
+      "minimum": 0,
+      "required": False
+    },
+    "idempotency_key": {
+      "type": "string",
+      "minLength": 1,
+      "maxLength": 128,
+      "required": False
     }
   }
 }
+Validators.register('command', schema, fast_validator = validate_command_envelope)
 
 class Command:
   """ Used to represent user commands.
@@ -41,28 +66,65 @@ class Command:
   YAML or JSON strings in their raw forms).
   """
   
-  def __init__(self, time_received, raw_command, user_id = None, kernel_mode = False):
+  def __init__(self, time_received, raw_command, user_id = None, kernel_mode = False, command_codec = None):
     """ Constructs a new Command object.
     
     This method sets up a new command based on the raw command received.
     
     @param time_received   The time (UNIX timestamp) when the command was received.
     @param raw_command     The raw command that this class will represent. Can either be a dictionary or a string. If it
-                           is a string, it will be passed through a series of parsers for the supported languages until
-                           one of them can decode the string. The resulting (or original) dictionary will then be 
-                           checked against the command schemma. Currently, only JSON strings are supported.
+                           is a string, it will be decoded using command_codec. The resulting (or original) dictionary 
+                           will then be checked against the command schemma.
     @param user_id         The ID of the user executing the command.
     @param kernel_mode     Whether or not the command is to run in kernel mode (ignores permission and session checks).
+    @param command_codec   The codec (see hwm.network.codec) used to decode raw_command if it is a string. If None, the
+                           default (JSON) codec will be used.
     """
     
     # Set command attributes
     self.time_received = time_received
     self.command_raw = raw_command
+    self.codec = command_codec if command_codec is not None else codec.get_codec(codec.DEFAULT_CODEC)
     self.command_dict = None
     self.user_id = user_id
     self.kernel_mode = kernel_mode
     self.valid = False
     self._user_sessions = []
+
+    # Stage timing attributes (see record_stage)
+    self.created_at = monotonic()
+    self.stage_timings = collections.OrderedDict()
+    self._last_stage_at = self.created_at
+    self.execution_started = False
+
+    # Deadline attributes (see CommandParser._execute_command)
+    self.timeout = None
+    self.priority = 'normal'
+    self.timed_out = False
+
+    # Scheduling attributes (see CommandParser._schedule_command)
+    self.execute_at = None
+    self.schedule_id = None
+
+    # Duplicate suppression attributes (see CommandParser._run_command)
+    self.idempotency_key = None
+
+    # Whether or not the command has been routed (see CommandParser._get_command_route)
+    self.routed = False
+
+    # Whether or not the command can be answered from the result cache (see CommandParser._execute_command)
+    self.use_result_cache = True
+
+    # Whether or not the command's batch or program has already been charged against the user's rate limit budget (see
+    # ratelimit.CommandRateLimiter.acquire_group)
+    self.group_rate_limited = False
+
+    # Progress attributes (see report_progress)
+    self.progress_pipeline = None
+    self.progress_id = None
+    self.progress_sequence = 0
+    self.progress_continues = False
+    self.progress_finished = False
     
     # Convenience attributes set after validate_command
     self.command = None
@@ -70,6 +132,7 @@ class Command:
     self.pipeline = None
     self.full_destination = None
     self.parameters = {}
+    self.debug = False
   
   def validate_command(self):
     """ Validates the submitted command and saves it in a usable form.
@@ -89,24 +152,27 @@ class Command:
             a pre-fired failed deferred is returned.
     """
     
-    # Check if the raw command was an unparsed string
+    # Start timing the command from when it starts being processed
+    self._last_stage_at = monotonic()
+
+    # Check if the raw command was an undecoded string
     if isinstance(self.command_raw, basestring):
       try:
-        self.command_dict = json.loads(self.command_raw)
-      except ValueError:
-        # Error parsing the command JSON
-        return defer.fail(CommandMalformed("The submitted command was malformed and couldn't be parsed as a JSON "+
-                                           "string."))
+        self.command_dict = self.codec.decode(self.command_raw)
+      except codec.CodecError:
+        # Error decoding the command
+        return defer.fail(CommandMalformed("The submitted command was malformed and couldn't be decoded using the '"+
+                                           self.codec.name+"' codec."))
     elif not isinstance(self.command_raw, dict):
       # Not a dictionary or a string
       return defer.fail(CommandMalformed("An invalid command type was detected by the command validator."))
     else:
       self.command_dict = self.command_raw
+    self.record_stage('decode')
     
     # Validate the command schema
-    command_validator = jsonschema.Draft3Validator(schema)
     try:
-      command_validator.validate(self.command_dict)
+      Validators.validate('command', self.command_dict)
       self.valid = True
     except jsonschema.ValidationError:
       # Invalid command schema
@@ -115,10 +181,100 @@ class Command:
     
     # Populate some attributes to make the command easier to work with
     self._populate_command_attributes()
+    self.record_stage('validation')
     
     return defer.succeed(True)
+
+  def record_stage(self, stage_name):
+    """ Records the completion of a command execution stage.
+
+    This method records how long the specified stage took, which is the time that has elapsed since the previous stage 
+    was recorded (or since the command started being processed if it's the first stage). The command parser records the
+    following stages in order:
+    * decode: Decoding the raw command
+    * validation: Validating the command against the command schema
+    * permissions: Loading the user's permissions
+    * routing: Locating the command's handler and meta-data
+    * sessions: Checking the user's permissions and active sessions
+    * execution: Executing the command (including any time spent waiting for the device)
+    * response: Building the command response
+
+    @note Stages are timed using a monotonic clock when one is available.
+    @note Commands that fail will only record the stages that they reached.
+
+    @param stage_name  The name of the stage that just completed.
+    """
+
+    stage_completed_at = monotonic()
+    self.stage_timings[stage_name] = stage_completed_at-self._last_stage_at
+    self._last_stage_at = stage_completed_at
+
+  def get_stage_timings(self):
+    """ Returns the command's stage timings.
+
+    @return Returns a dictionary containing the duration (in seconds) of each recorded stage, as well as the total time 
+            since the command was created (in the 'total' field).
+    """
+
+    stage_timings = dict(self.stage_timings)
+    stage_timings['total'] = self._last_stage_at-self.created_at
+
+    return stage_timings
   
-  def build_command_response(self, success, command_results = {}):
+  def report_progress(self, progress_data):
+    """ Reports the progress of the command to the user.
+
+    This method allows command handlers to report the progress of long running commands (e.g. an antenna calibration)
+    so that users don't have to repeatedly poll the device. Each call sends a 'progress' event to the sessions using 
+    the command's pipeline over the 'command_progress' telemetry stream. Once the command completes, the command 
+    parser will send a final 'complete' event (see finish_progress).
+
+    @note Progress can only be reported for device commands, because it is delivered through the pipeline that the 
+          command was sent to. For other commands, this method does nothing.
+    @note Like other telemetry, progress events may be discarded if the pipeline's telemetry is being throttled. The 
+          final 'complete' event is exempt from throttling (so users always learn that the command's action ended), 
+          but no progress events can be delivered while the pipeline doesn't have an active session.
+
+    @param progress_data  A dictionary describing the command's progress.
+    @return Returns True if the progress event was sent or False if it was discarded or progress can't be reported for 
+            the command.
+    """
+
+    if self.progress_finished:
+      return False
+
+    return self._write_progress_event('progress', progress_data)
+
+  def continue_progress(self):
+    """ Indicates that the command's action will continue after the command returns.
+
+    Some commands only start an action on their device and return before it finishes (e.g. parking the antenna). If the
+    command handler keeps monitoring the action after the command returns, it should call this method so that the 
+    command parser doesn't send the final progress event when the command completes. The handler is then responsible for
+    calling finish_progress once the action ends.
+    """
+
+    self.progress_continues = True
+
+  def finish_progress(self, success = True, progress_data = None):
+    """ Sends the command's final progress event.
+
+    @note Only the first call to this method will send an event. It does nothing if no progress has been reported.
+    @note The final event is sent even if the pipeline's telemetry is being throttled. It's only discarded if the 
+          pipeline no longer has an active session (e.g. if the action was ended by the session's cleanup).
+
+    @param success        Whether or not the command's action completed successfully.
+    @param progress_data  An optional dictionary containing the final state of the command's action.
+    @return Returns True if the final progress event was sent and False otherwise.
+    """
+
+    if self.progress_finished or self.progress_sequence == 0:
+      return False
+    self.progress_finished = True
+
+    return self._write_progress_event('complete', progress_data, status = 'okay' if success else 'error')
+
+  def build_command_response(self, success, command_results = {}, status = None):
     """ Constructs a dictionary to encapsulate the command results.
     
     This method builds a dictionary containing the command's response. Whatever module created the command in the first
@@ -127,6 +283,8 @@ class Command:
     
     @param success          Whether or not the command was successful (True or False).
     @param command_results  A dictionary containing the results of the command.
+    @param status           An optional status string that overrides the default 'okay' or 'error' status (e.g. 
+                            'superseded').
     @return Returns a dictionary containing the command's results.
     """
     
@@ -136,7 +294,10 @@ class Command:
     # Construct the command response
     command_response['received_at'] = self.time_received
     command_response['completed_at'] = int(time.time())
-    command_response['status'] = 'okay' if success else 'error'
+    if status is not None:
+      command_response['status'] = status
+    else:
+      command_response['status'] = 'okay' if success else 'error'
     if self.destination is not None:
       command_response['destination'] = ''
       if self.pipeline:
@@ -163,6 +324,10 @@ class Command:
       self.command = self.command_dict['command']
       self.parameters = self.command_dict['parameters'] if ('parameters' in self.command_dict) else None
       self.full_destination = self.command_dict['destination']
+      self.debug = self.command_dict.get('debug', False)
+      self.timeout = self.command_dict.get('timeout', None)
+      self.execute_at = self.command_dict.get('execute_at', None)
+      self.idempotency_key = self.command_dict.get('idempotency_key', None)
 
       if '.' in self.full_destination:
         self.pipeline = self.full_destination.split('.')[0]
@@ -174,6 +339,34 @@ class Command:
     else:
       return False
 
+  def _write_progress_event(self, event_type, progress_data, status = None):
+    """ Writes a progress event to the command's pipeline.
+
+    @param event_type     The type of event ('progress' or 'complete').
+    @param progress_data  A dictionary describing the command's progress, or None.
+    @param status         The final status of the command's action ('complete' events only).
+    @return Returns True if the event was written or False if it was discarded by the pipeline or the command doesn't 
+            have a pipeline to write it to.
+    """
+
+    if self.progress_pipeline is None:
+      return False
+
+    self.progress_sequence += 1
+    progress_event = {
+      'event': event_type,
+      'progress_id': self.progress_id,
+      'sequence': self.progress_sequence,
+      'command': self.command,
+      'destination': self.full_destination,
+      'progress': progress_data if progress_data is not None else {}
+    }
+    if status is not None:
+      progress_event['status'] = status
+
+    return self.progress_pipeline.write_telemetry(self.destination, 'command_progress', int(time.time()), 
+                                                  progress_event, throttle = (event_type != 'complete'))
+
   @property
   def active_user_sessions(self):
     """ Returns an array of the active Sessions associated with the user who submitted the command.
@@ -195,6 +388,85 @@ class Command:
 
     self._user_sessions = active_sessions
 
+class InternalCommand(Command):
+  """ Used to represent commands generated by the hardware manager itself.
+
+  This class represents commands that drivers and other hardware manager components send to devices on their own behalf
+  (e.g. an antenna controller moving to a tracker's latest position). Because these commands are built by the station 
+  from known values, they are created directly from their components instead of from a raw command and don't need to be
+  decoded or validated against the command schema. They are always executed in kernel mode.
+
+  @note Internal commands bypass the result cache. They are typically used to poll the device for its current state, so
+        a cached result would defeat their purpose.
+  @note Internal commands should be executed using CommandParser.invoke_internal.
+  """
+
+  def __init__(self, time_received, pipeline_id, destination, command_name, parameters = None, user_id = None):
+    """ Constructs a new internal command.
+
+    @param time_received  The time (UNIX timestamp) when the command was created.
+    @param pipeline_id    The ID of the pipeline that the command should be sent through. Should be None for system 
+                          commands.
+    @param destination    The command's destination (a device ID or system command handler name).
+    @param command_name   The name of the command.
+    @param parameters     A dictionary containing the command's parameters. These must already be valid for the command.
+    @param user_id        The ID of the user that the command is being executed on behalf of, if any. This is only used 
+                          to identify the command (e.g. in its response); it doesn't affect how the command is executed.
+    """
+
+    Command.__init__(self, time_received, None, user_id = user_id, kernel_mode = True)
+
+    # Set the command attributes directly
+    self.command = command_name
+    self.destination = destination
+    self.pipeline = pipeline_id
+    self.full_destination = destination if pipeline_id is None else pipeline_id+"."+destination
+    self.parameters = parameters
+    self.command_dict = {'command': command_name, 'destination': self.full_destination}
+    if parameters is not None:
+      self.command_dict['parameters'] = parameters
+    self.valid = True
+    self.use_result_cache = False
+
+  def validate_command(self):
+    """ Internal commands are constructed from known values and are always valid.
+
+    @return Returns a pre-fired deferred.
+    """
+
+    return defer.succeed(True)
+
+class PrecompiledCommand(Command):
+  """ Used to represent commands from a compiled setup program.
+
+  This class represents setup commands that the command parser already decoded and validated against the command schema
+  when it compiled their program (see CommandParser.compile_program). A new instance is created each time the program 
+  runs, so that every execution has its own response, timings, and progress state.
+  """
+
+  def __init__(self, time_received, command_dict, user_id = None, kernel_mode = False):
+    """ Constructs a new precompiled command.
+
+    @param time_received  The time (UNIX timestamp) when the command's program started running.
+    @param command_dict   The command's decoded and validated command dictionary.
+    @param user_id        The ID of the user executing the command.
+    @param kernel_mode    Whether or not the command is to run in kernel mode.
+    """
+
+    Command.__init__(self, time_received, command_dict, user_id = user_id, kernel_mode = kernel_mode)
+
+    self.command_dict = command_dict
+    self.valid = True
+    self._populate_command_attributes()
+
+  def validate_command(self):
+    """ Precompiled commands were validated when their program was compiled.
+
+    @return Returns a pre-fired deferred.
+    """
+
+    return defer.succeed(True)
+
 # Create some exceptions for the Command class
 class CommandNotFound(Exception):
   pass
@@ -218,3 +490,7 @@ class CommandError(Exception):
   
   def __str__(self):
     return self.message
+class CommandTimedOut(CommandError):
+  pass
+class CommandThrottled(CommandError):
+  pass
@@ -5,10 +5,12 @@ This module contains a Twisted resource for responding to station commands recei
 """
 
 # Import required modules
-import json
+import logging
+from twisted.python import failure
 from twisted.web.resource import Resource
 from twisted.web.http import HTTPClient, HTTPFactory
 from twisted.web.server import NOT_DONE_YET
+from hwm.network import codec
 
 class CommandResource(Resource):
   """ Handles commands received over the network.
@@ -33,6 +35,16 @@ class CommandResource(Resource):
   def render_POST(self, request):
     """ Responds to POST'd command requests.
     
+    The request body can either contain a single JSON command or a JSON array of commands. Arrays of commands are
+    executed as a batch using CommandParser.parse_command_batch, which will run them in the order that they are listed
+    unless the "mode" query argument is set to "concurrent". The response to a batch is a JSON array containing the 
+    response for each command in the batch. Batches that are rejected as a whole (e.g. because they contain too many 
+    commands) are answered with a single error response instead.
+
+    @note The request body is decoded using the codec that matches its Content-Type header (see hwm.network.codec), 
+          which defaults to JSON. The response is encoded using the codec that matches the first supported type in the
+          request's Accept header, or the request's codec if there isn't one.
+    
     @param request  The request object for the submitted command.
     @return Returns NOT_DONE_YET, indicating that the results of the request may not be ready yet (results handled by
             self._command_response_ready).
@@ -40,17 +52,58 @@ class CommandResource(Resource):
     
     # Store the user's ID from the SSL certificate
     user_id = None
-    user_certificate = self.transport.getPeerCertificate()
+    user_certificate = request.transport.getPeerCertificate()
     if user_certificate:
       user_id = user_certificate.get_subject().commonName.decode()
     
-    # Pass the request body to the parser
-    response_deferred = self.command_parser.parse_command(request.content.read(), user_id=user_id)
-    response_deferred.addBoth(self._command_response_ready, request)
+    # Select the request and response codecs
+    request_codec = (codec.get_codec_for_content_type(request.getHeader('content-type')) or
+                     codec.get_codec(codec.DEFAULT_CODEC))
+    response_codec = self._negotiate_response_codec(request, request_codec)
+    request.setHeader('content-type', response_codec.content_type)
+
+    # Decode the request body once so that batches can be detected
+    raw_command = request.content.read()
+    try:
+      parsed_command = request_codec.decode(raw_command)
+    except codec.CodecError:
+      # Let the parser generate the appropriate error response
+      parsed_command = raw_command
+    
+    # Pass the command(s) to the parser
+    if isinstance(parsed_command, list):
+      sequential = request.args.get('mode', ['sequential'])[0] != 'concurrent'
+      response_deferred = self.command_parser.parse_command_batch(parsed_command, user_id=user_id,
+                                                                  sequential=sequential)
+      response_deferred.addBoth(self._batch_response_ready, request, response_codec)
+    else:
+      command_input = parsed_command if isinstance(parsed_command, dict) else raw_command
+      response_deferred = self.command_parser.parse_command(command_input, user_id=user_id,
+                                                            command_codec=request_codec)
+      response_deferred.addBoth(self._command_response_ready, request, response_codec)
+    response_deferred.addErrback(self._response_failed, request)
     
     return NOT_DONE_YET
   
-  def _command_response_ready(self, command_response, request):
+  def _negotiate_response_codec(self, request, request_codec):
+    """ Selects the codec that will be used to encode the response to a request.
+
+    @param request        The HTTP request.
+    @param request_codec  The codec that the request body was encoded with.
+    @return Returns the codec for the first supported type in the request's Accept header, or request_codec if the
+            header isn't set or doesn't contain any supported types.
+    """
+
+    accept_header = request.getHeader('accept')
+    if accept_header is not None:
+      for accepted_type in accept_header.split(','):
+        accepted_codec = codec.get_codec_for_content_type(accepted_type)
+        if accepted_codec is not None:
+          return accepted_codec
+
+    return request_codec
+
+  def _command_response_ready(self, command_response, request, response_codec):
     """ Writes the command response back to the originating request.
 
     This callback writes the response of a command back to the network via the request that generated it. It handles 
@@ -58,20 +111,59 @@ class CommandResource(Resource):
     
     @param command_response  The results of the command. If the command was successful, this will be a dictionary
                              containing the command response. If the command failed, this will be a Failure object
-                             containing the command response encapsulated in a CommandError exception.
+                             containing the command response encapsulated in a CommandFailed exception.
     @param request           The original HTTP request for the connection.
+    @param response_codec    The codec to encode the response with.
     """
 
     # Extract the command response
     try:
-      # If the command failed, the response will be wrapped in a Failure (and in turn a CommandError) object
-      response_dict = command_response.value.response
+      # If the command failed, the response will be wrapped in a Failure (and in turn a CommandFailed) object
+      response_dict = command_response.value.results
     except AttributeError:
       # If the command was successful, command_response will just consist of a dictonary containing the response
       response_dict = command_response
     
     # Write the response to the client
-    request.write(json.dumps(response_dict['response']))
+    request.write(response_codec.encode(response_dict['response']))
     
     # Close the request
     request.finish()
+
+  def _batch_response_ready(self, batch_responses, request, response_codec):
+    """ Writes the responses for a batch of commands back to the originating request.
+
+    @param batch_responses  A list containing the response dictionary for each command in the batch, or a Failure 
+                            containing a CommandFailed exception if the whole batch was rejected.
+    @param request          The original HTTP request for the connection.
+    @param response_codec   The codec to encode the responses with.
+    """
+
+    # Batches that were rejected as a whole are answered like a single failed command
+    if isinstance(batch_responses, failure.Failure):
+      self._command_response_ready(batch_responses, request, response_codec)
+      return
+
+    # Write the responses to the client
+    request.write(response_codec.encode([command_response['response'] for command_response in batch_responses]))
+
+    # Close the request
+    request.finish()
+
+  def _response_failed(self, response_error, request):
+    """ Closes a request whose response couldn't be generated or encoded.
+
+    This errback makes sure that unexpected errors (e.g. a response that the response codec can't encode) don't leave 
+    the request open forever.
+
+    @param response_error  A Failure object containing the error.
+    @param request         The original HTTP request for the connection.
+    """
+
+    logging.error("The response to a command request could not be sent: "+response_error.getErrorMessage())
+
+    if not request.finished:
+      request.setResponseCode(500)
+      request.setHeader('content-type', 'text/plain')
+      request.write("The command response could not be generated.")
+      request.finish()
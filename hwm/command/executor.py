@@ -0,0 +1,310 @@
+""" @package hwm.command.executor
+Contains the queues used to order the execution of device commands.
+
+This module contains classes that sit between the command parser and the device command handlers. Every device gets
+its own priority ordered command queue that limits how many of the device's commands can execute at once, which keeps
+commands from user requests, setup commands, and internal control loops from overlapping on the device. It also 
+contains a dedicated thread pool that lets emergency commands make blocking calls without waiting behind routine work.
+"""
+
+# Import required modules
+import heapq, itertools
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool
+from hwm.command.metadata import priority_classes
+
+## The thread pool used by emergency commands (see defer_to_thread). Created the first time it's needed.
+_emergency_thread_pool = None
+
+def defer_to_thread(priority, blocking_function, *args, **kwargs):
+  """ Calls a blocking function in a thread on behalf of a command.
+
+  Command handlers that need to make blocking calls (such as querying a network device) should use this function 
+  instead of threads.deferToThread. Commands in the 'emergency' priority class are run in a small dedicated thread pool
+  so that they never wait behind routine commands that have saturated the reactor's thread pool. All other commands use
+  the reactor's thread pool.
+
+  @param priority           The priority class of the command making the call (see Command.priority).
+  @param blocking_function  The function to call.
+  @param *args              Arguments to pass to the function.
+  @param **kwargs           Keyword arguments to pass to the function.
+  @return Returns a deferred that will be fired with the function's return value (or error).
+  """
+
+  global _emergency_thread_pool
+
+  if priority != 'emergency':
+    return threads.deferToThread(blocking_function, *args, **kwargs)
+
+  # Start the emergency thread pool if needed
+  if _emergency_thread_pool is None:
+    _emergency_thread_pool = threadpool.ThreadPool(1, 4, "emergency-commands")
+    _emergency_thread_pool.start()
+    reactor.addSystemEventTrigger('during', 'shutdown', _emergency_thread_pool.stop)
+
+  return threads.deferToThreadPool(reactor, _emergency_thread_pool, blocking_function, *args, **kwargs)
+
+class CommandExecutor(object):
+  """ Manages the command queues for every device.
+
+  This class creates and stores the DeviceCommandQueue for each device. The command parser requests a device's queue
+  when it builds the routes for the device's commands.
+  """
+
+  def __init__(self, clock = None):
+    """ Sets up the command executor.
+
+    @param clock  An object that provides a seconds() method (typically the reactor) that will be used to measure how
+                  long commands wait in the queues.
+    """
+
+    self.clock = clock if clock is not None else reactor
+    self.queues = {}
+
+  def get_queue(self, queue_name, concurrency = None):
+    """ Returns the command queue with the specified name, creating it if needed.
+
+    @note If the queue already exists, its concurrency limit will be updated to the provided value.
+
+    @param queue_name   The name of the queue. This is typically the ID of the device that the queue is for.
+    @param concurrency  The maximum number of commands that may execute at once. If None, the number of commands will
+                        not be limited (although their wait times will still be tracked).
+    @return Returns the requested DeviceCommandQueue.
+    """
+
+    if queue_name not in self.queues:
+      self.queues[queue_name] = DeviceCommandQueue(queue_name, concurrency, self.clock)
+    else:
+      self.queues[queue_name].concurrency = concurrency
+
+    return self.queues[queue_name]
+
+  def get_statistics(self):
+    """ Returns the statistics for every queue.
+
+    @return Returns a dictionary containing the statistics for each queue (see DeviceCommandQueue.get_statistics),
+            keyed by queue name.
+    """
+
+    return dict((queue_name, device_queue.get_statistics()) for queue_name, device_queue in self.queues.iteritems())
+
+class DeviceCommandQueue(object):
+  """ A priority ordered command queue for a single device.
+
+  This class executes commands while making sure that no more than a set number of them are executing at once. Commands
+  that can't be started immediately wait in the queue until an earlier command completes. Waiting commands are started
+  in order of their priority class (see hwm.command.metadata.priority_classes), then kernel mode commands before user 
+  commands, and then in the order that they were received. It also records how many commands are waiting and how long
+  they waited for.
+
+  @note Commands in the 'emergency' priority class are started immediately, even if the queue is at its concurrency
+        limit. They can't stop the commands that are already executing, but they never wait behind them.
+  @note Executing commands that have been abandoned (e.g. because they timed out) can be released (see release) so 
+        that they don't keep the commands behind them waiting.
+  """
+
+  def __init__(self, name, concurrency = None, clock = None):
+    """ Sets up the command queue.
+
+    @throw Throws InvalidConcurrencyLimit if the concurrency limit isn't a positive integer or None.
+
+    @param name         The name of the queue.
+    @param concurrency  The maximum number of commands that may execute at once, or None for no limit.
+    @param clock        An object that provides a seconds() method that will be used to measure wait times.
+    """
+
+    self.name = name
+    self.concurrency = concurrency
+    self.clock = clock if clock is not None else reactor
+    self.executing = 0
+    self.executed_count = 0
+    self.released_count = 0
+    self.total_wait_time = 0
+    self.max_wait_time = 0
+    self.max_depth = 0
+    self.max_wait_times = dict((priority, 0) for priority in priority_classes)
+    self._waiting_commands = []
+    self._executing_commands = []
+    self._sequence = itertools.count()
+
+  @property
+  def concurrency(self):
+    """ The maximum number of commands that may execute at once (None for no limit). """
+
+    return self._concurrency
+
+  @concurrency.setter
+  def concurrency(self, concurrency):
+    if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, (int, long)) or
+                                    concurrency < 1):
+      raise InvalidConcurrencyLimit("The concurrency limit for the '"+str(self.name)+"' command queue must be a "+
+                                    "positive integer.")
+
+    self._concurrency = concurrency
+
+  def execute(self, command_function, active_command, priority = 'normal', kernel_mode = False):
+    """ Executes the command once the device is available.
+
+    @param command_function  The function that executes the command.
+    @param active_command    The Command object that will be passed to command_function.
+    @param priority          The command's priority class.
+    @param kernel_mode       Whether or not the command is being executed in kernel mode. Kernel mode commands are 
+                             started before user commands in the same priority class.
+    @return Returns a deferred that will be fired with the results of the command (or its error). If the deferred is 
+            cancelled while the command is still waiting in the queue, the command will be removed from the queue.
+    """
+
+    result_deferred = defer.Deferred(self._cancel_waiting_command)
+    queued_command = QueuedCommand((priority_classes[priority], 0 if kernel_mode else 1, next(self._sequence)), 
+                                   priority, command_function, active_command, result_deferred, self.clock.seconds())
+
+    if priority == 'emergency':
+      self._start_command(queued_command)
+    else:
+      heapq.heappush(self._waiting_commands, queued_command)
+      self.max_depth = max(self.max_depth, len(self._waiting_commands))
+      self._start_commands()
+
+    return result_deferred
+
+  def release(self, active_command):
+    """ Frees the slot of an executing command that has been abandoned so that the next waiting command can start.
+
+    The command itself isn't stopped (the queue can't interrupt it), but the queue stops waiting for it. Its results 
+    are still passed to its deferred if it eventually completes.
+
+    @param active_command  The Command object that was passed to execute.
+    @return Returns True if the command was executing and its slot was released and False otherwise.
+    """
+
+    for executing_command in self._executing_commands:
+      if executing_command.command is active_command:
+        self._executing_commands.remove(executing_command)
+        self.executing -= 1
+        self.released_count += 1
+        self._start_commands()
+        return True
+
+    return False
+
+  def get_statistics(self):
+    """ Returns statistics about the queue.
+
+    @return Returns a dictionary containing the queue's concurrency limit, the number of waiting and executing commands,
+            the maximum number of waiting commands observed, the number of commands executed (and released while they 
+            were executing), and the mean and maximum
+            time (in seconds) that commands have spent waiting in the queue. The maximum wait time for each priority 
+            class is in the 'max_wait_times' field.
+    """
+
+    return {
+      'concurrency': self.concurrency,
+      'depth': len(self._waiting_commands),
+      'max_depth': self.max_depth,
+      'executing': self.executing,
+      'executed': self.executed_count,
+      'released': self.released_count,
+      'mean_wait_time': (self.total_wait_time/self.executed_count) if self.executed_count > 0 else 0,
+      'max_wait_time': self.max_wait_time,
+      'max_wait_times': dict(self.max_wait_times)
+    }
+
+  def _cancel_waiting_command(self, result_deferred):
+    """ Removes a cancelled command from the queue if it hasn't been started yet.
+
+    @param result_deferred  The deferred of the cancelled command.
+    """
+
+    for waiting_command in self._waiting_commands:
+      if waiting_command.result_deferred is result_deferred:
+        self._waiting_commands.remove(waiting_command)
+        heapq.heapify(self._waiting_commands)
+        break
+
+  def _start_commands(self):
+    """ Starts as many waiting commands as the concurrency limit allows.
+    """
+
+    while self._waiting_commands and (self.concurrency is None or self.executing < self.concurrency):
+      self._start_command(heapq.heappop(self._waiting_commands))
+
+  def _start_command(self, queued_command):
+    """ Executes a command and records how long it waited.
+
+    @param queued_command  The QueuedCommand to execute.
+    """
+
+    # Record the wait time
+    wait_time = self.clock.seconds()-queued_command.queued_at
+    self.total_wait_time += wait_time
+    self.max_wait_time = max(self.max_wait_time, wait_time)
+    self.max_wait_times[queued_command.priority] = max(self.max_wait_times[queued_command.priority], wait_time)
+    self.executed_count += 1
+
+    # Execute the command
+    self.executing += 1
+    self._executing_commands.append(queued_command)
+    command_deferred = defer.maybeDeferred(queued_command.function, queued_command.command)
+    command_deferred.addBoth(self._command_complete, queued_command)
+    command_deferred.addBoth(self._pass_results, queued_command.result_deferred)
+
+  def _pass_results(self, command_results, result_deferred):
+    """ Passes the results of an executing command to the deferred returned for it, unless that deferred was cancelled
+    while the command was executing (e.g. because it timed out).
+
+    @param command_results  The results of the command (or a Failure).
+    @param result_deferred  The deferred that was returned for the command.
+    """
+
+    if not result_deferred.called:
+      result_deferred.callback(command_results)
+
+  def _command_complete(self, command_results, queued_command):
+    """ Starts the next waiting command once an executing command completes.
+
+    @param command_results  The results of the command that just completed (or a Failure).
+    @param queued_command   The QueuedCommand that completed.
+    @return Returns command_results so that they can be passed on to the command's deferred.
+    """
+
+    # Released commands have already given up their slot
+    if queued_command in self._executing_commands:
+      self._executing_commands.remove(queued_command)
+      self.executing -= 1
+      self._start_commands()
+
+    return command_results
+
+class QueuedCommand(object):
+  """ Represents a command waiting in a DeviceCommandQueue.
+
+  Queued commands are ordered by their sort key so that they can be stored in a heap.
+  """
+
+  __slots__ = ['sort_key', 'priority', 'function', 'command', 'result_deferred', 'queued_at']
+
+  def __init__(self, sort_key, priority, command_function, active_command, result_deferred, queued_at):
+    """ Sets up the queued command.
+
+    @param sort_key          A (priority rank, kernel mode rank, sequence number) tuple that determines the order in 
+                             which waiting commands are started.
+    @param priority          The command's priority class.
+    @param command_function  The function that executes the command.
+    @param active_command    The Command object that will be passed to command_function.
+    @param result_deferred   The deferred that will be fired with the command's results.
+    @param queued_at         The time when the command was added to the queue.
+    """
+
+    self.sort_key = sort_key
+    self.priority = priority
+    self.function = command_function
+    self.command = active_command
+    self.result_deferred = result_deferred
+    self.queued_at = queued_at
+
+  def __lt__(self, other_command):
+    return self.sort_key < other_command.sort_key
+
+# Define executor related exceptions
+class InvalidConcurrencyLimit(Exception):
+  pass
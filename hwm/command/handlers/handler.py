@@ -43,6 +43,7 @@ class CommandHandler(object):
 
     # Set the command handler attributes
     self.name = command_handler_name
+    self.parser = None # Set by the CommandParser that the handler is registered with
 
 class DeviceCommandHandler(CommandHandler):
   """ The base interface class for device command handlers.
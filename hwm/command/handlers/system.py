@@ -34,4 +34,191 @@ class SystemCommandHandler(handler.CommandHandler):
     # The station_command does not take any parameters
     command_parameters = []
 
-    return build_metadata_dict(command_parameters, 'station_time', self.name, requires_active_session = False)
+    return build_metadata_dict(command_parameters, 'station_time', self.name, requires_active_session = False,
+                               cache_ttl = 0.5)
+
+  def command_list_commands(self, active_command):
+    """ Returns the command catalog.
+
+    This command returns the meta-data for every system and device command (see hwm.command.catalog.CommandCatalog), 
+    along with the catalog's ETag. If the 'if_none_match' parameter is set to the ETag of the current catalog, the 
+    catalog itself will be left out of the response.
+
+    @note The ETag is returned in the 'etag' field of the response 'result' dictionary and the catalog in the 'catalog' 
+          field. If the catalog hasn't changed, the 'not_modified' field will be set to True instead.
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the catalog and its ETag.
+    """
+
+    command_catalog = self.parser.command_catalog
+
+    if active_command.parameters is not None and active_command.parameters.get('if_none_match') == command_catalog.etag:
+      return {'etag': command_catalog.etag, 'not_modified': True}
+
+    return {'etag': command_catalog.etag, 'not_modified': False, 'catalog': command_catalog.catalog}
+
+  def settings_list_commands(self):
+    """ Returns a dictionary containing meta-data about the list_commands command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "string",
+        "required": False,
+        "title": "if_none_match",
+        "description": "The ETag of a previously downloaded catalog. If it matches the current catalog, the catalog "+
+                       "won't be sent again."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'list_commands', self.name, requires_active_session = False)
+
+  def command_unschedule(self, active_command):
+    """ Cancels a command that was scheduled using the 'execute_at' command field.
+
+    @throw Throws CommandError if the schedule ID is missing or if the command can't be found or belongs to another 
+           user.
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the name, destination, and execution time of the cancelled command.
+    """
+
+    if active_command.parameters is None or 'schedule_id' not in active_command.parameters:
+      raise command.CommandError("The schedule ID of the command to cancel was not submitted with the command.",
+                                 {"missing_parameter": "schedule_id"})
+
+    cancelled_command = self.parser.unschedule_command(active_command.parameters['schedule_id'],
+                                                       None if active_command.kernel_mode else active_command.user_id)
+
+    return {'command': cancelled_command.command, 'destination': cancelled_command.full_destination,
+            'execute_at': cancelled_command.execute_at}
+
+  def settings_unschedule(self):
+    """ Returns a dictionary containing meta-data about the unschedule command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "number",
+        "integer": True,
+        "required": True,
+        "title": "schedule_id",
+        "description": "The schedule ID returned when the command was scheduled."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'unschedule', self.name, requires_active_session = False)
+
+  def command_device_queues(self, active_command):
+    """ Returns statistics about the device command queues.
+
+    @note The statistics are returned in the 'queues' field of the response 'result' dictionary, keyed by queue name. 
+          Each queue's statistics include its concurrency limit, the number of waiting and executing commands, and the 
+          mean and maximum time (in seconds) that commands have waited for the device.
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the statistics for each device command queue.
+    """
+
+    return {'queues': self.parser.get_device_queue_statistics()}
+
+  def settings_device_queues(self):
+    """ Returns a dictionary containing meta-data about the device_queues command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    # The device_queues command does not take any parameters
+    command_parameters = []
+
+    return build_metadata_dict(command_parameters, 'device_queues', self.name, requires_active_session = False)
+
+  def command_rate_limits(self, active_command):
+    """ Returns the command rate limits and how many commands they have throttled.
+
+    @note The statistics are returned in the 'budgets' field of the response 'result' dictionary, keyed by budget name
+          (see hwm.command.ratelimit.CommandRateLimiter).
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the statistics for each rate limit budget.
+    """
+
+    return {'budgets': self.parser.rate_limiter.get_statistics()}
+
+  def settings_rate_limits(self):
+    """ Returns a dictionary containing meta-data about the rate_limits command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    # The rate_limits command does not take any parameters
+    command_parameters = []
+
+    return build_metadata_dict(command_parameters, 'rate_limits', self.name, requires_active_session = False)
+
+  def command_permission_cache(self, active_command):
+    """ Returns statistics about the user permission cache.
+
+    @note The statistics are returned in the 'cache' field of the response 'result' dictionary (see 
+          hwm.network.security.permissions.PermissionCache).
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the permission cache statistics.
+    """
+
+    return {'cache': self.parser.permission_manager.get_cache_statistics()}
+
+  def settings_permission_cache(self):
+    """ Returns a dictionary containing meta-data about the permission_cache command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    # The permission_cache command does not take any parameters
+    command_parameters = []
+
+    return build_metadata_dict(command_parameters, 'permission_cache', self.name, requires_active_session = False)
+
+  def command_latency_statistics(self, active_command):
+    """ Returns the command latency histograms.
+
+    @note The histograms are returned in the 'latencies' field of the response 'result' dictionary. It contains an entry
+          for each (destination, command) combination that has been executed, which breaks the time it took to process 
+          the command down into stages (see hwm.command.command.Command.record_stage).
+
+    @param active_command  The Command object associated with the executing command. Contains the command parameters.
+    @return Returns a dictionary containing the latency histograms.
+    """
+
+    command_parameters = active_command.parameters if active_command.parameters is not None else {}
+
+    return {'latencies': self.parser.get_latency_statistics(command_parameters.get('destination', None),
+                                                            command_parameters.get('command', None))}
+
+  def settings_latency_statistics(self):
+    """ Returns a dictionary containing meta-data about the latency_statistics command.
+
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    command_parameters = [
+      {
+        "type": "string",
+        "required": False,
+        "title": "destination",
+        "description": "Only include commands sent to this destination (e.g. 'pipeline_id.device_id')."
+      },
+      {
+        "type": "string",
+        "required": False,
+        "title": "command",
+        "description": "Only include commands with this name."
+      }
+    ]
+
+    return build_metadata_dict(command_parameters, 'latency_statistics', self.name, requires_active_session = False)
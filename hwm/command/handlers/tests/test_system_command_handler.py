@@ -4,8 +4,10 @@ from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from mock import MagicMock
 from twisted.test import proto_helpers
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks
 from hwm.core.configuration import *
-from hwm.command import parser, command, connection
+from hwm.command import parser, command, connection, scheduler
 from hwm.command.handlers import system as command_handler
 from hwm.network.security import permissions
 from hwm.sessions.tests.utilities import *
@@ -60,3 +62,127 @@ class TestSystemCommandHandler(unittest.TestCase):
     test_deferred.addCallback(parsing_complete)
     
     return test_deferred
+
+  def test_device_queues(self):
+    """ This test verifies that the device_queues command returns the statistics for each device command queue.
+    """
+
+    # Create a device queue
+    self.command_parser.command_executor.get_queue('test_device', 1)
+
+    # Define a callback to test the parser results
+    def parsing_complete(command_results):
+      response_dict = command_results['response']
+
+      self.assertEqual(response_dict['status'], 'okay', 'The parser did not return a successful response.')
+      self.assertEqual(response_dict['result']['queues']['test_device']['concurrency'], 1)
+      self.assertEqual(response_dict['result']['queues']['test_device']['depth'], 0)
+
+    # Request the queue statistics
+    test_deferred = self.command_parser.parse_command({'command': 'device_queues', 'destination': 'system'},
+                                                      kernel_mode=True)
+    test_deferred.addCallback(parsing_complete)
+
+    return test_deferred
+
+  @inlineCallbacks
+  def test_rate_limits(self):
+    """ This test verifies that the rate_limits command returns the limits of each rate limit budget.
+    """
+
+    self.command_parser.rate_limiter.set_limit('user', 5, 10)
+    command_results = yield self.command_parser.parse_command({'command': 'rate_limits', 'destination': 'system'},
+                                                              kernel_mode=True)
+    rate_limit_statistics = command_results['response']['result']['budgets']
+    self.assertEqual(rate_limit_statistics['user']['rate'], 5)
+    self.assertEqual(rate_limit_statistics['user']['burst'], 10)
+    self.assertEqual(rate_limit_statistics['kernel']['rate'], None)
+
+  @inlineCallbacks
+  def test_unschedule(self):
+    """ This test verifies that the unschedule command cancels scheduled commands and requires a schedule ID.
+    """
+
+    self.command_parser.command_scheduler = scheduler.CommandScheduler(clock = task.Clock())
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                                               'execute_at': 3600}, kernel_mode=True)
+    schedule_id = command_results['response']['result']['schedule_id']
+
+    # Commands without a schedule ID should be rejected
+    try:
+      yield self.command_parser.parse_command({'command': 'unschedule', 'destination': 'system'}, kernel_mode=True)
+      self.fail("An unschedule command without a schedule ID was executed.")
+    except parser.CommandFailed as command_failure:
+      self.assertEqual(command_failure.results['response']['status'], 'error')
+      self.assertEqual(command_failure.results['response']['result']['missing_parameter'], 'schedule_id')
+
+    command_results = yield self.command_parser.parse_command({'command': 'unschedule', 'destination': 'system',
+                                                               'parameters': {'schedule_id': schedule_id}},
+                                                              kernel_mode=True)
+    self.assertEqual(command_results['response']['result']['command'], 'station_time')
+    self.assertEqual(self.command_parser.command_scheduler.get_pending_count(), 0)
+
+  @inlineCallbacks
+  def test_permission_cache(self):
+    """ This test verifies that the permission_cache command returns the permission cache statistics.
+    """
+
+    yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system'}, user_id="4")
+    command_results = yield self.command_parser.parse_command({'command': 'permission_cache', 'destination': 'system'},
+                                                              kernel_mode=True)
+    cache_statistics = command_results['response']['result']['cache']
+    self.assertEqual(cache_statistics['entries'], 5)
+    self.assertEqual((cache_statistics['hits'], cache_statistics['misses']), (0, 1))
+    self.assertTrue(cache_statistics['memory_estimate'] > 0)
+
+  @inlineCallbacks
+  def test_latency_statistics(self):
+    """ This test verifies that the latency_statistics command returns the latency histograms for executed commands.
+    """
+
+    # Run some commands
+    yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system'}, user_id="4")
+    yield self.command_parser.parse_command({'command': 'device_queues', 'destination': 'system'}, kernel_mode=True)
+
+    # Request the histograms for one of the commands
+    command_results = yield self.command_parser.parse_command({'command': 'latency_statistics', 'destination': 'system',
+                                                               'parameters': {'command': 'station_time'}},
+                                                              kernel_mode=True)
+    response_dict = command_results['response']
+    self.assertEqual(response_dict['status'], 'okay', 'The parser did not return a successful response.')
+    self.assertEqual(len(response_dict['result']['latencies']), 1)
+    self.assertEqual(response_dict['result']['latencies'][0]['destination'], 'system')
+    self.assertEqual(response_dict['result']['latencies'][0]['stages']['execution']['count'], 1)
+
+    # Request every histogram
+    command_results = yield self.command_parser.parse_command({'command': 'latency_statistics',
+                                                               'destination': 'system'}, kernel_mode=True)
+    self.assertEqual([latencies['command'] for latencies in command_results['response']['result']['latencies']],
+                     ['device_queues', 'latency_statistics', 'station_time'])
+
+  @inlineCallbacks
+  def test_list_commands(self):
+    """ This test verifies that the list_commands command returns the command catalog unless the provided ETag matches
+    the current catalog.
+    """
+
+    # Download the catalog
+    command_results = yield self.command_parser.parse_command({'command': 'list_commands', 'destination': 'system'},
+                                                              kernel_mode=True)
+    response_dict = command_results['response']
+    self.assertEqual(response_dict['status'], 'okay', 'The parser did not return a successful response.')
+    self.assertEqual(response_dict['result']['not_modified'], False)
+    self.assertTrue('list_commands' in response_dict['result']['catalog']['system']['system'])
+    catalog_etag = response_dict['result']['etag']
+
+    # Request it again using its ETag
+    command_results = yield self.command_parser.parse_command({'command': 'list_commands', 'destination': 'system',
+                                                               'parameters': {'if_none_match': catalog_etag}},
+                                                              kernel_mode=True)
+    self.assertEqual(command_results['response']['result'], {'etag': catalog_etag, 'not_modified': True})
+
+    # Outdated ETags should get the full catalog
+    command_results = yield self.command_parser.parse_command({'command': 'list_commands', 'destination': 'system',
+                                                               'parameters': {'if_none_match': 'outdated'}},
+                                                              kernel_mode=True)
+    self.assertTrue('catalog' in command_results['response']['result'])
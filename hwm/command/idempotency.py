@@ -0,0 +1,182 @@
+""" @package hwm.command.idempotency
+Contains a table of recently used command idempotency keys.
+
+This module contains a class that the command parser uses to suppress duplicate commands. Clients can attach an
+'idempotency_key' to a command so that, if they have to retry it (e.g. after an HTTP timeout), the retry will be
+answered with the response of the original command instead of executing the command (and its hardware action) again.
+"""
+
+# Import required modules
+import copy, json, collections
+from twisted.internet import defer, reactor
+from hwm.command import command
+
+class IdempotencyTable(object):
+  """ Stores the responses of recent commands that were submitted with an idempotency key.
+
+  This class executes commands that have an idempotency key on behalf of the command parser. The first command with a
+  given key is executed normally. Commands with the same key that are received while it is still executing will wait
+  for (and share) its response, and commands received after it completes will be answered with a copy of its stored
+  response until the key expires. Shared responses have their 'replayed' field set.
+
+  @note Keys are scoped to the user that submitted them, so users can't receive each other's responses.
+  @note Only successful responses are stored. If a command fails, its error will be passed to every command that was
+        waiting for it and the key will be released so that the command can be retried.
+  @note The table holds at most max_entries keys. When it is full, the oldest keys are discarded even if they haven't
+        expired yet.
+  """
+
+  def __init__(self, max_entries = 4096, key_ttl = 600, clock = None):
+    """ Sets up the idempotency table.
+
+    @param max_entries  The maximum number of keys to store.
+    @param key_ttl      How long (in seconds) a key's response will be stored after its command completes.
+    @param clock        An object that provides a seconds() method (typically the reactor).
+    """
+
+    self.max_entries = max_entries
+    self.key_ttl = key_ttl
+    self.clock = clock if clock is not None else reactor
+    self.replayed = 0
+    self.attached = 0
+    self._entries = collections.OrderedDict()
+
+  def execute(self, keyed_command, command_function, *args):
+    """ Executes a command unless a command with the same idempotency key has already been executed.
+
+    @throw Throws CommandError if the idempotency key has already been used for a different command.
+
+    @param keyed_command     The Command being executed. Its idempotency_key attribute must be set.
+    @param command_function  The function that executes the command and returns its response (or a deferred for it).
+    @param *args             Arguments to pass to command_function.
+    @return Returns a deferred that will be fired with the command's response (or the command's error).
+    """
+
+    table_key = (keyed_command.user_id, keyed_command.idempotency_key)
+    command_fingerprint = (keyed_command.full_destination, keyed_command.command,
+                           json.dumps(keyed_command.parameters, sort_keys = True))
+    self._remove_expired_entries()
+
+    # Check if the key has already been used
+    if table_key in self._entries:
+      key_entry = self._entries[table_key]
+      if key_entry.fingerprint != command_fingerprint:
+        raise command.CommandError("The submitted idempotency key has already been used for a different command.",
+                                   {"idempotency_key": keyed_command.idempotency_key})
+
+      if key_entry.response is not None:
+        self.replayed += 1
+        return defer.succeed(self._build_replayed_response(key_entry.response))
+
+      self.attached += 1
+      response_deferred = defer.Deferred()
+      key_entry.waiting.append(response_deferred)
+      return response_deferred
+
+    # Execute the command
+    while len(self._entries) >= self.max_entries:
+      self._entries.popitem(last = False)
+    key_entry = KeyEntry(command_fingerprint)
+    self._entries[table_key] = key_entry
+    command_deferred = defer.maybeDeferred(command_function, *args)
+    command_deferred.addCallbacks(self._command_complete, self._command_failed, callbackArgs = (table_key, key_entry),
+                                  errbackArgs = (table_key, key_entry))
+
+    return command_deferred
+
+  def get_statistics(self):
+    """ Returns statistics about the idempotency table.
+
+    @return Returns a dictionary containing the number of stored keys, the number of commands that were answered with a
+            stored response ('replayed'), and the number of commands that waited for an executing duplicate
+            ('attached').
+    """
+
+    return {
+      'entries': len(self._entries),
+      'replayed': self.replayed,
+      'attached': self.attached
+    }
+
+  def _command_complete(self, command_response, table_key, key_entry):
+    """ Stores a command's response and passes it to every waiting duplicate.
+
+    @param command_response  The command's response dictionary.
+    @param table_key         The command's key in the table.
+    @param key_entry         The command's KeyEntry.
+    @return Returns command_response so that it is passed on to the original command's callbacks.
+    """
+
+    if self._entries.get(table_key) is key_entry:
+      key_entry.response = copy.deepcopy(command_response)
+      key_entry.expires_at = self.clock.seconds()+self.key_ttl
+
+    waiting_deferreds = key_entry.waiting
+    key_entry.waiting = []
+    for waiting_deferred in waiting_deferreds:
+      waiting_deferred.callback(self._build_replayed_response(command_response))
+
+    return command_response
+
+  def _command_failed(self, failure, table_key, key_entry):
+    """ Releases a failed command's key and passes the error to every waiting duplicate.
+
+    @param failure    A Failure describing the error.
+    @param table_key  The command's key in the table.
+    @param key_entry  The command's KeyEntry.
+    @return Returns the failure so that it is passed on to the original command's errbacks.
+    """
+
+    if self._entries.get(table_key) is key_entry:
+      del self._entries[table_key]
+
+    waiting_deferreds = key_entry.waiting
+    key_entry.waiting = []
+    for waiting_deferred in waiting_deferreds:
+      waiting_deferred.errback(failure)
+
+    return failure
+
+  def _remove_expired_entries(self):
+    """ Removes the keys whose responses have expired.
+
+    @note Keys are stored in the order that their commands were received, and commands that are still executing don't
+          expire. Because of this, the oldest keys are checked first and the search stops at the first key that hasn't
+          expired.
+    """
+
+    current_time = self.clock.seconds()
+    while len(self._entries) > 0:
+      table_key, key_entry = next(self._entries.iteritems())
+      if key_entry.expires_at is None or key_entry.expires_at > current_time:
+        break
+      del self._entries[table_key]
+
+  def _build_replayed_response(self, command_response):
+    """ Builds the response for a duplicate command.
+
+    @param command_response  The original command's response dictionary.
+    @return Returns a copy of the response with its 'replayed' field set.
+    """
+
+    replayed_response = copy.deepcopy(command_response)
+    replayed_response['response']['replayed'] = True
+
+    return replayed_response
+
+class KeyEntry(object):
+  """ Represents an idempotency key stored in the IdempotencyTable.
+  """
+
+  __slots__ = ['fingerprint', 'response', 'expires_at', 'waiting']
+
+  def __init__(self, fingerprint):
+    """ Sets up the entry for a command that is about to be executed.
+
+    @param fingerprint  A tuple identifying the command's destination, name, and parameters.
+    """
+
+    self.fingerprint = fingerprint
+    self.response = None
+    self.expires_at = None
+    self.waiting = []
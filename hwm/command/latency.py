@@ -0,0 +1,156 @@
+""" @package hwm.command.latency
+Contains classes used to record how long each stage of command execution takes.
+
+This module contains a monotonic clock used to timestamp the stages of a command as it moves through the command parser
+(see hwm.command.command.Command.record_stage) and the histograms that those timings are aggregated into. The
+histograms are kept separately for each (destination, command) combination so that, for example, slow antenna "move"
+commands can be traced to schema validation, permission loading, or the antenna controller itself.
+"""
+
+# Import required modules
+import bisect, os, sys, ctypes, ctypes.util
+
+def _load_monotonic_clock():
+  """ Loads a monotonic clock so that the stage timings aren't affected by changes to the system clock.
+
+  On Linux, the clock reads CLOCK_MONOTONIC using clock_gettime. On other platforms (or if clock_gettime can't be
+  loaded), it uses the elapsed real time reported by os.times, which is also monotonic but much less precise.
+
+  @return Returns a function that returns the current value of the clock in seconds.
+  """
+
+  class Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+  if sys.platform.startswith('linux'):
+    try:
+      clock_library = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno = True)
+      clock_gettime = clock_library.clock_gettime
+      clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+    except (OSError, AttributeError):
+      clock_gettime = None
+
+    if clock_gettime is not None:
+      CLOCK_MONOTONIC = 1
+
+      def monotonic():
+        current_time = Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(current_time)) != 0:
+          raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return current_time.tv_sec+current_time.tv_nsec*1e-9
+
+      return monotonic
+
+  return lambda: os.times()[4]
+
+## Returns the current value of a monotonic clock in seconds
+monotonic = _load_monotonic_clock()
+
+## The upper bounds (in seconds) of the histogram buckets. Durations larger than the last bound are counted in an extra
+# overflow bucket.
+BUCKET_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class LatencyHistogram(object):
+  """ A fixed bucket histogram of stage durations.
+  """
+
+  __slots__ = ['count', 'total', 'max', 'buckets']
+
+  def __init__(self):
+    """ Sets up the empty histogram.
+    """
+
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.buckets = [0]*(len(BUCKET_BOUNDS)+1)
+
+  def record(self, duration):
+    """ Adds a duration to the histogram.
+
+    @param duration  The duration to add, in seconds.
+    """
+
+    self.count += 1
+    self.total += duration
+    self.max = max(self.max, duration)
+    self.buckets[bisect.bisect_left(BUCKET_BOUNDS, duration)] += 1
+
+  def get_statistics(self):
+    """ Returns a summary of the histogram.
+
+    @return Returns a dictionary containing the number of recorded durations, their mean and maximum, and the histogram
+            buckets. The buckets are stored as a list of [upper_bound, count] pairs, where the upper bound of the
+            overflow bucket is None.
+    """
+
+    return {
+      'count': self.count,
+      'mean': (self.total/self.count) if self.count > 0 else 0,
+      'max': self.max,
+      'buckets': [[upper_bound, bucket_count] for upper_bound, bucket_count in zip(BUCKET_BOUNDS+(None,), self.buckets)]
+    }
+
+class LatencyRecorder(object):
+  """ Aggregates command stage timings into per-(destination, command) histograms.
+  """
+
+  def __init__(self):
+    """ Sets up the latency recorder.
+    """
+
+    self._histograms = {}
+
+  def record_command(self, recorded_command):
+    """ Adds the stage timings of a completed command to its histograms.
+
+    @note Commands that failed before their destination and command name could be determined (e.g. malformed commands)
+          are not recorded.
+
+    @param recorded_command  The completed Command object.
+    """
+
+    if recorded_command.command is None or recorded_command.full_destination is None:
+      return
+
+    histogram_key = (recorded_command.full_destination, recorded_command.command)
+    if histogram_key not in self._histograms:
+      self._histograms[histogram_key] = {}
+    command_histograms = self._histograms[histogram_key]
+
+    for stage_name, stage_duration in recorded_command.get_stage_timings().iteritems():
+      if stage_name not in command_histograms:
+        command_histograms[stage_name] = LatencyHistogram()
+      command_histograms[stage_name].record(stage_duration)
+
+  def get_statistics(self, destination = None, command_name = None):
+    """ Returns the histograms for every recorded command.
+
+    @param destination   If set, only commands sent to this (full) destination will be included.
+    @param command_name  If set, only commands with this name will be included.
+    @return Returns a list containing a dictionary for each (destination, command) combination. Each dictionary contains
+            the destination, the command, and a 'stages' dictionary containing the statistics for each stage (see
+            LatencyHistogram.get_statistics).
+    """
+
+    latency_statistics = []
+    for (histogram_destination, histogram_command), command_histograms in sorted(self._histograms.iteritems()):
+      if destination is not None and histogram_destination != destination:
+        continue
+      if command_name is not None and histogram_command != command_name:
+        continue
+
+      latency_statistics.append({
+        'destination': histogram_destination,
+        'command': histogram_command,
+        'stages': dict((stage_name, histogram.get_statistics()) for stage_name, histogram in
+                       command_histograms.iteritems())
+      })
+
+    return latency_statistics
+
+  def clear(self):
+    """ Removes all recorded timings.
+    """
+
+    self._histograms = {}
@@ -7,8 +7,12 @@ it to the user interface. The user interface will use the metadata to build an a
 easily execute the command.
 """
 
+## The command priority classes, mapped to their rank (lower ranks are executed first). See build_metadata_dict.
+priority_classes = {'emergency': 0, 'high': 1, 'normal': 2, 'low': 3}
+
 def build_metadata_dict(command_parameters, command_id, command_handler_name, requires_active_session = True,
-                        dangerous = True, schedulable = False, use_as_initial_value = False):
+                        dangerous = True, schedulable = False, use_as_initial_value = False, cache_ttl = None,
+                        timeout = None, priority = 'normal'):
   """ Builds the command meta-data structure for a specific command.
   
   Command handlers use this function to build the command meta-data structures for the commands they service. For the 
@@ -63,6 +67,18 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
   @param use_as_initial_value     If set, the user interface will use this command when building the device or system's
                                   initial state configuration forms during the reservation process. This can be used, 
                                   for example, to set the initial frequency that a radio should be tunned to.
+  @param cache_ttl                If set, indicates that the command only reads state and that its results can be shared 
+                                  between identical requests (i.e. for the same pipeline, destination, command, and 
+                                  parameters) for this many seconds. Concurrent identical requests will also share a 
+                                  single execution of the command. Only use this for commands whose results don't 
+                                  depend on the user that submitted them.
+  @param timeout                  If set, the default number of seconds that the command may take before it is cancelled
+                                  and a 'timeout' response is returned. Users may override it using the command's 
+                                  'timeout' field. If not set, the command parser's default timeout will be used.
+  @param priority                 The command's priority class ('emergency', 'high', 'normal', or 'low'). Waiting 
+                                  commands are executed in priority order by their device's command queue. 'emergency'
+                                  commands (e.g. emergency stops) are also started without waiting for the device's 
+                                  executing commands, are never rate limited, and use a dedicated thread pool.
   @return Returns a dictionary containing the command meta-data.
   """
   
@@ -90,6 +106,20 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
         if not isinstance(option, list) or len(option) != 2:
           raise InvalidCommandMetadata("One of the options specified for a 'select' parameter was malformed. Options need to be a 2 element list containing the option title and value.")
   
+  # Validate the cache TTL
+  if cache_ttl is not None and (isinstance(cache_ttl, bool) or not isinstance(cache_ttl, (int, long, float)) or 
+                                cache_ttl <= 0):
+    raise InvalidCommandMetadata("A command's cache TTL must be a positive number of seconds.")
+
+  # Validate the timeout
+  if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, long, float)) or 
+                              timeout <= 0):
+    raise InvalidCommandMetadata("A command's timeout must be a positive number of seconds.")
+
+  # Validate the priority
+  if priority not in priority_classes:
+    raise InvalidCommandMetadata("Invalid command priority class specified: "+str(priority))
+  
   # Store the meta-data values
   metadata['command_id'] = command_id
   metadata['destination'] = command_handler_name
@@ -98,9 +128,48 @@ def build_metadata_dict(command_parameters, command_id, command_handler_name, re
   metadata['dangerous'] = True if dangerous else False
   metadata['schedulable'] = True if schedulable else False
   metadata['use_as_initial_value'] = True if use_as_initial_value else False
+  metadata['cache_ttl'] = cache_ttl
+  metadata['timeout'] = timeout
+  metadata['priority'] = priority
   
   return metadata;
 
+def freeze_metadata(metadata):
+  """ Builds a read-only copy of a command meta-data structure.
+
+  This function recursively copies the provided meta-data structure (typically the output of build_metadata_dict),
+  converting dictionaries into FrozenMetadata instances and lists into tuples. The command parser uses it to store the
+  meta-data in its routing table so that the same dictionary can be safely shared between every command execution.
+
+  @param metadata  The meta-data structure (or any nested part of it) to freeze.
+  @return Returns a read-only copy of the meta-data structure.
+  """
+
+  if isinstance(metadata, dict):
+    return FrozenMetadata((key, freeze_metadata(value)) for key, value in metadata.iteritems())
+  elif isinstance(metadata, (list, tuple)):
+    return tuple(freeze_metadata(value) for value in metadata)
+  else:
+    return metadata
+
+class FrozenMetadata(dict):
+  """ A read-only command meta-data dictionary.
+
+  This dictionary behaves like the one returned by build_metadata_dict except that it can't be modified after it has
+  been created. Any attempt to modify it will raise a TypeError.
+  """
+
+  def _read_only(self, *args, **kwargs):
+    raise TypeError("Command meta-data can not be modified once it has been frozen.")
+
+  __setitem__ = _read_only
+  __delitem__ = _read_only
+  clear = _read_only
+  pop = _read_only
+  popitem = _read_only
+  setdefault = _read_only
+  update = _read_only
+
 class InvalidCommandMetadata(Exception):
   pass
 class InvalidCommandAddress(Exception):
@@ -6,12 +6,16 @@ as they're received. Once a command has been executed, it returns the results of
 """
 
 # Import required modules
-import time, logging
-from twisted.internet import defer, threads
-from hwm.command import command
+import time, logging, functools
+from twisted.internet import defer, threads, reactor
+from twisted.python import failure
+from hwm.command import command, cache, coalescing, executor, latency, catalog, scheduler, ratelimit, idempotency
+from hwm.command import program
+from hwm.command.metadata import freeze_metadata
 from hwm.hardware.devices.drivers import driver
 from hwm.hardware.devices import manager as device_manager
 from hwm.hardware.pipelines import manager as pipeline_manager
+from hwm.network.security import permissions
 
 class CommandParser:
   """ Processes all commands received by the hardware manager.
@@ -33,15 +37,53 @@ class CommandParser:
           coordinator needs this class so that it can pass it to newly created sessions for their setup commands.
     @note This class requires that a PipelineManager instance be initialized with an instance of this class before it 
           can parse device commands. This is required so that it can relay device commands to the specified device.
+    @note Commands that don't specify a timeout (either in their meta-data or in the command itself) will use the 
+          default_timeout attribute, which is set from the 'command-timeout' configuration option during startup. If it
+          is None, these commands will never time out.
+    @note Batches submitted to parse_command_batch can contain at most max_batch_size commands, which is set from the
+          'command-batch-max-size' configuration option during startup. If it is None, batches aren't limited.
+    @note Each user can have at most max_scheduled_per_user commands waiting for their 'execute_at' time, which is set
+          from the 'user-max-scheduled-commands' configuration option during startup. If it is None, scheduled
+          commands aren't limited. Kernel mode commands are never limited.
+    @note Commands are charged against the rate_limiter attribute's budgets as soon as they have been routed, before 
+          their permission and session requirements are checked. Batches and setup programs are charged against the 
+          user budget once as a whole. The limits are set from the rate limit configuration options during startup, 
+          and are unlimited by default.
+    @note Every completed command will be recorded in the audit_log attribute (a CommandAuditLog), which is set during
+          startup. If it is None, commands won't be audited.
+    @note Commands that include an idempotency key are executed through the idempotency_table attribute, which answers
+          duplicate commands (e.g. retries) with the original command's response instead of executing them again.
+    @note Device commands can report their progress using Command.report_progress. The parser sends the final progress
+          event for these commands when they complete, unless their handler continues monitoring them.
     """
     
     # Set the class attributes
     self.system_handlers = {}
     for command_handler in system_command_handlers:
       self.system_handlers[command_handler.name] = command_handler
+      command_handler.parser = self
     self.permission_manager = permission_manager
     self.pipeline_manager = None
     self.session_coordinator = None
+    self.routing_table = {}
+    self.command_catalog = catalog.CommandCatalog()
+    self.result_cache = cache.CommandResultCache()
+    self.command_coalescer = coalescing.CommandCoalescer()
+    self.command_executor = executor.CommandExecutor()
+    self.latency_recorder = latency.LatencyRecorder()
+    self.default_timeout = None
+    self.max_batch_size = None
+    self.max_scheduled_per_user = None
+    self.clock = reactor
+    self.command_scheduler = scheduler.CommandScheduler()
+    self.audit_log = None
+    self.rate_limiter = ratelimit.CommandRateLimiter()
+    self.idempotency_table = idempotency.IdempotencyTable()
+    self._next_progress_id = 1
+    self._scheduled_counts = {}
+
+    # Build the initial routing table (only the system commands are available until a PipelineManager registers)
+    self.build_routing_table()
 
   def system_command_handlers(self):
     """ Provides access to the loaded system command handlers.
@@ -51,7 +93,63 @@ class CommandParser:
 
     return self.system_handlers
 
-  def parse_command(self, raw_command, user_id = None, kernel_mode = False):
+  def get_device_queue_statistics(self):
+    """ Returns statistics about the device command queues.
+
+    @return Returns a dictionary containing the statistics for each device's command queue (see 
+            executor.DeviceCommandQueue.get_statistics), keyed by queue name.
+    """
+
+    return self.command_executor.get_statistics()
+
+  def get_latency_statistics(self, destination = None, command_name = None):
+    """ Returns the command latency histograms.
+
+    @param destination   If set, only commands sent to this destination (e.g. "pipeline_id.device_id") will be included.
+    @param command_name  If set, only commands with this name will be included.
+    @return Returns a list containing the stage latency histograms for each (destination, command) combination (see 
+            latency.LatencyRecorder.get_statistics).
+    """
+
+    return self.latency_recorder.get_statistics(destination, command_name)
+
+  def build_routing_table(self):
+    """ Builds the command routing table.
+
+    This method builds a table that maps every available (pipeline, destination, command) combination to a CommandRoute
+    containing the bound command function and its frozen meta-data. Commands are dispatched using a single lookup in 
+    this table instead of resolving the pipeline, device, command handler, and command method for each command. System 
+    commands are stored with a pipeline of None.
+
+    @note The PipelineManager calls this method once its pipelines have been initialized. It must be called again 
+          whenever the loaded pipeline or device configuration changes so that the table reflects the new configuration.
+    @note Routes are only an optimization. If a command can't be found in the routing table the parser falls back to 
+          resolving it directly, which also generates the appropriate error messages.
+    @note This method also rebuilds the command catalog (see catalog.CommandCatalog) using the new routing table.
+    """
+
+    routing_table = {}
+
+    # Add the system command handlers
+    for handler_name, command_handler in self.system_handlers.iteritems():
+      self._add_handler_routes(routing_table, None, handler_name, command_handler)
+
+    # Add the device command handlers for each pipeline
+    if self.pipeline_manager is not None:
+      for pipeline_id, route_pipeline in self.pipeline_manager.pipelines.iteritems():
+        for device_id, device in route_pipeline.devices.iteritems():
+          try:
+            command_handler = device.get_command_handler()
+          except driver.CommandHandlerNotDefined:
+            continue
+
+          self._add_handler_routes(routing_table, pipeline_id, device_id, command_handler,
+                                   self._get_device_queue(pipeline_id, device))
+
+    self.routing_table = routing_table
+    self.command_catalog.build(routing_table)
+
+  def parse_command(self, raw_command, user_id = None, kernel_mode = False, command_codec = None):
     """ Processes all commands received by the ground station.
     
     When a raw command is passed to this function, it performs the following operations via a series of callbacks:
@@ -79,6 +177,8 @@ class CommandParser:
     @param kernel_mode  Indicates if the command should be run in kernel mode. That is, whether permission and session
                         restrictions should be ignored. This is done, for example, when pipeline setup commands get run
                         as a new session is being setup.
+    @param command_codec  The codec (see hwm.network.codec) that should be used to decode raw_command if it's a string.
+                          If None, it will be decoded as JSON.
     @return Returns the results of the command in a dictionary using a deferred. May be the output of the command or a
             Failure (containing details about the failure) in the event of an error.
     """
@@ -87,7 +187,8 @@ class CommandParser:
     time_command_received = int(time.time())
     
     # Create the new command (currently there is only one command type to worry about)
-    new_command = command.Command(time_command_received, raw_command, user_id=user_id, kernel_mode=kernel_mode)
+    new_command = command.Command(time_command_received, raw_command, user_id=user_id, kernel_mode=kernel_mode,
+                                  command_codec=command_codec)
     
     # Validate the command (format and schema)
     command_deferred = new_command.validate_command()
@@ -99,6 +200,302 @@ class CommandParser:
     
     return command_deferred
 
+  def invoke_internal(self, pipeline_id, destination, command_name, parameters = None, user_id = None):
+    """ Executes a command generated by the hardware manager itself.
+
+    This method is used by drivers and other hardware manager components to execute commands on their own behalf (e.g.
+    to update a radio's frequency with a new doppler correction). Unlike parse_command, it skips the steps that only 
+    matter for user submitted commands: the command isn't decoded or validated against the command schema, and the 
+    permission and session checks are skipped (the command is always run in kernel mode). The command is still routed, 
+    executed through its device's command queue (and the coalescing queue if applicable), and recorded in the latency 
+    histograms exactly like any other command. It is never answered from the result cache, because internal commands 
+    (e.g. a driver polling its device's state) need the device's current results.
+
+    @note The returned deferred behaves like the one returned by parse_command. It will be fired with the command's 
+          response dictionary, or errback'd with a CommandFailed exception containing the error response.
+
+    @param pipeline_id   The ID of the pipeline to send the command through. Should be None for system commands.
+    @param destination   The command's destination (a device ID or system command handler name).
+    @param command_name  The name of the command.
+    @param parameters    A dictionary containing the command's parameters. Because the parameters aren't validated, it
+                         is up to the caller to make sure that they are valid for the command.
+    @param user_id       The ID of the user that the command is being executed on behalf of (e.g. the user of the 
+                         session that triggered it), if any.
+    @return Returns a deferred that will be fired with the results of the command.
+    """
+
+    internal_command = command.InternalCommand(int(time.time()), pipeline_id, destination, command_name, parameters,
+                                               user_id)
+
+    command_deferred = defer.maybeDeferred(self._run_internal_command, internal_command)
+    command_deferred.addErrback(self._command_error, internal_command)
+
+    return command_deferred
+
+  def unschedule_command(self, schedule_id, user_id = None):
+    """ Cancels a command that is waiting for its 'execute_at' time.
+
+    @throw Throws CommandError if the scheduled command can't be found (e.g. because it has already been executed) or if
+           it belongs to a different user.
+
+    @param schedule_id  The schedule ID that was returned when the command was scheduled.
+    @param user_id      The ID of the user cancelling the command. If set, only the user's own commands can be 
+                        cancelled. If None, any scheduled command can be cancelled.
+    @return Returns the cancelled Command.
+    """
+
+    scheduled_entry = self.command_scheduler.get_entry(schedule_id)
+    if scheduled_entry is None:
+      raise command.CommandError("The specified scheduled command could not be found. It may have already been "+
+                                 "executed.", {"schedule_id": schedule_id})
+
+    scheduled_command = scheduled_entry.args[0]
+    if user_id is not None and scheduled_command.user_id != user_id:
+      raise command.CommandError("You can only cancel your own scheduled commands.", {"schedule_id": schedule_id})
+
+    self.command_scheduler.cancel(schedule_id)
+    self._release_scheduled_slot(scheduled_command)
+
+    return scheduled_command
+
+  def parse_command_batch(self, raw_commands, user_id = None, kernel_mode = False, sequential = True):
+    """ Processes a batch of commands submitted together.
+    
+    This method executes a list of commands on behalf of a single user. The user's permissions are only loaded once for 
+    the entire batch. Each command is then individually validated, routed, authorized, and executed exactly as if it had
+    been passed to parse_command.
+    
+    @note Unlike parse_command, the deferred returned by this method is never errback'd because of an individual
+          command failure. Instead, it is fired with a list containing the response dictionary of every command in the 
+          batch (in the same order as raw_commands). Failed commands are represented by their error responses (i.e. 
+          Failure.value.results from parse_command).
+    @note If the user's permissions can't be loaded, every command in the batch will fail with the same error.
+    @note Batches containing more than max_batch_size commands, or submitted by a user that has exhausted their rate 
+          limit budget, are rejected without executing any of them. In this case, the returned deferred will errback 
+          with a CommandFailed exception containing a single error (or 'throttled') response.
+    
+    @param raw_commands  A list of raw commands. Each element can be in any format accepted by parse_command.
+    @param user_id       The ID of the user submitting the batch. See parse_command.
+    @param kernel_mode   Indicates if the commands should be run in kernel mode. See parse_command.
+    @param sequential    If True, each command will only be started once the previous command has completed. If False,
+                         all of the commands will be started immediately and executed concurrently.
+    @return Returns a deferred that will be fired with a list containing the response for each command in the batch.
+    """
+    
+    # Reject batches that are too large
+    time_commands_received = int(time.time())
+    if self.max_batch_size is not None and len(raw_commands) > self.max_batch_size:
+      error_message = ("The batch contained "+str(len(raw_commands))+" commands, but at most "+str(self.max_batch_size)+
+                       " commands can be submitted at once.")
+      rejected_batch = command.Command(time_commands_received, None, user_id=user_id)
+      error_response = rejected_batch.build_command_response(False, {'error_message': error_message,
+                                                                     'max_batch_size': self.max_batch_size})
+      logging.error("A command batch was rejected: "+error_message)
+      return defer.fail(CommandFailed(error_message, error_response))
+
+    # Charge the batch against the user's rate limit budget once (its commands won't be charged individually)
+    if not kernel_mode:
+      rate_limited = self.rate_limiter.acquire_group(user_id)
+      if rate_limited is not None:
+        error_message = "Too many commands have been submitted, please wait before trying again."
+        throttled_batch = command.Command(time_commands_received, None, user_id=user_id)
+        error_response = throttled_batch.build_command_response(False, {'error_message': error_message,
+                                                                        'budget': rate_limited[0],
+                                                                        'retry_after': rate_limited[1]},
+                                                                status = 'throttled')
+        logging.error("A command batch was rejected: "+error_message)
+        return defer.fail(CommandFailed(error_message, error_response))
+
+    # Create the commands
+    batch_commands = [command.Command(time_commands_received, raw_command, user_id=user_id, kernel_mode=kernel_mode)
+                      for raw_command in raw_commands]
+    for batch_command in batch_commands:
+      batch_command.group_rate_limited = not kernel_mode
+    
+    # Load the user's permissions once for the entire batch
+    if kernel_mode:
+      permissions_deferred = defer.succeed(None)
+    else:
+      permissions_deferred = self.permission_manager.get_user_permissions(user_id)
+    
+    # Run the batch once the permissions are available (addBoth so that permission errors get passed to each command)
+    if sequential:
+      permissions_deferred.addBoth(self._run_batch_sequentially, batch_commands)
+    else:
+      permissions_deferred.addBoth(self._run_batch_concurrently, batch_commands)
+    
+    return permissions_deferred
+
+  def compile_program(self, raw_commands, user_id = None, kernel_mode = False):
+    """ Compiles a list of setup commands into a CommandProgram.
+
+    This method performs the parts of parse_command that only depend on the commands themselves ahead of time: each 
+    command is decoded, validated against the command schema, and routed. Unless the program will be run in kernel mode,
+    each command is also checked against the user's current permissions. The resulting program can then be executed 
+    (any number of times) using run_program. This is used by the pipeline manager and schedule manager to prepare the
+    pipeline and reservation setup commands when they are loaded, instead of when a session starts.
+
+    @note Problems found while compiling the commands are logged and recorded in the program's errors attribute. They 
+          never cause the returned deferred to errback. Instead, commands that are invalid or can't be routed will fail
+          with the appropriate error response when the program is run.
+    @note If the user's permissions can't be loaded, the permission checks will be skipped. They are always performed 
+          again when the program runs.
+
+    @param raw_commands  A list of raw commands. Each element can be in any format accepted by parse_command.
+    @param user_id       The ID of the user that the commands will be executed on behalf of. See parse_command.
+    @param kernel_mode   Indicates if the commands will be run in kernel mode. See parse_command.
+    @return Returns a deferred that will be fired with the compiled CommandProgram.
+    """
+
+    # Load the user's permissions once for the entire program
+    if kernel_mode:
+      permissions_deferred = defer.succeed(None)
+    else:
+      permissions_deferred = self.permission_manager.get_user_permissions(user_id)
+
+    # Compile the commands once the permissions are available (addBoth so that permission errors can be reported)
+    setup_program = program.CommandProgram(raw_commands, user_id, kernel_mode)
+    permissions_deferred.addBoth(self._compile_program_steps, setup_program)
+
+    return permissions_deferred
+
+  def run_program(self, setup_program):
+    """ Executes the commands in a compiled CommandProgram.
+
+    This method executes each of the program's commands exactly as parse_command would have, except that the commands 
+    aren't decoded and validated again and their routes are reused (unless the routing table has been rebuilt without 
+    them). The user's permissions are loaded once for the entire program, and each command's permission and session 
+    requirements are checked before it is executed.
+
+    @note Like parse_command, each command's deferred will be fired with the command's response dictionary or errback'd
+          with a CommandFailed exception containing its error response. All of the commands are started at once.
+    @note The program is charged against the user's rate limit budget once as a whole. If the budget is exhausted, every
+          command will fail with a 'throttled' response.
+
+    @param setup_program  The CommandProgram to execute (see compile_program).
+    @return Returns a list containing a deferred for each command in the program (in the same order as its steps).
+    """
+
+    # Load the user's permissions once for the entire program (after charging it against the user's rate limit budget)
+    if setup_program.kernel_mode:
+      permissions_deferred = defer.succeed(None)
+    else:
+      rate_limited = self.rate_limiter.acquire_group(setup_program.user_id)
+      if rate_limited is not None:
+        throttled_error = command.CommandThrottled("Too many commands have been submitted, please wait before trying "+
+                                                   "again.", {"budget": rate_limited[0], "retry_after": rate_limited[1]})
+        permissions_deferred = defer.fail(throttled_error)
+      else:
+        permissions_deferred = self.permission_manager.get_user_permissions(setup_program.user_id)
+
+    # Create a new command for each step
+    time_program_started = int(time.time())
+    step_deferreds = []
+    for program_step in setup_program.steps:
+      if program_step.command_dict is not None:
+        step_command = command.PrecompiledCommand(time_program_started, program_step.command_dict, 
+                                                  user_id = setup_program.user_id, 
+                                                  kernel_mode = setup_program.kernel_mode)
+      else:
+        step_command = command.Command(time_program_started, program_step.raw_command, user_id = setup_program.user_id,
+                                       kernel_mode = setup_program.kernel_mode)
+      step_command.group_rate_limited = not setup_program.kernel_mode
+
+      step_deferred = defer.Deferred()
+      step_deferred.addCallback(self._run_program_step, program_step, step_command)
+      step_deferred.addErrback(self._command_error, step_command)
+      step_deferreds.append(step_deferred)
+
+    # Start the commands once the permissions are available (addBoth so that permission errors get passed to each step)
+    permissions_deferred.addBoth(self._start_program_steps, step_deferreds)
+
+    return step_deferreds
+
+  @defer.inlineCallbacks
+  def _compile_program_steps(self, user_permissions, setup_program):
+    """ Validates, routes, and authorizes each of a program's commands.
+
+    @param user_permissions  The user's permissions, None for kernel mode programs, or a Failure if the user's 
+                             permissions couldn't be loaded.
+    @param setup_program     The empty CommandProgram to compile the commands into.
+    @return Returns a deferred that will be fired with the compiled CommandProgram.
+    """
+
+    if isinstance(user_permissions, failure.Failure):
+      logging.warning("The permissions for user '"+str(setup_program.user_id)+"' could not be loaded while compiling "+
+                      "their setup commands, they will be checked when the commands are run: "+
+                      user_permissions.getErrorMessage())
+      user_permissions = None
+
+    for step_index, raw_command in enumerate(setup_program.raw_commands):
+      program_step = program.ProgramStep(raw_command)
+      setup_program.steps.append(program_step)
+      step_command = command.Command(int(time.time()), raw_command, user_id = setup_program.user_id,
+                                     kernel_mode = setup_program.kernel_mode)
+
+      try:
+        # Validate the command
+        try:
+          yield step_command.validate_command()
+        except Exception as validation_error:
+          program_step.error = validation_error
+          raise
+        program_step.command_dict = step_command.command_dict
+
+        # Route the command (if this fails, the command will be routed again when the program is run)
+        program_step.route_key, program_step.route = self._get_command_route(step_command)
+
+        # Check the user's permissions
+        if user_permissions is not None and not setup_program.kernel_mode:
+          self._check_permissions(user_permissions, step_command)
+      except Exception as compile_error:
+        setup_program.add_error(step_index, str(compile_error))
+        logging.error("A setup command ("+str(step_command.command)+") will fail when it is run for the following "+
+                      "reason: "+str(compile_error))
+
+    defer.returnValue(setup_program)
+
+  def _start_program_steps(self, user_permissions, step_deferreds):
+    """ Starts each of a program's commands once the user's permissions have been loaded.
+
+    @param user_permissions  The user's permissions, None for kernel mode programs, or a Failure if the user's 
+                             permissions couldn't be loaded.
+    @param step_deferreds    The list of deferreds (see run_program) that will execute each command.
+    """
+
+    for step_deferred in step_deferreds:
+      if isinstance(user_permissions, failure.Failure):
+        step_deferred.errback(user_permissions)
+      else:
+        step_deferred.callback(user_permissions)
+
+  def _run_program_step(self, user_permissions, program_step, step_command):
+    """ Executes a single command from a compiled program.
+
+    @throw Raises the command's validation error if it couldn't be validated when the program was compiled. May also 
+           throw any of the exceptions thrown by _run_command.
+
+    @param user_permissions  A dictionary containing the user's permissions, or None for kernel mode programs.
+    @param program_step      The command's ProgramStep.
+    @param step_command      The Command object to execute.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    if program_step.error is not None:
+      raise program_step.error
+
+    step_command.record_stage('permissions')
+
+    # Reuse the compiled route unless the routing table has been rebuilt since the program was compiled
+    if program_step.route is not None and self.routing_table.get(program_step.route_key) is program_step.route:
+      route_key, command_route = program_step.route_key, program_step.route
+      step_command.routed = True
+    else:
+      route_key, command_route = self._get_command_route(step_command)
+    step_command.record_stage('routing')
+
+    return self._run_routed_command(user_permissions, route_key, command_route, step_command)
+
   def _load_permissions(self, validation_results, valid_command):
     """ Loads the user's permissions, if required.
     
@@ -145,8 +542,461 @@ class CommandParser:
     @return Returns a deferred that will eventually be fired with the results of the command execution.
     """
     
+    valid_command.record_stage('permissions')
+
+    # Look up the command's route
+    route_key, command_route = self._get_command_route(valid_command)
+    valid_command.record_stage('routing')
+
+    return self._run_routed_command(user_permissions, route_key, command_route, valid_command)
+
+  def _run_routed_command(self, user_permissions, route_key, command_route, valid_command):
+    """ Checks a routed command's permission and session requirements and then executes it.
+
+    @throw Throws CommandThrottled if the command exceeds one of the rate limiter's budgets.
+    @throw Throws CommandError if the user isn't allowed to execute the command. May also throw any of the exceptions 
+           thrown while executing the command.
+
+    @param user_permissions  A dictionary containing the user's permissions. If the command is being running in kernel
+                             mode, this will just be None.
+    @param route_key         The command's routing table key.
+    @param command_route     The command's CommandRoute.
+    @param valid_command     The Command object for the currently executing command.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    self._check_rate_limits(command_route, valid_command)
+
+    full_destination = valid_command.full_destination
+    pipeline = valid_command.pipeline
+    device_command = command_route.device_command
+
+    if not valid_command.kernel_mode:
+      # Check the user's permissions
+      self._check_permissions(user_permissions, valid_command)
+
+      # Check the command's session requirements
+      active_user_sessions = self.session_coordinator.load_user_sessions(valid_command.user_id)
+      valid_command.active_user_sessions = active_user_sessions
+      if not user_permissions['ignore_session_protections']:
+        # Check the command meta-data to see if it requires an active session
+        if command_route.metadata is not None:
+          require_session = command_route.metadata['requires_active_session']
+        else:
+          # Command metadata not specified, default to True for safety
+          require_session = True
+        
+        if require_session:
+          if device_command:
+            # Device command, make sure one of the user's active sessions uses the specified pipeline
+            session_requirements_met = False
+            for user_session in active_user_sessions:
+              if user_session.active_pipeline.id == pipeline:
+                session_requirements_met = True
+                break
+            
+            if not session_requirements_met:
+              raise command.CommandError("You must have a currently active session for a pipeline that contains the "+
+                                         "destination device to use that command.",
+                                         {"command": valid_command.command, "destination": full_destination})
+          else:
+            # System command, make sure the user has at least one active session
+            if len(active_user_sessions) <= 0:
+              raise command.CommandError("You must have an active session to use that command.",
+                                         {"command": valid_command.command, "destination": full_destination})
+
+    valid_command.record_stage('sessions')
+
+    # Answer duplicates of recent commands with the original command's response (scheduled commands have already been 
+    # checked when they were submitted)
+    if valid_command.idempotency_key is not None and valid_command.schedule_id is None:
+      return self.idempotency_table.execute(valid_command, self._dispatch_command, route_key, command_route,
+                                            valid_command)
+
+    return self._dispatch_command(route_key, command_route, valid_command)
+
+  def _check_permissions(self, user_permissions, valid_command):
+    """ Verifies that the user's permissions allow them to execute a command.
+
+    @throw Throws CommandError if the user doesn't have permission to execute the command.
+
+    @param user_permissions  A dictionary containing the user's permissions.
+    @param valid_command     The Command being checked.
+    """
+
+    if 'compiled_permissions' in user_permissions:
+      compiled_permissions = user_permissions['compiled_permissions']
+    else:
+      compiled_permissions = permissions.CompiledPermissions(user_permissions['permitted_commands'])
+
+    if not compiled_permissions.allows(valid_command.command, valid_command.destination, valid_command.pipeline):
+      raise command.CommandError("You do not have permission to execute that command on that device.",
+                                 {"command": valid_command.command, "destination": valid_command.full_destination})
+
+  def _dispatch_command(self, route_key, command_route, valid_command):
+    """ Executes an authorized command immediately or schedules it for its 'execute_at' time.
+
+    @param route_key      The command's routing table key.
+    @param command_route  The command's CommandRoute.
+    @param valid_command  The Command being executed.
+    @return Returns the command's 'scheduled' response if it was scheduled or a deferred that will eventually be fired 
+            with the results of the command execution.
+    """
+
+    # Hold the command until its execution time if it's scheduled for the future
+    if (valid_command.execute_at is not None and valid_command.schedule_id is None and 
+        valid_command.execute_at > self.command_scheduler.clock.seconds()):
+      return self._schedule_command(valid_command)
+
+    return self._execute_command(route_key, command_route, valid_command)
+
+  def _schedule_command(self, valid_command):
+    """ Schedules a command for execution at its 'execute_at' time.
+
+    This method adds a command that has been validated, routed, and authorized to the command scheduler and returns a 
+    response with a 'scheduled' status. When the command's execution time arrives, its permissions and session 
+    requirements will be checked again (because the user's permissions or sessions may have changed in the meantime) 
+    before it is executed.
+
+    @note The results of scheduled commands are not returned to the user. Errors will be logged.
+
+    @throw Throws CommandThrottled if the command's user already has max_scheduled_per_user commands scheduled.
+
+    @param valid_command  The Command to schedule.
+    @return Returns the 'scheduled' response for the command, which contains the command's schedule ID (which can be 
+            used to cancel it) in its 'schedule_id' field.
+    """
+
+    # Make sure that the user hasn't filled up the scheduler
+    if not valid_command.kernel_mode:
+      scheduled_count = self._scheduled_counts.get(valid_command.user_id, 0)
+      if self.max_scheduled_per_user is not None and scheduled_count >= self.max_scheduled_per_user:
+        raise command.CommandThrottled("Too many of your commands are already scheduled, please wait for them to be "+
+                                       "executed (or unschedule some of them) before scheduling more.",
+                                       {"budget": "scheduled", "max_scheduled_commands": self.max_scheduled_per_user})
+      self._scheduled_counts[valid_command.user_id] = scheduled_count+1
+
+    scheduled_entry = self.command_scheduler.schedule(valid_command.execute_at, self._run_scheduled_command, 
+                                                      valid_command)
+    valid_command.schedule_id = scheduled_entry.id
+
+    return valid_command.build_command_response(True, {'schedule_id': scheduled_entry.id, 
+                                                       'execute_at': valid_command.execute_at}, status = 'scheduled')
+
+  def _run_scheduled_command(self, scheduled_command):
+    """ Executes a scheduled command once its execution time arrives.
+
+    @param scheduled_command  The Command to execute.
+    @return Returns a deferred that will be fired with the command's response (or error response).
+    """
+
+    scheduled_command.record_stage('scheduled')
+    self._release_scheduled_slot(scheduled_command)
+
+    command_deferred = self._load_permissions(True, scheduled_command)
+    command_deferred.addErrback(self._command_error, scheduled_command)
+    command_deferred.addErrback(self._scheduled_command_failed)
+
+    return command_deferred
+
+  def _release_scheduled_slot(self, scheduled_command):
+    """ Removes a command that is no longer waiting in the command scheduler from its user's scheduled command count.
+
+    @param scheduled_command  The Command that was executed or cancelled.
+    """
+
+    if scheduled_command.kernel_mode:
+      return
+
+    scheduled_count = self._scheduled_counts.get(scheduled_command.user_id, 0)-1
+    if scheduled_count > 0:
+      self._scheduled_counts[scheduled_command.user_id] = scheduled_count
+    else:
+      self._scheduled_counts.pop(scheduled_command.user_id, None)
+
+  def _scheduled_command_failed(self, command_failure):
+    """ Handles the failure of a scheduled command.
+
+    The error has already been logged by _command_error, so this errback just converts it into the command's error 
+    response.
+
+    @param command_failure  A Failure wrapping the CommandFailed exception for the command.
+    @return Returns the command's error response dictionary.
+    """
+
+    command_failure.trap(CommandFailed)
+
+    return command_failure.value.results
+
+  def _run_internal_command(self, internal_command):
+    """ Executes a command submitted through invoke_internal.
+
+    @throw May throw CommandError if the command can't be routed, as well as any exceptions raised by the command.
+
+    @param internal_command  The InternalCommand to execute.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    route_key, command_route = self._get_command_route(internal_command)
+    internal_command.record_stage('routing')
+    self._check_rate_limits(command_route, internal_command)
+
+    return self._execute_command(route_key, command_route, internal_command)
+
+  def _check_rate_limits(self, command_route, valid_command):
+    """ Sets a routed command's priority and charges it against its rate limit budgets.
+
+    @note Scheduled commands are only charged when they are submitted, not again when their execution time arrives.
+          Emergency commands are never rate limited.
+
+    @throw Throws CommandThrottled if the command exceeds one of the rate limiter's budgets.
+
+    @param command_route  The command's CommandRoute.
+    @param valid_command  The Command being executed.
+    """
+
+    if command_route.metadata is not None:
+      valid_command.priority = command_route.metadata.get('priority', 'normal')
+    if valid_command.schedule_id is not None:
+      return
+
+    device_command = command_route.device_command
+    schedulable = command_route.metadata is not None and command_route.metadata.get('schedulable', False)
+    rate_limited = self.rate_limiter.acquire(valid_command, device_command, device_command and schedulable)
+    if rate_limited is not None:
+      raise command.CommandThrottled("Too many commands have been submitted, please wait before trying again.",
+                                     {"budget": rate_limited[0], "retry_after": rate_limited[1]})
+
+  def _get_command_route(self, valid_command):
+    """ Looks up the route for a command, resolving it and adding it to the routing table if needed.
+
+    @throw Throws CommandError if the command can't be routed (see _resolve_command_route).
+
+    @param valid_command  The Command being routed.
+    @return Returns a (route_key, CommandRoute) tuple for the command.
+    """
+
+    route_key = (None if valid_command.destination in self.system_handlers else valid_command.pipeline,
+                 valid_command.destination, valid_command.command)
+    try:
+      command_route = self.routing_table[route_key]
+    except KeyError:
+      command_route = self._resolve_command_route(valid_command)
+      self.routing_table[route_key] = command_route
+    valid_command.routed = True
+
+    return route_key, command_route
+
+  def _execute_command(self, route_key, command_route, valid_command):
+    """ Executes a routed command.
+
+    This method executes a command that has been routed and authorized. Device commands are always passed through their
+    device's command queue. In addition, cacheable commands are executed using the result cache and schedulable device 
+    commands are executed using the coalescing queue.
+
+    @param route_key      The command's routing table key.
+    @param command_route  The command's CommandRoute.
+    @param valid_command  The Command being executed.
+    @return Returns a deferred that will eventually be fired with the results of the command execution.
+    """
+
+    destination = valid_command.destination
+    device_command = command_route.device_command
+    schedulable = command_route.metadata is not None and command_route.metadata.get('schedulable', False)
+
+    valid_command.execution_started = True
+
+    # Allow device commands to report their progress to the sessions using their pipeline
+    if device_command and self.pipeline_manager is not None:
+      valid_command.progress_pipeline = self.pipeline_manager.pipelines.get(valid_command.pipeline, None)
+      valid_command.progress_id = self._next_progress_id
+      self._next_progress_id += 1
+
+    # Pass device commands through their device's command queue
+    command_function = command_route.function
+    if command_route.device_queue is not None:
+      command_function = functools.partial(command_route.device_queue.execute, command_function, 
+                                           priority = valid_command.priority, kernel_mode = valid_command.kernel_mode)
+    cache_ttl = command_route.metadata.get('cache_ttl') if command_route.metadata is not None else None
+    if cache_ttl and valid_command.use_result_cache:
+      cache_key = self.result_cache.build_key(route_key[0], destination, valid_command.command, 
+                                              valid_command.parameters)
+      command_deferred = self.result_cache.execute(cache_key, cache_ttl, command_function, valid_command)
+    elif device_command and schedulable:
+      command_deferred = self.command_coalescer.execute(route_key, command_function, valid_command)
+    else:
+      command_deferred = defer.maybeDeferred(command_function, valid_command)
+
+    # Cancel the command if it doesn't complete before its deadline
+    command_timeout = valid_command.timeout
+    if command_timeout is None and command_route.metadata is not None:
+      command_timeout = command_route.metadata.get('timeout')
+    if command_timeout is None:
+      command_timeout = self.default_timeout
+    if command_timeout is not None:
+      timeout_call = self.clock.callLater(command_timeout, self._command_timed_out, command_deferred, command_route,
+                                          valid_command)
+      command_deferred.addBoth(self._command_finished_before_timeout, timeout_call)
+      command_deferred.addErrback(self._command_cancelled, valid_command, command_timeout)
+
+    command_deferred.addCallback(self._command_complete, valid_command)
+    
+    return command_deferred
+
+  def _command_timed_out(self, command_deferred, command_route, timed_out_command):
+    """ Cancels a command that has passed its deadline.
+
+    This method notifies the command's handler that the command has timed out and then cancels the command's deferred,
+    which will cause a 'timeout' response to be returned. If the handler defines a "cancel_" method for the command 
+    (e.g. "cancel_move" for the "move" command), it will be called with the Command so that the handler can abort any 
+    work that is still in progress. Handlers can also check the Command's timed_out attribute.
+
+    @note Commands that are waiting in their device's command queue will be removed from the queue. Commands that have 
+          already started executing are released from the queue (see DeviceCommandQueue.release) so that the device's
+          next command can start, but the handler is responsible for actually stopping them.
+
+    @param command_deferred   The deferred for the command's execution.
+    @param command_route      The command's CommandRoute.
+    @param timed_out_command  The Command that timed out.
+    """
+
+    timed_out_command.timed_out = True
+
+    # Notify the command handler
+    cancel_function = getattr(command_route.handler, 'cancel_'+timed_out_command.command, None)
+    if callable(cancel_function):
+      try:
+        cancel_function(timed_out_command)
+      except Exception as cancel_error:
+        logging.error("An error occured cancelling a timed out command ("+timed_out_command.command+"): "+
+                      str(cancel_error))
+
+    command_deferred.cancel()
+    if command_route.device_queue is not None:
+      command_route.device_queue.release(timed_out_command)
+
+  def _command_finished_before_timeout(self, command_results, timeout_call):
+    """ Stops the command's timeout once it completes.
+
+    @param command_results  The results of the command (or a Failure).
+    @param timeout_call     The DelayedCall that will cancel the command when it times out.
+    @return Returns command_results so that they can be passed on to the rest of the callback chain.
+    """
+
+    if timeout_call.active():
+      timeout_call.cancel()
+
+    return command_results
+
+  def _command_cancelled(self, failure, cancelled_command, command_timeout):
+    """ Converts the cancellation of a command that has timed out into a CommandTimedOut error.
+
+    @throw Raises CommandTimedOut if the command was cancelled because it timed out. Otherwise, the original error will 
+           be passed on.
+
+    @param failure            The Failure describing why the command failed.
+    @param cancelled_command  The Command that failed.
+    @param command_timeout    The command's timeout in seconds.
+    @return Returns the original failure if the command didn't time out.
+    """
+
+    if not cancelled_command.timed_out or not failure.check(defer.CancelledError):
+      return failure
+
+    raise command.CommandTimedOut("The command did not complete within its "+str(command_timeout)+" second deadline.", 
+                                  {"command": cancelled_command.command, 
+                                   "destination": cancelled_command.full_destination,
+                                   "timeout": command_timeout})
+
+  @defer.inlineCallbacks
+  def _run_batch_sequentially(self, user_permissions, batch_commands):
+    """ Executes a batch of commands one after another.
+    
+    @param user_permissions  The user's permissions, None for kernel mode batches, or a Failure if the user's 
+                             permissions couldn't be loaded.
+    @param batch_commands    A list containing the Command objects in the batch.
+    @return Returns a deferred that will be fired with a list containing the response for each command.
+    """
+    
+    batch_results = []
+    for batch_command in batch_commands:
+      command_results = yield self._run_batch_command(user_permissions, batch_command)
+      batch_results.append(command_results)
+    
+    defer.returnValue(batch_results)
+  
+  def _run_batch_concurrently(self, user_permissions, batch_commands):
+    """ Executes a batch of commands concurrently.
+    
+    @param user_permissions  The user's permissions, None for kernel mode batches, or a Failure if the user's 
+                             permissions couldn't be loaded.
+    @param batch_commands    A list containing the Command objects in the batch.
+    @return Returns a deferred that will be fired with a list containing the response for each command.
+    """
+    
+    return defer.gatherResults([self._run_batch_command(user_permissions, batch_command)
+                                for batch_command in batch_commands])
+  
+  def _run_batch_command(self, user_permissions, batch_command):
+    """ Validates and executes a single command from a batch.
+    
+    @param user_permissions  The user's permissions, None for kernel mode batches, or a Failure if the user's 
+                             permissions couldn't be loaded.
+    @param batch_command     The Command object to execute.
+    @return Returns a deferred that will be fired with the command's response dictionary, even if the command fails.
+    """
+    
+    command_deferred = batch_command.validate_command()
+    command_deferred.addCallback(self._run_validated_batch_command, user_permissions, batch_command)
+    command_deferred.addErrback(self._command_error, batch_command)
+    command_deferred.addErrback(self._batch_command_failed)
+    
+    return command_deferred
+  
+  def _run_validated_batch_command(self, validation_results, user_permissions, batch_command):
+    """ Executes a batch command once it has been validated.
+    
+    @throw Re-raises the permission loading error if the user's permissions couldn't be loaded.
+    
+    @param validation_results  The validation results. Always true.
+    @param user_permissions    The user's permissions, None for kernel mode batches, or a Failure if the user's 
+                               permissions couldn't be loaded.
+    @param batch_command       The Command object to execute.
+    @return Returns a deferred that will be fired with the results of the command execution.
+    """
+    
+    if isinstance(user_permissions, failure.Failure):
+      user_permissions.raiseException()
+    
+    return self._run_command(user_permissions, batch_command)
+  
+  def _batch_command_failed(self, command_failure):
+    """ Converts a failed batch command into its error response.
+    
+    @param command_failure  A Failure wrapping the CommandFailed exception for the command.
+    @return Returns the command's error response dictionary.
+    """
+    
+    command_failure.trap(CommandFailed)
+    
+    return command_failure.value.results
+
+  def _resolve_command_route(self, valid_command):
+    """ Resolves the route for a command that isn't in the routing table.
+
+    This method locates the command handler and command function for the specified command by querying the pipeline 
+    manager and the destination device directly. It is used when a command can't be found in the routing table and is 
+    responsible for generating the error messages for commands that can't be routed.
+
+    @throw Throws CommandError if the command's destination or the command itself can't be located.
+
+    @param valid_command  The Command object for the command being routed.
+    @return Returns a CommandRoute for the command.
+    """
+
     # Determine where to send the command
     device_command = False
+    device_queue = None
     destination = valid_command.destination
     full_destination = valid_command.full_destination
     pipeline = valid_command.pipeline
@@ -171,73 +1021,88 @@ class CommandParser:
         command_handler = dest_device.get_command_handler()
       except driver.CommandHandlerNotDefined as e:
         raise command.CommandError(str(e), {"command": valid_command.command, "destination": full_destination})
+
+      device_queue = self._get_device_queue(pipeline, dest_device)
     else:
       # Invalid Command
       raise command.CommandError("The received command was invalid because it specified an invalid command "+
                                  "destination.", {"command": valid_command.command, "destination": full_destination})
     
     # Verify that the command exists in the command handler
-    if not hasattr(command_handler, 'command_'+valid_command.command):
+    if not callable(getattr(command_handler, 'command_'+valid_command.command, None)):
       handler_string = "'"+destination+"'"
       if device_command:
         handler_string += " device"
       
       raise command.CommandError("The received command could not be located in the "+handler_string+" command handler.",
                                  {"command": valid_command.command, "destination": full_destination})
-    
-    if not valid_command.kernel_mode:
-      # Check the user's permissions
-      user_has_permission = False
-      for command_permission in user_permissions['permitted_commands']:
-        if (command_permission['command'] == valid_command.command and 
-            command_permission['destination'] == destination):
-          if 'pipelines' in command_permission:
-            if pipeline is not None and pipeline in command_permission['pipelines']:
-              user_has_permission = True
-          else:
-            user_has_permission = True
-      
-      if not user_has_permission:
-        raise command.CommandError("You do not have permission to execute that command on that device.",
-                                   {"command": valid_command.command, "destination": full_destination})
 
-      # Check the command's session requirements
-      active_user_sessions = self.session_coordinator.load_user_sessions(valid_command.user_id)
-      valid_command.active_user_sessions = active_user_sessions
-      if not user_permissions['ignore_session_protections']:
-        # Load the command meta-data to see if it requires an active session
+    return self._build_command_route(command_handler, valid_command.command, device_command, device_queue)
+
+  def _get_device_queue(self, pipeline_id, device):
+    """ Returns the command queue for the specified device.
+
+    Physical devices are shared between pipelines, so each one has a single queue named after its ID. Virtual devices 
+    are initialized separately for each pipeline that uses them, so their queues are named "[pipeline_id].[device_id]".
+
+    @param pipeline_id  The ID of the pipeline that the device's commands are being routed through.
+    @param device       The device's Driver instance.
+    @return Returns the device's DeviceCommandQueue, or None if the device isn't a Driver.
+    """
+
+    if not isinstance(device, driver.Driver):
+      return None
+
+    if isinstance(device, driver.VirtualDriver):
+      queue_name = pipeline_id+"."+device.id
+    else:
+      queue_name = device.id
+
+    return self.command_executor.get_queue(queue_name, device.command_concurrency)
+
+  def _add_handler_routes(self, routing_table, pipeline_id, destination, command_handler, device_queue = None):
+    """ Adds routes for all of the commands offered by a command handler to the routing table.
+
+    @param routing_table    The routing table dictionary to add the routes to.
+    @param pipeline_id      The ID of the pipeline that the commands will be routed through. None for system commands.
+    @param destination      The destination of the handler's commands (the system handler name or the device ID).
+    @param command_handler  The command handler that offers the commands.
+    @param device_queue     The DeviceCommandQueue that the device's commands should be executed through. None for 
+                            system commands.
+    """
+
+    for attribute_name in dir(command_handler):
+      if attribute_name.startswith('command_'):
+        command_name = attribute_name[len('command_'):]
+        if not callable(getattr(command_handler, attribute_name)):
+          continue
+
         try:
-          command_metadata = getattr(command_handler, 'settings_'+valid_command.command)
-          require_session = command_metadata()['requires_active_session']
-        except AttributeError:
-          # Command metadata not specified, default to True for safety
-          require_session = True
-        
-        if require_session:
-          if device_command:
-            # Device command, make sure one of the user's active sessions uses the specified pipeline
-            session_requirements_met = False
-            for user_session in active_user_sessions:
-              if user_session.active_pipeline.id == pipeline:
-                session_requirements_met = True
-                break
-            
-            if not session_requirements_met:
-              raise command.CommandError("You must have a currently active session for a pipeline that contains the "+
-                                         "destination device to use that command.",
-                                         {"command": valid_command.command, "destination": full_destination})
-          else:
-            # System command, make sure the user has at least one active session
-            if len(active_user_sessions) <= 0:
-              raise command.CommandError("You must have an active session to use that command.",
-                                         {"command": valid_command.command, "destination": full_destination})
+          routing_table[(pipeline_id, destination, command_name)] = self._build_command_route(command_handler,
+                                                                                              command_name,
+                                                                                              pipeline_id is not None,
+                                                                                              device_queue)
+        except Exception as route_error:
+          # Leave the command out of the table so that the error will be reported when the command is used
+          logging.warning("Could not build the route for the '"+command_name+"' command offered by '"+destination+
+                          "': "+str(route_error))
 
-    # Execute the command in a new thread
-    command_function = getattr(command_handler, 'command_'+valid_command.command)
-    command_deferred = defer.maybeDeferred(command_function, valid_command)
-    command_deferred.addCallback(self._command_complete, valid_command)
-    
-    return command_deferred
+  def _build_command_route(self, command_handler, command_name, device_command, device_queue = None):
+    """ Builds the route for the specified command.
+
+    @param command_handler  The command handler that offers the command.
+    @param command_name     The name of the command (without the "command_" prefix).
+    @param device_command   Whether or not the command is a device command.
+    @param device_queue     The DeviceCommandQueue that the command should be executed through, if any.
+    @return Returns a new CommandRoute for the command.
+    """
+
+    # Load and freeze the command's meta-data, if it has any
+    settings_function = getattr(command_handler, 'settings_'+command_name, None)
+    command_metadata = freeze_metadata(settings_function()) if settings_function is not None else None
+
+    return CommandRoute(command_handler, getattr(command_handler, 'command_'+command_name), command_metadata,
+                        device_command, device_queue)
   
   def _command_complete(self, command_results, successful_command):
     """ Builds a complete response for the successful command.
@@ -248,12 +1113,26 @@ class CommandParser:
     @param command_results     A dictionary containing additional data to embed with the command response (in the
                                "result" field of the JSON response). This is returned by the individual command 
                                functions in the command handlers.
+    @note If the command was a schedulable command that was superseded by a newer command before it could be executed,
+          command_results will be a CommandSuperseded instance and the response will have a 'superseded' status.
+    
     @param successful_command  The command that just completed.
     @return Returns the constructed command response dictionary. This dictionary is fed into callbacks waiting for the
             command results.
     """
     
-    command_response = successful_command.build_command_response(True, command_results)
+    successful_command.record_stage('execution')
+
+    if isinstance(command_results, coalescing.CommandSuperseded):
+      # The command was replaced by a newer one before it was executed
+      command_response = successful_command.build_command_response(True, command_results.build_results(),
+                                                                   status = 'superseded')
+    else:
+      command_response = successful_command.build_command_response(True, command_results)
+    self._finish_command_progress(successful_command, command_response, True)
+    self._record_command_timings(successful_command, command_response)
+    if self.audit_log is not None:
+      self.audit_log.record(successful_command, command_response)
     
     return command_response
   
@@ -270,6 +1149,10 @@ class CommandParser:
     @param failed_command  The Command object of the failed command.
     """
     
+    # Only count the execution stage if the command made it that far
+    if failed_command.execution_started:
+      failed_command.record_stage('execution')
+
     # Set the error message
     error_message = {
       "error_message": str(failure.value)
@@ -283,7 +1166,17 @@ class CommandParser:
       error_results = error_message
 
     # Build the response dictionary
-    error_response = failed_command.build_command_response(False, error_results)
+    if failure.check(command.CommandTimedOut):
+      error_status = 'timeout'
+    elif failure.check(command.CommandThrottled):
+      error_status = 'throttled'
+    else:
+      error_status = None
+    error_response = failed_command.build_command_response(False, error_results, status = error_status)
+    self._finish_command_progress(failed_command, error_response, False)
+    self._record_command_timings(failed_command, error_response)
+    if self.audit_log is not None:
+      self.audit_log.record(failed_command, error_response)
 
     # Log the error
     if failed_command.command:
@@ -294,6 +1187,72 @@ class CommandParser:
     # Raise a CommandFailed describing the error
     raise CommandFailed(error_message['error_message'], error_response)
 
+  def _finish_command_progress(self, finished_command, command_response, success):
+    """ Sends the final progress event for a completed command that reported its progress.
+
+    If the command reported its progress, its progress ID is added to the command response so that the user can match
+    the response with the command's progress events. The final progress event is then sent unless the command's handler
+    is still monitoring the command's action (see Command.continue_progress).
+
+    @param finished_command  The Command that just completed (successfully or not).
+    @param command_response  The command's response dictionary.
+    @param success           Whether or not the command was successful.
+    """
+
+    if finished_command.progress_sequence == 0:
+      return
+
+    command_response['response']['progress_id'] = finished_command.progress_id
+    if not success or not finished_command.progress_continues:
+      finished_command.finish_progress(success, {'status': command_response['response']['status']})
+
+  def _record_command_timings(self, timed_command, command_response):
+    """ Records the stage timings of a completed command.
+
+    This method adds the command's stage timings to the latency histograms. If the command's 'debug' flag is set, the
+    timings will also be added to the 'timings' field of the command response.
+
+    @note Only commands that were routed are added to the histograms. Otherwise, commands with made up destinations or
+          names (which are rejected before they're routed) would each create a new histogram.
+
+    @param timed_command     The Command that just completed (successfully or not).
+    @param command_response  The command's response dictionary.
+    """
+
+    timed_command.record_stage('response')
+    if timed_command.routed:
+      self.latency_recorder.record_command(timed_command)
+
+    if timed_command.debug:
+      command_response['response']['timings'] = timed_command.get_stage_timings()
+
+class CommandRoute(object):
+  """ Stores the pre-resolved route for a single command.
+
+  Instances of this class are stored in the command parser's routing table. They contain everything that the parser 
+  needs to execute a command once it has been validated.
+  """
+
+  __slots__ = ['handler', 'function', 'metadata', 'device_command', 'device_queue']
+
+  def __init__(self, command_handler, command_function, command_metadata, device_command, device_queue = None):
+    """ Sets up the command route.
+
+    @param command_handler   The command handler that offers the command.
+    @param command_function  The bound command function (i.e. "command_"+command name) that executes the command.
+    @param command_metadata  The command's frozen meta-data dictionary, or None if the command doesn't define a 
+                             "settings_" method.
+    @param device_command    Whether or not the command is a device command.
+    @param device_queue      The DeviceCommandQueue that limits how many of the device's commands can execute at once. 
+                             None for system commands.
+    """
+
+    self.handler = command_handler
+    self.function = command_function
+    self.metadata = command_metadata
+    self.device_command = device_command
+    self.device_queue = device_queue
+
 # High level command system exceptions
 class CommandFailed(Exception):
   """ Used to wrap command execution errors.
@@ -0,0 +1,64 @@
+""" @package hwm.command.program
+Contains the precompiled form of a list of setup commands.
+
+This module contains the classes that the command parser uses to represent pipeline and reservation setup commands
+that have been validated and routed ahead of time. The pipeline manager and schedule manager compile these commands when
+the pipeline configuration and reservation schedule are loaded so that configuration errors are reported right away and
+starting a session only has to execute them.
+"""
+
+class CommandProgram(object):
+  """ Represents a list of setup commands that have been compiled by the command parser.
+
+  Programs are created by CommandParser.compile_program and executed by CommandParser.run_program. Each command in the
+  program is stored as a ProgramStep, in the same order as the raw commands it was compiled from.
+
+  @note Permissions and session requirements can change between the time a program is compiled and the time it is run,
+        so they are always checked again when the program runs. Permission problems found while compiling are only
+        reported (in the errors attribute and the log).
+  """
+
+  def __init__(self, raw_commands, user_id = None, kernel_mode = False):
+    """ Sets up an empty program.
+
+    @param raw_commands  The list of raw commands that the program is being compiled from.
+    @param user_id       The ID of the user that the program's commands will be executed on behalf of.
+    @param kernel_mode   Whether or not the program's commands will be executed in kernel mode.
+    """
+
+    self.raw_commands = raw_commands
+    self.user_id = user_id
+    self.kernel_mode = kernel_mode
+    self.steps = []
+    self.errors = []
+
+  def add_error(self, step_index, error_message):
+    """ Records a problem found while compiling one of the program's commands.
+
+    @param step_index     The index of the command in the program.
+    @param error_message  A string describing the problem.
+    """
+
+    self.errors.append({'step': step_index, 'error_message': error_message})
+
+class ProgramStep(object):
+  """ Stores a single compiled command.
+
+  Commands that couldn't be compiled (e.g. because they were invalid or couldn't be routed) are still stored, along with
+  the exception describing the problem, so that the error is returned when the program runs just like it would have
+  been if the command was parsed at that time.
+  """
+
+  __slots__ = ['raw_command', 'command_dict', 'route_key', 'route', 'error']
+
+  def __init__(self, raw_command):
+    """ Sets up the step.
+
+    @param raw_command  The raw command that the step was compiled from.
+    """
+
+    self.raw_command = raw_command
+    self.command_dict = None
+    self.route_key = None
+    self.route = None
+    self.error = None
@@ -0,0 +1,228 @@
+""" @package hwm.command.ratelimit
+Contains the token buckets used to limit how quickly commands can be executed.
+
+This module contains the rate limiter that the command parser uses to keep a single user (e.g. a buggy script) or a
+burst of internal traffic from flooding the hardware drivers with commands. Commands that exceed their budget are
+rejected immediately with a 'throttled' response that tells the client how long to wait before trying again.
+"""
+
+# Import required modules
+from twisted.internet import reactor
+
+class CommandRateLimiter(object):
+  """ Limits the rate of commands using per-user and per-device token buckets.
+
+  Each command is charged against the following budgets:
+  * user: A bucket for each user. Charged for every command that isn't executed in kernel mode.
+  * device: A bucket for each device. Charged for every device command that isn't executed in kernel mode.
+  * kernel: A bucket for each destination. Charged for every command executed in kernel mode (e.g. session setup
+    commands and commands invoked by drivers), so that internal traffic has its own budget that users can't exhaust.
+
+  A command is only executed if every bucket that it is charged against has a token available, in which case one token
+  is taken from each of them.
+
+  Batches and setup programs are charged against the user budget once as a whole (see acquire_group) instead of once
+  per command, so that a batch of up to the maximum batch size isn't partly throttled. Their commands are flagged with
+  Command.group_rate_limited and are only charged against the device budgets.
+
+  @note Schedulable device commands (e.g. antenna "move" commands) are not charged against the device or kernel
+        budgets. They are already limited by the command parser's coalescing queue, which only keeps the most recent
+        one, so throttling them would just drop legitimate tracking updates.
+  @note Commands in the 'emergency' priority class (e.g. emergency stops) are never charged or throttled.
+  @note Idle buckets that have refilled completely are discarded every prune_interval seconds. A full bucket behaves 
+        exactly like a new one, so this doesn't change which commands are throttled.
+  """
+
+  ## How often (in seconds) to discard idle buckets
+  prune_interval = 60
+
+  def __init__(self, clock = None):
+    """ Sets up the rate limiter. Every budget is unlimited until set_limit is called.
+
+    @param clock  An object that provides a seconds() method (typically the reactor).
+    """
+
+    self.clock = clock if clock is not None else reactor
+    self.limits = {'user': None, 'device': None, 'kernel': None}
+    self.throttled_counts = {'user': 0, 'device': 0, 'kernel': 0}
+    self._buckets = {}
+    self._last_pruned = self.clock.seconds()
+
+  def set_limit(self, budget, rate, burst = None):
+    """ Sets the limit for one of the budgets.
+
+    @note Changing a budget's limit resets its buckets.
+
+    @throw Throws InvalidRateLimit if the budget doesn't exist or if the rate or burst size is invalid.
+
+    @param budget  The budget to set the limit for ('user', 'device', or 'kernel').
+    @param rate    The number of commands per second that each of the budget's buckets allows, or None for no limit.
+    @param burst   The number of commands that each bucket can hold (i.e. how many commands can be executed at once
+                   after a quiet period). If None, it will be set to one second worth of commands (minimum 1).
+    """
+
+    if budget not in self.limits:
+      raise InvalidRateLimit("The '"+str(budget)+"' rate limit budget does not exist.")
+    if rate is not None and rate <= 0:
+      raise InvalidRateLimit("The command rate for the '"+budget+"' budget must be greater than 0.")
+    if burst is not None and burst < 1:
+      raise InvalidRateLimit("The command burst size for the '"+budget+"' budget must be at least 1.")
+
+    self.limits[budget] = (rate, burst if burst is not None else max(rate, 1)) if rate is not None else None
+    for bucket_key in self._buckets.keys():
+      if bucket_key[0] == budget:
+        del self._buckets[bucket_key]
+
+  def acquire(self, limited_command, device_command, schedulable = False):
+    """ Charges a command against its budgets.
+
+    @param limited_command  The Command that is about to be executed.
+    @param device_command   Whether or not the command is a device command.
+    @param schedulable      Whether or not the command is a schedulable device command.
+    @return Returns None if the command can be executed. Otherwise, returns a tuple containing the name of the budget
+            that was exhausted and the number of seconds until the command can be retried.
+    """
+
+    if limited_command.priority == 'emergency':
+      return None
+
+    # Load the buckets that the command should be charged against
+    bucket_keys = []
+    if limited_command.kernel_mode:
+      if not schedulable:
+        bucket_keys.append(('kernel', limited_command.full_destination))
+    else:
+      if not limited_command.group_rate_limited:
+        bucket_keys.append(('user', limited_command.user_id))
+      if device_command and not schedulable:
+        bucket_keys.append(('device', limited_command.full_destination))
+
+    return self._take_tokens(bucket_keys)
+
+  def acquire_group(self, user_id):
+    """ Charges a batch of commands or a setup program against its user's budget.
+
+    @note The commands in the group should have their group_rate_limited attribute set so that they aren't charged 
+          against the user budget again when they are executed.
+
+    @param user_id  The ID of the user that the group is being executed on behalf of.
+    @return Returns None if the group can be executed. Otherwise, returns a tuple containing the name of the budget that
+            was exhausted and the number of seconds until the group can be retried.
+    """
+
+    return self._take_tokens([('user', user_id)])
+
+  def _take_tokens(self, bucket_keys):
+    """ Takes a token from each of the specified buckets if all of them have one available.
+
+    @param bucket_keys  A list containing the (budget, key) tuple of each bucket to charge.
+    @return Returns None if the tokens were taken. Otherwise, returns a tuple containing the name of the budget that was
+            exhausted and the number of seconds until a token will be available.
+    """
+
+    current_time = self.clock.seconds()
+    if current_time-self._last_pruned >= self.prune_interval:
+      self._prune_buckets(current_time)
+
+    command_buckets = [(bucket_key[0], self._get_bucket(bucket_key)) for bucket_key in bucket_keys]
+    command_buckets = [(budget, bucket) for budget, bucket in command_buckets if bucket is not None]
+
+    # Make sure every bucket has a token available before taking any
+    exhausted_budget = None
+    retry_after = 0
+    for budget, command_bucket in command_buckets:
+      bucket_wait_time = command_bucket.get_wait_time(current_time)
+      if bucket_wait_time > retry_after:
+        exhausted_budget = budget
+        retry_after = bucket_wait_time
+
+    if exhausted_budget is not None:
+      self.throttled_counts[exhausted_budget] += 1
+      return (exhausted_budget, retry_after)
+
+    for budget, command_bucket in command_buckets:
+      command_bucket.tokens -= 1
+
+    return None
+
+  def get_statistics(self):
+    """ Returns statistics about the rate limiter.
+
+    @return Returns a dictionary containing the limit (rate and burst size, or None if unlimited), number of buckets,
+            and number of throttled commands for each budget.
+    """
+
+    rate_limit_statistics = {}
+    for budget, budget_limit in self.limits.iteritems():
+      rate_limit_statistics[budget] = {
+        'rate': budget_limit[0] if budget_limit is not None else None,
+        'burst': budget_limit[1] if budget_limit is not None else None,
+        'buckets': len([bucket_key for bucket_key in self._buckets if bucket_key[0] == budget]),
+        'throttled': self.throttled_counts[budget]
+      }
+
+    return rate_limit_statistics
+
+  def _prune_buckets(self, current_time):
+    """ Discards the buckets that have refilled completely.
+
+    @param current_time  The current time.
+    """
+
+    for bucket_key, command_bucket in self._buckets.items():
+      # Refill the bucket before checking if it's full
+      command_bucket.get_wait_time(current_time)
+      if command_bucket.tokens >= command_bucket.burst:
+        del self._buckets[bucket_key]
+    self._last_pruned = current_time
+
+  def _get_bucket(self, bucket_key):
+    """ Returns the specified bucket, creating it (full) if needed.
+
+    @param bucket_key  A (budget, key) tuple identifying the bucket.
+    @return Returns the TokenBucket, or None if the bucket's budget is unlimited.
+    """
+
+    budget_limit = self.limits[bucket_key[0]]
+    if budget_limit is None:
+      return None
+
+    if bucket_key not in self._buckets:
+      self._buckets[bucket_key] = TokenBucket(budget_limit[0], budget_limit[1], self.clock.seconds())
+
+    return self._buckets[bucket_key]
+
+class TokenBucket(object):
+  """ A token bucket that refills at a constant rate.
+  """
+
+  __slots__ = ['rate', 'burst', 'tokens', 'updated_at']
+
+  def __init__(self, rate, burst, current_time):
+    """ Sets up a full bucket.
+
+    @param rate          The number of tokens added to the bucket per second.
+    @param burst         The maximum number of tokens that the bucket can hold.
+    @param current_time  The current time.
+    """
+
+    self.rate = rate
+    self.burst = burst
+    self.tokens = float(burst)
+    self.updated_at = current_time
+
+  def get_wait_time(self, current_time):
+    """ Refills the bucket and returns how long it will be until a token is available.
+
+    @param current_time  The current time.
+    @return Returns 0 if a token is available or the number of seconds until one will be.
+    """
+
+    self.tokens = min(self.burst, self.tokens+(current_time-self.updated_at)*self.rate)
+    self.updated_at = current_time
+
+    return 0 if self.tokens >= 1 else (1-self.tokens)/self.rate
+
+# Define rate limiter related exceptions
+class InvalidRateLimit(Exception):
+  pass
@@ -0,0 +1,225 @@
+""" @package hwm.command.scheduler
+Contains a timing wheel used to execute commands at specific times.
+
+This module contains a hashed timing wheel that the command parser uses to hold commands that specify an 'execute_at'
+timestamp until it is time to execute them. This allows clients to upload a series of commands, such as every antenna
+"move" point for a pass, in a single request instead of sending each one in real time.
+"""
+
+# Import required modules
+import math, logging
+from twisted.internet import reactor
+
+class CommandScheduler(object):
+  """ A hashed timing wheel that calls functions at specific times.
+
+  Time is divided into ticks (1 ms by default) and each scheduled entry is stored in the wheel slot that corresponds to
+  its deadline tick (modulo the number of slots). Because entries are only ever appended to or removed from their slot,
+  scheduling and cancelling entries are constant time operations, and the wheel only needs to store a small entry object
+  for each scheduled call regardless of how far in the future it is.
+
+  Instead of waking up on every tick, the scheduler uses a single reactor timer that is set for the next tick that has
+  an entry due. When it fires, every entry whose deadline has passed is executed in deadline order.
+
+  @note Cancelled entries are flagged and left in their slot until their deadline passes, at which point they are
+        discarded.
+  """
+
+  def __init__(self, tick_length = 0.001, wheel_size = 4096, clock = None):
+    """ Sets up the scheduler.
+
+    @param tick_length  The length of each tick in seconds. Entries will be executed within one tick of their deadline
+                        (subject to the accuracy of the reactor).
+    @param wheel_size   The number of slots in the wheel.
+    @param clock        An object that provides the seconds() and callLater() methods (typically the reactor).
+    """
+
+    self.tick_length = tick_length
+    self.wheel_size = wheel_size
+    self.clock = clock if clock is not None else reactor
+    self._slots = [None]*wheel_size
+    self._entries = {}
+    self._next_entry_id = 1
+    self._processed_tick = self._get_tick(self.clock.seconds())
+    self._wake_call = None
+    self._wake_tick = None
+
+  def schedule(self, execute_at, scheduled_function, *args):
+    """ Schedules a function to be called at the specified time.
+
+    @note If execute_at has already passed, the function will be called on the next tick.
+
+    @param execute_at          The UNIX timestamp (in seconds, with any precision) when the function should be called.
+    @param scheduled_function  The function to call.
+    @param *args               Any arguments to pass to the function.
+    @return Returns the new ScheduledEntry.
+    """
+
+    deadline_tick = max(int(math.ceil(round(execute_at/self.tick_length, 6))), self._processed_tick+1)
+
+    # Add the entry to the wheel
+    new_entry = ScheduledEntry(self._next_entry_id, execute_at, deadline_tick, scheduled_function, args)
+    self._next_entry_id += 1
+    slot_index = deadline_tick % self.wheel_size
+    if self._slots[slot_index] is None:
+      self._slots[slot_index] = []
+    self._slots[slot_index].append(new_entry)
+    self._entries[new_entry.id] = new_entry
+
+    # Wake up earlier if needed
+    if self._wake_tick is None or deadline_tick < self._wake_tick:
+      self._set_wake_tick(deadline_tick)
+
+    return new_entry
+
+  def cancel(self, entry_id):
+    """ Cancels a scheduled entry.
+
+    @param entry_id  The ID of the entry to cancel.
+    @return Returns True if the entry was cancelled or False if it doesn't exist (or has already been executed).
+    """
+
+    cancelled_entry = self._entries.pop(entry_id, None)
+    if cancelled_entry is None:
+      return False
+
+    cancelled_entry.cancelled = True
+    if len(self._entries) == 0:
+      self._set_wake_tick(None)
+
+    return True
+
+  def get_entry(self, entry_id):
+    """ Returns the specified scheduled entry.
+
+    @param entry_id  The ID of the entry.
+    @return Returns the pending ScheduledEntry with the specified ID, or None if there isn't one.
+    """
+
+    return self._entries.get(entry_id, None)
+
+  def get_pending_count(self):
+    """ Returns the number of entries waiting to be executed.
+
+    @return Returns the number of pending (not cancelled) entries.
+    """
+
+    return len(self._entries)
+
+  def _get_tick(self, timestamp):
+    """ Returns the tick that contains the specified time.
+
+    @param timestamp  A UNIX timestamp.
+    @return Returns the tick number.
+    """
+
+    # Round the tick first so that floating point errors don't push times that fall on a tick boundary into the wrong tick
+    return int(math.floor(round(timestamp/self.tick_length, 6)))
+
+  def _set_wake_tick(self, wake_tick):
+    """ Sets (or clears) the reactor timer that processes the wheel.
+
+    @param wake_tick  The tick that the scheduler should wake up at, or None if there aren't any pending entries.
+    """
+
+    if self._wake_call is not None and self._wake_call.active():
+      self._wake_call.cancel()
+    self._wake_call = None
+    self._wake_tick = wake_tick
+
+    if wake_tick is not None:
+      wake_delay = round(wake_tick*self.tick_length-self.clock.seconds(), 9)
+      self._wake_call = self.clock.callLater(max(0, wake_delay), self._wake, wake_tick)
+
+  def _wake(self, wake_tick):
+    """ Executes every entry whose deadline has passed and sets the timer for the next due entry.
+
+    @param wake_tick  The tick that the timer was set for. The timer may fire a fraction of a tick early due to rounding,
+                      so the entries due on this tick are always executed.
+    """
+
+    self._wake_call = None
+    self._wake_tick = None
+    current_tick = max(self._get_tick(self.clock.seconds()), wake_tick, self._processed_tick)
+
+    # Collect the due entries from each slot that has passed since the last wake up
+    if current_tick-self._processed_tick >= self.wheel_size:
+      slot_indices = range(self.wheel_size)
+    else:
+      slot_indices = [tick % self.wheel_size for tick in xrange(self._processed_tick+1, current_tick+1)]
+    due_entries = []
+    for slot_index in slot_indices:
+      slot_entries = self._slots[slot_index]
+      if slot_entries is None:
+        continue
+
+      remaining_entries = []
+      for slot_entry in slot_entries:
+        if slot_entry.cancelled:
+          continue
+        elif slot_entry.deadline_tick <= current_tick:
+          due_entries.append(slot_entry)
+        else:
+          remaining_entries.append(slot_entry)
+      self._slots[slot_index] = remaining_entries if len(remaining_entries) > 0 else None
+    self._processed_tick = current_tick
+
+    # Execute the due entries
+    due_entries.sort(key = lambda due_entry: (due_entry.deadline_tick, due_entry.id))
+    for due_entry in due_entries:
+      if due_entry.cancelled:
+        continue
+      del self._entries[due_entry.id]
+
+      try:
+        due_entry.function(*due_entry.args)
+      except Exception as scheduled_error:
+        logging.error("An error occured executing a scheduled function: "+str(scheduled_error))
+
+    # Set the timer for the next due entry (the executed functions may have already scheduled new entries)
+    if len(self._entries) > 0:
+      next_tick = self._find_next_tick()
+      if self._wake_tick is None or next_tick < self._wake_tick:
+        self._set_wake_tick(next_tick)
+
+  def _find_next_tick(self):
+    """ Finds the tick of the next pending entry.
+
+    This method checks the slots for the next rotation of the wheel first. If none of them contain an entry that is due
+    during the rotation, it searches every pending entry.
+
+    @return Returns the deadline tick of the next pending entry.
+    """
+
+    for tick_offset in xrange(1, self.wheel_size+1):
+      next_tick = self._processed_tick+tick_offset
+      slot_entries = self._slots[next_tick % self.wheel_size]
+      if slot_entries is not None:
+        for slot_entry in slot_entries:
+          if slot_entry.deadline_tick == next_tick and not slot_entry.cancelled:
+            return next_tick
+
+    return min(pending_entry.deadline_tick for pending_entry in self._entries.itervalues())
+
+class ScheduledEntry(object):
+  """ Represents a function call stored in the CommandScheduler.
+  """
+
+  __slots__ = ['id', 'execute_at', 'deadline_tick', 'function', 'args', 'cancelled']
+
+  def __init__(self, entry_id, execute_at, deadline_tick, scheduled_function, args):
+    """ Sets up the entry.
+
+    @param entry_id            The entry's unique ID.
+    @param execute_at          The UNIX timestamp that the entry was scheduled for.
+    @param deadline_tick       The tick that the entry will be executed on.
+    @param scheduled_function  The function to call.
+    @param args                A tuple containing the arguments to pass to the function.
+    """
+
+    self.id = entry_id
+    self.execute_at = execute_at
+    self.deadline_tick = deadline_tick
+    self.function = scheduled_function
+    self.args = args
+    self.cancelled = False
@@ -0,0 +1,98 @@
+# Import required modules
+import logging, os, time, json
+from twisted.trial import unittest
+from hwm.command import audit, command
+
+class TestCommandAuditLog(unittest.TestCase):
+  """ This test suite verifies the functionality of the CommandAuditLog class, which records every executed command and
+  its response using a background writer thread.
+  """
+
+  def setUp(self):
+    # Create an audit log in a temporary directory
+    self.log_directory = self.mktemp()
+    self.audit_log = audit.CommandAuditLog(self.log_directory, max_file_size = 2048, flush_interval = 0.01)
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def tearDown(self):
+    self.audit_log.stop()
+
+  def test_group_commit(self):
+    """ Verifies that buffered records are written in batches and that each batch is added to the index.
+    """
+
+    # Record a batch of commands before the writer thread can write them
+    with self.audit_log._buffer_condition:
+      for point_index in range(5):
+        self._record_command('test_pipeline', 'test_device', 'move', {'point': point_index}, "4")
+    self.audit_log.flush()
+    self.assertEqual(self.audit_log.written_count, 5)
+    self.assertEqual(self.audit_log.commit_count, 1)
+
+    # Check the log file and index
+    with open(os.path.join(self.log_directory, 'commands.000001.jsonl'), 'rb') as log_file:
+      logged_records = [json.loads(log_line) for log_line in log_file]
+    self.assertEqual([logged_record['parameters']['point'] for logged_record in logged_records], range(5))
+    self.assertEqual(logged_records[0]['response']['status'], 'okay')
+    with open(os.path.join(self.log_directory, 'index.jsonl'), 'rb') as index_file:
+      index_entries = [json.loads(index_line) for index_line in index_file]
+    self.assertEqual(len(index_entries), 1)
+    self.assertEqual(index_entries[0]['count'], 5)
+    self.assertEqual(index_entries[0]['users'], ["4"])
+    self.assertEqual(index_entries[0]['destinations'], ['test_pipeline.test_device'])
+
+  def test_rotation(self):
+    """ Verifies that a new log file is started once the current one is full and that a new audit log continues writing
+    to the newest file.
+    """
+
+    for point_index in range(30):
+      self._record_command('test_pipeline', 'test_device', 'move', {'point': point_index}, "4")
+      self.audit_log.flush()
+
+    log_files = sorted(file_name for file_name in os.listdir(self.log_directory) if file_name.startswith('commands.'))
+    self.assertTrue(len(log_files) > 1)
+    for log_file in log_files[:-1]:
+      self.assertTrue(os.path.getsize(os.path.join(self.log_directory, log_file)) < 2048+512)
+    self.assertEqual(len(self.audit_log.find_records()), 30)
+
+    # Restart the log
+    self.audit_log.stop()
+    self.audit_log = audit.CommandAuditLog(self.log_directory, max_file_size = 2048, flush_interval = 0.01)
+    self.assertEqual(self.audit_log._get_log_file_name(self.audit_log._file_number), log_files[-1])
+
+  def test_find_records(self):
+    """ Verifies that records can be looked up by time, user, and device.
+    """
+
+    self._record_command('test_pipeline', 'test_device', 'move', {'point': 1}, "4")
+    self._record_command(None, 'system', 'station_time', None, "5")
+    self.audit_log.flush()
+    time.sleep(0.01)
+    split_time = time.time()
+    self._record_command('test_pipeline', 'test_device', 'move', {'point': 2}, "5")
+    self._record_command('test_pipeline', 'other_device', 'stop', None, None)
+    self.audit_log.flush()
+
+    self.assertEqual(len(self.audit_log.find_records()), 4)
+    self.assertEqual([audit_record['command'] for audit_record in self.audit_log.find_records(user_id = "5")],
+                     ['station_time', 'move'])
+    self.assertEqual([audit_record['parameters']['point'] for audit_record in
+                      self.audit_log.find_records(destination = 'test_pipeline.test_device')], [1, 2])
+    self.assertEqual([audit_record['destination'] for audit_record in
+                      self.audit_log.find_records(start_time = split_time)],
+                     ['test_pipeline.test_device', 'test_pipeline.other_device'])
+    self.assertEqual(len(self.audit_log.find_records(end_time = split_time, user_id = "4")), 1)
+    self.assertEqual(self.audit_log.find_records(start_time = time.time()+60), [])
+
+    # Query from the reactor thread
+    query_deferred = self.audit_log.query(user_id = "4")
+    query_deferred.addCallback(lambda audit_records: self.assertEqual(len(audit_records), 1))
+
+    return query_deferred
+
+  def _record_command(self, pipeline_id, destination, command_name, parameters, user_id):
+    audited_command = command.InternalCommand(time.time(), pipeline_id, destination, command_name, parameters, user_id)
+    self.audit_log.record(audited_command, audited_command.build_command_response(True, {}))
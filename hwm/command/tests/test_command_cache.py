@@ -0,0 +1,103 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from hwm.command import cache
+
+class TestCommandResultCache(unittest.TestCase):
+  """ This test suite verifies the functionality of the CommandResultCache class, which the command parser uses to share
+  the results of cacheable commands.
+  """
+
+  def setUp(self):
+    # Create a result cache that uses a fake clock
+    self.clock = task.Clock()
+    self.result_cache = cache.CommandResultCache(clock = self.clock)
+    self.command_deferreds = []
+    self.command_calls = []
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_build_key(self):
+    # Keys should ignore the order of the parameters
+    key_1 = self.result_cache.build_key('pipeline', 'device', 'command', {'a': 1, 'b': [1, 2]})
+    key_2 = self.result_cache.build_key('pipeline', 'device', 'command', {'b': [1, 2], 'a': 1})
+    self.assertEqual(key_1, key_2)
+    self.assertNotEqual(key_1, self.result_cache.build_key('pipeline', 'device', 'command', {'a': 2, 'b': [1, 2]}))
+    self.assertNotEqual(key_1, self.result_cache.build_key(None, 'device', 'command', {'a': 1, 'b': [1, 2]}))
+
+  def test_cached_results_expire(self):
+    """ Verifies that results are served from the cache until their TTL expires and that each caller gets a copy.
+    """
+
+    test_key = self.result_cache.build_key('pipeline', 'device', 'get_state', {})
+
+    # Execute the command and make sure the result is cached
+    first_results = []
+    self.result_cache.execute(test_key, 1, self._immediate_command, 'command_1').addCallback(first_results.append)
+    first_results[0]['modified'] = True
+    second_results = []
+    self.result_cache.execute(test_key, 1, self._immediate_command, 'command_2').addCallback(second_results.append)
+    self.assertEqual(self.command_calls, ['command_1'])
+    self.assertEqual(second_results, [{'state': 1}])
+
+    # Let the result expire
+    self.clock.advance(1)
+    self.result_cache.execute(test_key, 1, self._immediate_command, 'command_3')
+    self.assertEqual(self.command_calls, ['command_1', 'command_3'])
+    self.assertEqual(self.result_cache.get_statistics()['hits'], 1)
+    self.assertEqual(self.result_cache.get_statistics()['misses'], 2)
+
+  def test_concurrent_requests_collapsed(self):
+    """ Verifies that identical requests made while a command is executing share its result or error.
+    """
+
+    test_key = self.result_cache.build_key('pipeline', 'device', 'get_state', {})
+
+    # Make several requests while the command is executing
+    test_results = []
+    for command_id in range(3):
+      self.result_cache.execute(test_key, 1, self._deferred_command, command_id).addCallback(test_results.append)
+    self.assertEqual(self.command_calls, [0])
+    self.assertEqual(self.result_cache.get_statistics()['in_flight'], 1)
+    self.assertEqual(self.result_cache.get_statistics()['collapsed'], 2)
+
+    # Complete the command
+    self.command_deferreds[0].callback({'state': 5})
+    self.assertEqual(test_results, [{'state': 5}]*3)
+    self.assertEqual(self.result_cache.get_statistics()['in_flight'], 0)
+
+    # Now make sure errors are passed to every waiting request and aren't cached
+    self.clock.advance(5)
+    test_errors = []
+    for command_id in range(2):
+      error_deferred = self.result_cache.execute(test_key, 1, self._deferred_command, command_id)
+      error_deferred.addErrback(lambda failure: test_errors.append(failure.value))
+    self.command_deferreds[1].errback(TestCacheError())
+    self.assertEqual(len(test_errors), 2)
+    self.assertTrue(isinstance(test_errors[0], TestCacheError))
+    self.assertEqual(self.result_cache.get_statistics()['entries'], 0)
+
+  def test_max_entries(self):
+    """ Verifies that the cache doesn't grow beyond its maximum size.
+    """
+
+    self.result_cache.max_entries = 2
+    for command_id in range(5):
+      test_key = self.result_cache.build_key('pipeline', 'device', 'get_state', {'id': command_id})
+      self.result_cache.execute(test_key, 10, self._immediate_command, command_id)
+      self.assertTrue(self.result_cache.get_statistics()['entries'] <= 2)
+
+  def _immediate_command(self, active_command):
+    self.command_calls.append(active_command)
+    return {'state': 1}
+
+  def _deferred_command(self, active_command):
+    self.command_calls.append(active_command)
+    command_deferred = defer.Deferred()
+    self.command_deferreds.append(command_deferred)
+    return command_deferred
+
+class TestCacheError(Exception):
+  pass
@@ -0,0 +1,96 @@
+# Import required modules
+import logging
+from mock import MagicMock
+from twisted.trial import unittest
+from twisted.internet import defer
+from hwm.command import coalescing
+
+class TestCommandCoalescer(unittest.TestCase):
+  """ This test suite verifies the functionality of the CommandCoalescer class, which the command parser uses to drop 
+  outdated schedulable device commands.
+  """
+
+  def setUp(self):
+    self.coalescer = coalescing.CommandCoalescer()
+    self.command_deferreds = []
+    self.executed_commands = []
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_latest_command_wins(self):
+    """ Verifies that only the newest waiting command is executed once the executing command completes.
+    """
+
+    # Submit several commands while the first one is executing
+    test_commands = [self._build_command(position) for position in range(4)]
+    test_results = []
+    for test_command in test_commands:
+      result_deferred = self.coalescer.execute('queue', self._deferred_command, test_command)
+      result_deferred.addCallbacks(test_results.append, lambda failure: test_results.append(failure.value))
+
+    # Only the first command should be executing, and the second and third should have been superseded
+    self.assertEqual(self.executed_commands, [test_commands[0]])
+    self.assertEqual(len(test_results), 2)
+    for superseded_index, superseded_result in enumerate(test_results):
+      self.assertTrue(isinstance(superseded_result, coalescing.CommandSuperseded))
+      self.assertEqual(superseded_result.superseded_command, test_commands[superseded_index+1])
+      self.assertEqual(superseded_result.build_results()['superseded_by'], test_commands[superseded_index+2].parameters)
+    self.assertEqual(self.coalescer.get_pending_count(), 1)
+    self.assertEqual(self.coalescer.superseded_count, 2)
+
+    # Complete the first command and make sure the last command is started
+    self.command_deferreds[0].callback({'position': 0})
+    self.assertEqual(test_results[2], {'position': 0})
+    self.assertEqual(self.executed_commands, [test_commands[0], test_commands[3]])
+    self.assertEqual(self.coalescer.get_pending_count(), 0)
+
+    # Fail the last command and make sure the queue is empty again
+    self.command_deferreds[1].errback(TestCoalescingError())
+    self.assertTrue(isinstance(test_results[3], TestCoalescingError))
+    self.assertEqual(self.coalescer._queues, {})
+
+  def test_independent_queues(self):
+    """ Verifies that commands with different queue keys don't affect each other.
+    """
+
+    test_results = []
+    for queue_key in ['queue_1', 'queue_2']:
+      self.coalescer.execute(queue_key, self._deferred_command, self._build_command(0)).addCallback(test_results.append)
+
+    self.assertEqual(len(self.executed_commands), 2)
+    self.command_deferreds[1].callback('done')
+    self.command_deferreds[0].callback('done')
+    self.assertEqual(test_results, ['done', 'done'])
+
+  def test_cancel_waiting_command(self):
+    """ Verifies that a waiting command that is cancelled (e.g. because it timed out) is never executed.
+    """
+
+    test_commands = [self._build_command(position) for position in range(2)]
+    first_deferred = self.coalescer.execute('queue', self._deferred_command, test_commands[0])
+    waiting_deferred = self.coalescer.execute('queue', self._deferred_command, test_commands[1])
+    waiting_deferred.cancel()
+    self.failureResultOf(waiting_deferred, defer.CancelledError)
+    self.assertEqual(self.coalescer.get_pending_count(), 0)
+
+    # Completing the executing command shouldn't start the cancelled one
+    self.command_deferreds[0].callback('done')
+    self.assertEqual(self.successResultOf(first_deferred), 'done')
+    self.assertEqual(self.executed_commands, [test_commands[0]])
+    self.assertEqual(self.coalescer._queues, {})
+
+  def _build_command(self, position):
+    test_command = MagicMock()
+    test_command.command = 'move'
+    test_command.parameters = {'position': position}
+    return test_command
+
+  def _deferred_command(self, active_command):
+    self.executed_commands.append(active_command)
+    command_deferred = defer.Deferred()
+    self.command_deferreds.append(command_deferred)
+    return command_deferred
+
+class TestCoalescingError(Exception):
+  pass
@@ -0,0 +1,145 @@
+# Import required modules
+import logging, threading
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from hwm.command import executor
+
+class TestDeviceCommandQueue(unittest.TestCase):
+  """ This test suite verifies the functionality of the DeviceCommandQueue class, which limits how many of a device's 
+  commands can execute at once.
+  """
+
+  def setUp(self):
+    # Create a command executor that uses a fake clock
+    self.clock = task.Clock()
+    self.command_executor = executor.CommandExecutor(clock = self.clock)
+    self.command_deferreds = []
+    self.command_calls = []
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_commands_serialized(self):
+    """ Verifies that a queue with a concurrency limit of 1 executes its commands one at a time in FIFO order and 
+    records how long they waited.
+    """
+
+    device_queue = self.command_executor.get_queue('test_device', 1)
+
+    # Submit several commands at once
+    test_results = []
+    test_errors = []
+    for command_id in range(3):
+      command_deferred = device_queue.execute(self._deferred_command, command_id)
+      command_deferred.addCallbacks(test_results.append, lambda failure: test_errors.append(failure.value))
+    self.assertEqual(self.command_calls, [0])
+    self.assertEqual(device_queue.get_statistics()['depth'], 2)
+
+    # Complete the commands one by one
+    self.clock.advance(2)
+    self.command_deferreds[0].callback('result_0')
+    self.assertEqual(self.command_calls, [0, 1])
+    self.clock.advance(1)
+    self.command_deferreds[1].errback(TestExecutorError())
+    self.assertEqual(self.command_calls, [0, 1, 2])
+    self.command_deferreds[2].callback('result_2')
+    self.assertEqual(test_results, ['result_0', 'result_2'])
+    self.assertEqual(len(test_errors), 1)
+    self.assertTrue(isinstance(test_errors[0], TestExecutorError))
+
+    # Check the statistics
+    queue_statistics = device_queue.get_statistics()
+    self.assertEqual(queue_statistics['depth'], 0)
+    self.assertEqual(queue_statistics['max_depth'], 2)
+    self.assertEqual(queue_statistics['executing'], 0)
+    self.assertEqual(queue_statistics['executed'], 3)
+    self.assertEqual(queue_statistics['max_wait_time'], 3)
+    self.assertEqual(queue_statistics['mean_wait_time'], 5.0/3)
+
+  def test_concurrency_limit(self):
+    """ Verifies that queues execute up to their concurrency limit at once and that unlimited queues don't wait.
+    """
+
+    device_queue = self.command_executor.get_queue('test_device', 2)
+    for command_id in range(3):
+      device_queue.execute(self._deferred_command, command_id).addErrback(lambda failure: None)
+    self.assertEqual(self.command_calls, [0, 1])
+    self.assertEqual(device_queue.get_statistics()['executing'], 2)
+    self.command_deferreds[1].callback(None)
+    self.assertEqual(self.command_calls, [0, 1, 2])
+
+    # Synchronous commands and errors should also release their slot
+    unlimited_queue = self.command_executor.get_queue('virtual_device')
+    for command_id in range(2):
+      unlimited_queue.execute(self._failing_command, command_id).addErrback(lambda failure: None)
+    self.assertEqual(unlimited_queue.get_statistics()['executing'], 0)
+    self.assertEqual(unlimited_queue.get_statistics()['executed'], 2)
+    self.assertEqual(sorted(self.command_executor.get_statistics().keys()), ['test_device', 'virtual_device'])
+
+  def test_priority_order(self):
+    """ Verifies that waiting commands are started in priority order (then kernel commands first, then FIFO) and that
+    emergency commands don't wait for the queue's concurrency limit.
+    """
+
+    device_queue = self.command_executor.get_queue('test_device', 1)
+    device_queue.execute(self._deferred_command, 'executing')
+    device_queue.execute(self._deferred_command, 'low', priority = 'low')
+    device_queue.execute(self._deferred_command, 'normal_user')
+    device_queue.execute(self._deferred_command, 'normal_kernel', kernel_mode = True)
+    device_queue.execute(self._deferred_command, 'high', priority = 'high')
+    cancelled_deferred = device_queue.execute(self._deferred_command, 'cancelled', priority = 'high')
+    cancelled_deferred.addErrback(lambda failure: None)
+    cancelled_deferred.cancel()
+
+    # Emergency commands start immediately
+    self.clock.advance(1)
+    device_queue.execute(self._deferred_command, 'emergency', priority = 'emergency')
+    self.assertEqual(self.command_calls, ['executing', 'emergency'])
+    self.assertEqual(device_queue.get_statistics()['executing'], 2)
+
+    # The rest are started one at a time as the device becomes available
+    self.command_deferreds[1].callback(None)
+    for command_index in [0, 2, 3, 4]:
+      self.command_deferreds[command_index].callback(None)
+    self.assertEqual(self.command_calls, ['executing', 'emergency', 'high', 'normal_kernel', 'normal_user', 'low'])
+
+    queue_statistics = device_queue.get_statistics()
+    self.assertEqual(queue_statistics['max_wait_times']['emergency'], 0)
+    self.assertEqual(queue_statistics['max_wait_times']['low'], 1)
+
+  def test_emergency_thread_pool(self):
+    """ Verifies that emergency commands make their blocking calls in the dedicated emergency thread pool.
+    """
+
+    def get_thread_name():
+      return threading.current_thread().name
+
+    def check_thread_names(thread_names):
+      self.assertTrue("emergency-commands" in thread_names[0])
+      self.assertTrue("emergency-commands" not in thread_names[1])
+
+    thread_deferred = defer.gatherResults([executor.defer_to_thread('emergency', get_thread_name),
+                                           executor.defer_to_thread('normal', get_thread_name)])
+    thread_deferred.addCallback(check_thread_names)
+
+    return thread_deferred
+
+  def test_invalid_concurrency(self):
+    """ Verifies that invalid concurrency limits are rejected.
+    """
+
+    for invalid_limit in [0, -1, 1.5, True, '1']:
+      self.assertRaises(executor.InvalidConcurrencyLimit, self.command_executor.get_queue, 'test_'+str(invalid_limit),
+                        invalid_limit)
+
+  def _deferred_command(self, active_command):
+    self.command_calls.append(active_command)
+    command_deferred = defer.Deferred()
+    self.command_deferreds.append(command_deferred)
+    return command_deferred
+
+  def _failing_command(self, active_command):
+    raise TestExecutorError()
+
+class TestExecutorError(Exception):
+  pass
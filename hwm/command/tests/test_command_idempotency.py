@@ -0,0 +1,102 @@
+# Import required modules
+import logging, time
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from hwm.command import idempotency, command
+
+class TestIdempotencyTable(unittest.TestCase):
+  """ This test suite verifies the functionality of the IdempotencyTable class, which suppresses duplicate commands that
+  were submitted with the same idempotency key.
+  """
+
+  def setUp(self):
+    # Create an idempotency table with a fake clock
+    self.clock = task.Clock()
+    self.idempotency_table = idempotency.IdempotencyTable(max_entries = 3, key_ttl = 10, clock = self.clock)
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_replay_response(self):
+    """ Verifies that duplicate commands are answered with the original response until the key expires.
+    """
+
+    execution_count = [0]
+    def run_command(keyed_command):
+      execution_count[0] += 1
+      return keyed_command.build_command_response(True, {'execution': execution_count[0]})
+
+    first_response = self._execute(self._build_command("key1"), run_command)
+    self.assertEqual(first_response['response']['result']['execution'], 1)
+    self.assertTrue('replayed' not in first_response['response'])
+
+    # Retry the command
+    self.clock.advance(5)
+    replayed_response = self._execute(self._build_command("key1"), run_command)
+    self.assertEqual(replayed_response['response']['result']['execution'], 1)
+    self.assertTrue(replayed_response['response']['replayed'])
+    self.assertEqual(execution_count[0], 1)
+
+    # Keys are scoped to their user
+    other_response = self._execute(self._build_command("key1", user_id = "5"), run_command)
+    self.assertEqual(other_response['response']['result']['execution'], 2)
+
+    # Retry the command after the key expires
+    self.clock.advance(6)
+    expired_response = self._execute(self._build_command("key1"), run_command)
+    self.assertEqual(expired_response['response']['result']['execution'], 3)
+    self.assertEqual(self.idempotency_table.get_statistics()['replayed'], 1)
+
+  def test_attach_in_flight(self):
+    """ Verifies that duplicates of an executing command wait for its response instead of executing it again.
+    """
+
+    command_deferred = defer.Deferred()
+    first_deferred = self.idempotency_table.execute(self._build_command("key1"), lambda: command_deferred)
+    duplicate_deferred = self.idempotency_table.execute(self._build_command("key1"), lambda: self.fail("Ran twice."))
+    self.assertEqual(self.idempotency_table.get_statistics()['attached'], 1)
+
+    command_deferred.callback({'response': {'status': 'okay'}})
+    self.assertEqual(self.successResultOf(first_deferred), {'response': {'status': 'okay'}})
+    self.assertEqual(self.successResultOf(duplicate_deferred), {'response': {'status': 'okay', 'replayed': True}})
+
+  def test_failed_command(self):
+    """ Verifies that the errors of failed commands are shared with waiting duplicates and that the key is released.
+    """
+
+    command_deferred = defer.Deferred()
+    first_deferred = self.idempotency_table.execute(self._build_command("key1"), lambda: command_deferred)
+    duplicate_deferred = self.idempotency_table.execute(self._build_command("key1"), lambda: None)
+    command_deferred.errback(command.CommandError("Test error."))
+    self.failureResultOf(first_deferred, command.CommandError)
+    self.failureResultOf(duplicate_deferred, command.CommandError)
+
+    # The command can be retried
+    retry_response = self._execute(self._build_command("key1"), self._run_command)
+    self.assertTrue('replayed' not in retry_response['response'])
+
+  def test_key_reuse(self):
+    """ Verifies that a key can't be reused for a different command and that the table is bounded.
+    """
+
+    self._execute(self._build_command("key1"), self._run_command)
+    self.assertRaises(command.CommandError, self.idempotency_table.execute,
+                      self._build_command("key1", parameters = {'azimuth': 5}), lambda: None)
+
+    # Fill the table past its limit
+    for key_index in range(2, 5):
+      self._execute(self._build_command("key"+str(key_index)), self._run_command)
+    self.assertEqual(self.idempotency_table.get_statistics()['entries'], 3)
+    retry_response = self._execute(self._build_command("key1"), self._run_command)
+    self.assertTrue('replayed' not in retry_response['response'])
+
+  def _build_command(self, idempotency_key, user_id = "4", parameters = None):
+    keyed_command = command.InternalCommand(time.time(), 'test_pipeline', 'test_device', 'move', parameters, user_id)
+    keyed_command.idempotency_key = idempotency_key
+    return keyed_command
+
+  def _run_command(self, keyed_command):
+    return {'response': {'status': 'okay'}}
+
+  def _execute(self, keyed_command, command_function):
+    return self.successResultOf(self.idempotency_table.execute(keyed_command, command_function, keyed_command))
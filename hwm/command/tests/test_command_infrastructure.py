@@ -4,12 +4,17 @@ from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from mock import MagicMock
 from twisted.test import proto_helpers
+from twisted.internet import defer, task
 from twisted.internet.defer import inlineCallbacks
+from twisted.web.test.requesthelper import DummyRequest
+from twisted.web.test._util import _render
+from StringIO import StringIO
 from hwm.core.configuration import *
-from hwm.command import parser, command, connection, metadata
+from hwm.command import parser, command, connection, metadata, scheduler, ratelimit
 from hwm.command.handlers import system as command_handler
 from hwm.command.tests import utilities
 from hwm.network.security import permissions
+from hwm.network import codec
 from hwm.sessions.tests.utilities import *
 from hwm.hardware.pipelines import manager as pipeline_manager
 from hwm.hardware.devices import manager as device_manager
@@ -60,6 +65,10 @@ class TestCommandInfrastructure(unittest.TestCase):
     
     # Don't specify a command ID
     self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [{}], '', 'system', False)
+
+    # Specify an unknown priority class
+    self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'test_command', 'system',
+                      priority = 'urgent')
     
     # Include some parameters with invalid types
     test_parameters = [
@@ -103,6 +112,26 @@ class TestCommandInfrastructure(unittest.TestCase):
     ]
     self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, test_parameters, 'test_command', 'system', False)
   
+  def test_metadata_cache_ttl(self):
+    """ Verifies that the command metadata generation function validates the cache TTL.
+    """
+
+    self.assertEqual(metadata.build_metadata_dict([], 'test_command', 'system')['cache_ttl'], None)
+    self.assertEqual(metadata.build_metadata_dict([], 'test_command', 'system', cache_ttl = 2.5)['cache_ttl'], 2.5)
+    for invalid_ttl in [0, -1, '5', True]:
+      self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'test_command', 'system',
+                        cache_ttl = invalid_ttl)
+
+  def test_metadata_timeout(self):
+    """ Verifies that the command metadata generation function validates the command timeout.
+    """
+
+    self.assertEqual(metadata.build_metadata_dict([], 'test_command', 'system')['timeout'], None)
+    self.assertEqual(metadata.build_metadata_dict([], 'test_command', 'system', timeout = 5)['timeout'], 5)
+    for invalid_timeout in [0, -1, '5', True]:
+      self.assertRaises(metadata.InvalidCommandMetadata, metadata.build_metadata_dict, [], 'test_command', 'system',
+                        timeout = invalid_timeout)
+
   def test_metadata_types(self):
     """ Tests that the command metadata generation function accepts the types that it should.
     """
@@ -132,6 +161,653 @@ class TestCommandInfrastructure(unittest.TestCase):
     
     metadata.build_metadata_dict(test_parameters, 'test_command', 'system', False)
   
+  def test_parser_routing_table(self):
+    """ Verifies that the command parser builds a routing table containing the system and device commands and that the 
+    stored command meta-data can't be modified.
+    """
+
+    routing_table = self.command_parser.routing_table
+
+    # Check the system command routes
+    station_time_route = routing_table[(None, 'system', 'station_time')]
+    self.assertTrue(not station_time_route.device_command)
+    self.assertEqual(station_time_route.function, self.command_parser.system_handlers['system'].command_station_time)
+    self.assertEqual(station_time_route.metadata['requires_active_session'], False)
+    self.assertTrue((None, 'test', 'generate_error') in routing_table)
+    self.assertEqual(routing_table[(None, 'test', 'generate_error')].metadata, None)
+
+    # Check the device command routes
+    requires_session_route = routing_table[('test_pipeline', 'test_device', 'requires_session')]
+    self.assertTrue(requires_session_route.device_command)
+    self.assertEqual(requires_session_route.metadata['requires_active_session'], True)
+    self.assertTrue(('test_pipeline', 'test_device', 'device_time') in routing_table)
+    self.assertTrue(('test_pipeline', 'test_device', 'fake_command') not in routing_table)
+
+    # Device commands should share their device's command queue and system commands shouldn't have one
+    self.assertTrue(station_time_route.device_queue is None)
+    self.assertTrue(requires_session_route.device_queue is not None)
+    self.assertTrue(routing_table[('test_pipeline', 'test_device', 'device_time')].device_queue is
+                    requires_session_route.device_queue)
+
+    # Make sure the meta-data is read-only
+    self.assertRaises(TypeError, requires_session_route.metadata.__setitem__, 'requires_active_session', False)
+    self.assertRaises(TypeError, requires_session_route.metadata.update, {'requires_active_session': False})
+    self.assertTrue(isinstance(requires_session_route.metadata['parameters'], tuple))
+
+  def test_parser_command_catalog(self):
+    """ Verifies that the command parser builds a catalog of the available commands along with their meta-data, and 
+    that the catalog's ETag only changes when its content does.
+    """
+
+    command_catalog = self.command_parser.command_catalog
+
+    # Check the catalog contents
+    self.assertEqual(command_catalog.catalog['system']['system']['station_time']['requires_active_session'], False)
+    self.assertTrue('generate_error' not in command_catalog.catalog['system'].get('test', {}))
+    self.assertEqual(command_catalog.catalog['devices']['test_device']['requires_session']['requires_active_session'],
+                     True)
+    self.assertTrue('test_device' in command_catalog.catalog['pipelines']['test_pipeline'])
+    self.assertEqual(command_catalog.catalog['pipelines']['test_pipeline'],
+                     sorted(command_catalog.catalog['pipelines']['test_pipeline']))
+
+    # Rebuilding the catalog shouldn't change the ETag unless the commands change
+    original_etag = command_catalog.etag
+    self.command_parser.build_routing_table()
+    self.assertEqual(command_catalog.etag, original_etag)
+    del self.command_parser.system_handlers['system']
+    self.command_parser.build_routing_table()
+    self.assertNotEqual(command_catalog.etag, original_etag)
+    self.assertTrue('system' not in command_catalog.catalog['system'])
+
+  @inlineCallbacks
+  def test_parser_routing_table_miss(self):
+    """ Verifies that the command parser can still execute commands that aren't in the routing table and that it adds
+    them to the table once they have been resolved.
+    """
+
+    # Clear the routing table and run a command
+    self.command_parser.routing_table = {}
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system'},
+                                                              user_id="4")
+    self.assertEqual(command_results['response']['status'], 'okay')
+    self.assertTrue((None, 'system', 'station_time') in self.command_parser.routing_table)
+
+    # Rebuild the table and make sure it contains the device commands again
+    self.command_parser.build_routing_table()
+    self.assertTrue(('test_pipeline', 'test_device', 'requires_session') in self.command_parser.routing_table)
+
+  @inlineCallbacks
+  def test_parser_command_batch(self):
+    """ Verifies that the command parser can execute a batch of commands sequentially and concurrently, returning a
+    response for every command in the batch (including the ones that fail).
+    """
+
+    test_batch = [
+      {'command': 'station_time', 'destination': 'system'},
+      {'command': 'generate_error', 'destination': 'test'},
+      {'command': 'device_time_restricted', 'destination': 'test'},
+      "{\"invalid_json\":true,invalid_element}",
+      {'command': 'station_time', 'destination': 'system'}
+    ]
+
+    for sequential in [True, False]:
+      batch_results = yield self.command_parser.parse_command_batch(test_batch, user_id="4", sequential=sequential)
+
+      self.assertEqual(len(batch_results), 5)
+      self.assertEqual(batch_results[0]['response']['status'], 'okay')
+      self.assertTrue('timestamp' in batch_results[0]['response']['result'])
+      self.assertEqual(batch_results[1]['response']['status'], 'error')
+      self.assertEqual(batch_results[1]['response']['result']['error_message'], 'Command Error Test.')
+      self.assertEqual(batch_results[2]['response']['status'], 'error')
+      self.assertTrue('permission' in batch_results[2]['response']['result']['error_message'])
+      self.assertEqual(batch_results[3]['response']['status'], 'error')
+      self.assertTrue('malformed' in batch_results[3]['response']['result']['error_message'])
+      self.assertEqual(batch_results[4]['response']['status'], 'okay')
+
+    # Make sure an empty batch works
+    batch_results = yield self.command_parser.parse_command_batch([], user_id="4")
+    self.assertEqual(batch_results, [])
+
+  @inlineCallbacks
+  def test_parser_command_batch_permission_error(self):
+    """ Verifies that every command in a batch fails if the user's permissions can't be loaded and that the user's 
+    permissions are only loaded once per batch.
+    """
+
+    # Submit a batch for a user that doesn't exist
+    test_batch = [{'command': 'station_time', 'destination': 'system'}]*3
+    batch_results = yield self.command_parser.parse_command_batch(test_batch, user_id="99")
+    self.assertEqual(len(batch_results), 3)
+    for command_results in batch_results:
+      self.assertEqual(command_results['response']['status'], 'error')
+
+    # Make sure the permissions are only loaded once
+    self.command_parser.permission_manager.get_user_permissions = MagicMock(
+        wraps=self.command_parser.permission_manager.get_user_permissions)
+    batch_results = yield self.command_parser.parse_command_batch(test_batch, user_id="4", sequential=False)
+    self.assertEqual(self.command_parser.permission_manager.get_user_permissions.call_count, 1)
+    for command_results in batch_results:
+      self.assertEqual(command_results['response']['status'], 'okay')
+
+  @inlineCallbacks
+  def test_parser_setup_program(self):
+    """ Verifies that the command parser can compile a list of setup commands ahead of time, reporting their errors, 
+    and that running the compiled program returns the same responses that parsing the commands would.
+    """
+
+    test_commands = [
+      {'command': 'station_time', 'destination': 'system'},
+      {'command': 'device_time_restricted', 'destination': 'test'},
+      "{\"invalid_json\":true,invalid_element}",
+      {'command': 'missing_command', 'destination': 'system'}
+    ]
+
+    # Compile the program
+    setup_program = yield self.command_parser.compile_program(test_commands, user_id="4")
+    self.assertEqual(len(setup_program.steps), 4)
+    self.assertEqual([program_error['step'] for program_error in setup_program.errors], [1, 2, 3])
+    self.assertTrue(setup_program.steps[0].route is self.command_parser.routing_table[(None, 'system', 'station_time')])
+    self.assertTrue(setup_program.steps[2].command_dict is None)
+
+    # Run the program, making sure that the permissions are only loaded once
+    self.command_parser.permission_manager.get_user_permissions = MagicMock(
+        wraps=self.command_parser.permission_manager.get_user_permissions)
+    for run_index in range(2):
+      program_results = yield defer.DeferredList(self.command_parser.run_program(setup_program), consumeErrors = True)
+      self.assertEqual(self.command_parser.permission_manager.get_user_permissions.call_count, run_index+1)
+      self.assertTrue(program_results[0][0])
+      self.assertTrue('timestamp' in program_results[0][1]['response']['result'])
+      error_messages = [step_results[1].value.results['response']['result']['error_message']
+                        for step_results in program_results[1:]]
+      self.assertTrue('permission' in error_messages[0])
+      self.assertTrue('malformed' in error_messages[1])
+      self.assertTrue('could not be located' in error_messages[2])
+
+      # Routes are resolved again if the routing table is rebuilt
+      self.command_parser.build_routing_table()
+
+    # Kernel mode programs skip the permission checks
+    setup_program = yield self.command_parser.compile_program(test_commands[0:2], kernel_mode = True)
+    self.assertEqual(setup_program.errors, [])
+    program_results = yield defer.gatherResults(self.command_parser.run_program(setup_program))
+    self.assertTrue('timestamp' in program_results[1]['response']['result'])
+
+  @inlineCallbacks
+  def test_command_resource(self):
+    """ Verifies that CommandResource correctly handles single commands and batches of commands.
+    """
+
+    # Create the resource and a helper that builds requests from user "4"
+    test_resource = connection.CommandResource(self.command_parser)
+    def create_request(request_body, request_args = {}):
+      test_request = DummyRequest([''])
+      test_request.method = 'POST'
+      test_request.content = StringIO(request_body)
+      test_request.args = request_args
+      test_request.transport = MagicMock()
+      test_request.transport.getPeerCertificate.return_value.get_subject.return_value.commonName = "4"
+      return test_request
+
+    # Submit a single command
+    test_request = create_request(json.dumps({'command': 'station_time', 'destination': 'system'}))
+    yield _render(test_resource, test_request)
+    command_response = json.loads("".join(test_request.written))
+    self.assertEqual(command_response['status'], 'okay')
+
+    # Submit a failing command
+    test_request = create_request("{\"invalid_json\":true,invalid_element}")
+    yield _render(test_resource, test_request)
+    command_response = json.loads("".join(test_request.written))
+    self.assertEqual(command_response['status'], 'error')
+
+    # Submit a batch of commands
+    test_request = create_request(json.dumps([{'command': 'station_time', 'destination': 'system'},
+                                              {'command': 'generate_error', 'destination': 'test'}]),
+                                  {'mode': ['concurrent']})
+    yield _render(test_resource, test_request)
+    batch_response = json.loads("".join(test_request.written))
+    self.assertEqual(len(batch_response), 2)
+    self.assertEqual(batch_response[0]['status'], 'okay')
+    self.assertEqual(batch_response[1]['status'], 'error')
+
+    # Submit a batch that is too large
+    self.command_parser.max_batch_size = 2
+    test_request = create_request(json.dumps([{'command': 'station_time', 'destination': 'system'}]*3))
+    yield _render(test_resource, test_request)
+    batch_response = json.loads("".join(test_request.written))
+    self.assertEqual(batch_response['status'], 'error')
+    self.assertEqual(batch_response['result']['max_batch_size'], 2)
+    self.command_parser.max_batch_size = None
+
+    # Submit a MessagePack encoded command and request a MessagePack response
+    msgpack_codec = codec.get_codec('msgpack')
+    test_request = create_request(msgpack_codec.encode({'command': 'station_time', 'destination': 'system'}))
+    test_request.requestHeaders.setRawHeaders('content-type', ['application/x-msgpack'])
+    yield _render(test_resource, test_request)
+    self.assertEqual(test_request.responseHeaders.getRawHeaders('content-type'), ['application/x-msgpack'])
+    command_response = msgpack_codec.decode("".join(test_request.written))
+    self.assertEqual(command_response['status'], 'okay')
+
+    # The Accept header should override the request's codec
+    test_request = create_request(json.dumps({'command': 'station_time', 'destination': 'system'}))
+    test_request.requestHeaders.setRawHeaders('accept', ['text/html, application/x-msgpack'])
+    yield _render(test_resource, test_request)
+    command_response = msgpack_codec.decode("".join(test_request.written))
+    self.assertEqual(command_response['status'], 'okay')
+
+    # Commands that can't be decoded should be rejected
+    test_request = create_request("\x92\x01")
+    test_request.requestHeaders.setRawHeaders('content-type', ['application/x-msgpack'])
+    yield _render(test_resource, test_request)
+    command_response = msgpack_codec.decode("".join(test_request.written))
+    self.assertEqual(command_response['status'], 'error')
+    self.assertTrue('msgpack' in command_response['result']['error_message'])
+
+    # Responses that can't be encoded should still close the request
+    test_request = create_request(json.dumps([{'command': 'station_time', 'destination': 'system'}]))
+    test_request.requestHeaders.setRawHeaders('accept', ['application/x-msgpack'])
+    self.patch(codec.get_codec('msgpack'), 'encode', MagicMock(side_effect=codec.CodecError("Test error.")))
+    yield _render(test_resource, test_request)
+    self.assertEqual(test_request.finished, 1)
+    self.assertEqual(test_request.responseCode, 500)
+
+  @inlineCallbacks
+  def test_parser_cached_command(self):
+    """ Verifies that the command parser serves cacheable commands from its result cache while still building a
+    separate response for each command.
+    """
+
+    # Run the same cacheable command twice
+    test_command = {'command': 'station_time', 'destination': 'system'}
+    first_results = yield self.command_parser.parse_command(test_command, user_id="4")
+    second_results = yield self.command_parser.parse_command(test_command, user_id="4")
+    self.assertEqual(first_results['response']['result'], second_results['response']['result'])
+    self.assertEqual(self.command_parser.result_cache.get_statistics()['hits'], 1)
+
+    # Make sure the permissions are still checked for cached commands
+    try:
+      yield self.command_parser.parse_command(test_command, user_id="5")
+      self.fail("A user without permission to run a cached command was able to run it.")
+    except parser.CommandFailed as command_failure:
+      self.assertTrue('permission' in command_failure.results['response']['result']['error_message'])
+
+    # Internal commands should bypass the cache
+    command_results = yield self.command_parser.invoke_internal(None, 'system', 'station_time')
+    self.assertEqual(command_results['response']['status'], 'okay')
+    self.assertEqual(self.command_parser.result_cache.get_statistics()['hits'], 1)
+
+  def test_parser_coalesced_command(self):
+    """ Verifies that the command parser coalesces schedulable device commands and returns a 'superseded' response for
+    commands that get replaced before they are executed.
+    """
+
+    # Replace the schedulable command with one that doesn't complete until the test fires it
+    command_deferreds = []
+    def mock_set_target(active_command):
+      command_deferreds.append(defer.Deferred())
+      return command_deferreds[-1]
+    self.command_parser.routing_table[('test_pipeline', 'test_device', 'set_target')].function = mock_set_target
+
+    # Submit several commands in kernel mode
+    test_responses = []
+    for target in range(3):
+      test_command = {'command': 'set_target', 'destination': 'test_pipeline.test_device', 'parameters': {'t': target}}
+      command_deferred = self.command_parser.parse_command(test_command, kernel_mode=True)
+      command_deferred.addCallback(test_responses.append)
+
+    # The second command should have been superseded by the third
+    self.assertEqual(len(command_deferreds), 1)
+    self.assertEqual(len(test_responses), 1)
+    self.assertEqual(test_responses[0]['response']['status'], 'superseded')
+    self.assertEqual(test_responses[0]['response']['result']['superseded_by'], {'t': 2})
+
+    # Complete the commands
+    command_deferreds[0].callback({'target': 0})
+    self.assertEqual(len(command_deferreds), 2)
+    command_deferreds[1].callback({'target': 2})
+    self.assertEqual([test_response['response']['status'] for test_response in test_responses], 
+                     ['superseded', 'okay', 'okay'])
+    self.assertEqual(test_responses[2]['response']['result'], {'target': 2})
+
+  @inlineCallbacks
+  def test_parser_stage_timings(self):
+    """ Verifies that the command parser records the stage timings of successful and failed commands, adds them to the
+    latency histograms, and only includes them in responses when the command's debug flag is set.
+    """
+
+    # Run a command with the debug flag set
+    test_command = {'command': 'station_time', 'destination': 'system', 'debug': True}
+    command_results = yield self.command_parser.parse_command(test_command, user_id="4")
+    command_timings = command_results['response']['timings']
+    for stage_name in ['decode', 'validation', 'permissions', 'routing', 'sessions', 'execution', 'response', 'total']:
+      self.assertTrue(command_timings[stage_name] >= 0, "The '"+stage_name+"' stage was not timed.")
+    self.assertTrue(command_timings['total'] >= command_timings['execution'])
+
+    # Without the debug flag the timings should only be recorded in the histograms
+    del test_command['debug']
+    command_results = yield self.command_parser.parse_command(test_command, user_id="4")
+    self.assertTrue('timings' not in command_results['response'])
+    latency_statistics = self.command_parser.get_latency_statistics('system', 'station_time')
+    self.assertEqual(len(latency_statistics), 1)
+    self.assertEqual(latency_statistics[0]['stages']['total']['count'], 2)
+
+    # Failed commands should only record the stages that they reached
+    try:
+      yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system', 'debug': True},
+                                              user_id="5")
+      self.fail("A user without permission to run the command was able to run it.")
+    except parser.CommandFailed as command_failure:
+      command_timings = command_failure.results['response']['timings']
+      self.assertTrue('routing' in command_timings and 'response' in command_timings)
+      self.assertTrue('sessions' not in command_timings and 'execution' not in command_timings)
+    self.assertEqual(self.command_parser.get_latency_statistics('system', 'station_time')[0]['stages']['total']['count'],
+                     3)
+
+    # Commands that can't be routed shouldn't create histograms
+    histogram_count = len(self.command_parser.get_latency_statistics())
+    yield self.assertFailure(self.command_parser.parse_command({'command': 'made_up', 'destination': 'nowhere'},
+                                                               kernel_mode=True), parser.CommandFailed)
+    self.assertEqual(len(self.command_parser.get_latency_statistics()), histogram_count)
+
+  @inlineCallbacks
+  def test_parser_audit_log(self):
+    """ Verifies that the command parser adds successful and failed commands to its audit log.
+    """
+
+    self.command_parser.audit_log = MagicMock()
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system'},
+                                                              user_id="4")
+    try:
+      yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system'}, user_id="5")
+      self.fail("A user without permission to run the command was able to run it.")
+    except parser.CommandFailed as command_failure:
+      pass
+
+    audited_commands = self.command_parser.audit_log.record.call_args_list
+    self.assertEqual(len(audited_commands), 2)
+    self.assertEqual(audited_commands[0][0][0].user_id, "4")
+    self.assertTrue(audited_commands[0][0][1] is command_results)
+    self.assertTrue(audited_commands[1][0][1] is command_failure.results)
+
+  @inlineCallbacks
+  def test_parser_rate_limits(self):
+    """ Verifies that commands that exceed their rate limits are rejected with a 'throttled' response before they are
+    executed.
+    """
+
+    self.command_parser.rate_limiter = ratelimit.CommandRateLimiter(task.Clock())
+    self.command_parser.rate_limiter.set_limit('user', 1, 2)
+    test_command = {'command': 'station_time', 'destination': 'system'}
+    for command_index in range(2):
+      command_results = yield self.command_parser.parse_command(test_command, user_id="4")
+      self.assertEqual(command_results['response']['status'], 'okay')
+
+    try:
+      yield self.command_parser.parse_command(test_command, user_id="4")
+      self.fail("A command that exceeded the user's rate limit was executed.")
+    except parser.CommandFailed as command_failure:
+      throttled_response = command_failure.results['response']
+      self.assertEqual(throttled_response['status'], 'throttled')
+      self.assertEqual(throttled_response['result']['budget'], 'user')
+      self.assertAlmostEqual(throttled_response['result']['retry_after'], 1)
+
+    # Kernel commands have a separate budget
+    command_results = yield self.command_parser.parse_command(test_command, kernel_mode=True)
+    self.assertEqual(command_results['response']['status'], 'okay')
+
+    # Batches and setup programs are charged once as a whole, so a full size batch isn't throttled by the default limits
+    self.command_parser.rate_limiter.set_limit('user', 20, 40)
+    self.command_parser.max_batch_size = 100
+    batch_results = yield self.command_parser.parse_command_batch([test_command]*100, user_id="4")
+    self.assertEqual([command_response['response']['status'] for command_response in batch_results], ['okay']*100)
+    setup_program = yield self.command_parser.compile_program([test_command]*60, user_id="4")
+    program_results = yield defer.gatherResults(self.command_parser.run_program(setup_program))
+    self.assertEqual([step_response['response']['status'] for step_response in program_results], ['okay']*60)
+    self.assertEqual(self.command_parser.rate_limiter._buckets[('user', "4")].tokens, 38)
+
+    # Batches from users that have exhausted their budget are rejected as a whole
+    self.command_parser.rate_limiter.set_limit('user', 1, 1)
+    yield self.command_parser.parse_command(test_command, user_id="4")
+    try:
+      yield self.command_parser.parse_command_batch([test_command]*2, user_id="4")
+      self.fail("A batch that exceeded the user's rate limit was executed.")
+    except parser.CommandFailed as command_failure:
+      self.assertEqual(command_failure.results['response']['status'], 'throttled')
+      self.assertEqual(command_failure.results['response']['result']['budget'], 'user')
+
+  @inlineCallbacks
+  def test_parser_idempotency_key(self):
+    """ Verifies that commands resubmitted with the same idempotency key are answered with the original response
+    without being executed again.
+    """
+
+    self.command_parser.audit_log = MagicMock()
+    test_command = {'command': 'station_time', 'destination': 'system', 'idempotency_key': 'retry-1'}
+    first_results = yield self.command_parser.parse_command(test_command, user_id="4")
+    replayed_results = yield self.command_parser.parse_command(dict(test_command), user_id="4")
+    self.assertTrue('replayed' not in first_results['response'])
+    self.assertTrue(replayed_results['response']['replayed'])
+    self.assertEqual(replayed_results['response']['result'], first_results['response']['result'])
+    self.assertEqual(self.command_parser.audit_log.record.call_count, 1)
+
+    # Reusing the key for a different command fails
+    try:
+      yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                               'parameters': {'a': 1}, 'idempotency_key': 'retry-1'}, user_id="4")
+      self.fail("An idempotency key was reused for a different command.")
+    except parser.CommandFailed as command_failure:
+      self.assertEqual(command_failure.results['response']['result']['idempotency_key'], 'retry-1')
+
+  @inlineCallbacks
+  def test_parser_command_progress(self):
+    """ Verifies that device commands can report their progress over their pipeline's telemetry stream and that the
+    parser sends the final progress event when they complete.
+    """
+
+    test_pipeline = self.pipeline_manager.get_pipeline('test_pipeline')
+    test_pipeline.write_telemetry = MagicMock()
+    command_results = yield self.command_parser.invoke_internal('test_pipeline', 'test_device', 'report_progress')
+    progress_events = [telemetry_call[0] for telemetry_call in test_pipeline.write_telemetry.call_args_list]
+    self.assertEqual(len(progress_events), 3)
+    self.assertEqual([progress_event[0] for progress_event in progress_events], ['test_device']*3)
+    self.assertEqual([progress_event[1] for progress_event in progress_events], ['command_progress']*3)
+    self.assertEqual([progress_event[3]['event'] for progress_event in progress_events],
+                     ['progress', 'progress', 'complete'])
+    self.assertEqual([progress_event[3]['sequence'] for progress_event in progress_events], [1, 2, 3])
+    self.assertEqual(progress_events[1][3]['progress'], {'step': 2})
+    self.assertEqual(progress_events[2][3]['status'], 'okay')
+    self.assertEqual(progress_events[2][3]['destination'], 'test_pipeline.test_device')
+    self.assertEqual(progress_events[2][3]['progress_id'], command_results['response']['progress_id'])
+
+    # Only the final event is sent while the pipeline's telemetry is being throttled
+    self.assertEqual([telemetry_call[1]['throttle'] for telemetry_call in test_pipeline.write_telemetry.call_args_list],
+                     [True, True, False])
+
+    # Commands whose handler continues monitoring them don't get a final event until the handler sends it
+    test_pipeline.write_telemetry.reset_mock()
+    command_results = yield self.command_parser.invoke_internal('test_pipeline', 'test_device', 'report_progress',
+                                                                {'continue': True})
+    self.assertEqual(test_pipeline.write_telemetry.call_count, 2)
+
+    # Commands that don't report their progress don't send any events
+    test_pipeline.write_telemetry.reset_mock()
+    command_results = yield self.command_parser.invoke_internal('test_pipeline', 'test_device', 'device_time')
+    self.assertEqual(test_pipeline.write_telemetry.call_count, 0)
+    self.assertTrue('progress_id' not in command_results['response'])
+
+  @inlineCallbacks
+  def test_parser_invoke_internal(self):
+    """ Verifies that internal commands are routed and executed without being validated or checked against the user's
+    permissions and sessions, and that they are still recorded in the latency histograms.
+    """
+
+    # Run a device command that requires a session on behalf of a user that doesn't have permission to run it
+    self.session_coordinator.load_user_sessions = MagicMock(side_effect = Exception("Sessions should not be loaded."))
+    command_results = yield self.command_parser.invoke_internal('test_pipeline', 'test_device', 'requires_session',
+                                                                user_id = "5")
+    self.assertEqual(command_results['response']['status'], 'okay')
+    self.assertEqual(command_results['response']['destination'], 'test_pipeline.test_device')
+    latency_statistics = self.command_parser.get_latency_statistics('test_pipeline.test_device', 'requires_session')
+    self.assertEqual(latency_statistics[0]['stages']['execution']['count'], 1)
+    self.assertTrue('validation' not in latency_statistics[0]['stages'])
+
+    # System commands can be invoked without a pipeline
+    command_results = yield self.command_parser.invoke_internal(None, 'system', 'station_time')
+    self.assertTrue('timestamp' in command_results['response']['result'])
+
+    # Commands that can't be routed should fail like regular commands
+    try:
+      yield self.command_parser.invoke_internal('test_pipeline', 'test_device', 'fake_command')
+      self.fail("An internal command that doesn't exist was executed.")
+    except parser.CommandFailed as command_failure:
+      self.assertEqual(command_failure.results['response']['status'], 'error')
+
+  @inlineCallbacks
+  def test_parser_command_timeout(self):
+    """ Verifies that commands are cancelled once their deadline passes, that their handler is notified, and that a 
+    'timeout' response is returned.
+    """
+
+    # Replace the test device command with one that doesn't complete until the test fires it
+    command_deferreds = []
+    cancelled_commands = []
+    def mock_requires_session(active_command):
+      command_deferreds.append(defer.Deferred())
+      return command_deferreds[-1]
+    test_route = self.command_parser.routing_table[('test_pipeline', 'test_device', 'requires_session')]
+    test_route.function = mock_requires_session
+    test_route.handler.cancel_requires_session = cancelled_commands.append
+    test_route.device_queue.concurrency = 1
+    self.command_parser.clock = task.Clock()
+    self.command_parser.default_timeout = 10
+
+    # Submit two commands, the second one will wait in the device's queue and has a shorter timeout
+    test_command = {'command': 'requires_session', 'destination': 'test_pipeline.test_device'}
+    test_responses = []
+    test_failures = []
+    for command_timeout in [None, 2]:
+      if command_timeout is not None:
+        test_command['timeout'] = command_timeout
+      command_deferred = self.command_parser.parse_command(dict(test_command), kernel_mode=True)
+      command_deferred.addCallbacks(test_responses.append, test_failures.append)
+    self.assertEqual(test_route.device_queue.get_statistics()['depth'], 1)
+
+    # Let the second command time out and make sure that it was removed from the queue
+    self.command_parser.clock.advance(2)
+    self.assertEqual(len(test_failures), 1)
+    timeout_response = test_failures[0].value.results['response']
+    self.assertEqual(timeout_response['status'], 'timeout')
+    self.assertEqual(timeout_response['result']['timeout'], 2)
+    self.assertEqual(len(cancelled_commands), 1)
+    self.assertTrue(cancelled_commands[0].timed_out)
+    self.assertEqual(test_route.device_queue.get_statistics()['depth'], 0)
+
+    # The first command should complete normally and its timeout should be cancelled
+    command_deferreds[0].callback({'done': True})
+    self.assertEqual(test_responses[0]['response']['status'], 'okay')
+    self.assertEqual(len(command_deferreds), 1)
+    self.assertEqual(self.command_parser.clock.getDelayedCalls(), [])
+
+    # Commands that run past the default timeout should also time out
+    try:
+      command_deferred = self.command_parser.invoke_internal('test_pipeline', 'test_device', 'requires_session')
+      self.command_parser.clock.advance(10)
+      yield command_deferred
+      self.fail("A command that never completed didn't time out.")
+    except parser.CommandFailed as command_failure:
+      self.assertEqual(command_failure.results['response']['status'], 'timeout')
+      self.assertEqual(command_failure.results['response']['result']['timeout'], 10)
+
+    # The timed out command should have released its queue slot, so the next command starts right away
+    self.assertEqual(test_route.device_queue.get_statistics()['released'], 1)
+    command_deferred = self.command_parser.invoke_internal('test_pipeline', 'test_device', 'requires_session')
+    self.assertEqual(len(command_deferreds), 3)
+    self.assertEqual(test_route.device_queue.executing, 1)
+
+    # The abandoned command finishing late shouldn't free the new command's slot
+    command_deferreds[1].callback({'done': True})
+    self.assertEqual(test_route.device_queue.executing, 1)
+    command_deferreds[2].callback({'done': True})
+    self.assertEqual((yield command_deferred)['response']['status'], 'okay')
+    self.assertEqual(test_route.device_queue.executing, 0)
+
+  @inlineCallbacks
+  def test_parser_scheduled_command(self):
+    """ Verifies that commands with a future 'execute_at' time are held by the command scheduler until their execution
+    time and that scheduled commands can be cancelled by the user that submitted them.
+    """
+
+    # Replace the test device command with one that records when it was executed
+    command_scheduler = scheduler.CommandScheduler(clock = task.Clock())
+    self.command_parser.command_scheduler = command_scheduler
+    executed_commands = []
+    def mock_requires_session(active_command):
+      executed_commands.append((active_command.parameters['point'], command_scheduler.clock.seconds()))
+      return {'point': active_command.parameters['point']}
+    test_route = self.command_parser.routing_table[('test_pipeline', 'test_device', 'requires_session')]
+    test_route.function = mock_requires_session
+
+    # Schedule a batch of points, the batch should only contain 'scheduled' responses
+    test_commands = [{'command': 'requires_session', 'destination': 'test_pipeline.test_device', 
+                      'parameters': {'point': point_index}, 'execute_at': 10+point_index*0.25} for point_index in range(8)]
+    batch_results = yield self.command_parser.parse_command_batch(test_commands, kernel_mode=True)
+    schedule_ids = []
+    for command_response in batch_results:
+      self.assertEqual(command_response['response']['status'], 'scheduled')
+      schedule_ids.append(command_response['response']['result']['schedule_id'])
+    self.assertEqual(command_scheduler.get_pending_count(), 8)
+    self.assertEqual(executed_commands, [])
+
+    # Cancel one of the points and run the rest
+    self.command_parser.unschedule_command(schedule_ids[3])
+    command_scheduler.clock.pump([0.001]*12000)
+    self.assertEqual([executed_command[0] for executed_command in executed_commands], [0, 1, 2, 4, 5, 6, 7])
+    for point_index, executed_at in executed_commands:
+      self.assertTrue(abs(executed_at-(10+point_index*0.25)) < 0.0015)
+
+    # Commands whose execution time has already passed should be executed immediately
+    test_command = dict(test_commands[0], execute_at = 5)
+    command_results = yield self.command_parser.parse_command(test_command, kernel_mode=True)
+    self.assertEqual(command_results['response']['status'], 'okay')
+
+    # Users can only cancel their own scheduled commands
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system', 
+                                                               'execute_at': 100}, user_id="4")
+    schedule_id = command_results['response']['result']['schedule_id']
+    self.assertRaises(command.CommandError, self.command_parser.unschedule_command, schedule_id, "5")
+    self.assertEqual(self.command_parser.unschedule_command(schedule_id, "4").command, 'station_time')
+    self.assertRaises(command.CommandError, self.command_parser.unschedule_command, schedule_id, "4")
+
+    # Users can only have a limited number of scheduled commands pending (kernel mode commands aren't limited)
+    self.command_parser.max_scheduled_per_user = 2
+    schedule_ids = []
+    for execute_at in [100, 101]:
+      command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                                                 'execute_at': execute_at}, user_id="4")
+      schedule_ids.append(command_results['response']['result']['schedule_id'])
+    try:
+      yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                               'execute_at': 102}, user_id="4")
+      self.fail("A scheduled command that exceeded the user's scheduled command limit was accepted.")
+    except parser.CommandFailed as command_failure:
+      throttled_response = command_failure.results['response']
+      self.assertEqual(throttled_response['status'], 'throttled')
+      self.assertEqual(throttled_response['result']['budget'], 'scheduled')
+      self.assertEqual(throttled_response['result']['max_scheduled_commands'], 2)
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                                               'execute_at': 102}, kernel_mode=True)
+    self.assertEqual(command_results['response']['status'], 'scheduled')
+
+    # Cancelled and executed commands no longer count against the limit
+    self.command_parser.unschedule_command(schedule_ids[0], "4")
+    command_results = yield self.command_parser.parse_command({'command': 'station_time', 'destination': 'system',
+                                                               'execute_at': 103}, user_id="4")
+    self.assertEqual(command_results['response']['status'], 'scheduled')
+    command_scheduler.clock.advance(200)
+    command_scheduler.clock.advance(0)
+    self.assertEqual(command_scheduler.get_pending_count(), 0)
+    self.assertEqual(self.command_parser._scheduled_counts, {})
+
   def test_parser_unrecognized_command(self):
     """ This test ensures that the command parser correctly rejects unrecognized commands. In addition, it verifies the 
     functionality of the optional CommandError exception which allows additional meta-data to be embedded with the 
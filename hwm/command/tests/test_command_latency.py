@@ -0,0 +1,69 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from hwm.command import latency, command
+
+class TestCommandLatency(unittest.TestCase):
+  """ This test suite verifies the functionality of the latency histogram classes, which aggregate the stage timings 
+  recorded by commands.
+  """
+
+  def setUp(self):
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_histogram_buckets(self):
+    """ Verifies that durations are counted in the correct histogram buckets.
+    """
+
+    test_histogram = latency.LatencyHistogram()
+    for duration in [0.00005, 0.0001, 0.003, 0.003, 60]:
+      test_histogram.record(duration)
+
+    histogram_statistics = test_histogram.get_statistics()
+    self.assertEqual(histogram_statistics['count'], 5)
+    self.assertEqual(histogram_statistics['max'], 60)
+    self.assertAlmostEqual(histogram_statistics['mean'], (0.00005+0.0001+0.003+0.003+60)/5)
+    bucket_counts = dict((upper_bound, bucket_count) for upper_bound, bucket_count in histogram_statistics['buckets'])
+    self.assertEqual(bucket_counts[0.0001], 2)
+    self.assertEqual(bucket_counts[0.005], 2)
+    self.assertEqual(bucket_counts[None], 1)
+    self.assertEqual(sum(bucket_counts.values()), 5)
+
+  def test_monotonic_clock(self):
+    """ Verifies that the stage timing clock never goes backwards.
+    """
+
+    clock_readings = [latency.monotonic() for reading_index in range(1000)]
+    self.assertEqual(clock_readings, sorted(clock_readings))
+    self.assertTrue(clock_readings[-1] > 0)
+
+  def test_recorder(self):
+    """ Verifies that the recorder keeps separate histograms for each destination and command, and that it ignores 
+    commands that couldn't be validated.
+    """
+
+    latency_recorder = latency.LatencyRecorder()
+
+    # Record some commands
+    for raw_command in [{'command': 'move', 'destination': 'p.antenna'}, {'command': 'move', 'destination': 'p.antenna'},
+                        {'command': 'park', 'destination': 'p.antenna'}, {'command': 'move', 'destination': 'system'},
+                        {'invalid': True}]:
+      test_command = command.Command(0, raw_command)
+      test_command.validate_command().addErrback(lambda failure: None)
+      test_command.record_stage('execution')
+      latency_recorder.record_command(test_command)
+
+    # Check the recorded histograms
+    latency_statistics = latency_recorder.get_statistics()
+    self.assertEqual([(latencies['destination'], latencies['command']) for latencies in latency_statistics],
+                     [('p.antenna', 'move'), ('p.antenna', 'park'), ('system', 'move')])
+    self.assertEqual(latency_statistics[0]['stages']['execution']['count'], 2)
+    self.assertEqual(sorted(latency_statistics[0]['stages'].keys()), ['decode', 'execution', 'total', 'validation'])
+
+    # Check the filters
+    self.assertEqual(len(latency_recorder.get_statistics(destination = 'p.antenna')), 2)
+    self.assertEqual(len(latency_recorder.get_statistics(command_name = 'move')), 2)
+    self.assertEqual(len(latency_recorder.get_statistics('system', 'park')), 0)
+    latency_recorder.clear()
+    self.assertEqual(latency_recorder.get_statistics(), [])
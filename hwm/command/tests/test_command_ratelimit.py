@@ -0,0 +1,131 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import task
+from hwm.command import ratelimit, command
+
+class TestCommandRateLimiter(unittest.TestCase):
+  """ This test suite verifies the functionality of the CommandRateLimiter class, which limits how quickly users and 
+  devices can execute commands using token buckets.
+  """
+
+  def setUp(self):
+    # Create a rate limiter that uses a fake clock
+    self.clock = task.Clock()
+    self.rate_limiter = ratelimit.CommandRateLimiter(self.clock)
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_unlimited_by_default(self):
+    """ Verifies that commands aren't limited until a budget's limit is set.
+    """
+
+    for command_index in range(1000):
+      self.assertEqual(self.rate_limiter.acquire(self._build_command("4"), True), None)
+    self.assertEqual(self.rate_limiter.get_statistics()['user']['buckets'], 0)
+
+  def test_user_budget(self):
+    """ Verifies that each user has their own bucket that refills at the configured rate.
+    """
+
+    self.rate_limiter.set_limit('user', 2, 3)
+
+    # Use up the user's burst allowance
+    for command_index in range(3):
+      self.assertEqual(self.rate_limiter.acquire(self._build_command("4"), False), None)
+    budget, retry_after = self.rate_limiter.acquire(self._build_command("4"), False)
+    self.assertEqual(budget, 'user')
+    self.assertAlmostEqual(retry_after, 0.5)
+
+    # Other users should be unaffected
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("5"), False), None)
+
+    # The bucket should refill over time
+    self.clock.advance(0.5)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("4"), False), None)
+    self.assertNotEqual(self.rate_limiter.acquire(self._build_command("4"), False), None)
+    self.assertEqual(self.rate_limiter.get_statistics()['user']['throttled'], 2)
+
+  def test_device_and_kernel_budgets(self):
+    """ Verifies that device commands are charged against their device's budget, that kernel commands have a separate
+    budget, and that schedulable commands are exempt from the device budgets.
+    """
+
+    self.rate_limiter.set_limit('device', 1, 2)
+    self.rate_limiter.set_limit('kernel', 1, 1)
+
+    # Exhaust the device's budget using two different users
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("4"), True), None)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("5"), True), None)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("6"), True)[0], 'device')
+
+    # Schedulable commands, system commands, and kernel commands should still be allowed
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("6"), True, schedulable = True), None)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("6", 'system'), False), None)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command(None, kernel_mode = True), True), None)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command(None, kernel_mode = True), True)[0], 'kernel')
+    self.assertEqual(self.rate_limiter.acquire(self._build_command(None, kernel_mode = True), True, True), None)
+
+  def test_emergency_commands(self):
+    """ Verifies that emergency commands are never charged or throttled.
+    """
+
+    self.rate_limiter.set_limit('user', 1, 1)
+    self.rate_limiter.set_limit('device', 1, 1)
+    self.assertEqual(self.rate_limiter.acquire(self._build_command("4"), True), None)
+    self.assertNotEqual(self.rate_limiter.acquire(self._build_command("4"), True), None)
+    emergency_command = self._build_command("4")
+    emergency_command.priority = 'emergency'
+    for command_index in range(10):
+      self.assertEqual(self.rate_limiter.acquire(emergency_command, True), None)
+
+  def test_group_budget(self):
+    """ Verifies that batches are charged against the user budget once and that their commands are only charged against
+    the device budgets.
+    """
+
+    self.rate_limiter.set_limit('user', 1, 2)
+    self.rate_limiter.set_limit('device', 1, 3)
+    self.assertEqual(self.rate_limiter.acquire_group("4"), None)
+    for command_index in range(3):
+      group_command = self._build_command("4")
+      group_command.group_rate_limited = True
+      self.assertEqual(self.rate_limiter.acquire(group_command, True), None)
+    self.assertEqual(self.rate_limiter.acquire(group_command, True)[0], 'device')
+    self.assertEqual(self.rate_limiter.acquire_group("4"), None)
+    self.assertEqual(self.rate_limiter.acquire_group("4")[0], 'user')
+
+  def test_prune_idle_buckets(self):
+    """ Verifies that buckets are discarded once they have refilled completely.
+    """
+
+    self.rate_limiter.set_limit('user', 1, 2)
+    for user_id in ["4", "5", "6"]:
+      self.rate_limiter.acquire(self._build_command(user_id), False)
+    self.assertEqual(self.rate_limiter.get_statistics()['user']['buckets'], 3)
+
+    # Only the active user's bucket should be kept
+    self.clock.advance(self.rate_limiter.prune_interval-0.5)
+    self.rate_limiter.acquire(self._build_command("4"), False)
+    self.rate_limiter.acquire(self._build_command("4"), False)
+    self.clock.advance(0.5)
+    self.rate_limiter.acquire(self._build_command("5"), False)
+    self.assertEqual(sorted(bucket_key[1] for bucket_key in self.rate_limiter._buckets), ["4", "5"])
+    self.assertAlmostEqual(self.rate_limiter._buckets[('user', "4")].tokens, 0.5)
+
+  def test_invalid_limits(self):
+    """ Verifies that invalid limits are rejected.
+    """
+
+    self.assertRaises(ratelimit.InvalidRateLimit, self.rate_limiter.set_limit, 'fake_budget', 1)
+    self.assertRaises(ratelimit.InvalidRateLimit, self.rate_limiter.set_limit, 'user', 0)
+    self.assertRaises(ratelimit.InvalidRateLimit, self.rate_limiter.set_limit, 'user', 1, 0)
+    self.rate_limiter.set_limit('user', 0.5)
+    self.assertEqual(self.rate_limiter.limits['user'], (0.5, 1))
+
+  def _build_command(self, user_id, destination = 'test_pipeline.test_device', kernel_mode = False):
+    test_command = command.Command(0, {'command': 'test', 'destination': destination}, user_id = user_id,
+                                   kernel_mode = kernel_mode)
+    test_command.full_destination = destination
+    return test_command
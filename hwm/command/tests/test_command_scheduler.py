@@ -0,0 +1,96 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from twisted.internet import task
+from hwm.command import scheduler
+
+class TestCommandScheduler(unittest.TestCase):
+  """ This test suite verifies the functionality of the CommandScheduler class, a hashed timing wheel that the command 
+  parser uses to execute commands at specific times.
+  """
+
+  def setUp(self):
+    # Create a scheduler that uses a fake clock
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    self.command_scheduler = scheduler.CommandScheduler(clock = self.clock)
+    self.executed_entries = []
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_execution_order_and_accuracy(self):
+    """ Verifies that entries are executed in deadline order within a tick of their execution time, even when they are
+    scheduled out of order or more than one rotation of the wheel in the future.
+    """
+
+    for execute_at in [1000.5, 1000.0015, 1000.5, 1030, 1000.002]:
+      self.command_scheduler.schedule(execute_at, self._record_execution, execute_at)
+
+    # Nothing should execute early
+    self.clock.advance(0.0014)
+    self.assertEqual(self.executed_entries, [])
+    self.clock.advance(0.0006)
+    self.assertEqual(self.executed_entries, [(1000.0015, 1000.002), (1000.002, 1000.002)])
+
+    # Entries with the same time should execute in the order that they were scheduled
+    self.clock.advance(0.498)
+    self.assertEqual([entry[0] for entry in self.executed_entries], [1000.0015, 1000.002, 1000.5, 1000.5])
+
+    # The reactor should only be woken up for the next pending entry
+    self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+    self.assertAlmostEqual(self.clock.getDelayedCalls()[0].getTime(), 1030)
+    self.clock.advance(29.5)
+    self.assertEqual(self.executed_entries[-1], (1030, 1030))
+    self.assertEqual(self.command_scheduler.get_pending_count(), 0)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_cancel(self):
+    """ Verifies that cancelled entries aren't executed.
+    """
+
+    first_entry = self.command_scheduler.schedule(1001, self._record_execution, 'first')
+    second_entry = self.command_scheduler.schedule(1002, self._record_execution, 'second')
+    self.assertTrue(self.command_scheduler.cancel(first_entry.id))
+    self.assertFalse(self.command_scheduler.cancel(first_entry.id))
+    self.assertEqual(self.command_scheduler.get_entry(first_entry.id), None)
+    self.assertTrue(self.command_scheduler.get_entry(second_entry.id) is second_entry)
+
+    self.clock.advance(2)
+    self.assertEqual([entry[0] for entry in self.executed_entries], ['second'])
+
+    # Cancelling the last entry should stop the timer
+    last_entry = self.command_scheduler.schedule(1005, self._record_execution, 'last')
+    self.command_scheduler.cancel(last_entry.id)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_many_entries(self):
+    """ Verifies that a large number of entries (e.g. the antenna positions for a long pass) are all executed on time, 
+    including entries scheduled in the past and entries scheduled by executing entries.
+    """
+
+    for entry_index in range(20000):
+      self.command_scheduler.schedule(1000+entry_index*0.03, self._record_execution, entry_index)
+    self.command_scheduler.schedule(900, self._record_execution, 'past')
+    self.command_scheduler.schedule(1001, self._raise_error)
+    self.command_scheduler.schedule(1002, lambda: self.command_scheduler.schedule(1002.0005, self._record_execution,
+                                                                                    'nested'))
+
+    self.clock.pump([0.01]*61000)
+    self.assertEqual(len(self.executed_entries), 20002)
+    self.assertEqual(self.executed_entries[1][0], 'past')
+    self.assertAlmostEqual(self.executed_entries[1][1], 1000.01)
+    self.assertTrue('nested' in [entry[0] for entry in self.executed_entries])
+    for scheduled_value, executed_at in self.executed_entries:
+      if isinstance(scheduled_value, int):
+        self.assertTrue(executed_at-(1000+scheduled_value*0.03) < 0.011)
+    self.assertEqual(self.command_scheduler.get_pending_count(), 0)
+
+  def _record_execution(self, scheduled_value):
+    self.executed_entries.append((scheduled_value, self.clock.seconds()))
+
+  def _raise_error(self):
+    raise TestSchedulerError()
+
+class TestSchedulerError(Exception):
+  pass
@@ -62,4 +62,33 @@ class TestCommandHandler(handler.CommandHandler):
     @return Returns a standard dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'requires_session', self.name, requires_active_session = True)
\ No newline at end of file
+    return build_metadata_dict([], 'requires_session', self.name, requires_active_session = True)
+
+  def command_report_progress(self, active_command):
+    """ A test command that reports its progress before returning.
+
+    @param active_command  The command object associated with the executing command.
+    """
+
+    active_command.report_progress({'step': 1})
+    active_command.report_progress({'step': 2})
+    if active_command.parameters is not None and active_command.parameters.get('continue', False):
+      active_command.continue_progress()
+
+    return {'progress_reported': True}
+
+  def command_set_target(self, active_command):
+    """ A schedulable test command that simply returns its parameters.
+
+    @param active_command  The command object associated with the executing command.
+    """
+
+    return {'target': active_command.parameters}
+
+  def settings_set_target(self):
+    """ Returns a dictionary containing meta-data about the set_target command.
+    
+    @return Returns a standard dictionary containing meta-data about the command.
+    """
+
+    return build_metadata_dict([], 'set_target', self.name, requires_active_session = False, schedulable = True)
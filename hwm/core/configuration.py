@@ -8,6 +8,7 @@ of the module).
 
 # Load the required libraries
 import logging, yaml, jsonschema
+from hwm.core.validation import Validators
 
 class Config:
   """ Provides access to the hardware manager application configuration.
@@ -206,6 +207,86 @@ class Config:
           "minimum": 1,
           "default": 45502
         },
+        "command-channel-port": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 45503
+        },
+        "command-timeout": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 30
+        },
+        "command-batch-max-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 100
+        },
+        "user-max-scheduled-commands": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 10000
+        },
+        "user-command-rate": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 20
+        },
+        "user-command-burst": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 40
+        },
+        "device-command-rate": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 50
+        },
+        "device-command-burst": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 100
+        },
+        "kernel-command-rate": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 200
+        },
+        "kernel-command-burst": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 400
+        },
+        "idempotency-key-ttl": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 600
+        },
+        "idempotency-max-keys": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 4096
+        },
+        "audit-log-location": {
+          "type": "string",
+          "default": self.data_directory + "audit/"
+        },
+        "audit-log-max-file-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 10485760
+        },
+        "audit-log-flush-interval": {
+          "type": "number",
+          "minimum": 0,
+          "exclusiveMinimum": True,
+          "default": 0.25
+        },
         "mercury2-ui-location": {
           "type": "string",
           "required": True
@@ -249,6 +330,16 @@ class Config:
           "maximum": 60,
           "default": 10
         },
+        "permissions-cache-size": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 1000
+        },
+        "permissions-cache-ttl": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 3600
+        },
         "permissions-location-local": {
           "type": "string",
           "default": self.config_directory + "permissions/offline_permissions.json"
@@ -256,14 +347,28 @@ class Config:
         "permissions-location-network": {
           "type": "string",
           "default": "test_permissions.json"
+        },
+        "permissions-invalidation-location": {
+          "type": ["string", "null"],
+          "default": None
+        },
+        "permissions-invalidation-timeout": {
+          "type": "integer",
+          "minimum": 1,
+          "default": 60
+        },
+        "snapshot-location": {
+          "type": "string",
+          "default": self.data_directory + "snapshots/"
         }
       }
     }
 
-    # Validate the loaded configuration against the schema
-    configuration_validator = jsonschema.Draft3Validator(configuration_schema)
+    # Validate the loaded configuration against the schema. The schema is re-registered each time because its default
+    # values depend on the current configuration directory.
+    Validators.register('configuration', configuration_schema)
     try:
-      configuration_validator.validate(self.options)
+      Validators.validate('configuration', self.options)
 
       if self.verbose_startup:
         print "- Basic configuration options validated. The device and pipeline configurations will be validated later."
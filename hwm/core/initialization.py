@@ -15,15 +15,15 @@ from txws import WebSocketFactory
 from pkg_resources import Requirement, resource_filename
 
 # HWM modules
-from hwm.core import errors
+from hwm.core import errors, snapshots
 from hwm.core.configuration import Configuration
 from hwm.sessions import coordinator, schedule as schedule
 from hwm.hardware.devices import manager as devices
 from hwm.hardware.pipelines import manager as pipelines
-from hwm.command import parser as command_parser_mod, connection as command_connection
+from hwm.command import parser as command_parser_mod, connection as command_connection, audit, idempotency
 from hwm.command.handlers import system as system_command_handler
 from hwm.network.security import verification, permissions
-from hwm.network.protocols import data, telemetry
+from hwm.network.protocols import data, telemetry, command_channel
 
 def initialize():
   """ Initializes the Mercury2 Hardware Manager.
@@ -47,11 +47,14 @@ def initialize():
   # Setup the configuration
   _setup_configuration()
   
+  # Set up the store for the schedule and permission snapshots
+  snapshot_store = snapshots.SnapshotStore(Configuration.get('snapshot-location'))
+  
   # Initialize the main reservation schedule
-  schedule_manager = _setup_schedule_manager()
+  schedule_manager = _setup_schedule_manager(snapshot_store)
   
   # Setup the command parser
-  command_parser = _setup_command_system()
+  command_parser = _setup_command_system(snapshot_store)
 
   # Initialize the device manager
   device_manager = devices.DeviceManager(command_parser)
@@ -66,6 +69,9 @@ def initialize():
                                                        pipeline_manager,
                                                        command_parser)
   
+  # Restore the last saved schedule (now that its setup commands can be compiled)
+  schedule_manager.load_snapshot()
+  
   # Initialize the required network listeners
   _setup_network_listeners(command_parser, session_coordinator);
   
@@ -111,6 +117,8 @@ def initial_setup():
     os.makedirs(Configuration.data_directory+"permissions")
     os.makedirs(Configuration.data_directory+"schedules")
     os.makedirs(Configuration.data_directory+"stream_dumps")
+    os.makedirs(Configuration.data_directory+"audit")
+    os.makedirs(Configuration.data_directory+"snapshots")
     if Configuration.verbose_startup:
       print "- Existing Mercury2 HWM data directory not found, created at: "+Configuration.data_directory
 
@@ -132,11 +140,12 @@ def _announce_start():
   print "|___________________________________________________|\n"
   print "Version: "+Configuration.version+"\n"
 
-def _setup_schedule_manager():
+def _setup_schedule_manager(snapshot_store):
   """ Initializes the schedule manager.
   
   This function initializes the schedule manager based on the location of the schedule (either local or remote).
   
+  @param snapshot_store  The SnapshotStore that the schedule manager should save schedule snapshots to.
   @return Returns an instance to the new ScheduleManager instance.
   """
   
@@ -145,16 +154,19 @@ def _setup_schedule_manager():
     schedule_manager = schedule.ScheduleManager(Configuration.get('schedule-location-local'))
   else:
     schedule_manager = schedule.ScheduleManager(Configuration.get('schedule-location-network'))
+  schedule_manager.snapshot_store = snapshot_store
   
   return schedule_manager
 
-def _setup_command_system():
+def _setup_command_system(snapshot_store):
   """ Sets up the command system.
   
   This function sets up the CommandParser class which is responsible for parsing, validating, and executing commands
   (either from the network or internal scripts). It also, consequently, initializes the permission system which updates
   and exposes user command execution permissions.
   
+  @param snapshot_store  The SnapshotStore that the permission manager should save and restore permission snapshots 
+                         with.
   @return Returns a reference to the new CommandParser instance.
   """
   
@@ -163,11 +175,36 @@ def _setup_command_system():
   system_command_handlers.append(system_command_handler.SystemCommandHandler('system'))
   if Configuration.get('offline-mode'):
     permission_manager = permissions.PermissionManager(Configuration.get('permissions-location-local'),
-                                                       Configuration.get('permissions-update-period'))
+                                                       Configuration.get('permissions-update-period'),
+                                                       Configuration.get('permissions-cache-size'),
+                                                       Configuration.get('permissions-cache-ttl'))
   else:
     permission_manager = permissions.PermissionManager(Configuration.get('permissions-location-network'),
-                                                       Configuration.get('permissions-update-period'))
+                                                       Configuration.get('permissions-update-period'),
+                                                       Configuration.get('permissions-cache-size'),
+                                                       Configuration.get('permissions-cache-ttl'))
+  permission_manager.snapshot_store = snapshot_store
+  permission_manager.load_snapshot()
+  permission_manager.start_refreshing()
+  permission_manager.permissions.start_eviction()
+  if not Configuration.get('offline-mode') and Configuration.get('permissions-invalidation-location') is not None:
+    permission_manager.subscribe_to_invalidations(Configuration.get('permissions-invalidation-location'),
+                                                  Configuration.get('permissions-invalidation-timeout'))
   command_parser = command_parser_mod.CommandParser(system_command_handlers, permission_manager)
+  command_parser.default_timeout = Configuration.get('command-timeout')
+  command_parser.max_batch_size = Configuration.get('command-batch-max-size')
+  command_parser.max_scheduled_per_user = Configuration.get('user-max-scheduled-commands')
+  for rate_limit_budget in ['user', 'device', 'kernel']:
+    command_parser.rate_limiter.set_limit(rate_limit_budget, Configuration.get(rate_limit_budget+'-command-rate'),
+                                          Configuration.get(rate_limit_budget+'-command-burst'))
+  command_parser.idempotency_table = idempotency.IdempotencyTable(Configuration.get('idempotency-max-keys'),
+                                                                  Configuration.get('idempotency-key-ttl'))
+
+  # Set up the command audit log and make sure that it gets written to disk before the reactor stops
+  command_parser.audit_log = audit.CommandAuditLog(Configuration.get('audit-log-location'),
+                                                   Configuration.get('audit-log-max-file-size'),
+                                                   Configuration.get('audit-log-flush-interval'))
+  reactor.addSystemEventTrigger('before', 'shutdown', command_parser.audit_log.stop)
   
   return command_parser
 
@@ -202,6 +239,12 @@ def _setup_network_listeners(command_parser, session_coordinator):
                     WebSocketFactory(pipeline_telemetry_factory), 
                     tls_context_factory)
 
+  # Setup the persistent command channel listener
+  command_channel_factory = command_channel.CommandChannelFactory(command_parser)
+  reactor.listenSSL(Configuration.get('command-channel-port'),
+                    WebSocketFactory(command_channel_factory),
+                    tls_context_factory)
+
 def _setup_configuration():
   """ Sets up the HWM configuration class.
   
@@ -0,0 +1,154 @@
+""" @package hwm.core.resources
+Fetches the resources that the hardware manager periodically reloads.
+
+This module contains a class that the schedule manager and permission manager use to load their resources (the
+reservation schedule and the user permissions) from a local file or the mercury2 user interface. Resources that haven't
+changed since they were last fetched are skipped, so that periodic updates don't have to parse and validate them again.
+"""
+
+# Import required modules
+import os, hashlib, threading, urllib2
+
+class ConditionalFetcher(object):
+  """ Fetches resources, skipping the ones that haven't changed since they were last fetched.
+
+  Remote resources (locations that begin with 'http') are requested with If-None-Match and If-Modified-Since headers
+  built from the ETag and Last-Modified headers of the previous response, so that the server can answer with a 304 (Not
+  Modified) response instead of the resource. Local files are only read if their modification time or size has changed.
+  In both cases, a hash of the resource's content is compared to the hash of the previous content so that resources
+  that were rewritten without being changed (e.g. by a server that doesn't support conditional requests) are skipped
+  too.
+
+  @note The fetch method blocks and is intended to be called with threads.deferToThread.
+  @note If a fetched resource can't be used (e.g. because it doesn't conform to its schema), the caller should call
+        invalidate so that the resource will be returned (and the error reported) again by the next fetch.
+  """
+
+  def __init__(self):
+    """ Sets up the fetcher.
+    """
+
+    self.fetch_count = 0
+    self.unchanged_count = 0
+    self._fetched = {}
+    self._lock = threading.Lock()
+
+  def fetch(self, location, timeout = None):
+    """ Fetches a resource if it has changed since it was last fetched.
+
+    @throw Throws ResourceError if the resource can't be downloaded or read.
+
+    @param location  The location of the resource. If it begins with 'http', it will be downloaded. Otherwise, it will
+                     be treated as the path to a local file.
+    @param timeout   The timeout (in seconds) to use when downloading remote resources.
+    @return Returns a string containing the resource's content, or None if it hasn't changed since it was last fetched.
+    """
+
+    with self._lock:
+      self.fetch_count += 1
+      previous_resource = self._fetched.get(location, None)
+    fetched_resource = FetchedResource()
+
+    if location.startswith('http'):
+      resource_content = self._fetch_remote(location, timeout, previous_resource, fetched_resource)
+    else:
+      resource_content = self._fetch_local(location, previous_resource, fetched_resource)
+
+    # Compare the content with the previously fetched content
+    if resource_content is not None:
+      fetched_resource.content_hash = hashlib.sha1(resource_content).hexdigest()
+      if previous_resource is not None and previous_resource.content_hash == fetched_resource.content_hash:
+        resource_content = None
+    elif previous_resource is not None:
+      fetched_resource.content_hash = previous_resource.content_hash
+
+    with self._lock:
+      self._fetched[location] = fetched_resource
+      if resource_content is None:
+        self.unchanged_count += 1
+
+    return resource_content
+
+  def invalidate(self, location):
+    """ Forgets a resource so that it will be returned by the next fetch, even if it hasn't changed.
+
+    @param location  The location of the resource.
+    """
+
+    with self._lock:
+      self._fetched.pop(location, None)
+
+  def _fetch_remote(self, location, timeout, previous_resource, fetched_resource):
+    """ Downloads a remote resource if the server indicates that it has changed.
+
+    @throw Throws ResourceError if the resource can't be downloaded.
+
+    @param location           The resource's URL.
+    @param timeout            The timeout (in seconds) to use for the request.
+    @param previous_resource  The FetchedResource from the last time the resource was fetched, if any.
+    @param fetched_resource   The FetchedResource to store the response's validators in.
+    @return Returns the resource's content, or None if the server responded with 304 (Not Modified).
+    """
+
+    resource_request = urllib2.Request(location)
+    if previous_resource is not None:
+      if previous_resource.etag is not None:
+        resource_request.add_header('If-None-Match', previous_resource.etag)
+      if previous_resource.last_modified is not None:
+        resource_request.add_header('If-Modified-Since', previous_resource.last_modified)
+
+    try:
+      resource_file = urllib2.build_opener().open(resource_request, None, timeout)
+      resource_content = resource_file.read()
+    except urllib2.HTTPError as http_error:
+      if http_error.code == 304 and previous_resource is not None:
+        fetched_resource.etag = previous_resource.etag
+        fetched_resource.last_modified = previous_resource.last_modified
+        return None
+
+      raise ResourceError("The resource could not be downloaded from '"+location+"' (HTTP "+str(http_error.code)+").")
+    except Exception as download_error:
+      raise ResourceError("The resource could not be downloaded from '"+location+"': "+str(download_error))
+
+    fetched_resource.etag = resource_file.info().getheader('ETag')
+    fetched_resource.last_modified = resource_file.info().getheader('Last-Modified')
+
+    return resource_content
+
+  def _fetch_local(self, location, previous_resource, fetched_resource):
+    """ Reads a local file if its modification time or size has changed.
+
+    @throw Throws ResourceError if the file can't be read.
+
+    @param location           The path to the file.
+    @param previous_resource  The FetchedResource from the last time the file was fetched, if any.
+    @param fetched_resource   The FetchedResource to store the file's signature in.
+    @return Returns the file's content, or None if its modification time and size haven't changed.
+    """
+
+    try:
+      file_stats = os.stat(location)
+      fetched_resource.signature = (file_stats.st_mtime, file_stats.st_size)
+      if previous_resource is not None and previous_resource.signature == fetched_resource.signature:
+        return None
+
+      with open(location, 'r') as resource_file:
+        return resource_file.read()
+    except (IOError, OSError) as read_error:
+      raise ResourceError("The resource could not be read from '"+location+"': "+str(read_error))
+
+class FetchedResource(object):
+  """ Stores the information used to detect whether a resource has changed since it was fetched.
+  """
+
+  __slots__ = ['etag', 'last_modified', 'signature', 'content_hash']
+
+  def __init__(self):
+    self.etag = None
+    self.last_modified = None
+    self.signature = None
+    self.content_hash = None
+
+# Define resource related exceptions
+class ResourceError(Exception):
+  pass
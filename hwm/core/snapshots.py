@@ -0,0 +1,108 @@
+""" @package hwm.core.snapshots
+Persists the last validated copies of the resources that the hardware manager loads from the user interface.
+
+This module contains a class that the schedule manager and permission manager use to save the most recent reservation
+schedule and user permissions that passed validation to the HWM data directory. The saved snapshots are loaded when the
+hardware manager starts so that it can execute commands and start sessions before (or without) contacting the user
+interface.
+"""
+
+# Import required modules
+import os, json, time, hashlib, tempfile, logging
+
+## The version of the snapshot file format
+snapshot_format_version = 1
+
+class SnapshotStore(object):
+  """ Saves and loads resource snapshots.
+
+  Each snapshot is stored in its own file ('<name>.snapshot') containing two lines:
+  * A JSON header with the format version, the time that the snapshot was saved, and a SHA-1 hash of the second line.
+  * The snapshot's data, serialized as compact JSON.
+
+  Snapshots are only saved after they have been validated, so they aren't validated again when loaded. The hash is used
+  to detect truncated or corrupted files instead.
+
+  @note Snapshots are written to a temporary file that is renamed over the previous snapshot once it has been flushed
+        to disk, so a crash while saving can't leave a partially written snapshot behind.
+  @note The save method blocks and is intended to be called with threads.deferToThread. The load method is intended to
+        be called during startup, before the reactor is running.
+  """
+
+  def __init__(self, snapshot_directory):
+    """ Sets up the snapshot store.
+
+    @param snapshot_directory  The directory to store the snapshots in. It will be created if it doesn't exist.
+    """
+
+    self.snapshot_directory = os.path.join(snapshot_directory, '')
+
+    if not os.path.exists(self.snapshot_directory):
+      os.makedirs(self.snapshot_directory)
+
+  def save(self, snapshot_name, snapshot_data):
+    """ Atomically replaces a snapshot.
+
+    @throw Throws SnapshotError if the snapshot can't be written.
+
+    @param snapshot_name  The name of the snapshot (e.g. 'schedule').
+    @param snapshot_data  The snapshot's data. Must be serializable as JSON.
+    """
+
+    serialized_data = json.dumps(snapshot_data, separators = (',', ':'))
+    snapshot_header = json.dumps({
+      'version': snapshot_format_version,
+      'saved_at': time.time(),
+      'checksum': hashlib.sha1(serialized_data).hexdigest()
+    }, separators = (',', ':'))
+
+    temp_path = None
+    try:
+      temp_descriptor, temp_path = tempfile.mkstemp(prefix = '.'+snapshot_name+'.', dir = self.snapshot_directory)
+      with os.fdopen(temp_descriptor, 'w') as snapshot_file:
+        snapshot_file.write(snapshot_header+"\n"+serialized_data+"\n")
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+      os.rename(temp_path, self._get_snapshot_path(snapshot_name))
+    except (IOError, OSError) as write_error:
+      if temp_path is not None and os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise SnapshotError("The '"+snapshot_name+"' snapshot could not be saved: "+str(write_error))
+
+  def load(self, snapshot_name):
+    """ Loads a snapshot.
+
+    @note Snapshots that can't be read, are corrupted, or were saved in a different format are logged and ignored.
+
+    @param snapshot_name  The name of the snapshot.
+    @return Returns a (data, saved_at) tuple containing the snapshot's data and the UNIX timestamp it was saved at, or
+            None if there is no usable snapshot.
+    """
+
+    snapshot_path = self._get_snapshot_path(snapshot_name)
+    if not os.path.exists(snapshot_path):
+      return None
+
+    try:
+      with open(snapshot_path, 'r') as snapshot_file:
+        snapshot_header = json.loads(snapshot_file.readline())
+        serialized_data = snapshot_file.readline().rstrip("\n")
+
+      if snapshot_header.get('version', None) != snapshot_format_version:
+        logging.warning("Ignoring the '"+snapshot_name+"' snapshot because it uses an unsupported format.")
+        return None
+      if hashlib.sha1(serialized_data).hexdigest() != snapshot_header.get('checksum', None):
+        logging.error("Ignoring the '"+snapshot_name+"' snapshot because it is corrupted: "+snapshot_path)
+        return None
+
+      return (json.loads(serialized_data), snapshot_header['saved_at'])
+    except (IOError, OSError, ValueError, KeyError, AttributeError) as load_error:
+      logging.error("The '"+snapshot_name+"' snapshot could not be loaded: "+str(load_error))
+      return None
+
+  def _get_snapshot_path(self, snapshot_name):
+    return self.snapshot_directory+snapshot_name+'.snapshot'
+
+# Define snapshot related exceptions
+class SnapshotError(Exception):
+  pass
@@ -0,0 +1,103 @@
+# Import required modules
+import os, time
+from twisted.trial import unittest
+from twisted.internet import reactor, threads
+from twisted.internet.defer import inlineCallbacks
+from twisted.web import server, resource
+from ..resources import *
+
+class TestConditionalFetcher(unittest.TestCase):
+  """
+  This test case tests the functionality of the ConditionalFetcher class, which only returns resources that have changed
+  since they were last fetched.
+  """
+
+  def setUp(self):
+    self.fetcher = ConditionalFetcher()
+
+  def test_local_file(self):
+    """ Verifies that local files are only returned when their content changes.
+    """
+
+    resource_path = self.mktemp()
+    self._write_file(resource_path, '{"version": 1}', 1000)
+    self.assertEqual(self.fetcher.fetch(resource_path), '{"version": 1}')
+    self.assertEqual(self.fetcher.fetch(resource_path), None)
+
+    # Rewriting the file without changing it
+    self._write_file(resource_path, '{"version": 1}', 2000)
+    self.assertEqual(self.fetcher.fetch(resource_path), None)
+
+    # Changing the file
+    self._write_file(resource_path, '{"version": 2}', 3000)
+    self.assertEqual(self.fetcher.fetch(resource_path), '{"version": 2}')
+
+    # Invalidated resources are always returned
+    self.fetcher.invalidate(resource_path)
+    self.assertEqual(self.fetcher.fetch(resource_path), '{"version": 2}')
+    self.assertEqual((self.fetcher.fetch_count, self.fetcher.unchanged_count), (5, 2))
+
+    # Missing files
+    self.assertRaises(ResourceError, self.fetcher.fetch, resource_path+'_missing')
+
+  @inlineCallbacks
+  def test_remote_resource(self):
+    """ Verifies that remote resources are requested conditionally and only returned when their content changes.
+    """
+
+    test_resource = TestResource()
+    test_server = reactor.listenTCP(0, server.Site(test_resource), interface = '127.0.0.1')
+    self.addCleanup(test_server.stopListening)
+    resource_url = 'http://127.0.0.1:'+str(test_server.getHost().port)+'/'
+
+    self.assertEqual((yield threads.deferToThread(self.fetcher.fetch, resource_url, 5)), '{"version": 1}')
+    self.assertEqual((yield threads.deferToThread(self.fetcher.fetch, resource_url, 5)), None)
+    self.assertEqual(test_resource.not_modified_count, 1)
+
+    # Changing the resource's ETag without changing its content
+    test_resource.etag = '"2"'
+    self.assertEqual((yield threads.deferToThread(self.fetcher.fetch, resource_url, 5)), None)
+    self.assertEqual(test_resource.not_modified_count, 1)
+
+    # Changing the resource
+    test_resource.etag = '"3"'
+    test_resource.content = '{"version": 3}'
+    self.assertEqual((yield threads.deferToThread(self.fetcher.fetch, resource_url, 5)), '{"version": 3}')
+    self.assertEqual(test_resource.request_headers[-1], '"2"')
+
+    # Server errors
+    test_resource.error_code = 500
+    yield self.assertFailure(threads.deferToThread(self.fetcher.fetch, resource_url, 5), ResourceError)
+
+  def _write_file(self, path, content, modified_at):
+    with open(path, 'w') as resource_file:
+      resource_file.write(content)
+    os.utime(path, (modified_at, modified_at))
+
+class TestResource(resource.Resource):
+  """ A web resource that supports ETag based conditional requests.
+  """
+
+  isLeaf = True
+
+  def __init__(self):
+    resource.Resource.__init__(self)
+    self.content = '{"version": 1}'
+    self.etag = '"1"'
+    self.error_code = None
+    self.not_modified_count = 0
+    self.request_headers = []
+
+  def render_GET(self, request):
+    self.request_headers.append(request.getHeader('If-None-Match'))
+    if self.error_code is not None:
+      request.setResponseCode(self.error_code)
+      return ''
+
+    request.setHeader('ETag', self.etag)
+    if request.getHeader('If-None-Match') == self.etag:
+      self.not_modified_count += 1
+      request.setResponseCode(304)
+      return ''
+
+    return self.content
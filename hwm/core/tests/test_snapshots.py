@@ -0,0 +1,58 @@
+# Import required modules
+import os, logging
+from twisted.trial import unittest
+from ..snapshots import *
+
+class TestSnapshotStore(unittest.TestCase):
+  """
+  This test case tests the functionality of the SnapshotStore class, which saves and restores validated resource
+  snapshots.
+  """
+
+  def setUp(self):
+    self.snapshot_directory = self.mktemp()
+    self.snapshot_store = SnapshotStore(self.snapshot_directory)
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_save_load(self):
+    """ Verifies that snapshots are restored exactly as they were saved and that saving replaces them.
+    """
+
+    self.assertEqual(self.snapshot_store.load('schedule'), None)
+
+    self.snapshot_store.save('schedule', {'generated_at': 1, 'reservations': [{'reservation_id': 'RES.1'}]})
+    self.snapshot_store.save('schedule', {'generated_at': 2, 'reservations': []})
+    schedule_snapshot = self.snapshot_store.load('schedule')
+    self.assertEqual(schedule_snapshot[0], {'generated_at': 2, 'reservations': []})
+    self.assertTrue(schedule_snapshot[1] > 0)
+
+    # Only the snapshot file should be left in the directory
+    self.assertEqual(os.listdir(self.snapshot_directory), ['schedule.snapshot'])
+
+  def test_corrupted_snapshot(self):
+    """ Verifies that truncated and corrupted snapshots are ignored.
+    """
+
+    self.snapshot_store.save('permissions', [{'user_id': '1'}])
+    snapshot_path = os.path.join(self.snapshot_directory, 'permissions.snapshot')
+    with open(snapshot_path, 'r') as snapshot_file:
+      snapshot_content = snapshot_file.read()
+
+    # Changed data
+    with open(snapshot_path, 'w') as snapshot_file:
+      snapshot_file.write(snapshot_content.replace('"1"', '"2"'))
+    self.assertEqual(self.snapshot_store.load('permissions'), None)
+
+    # Truncated file
+    with open(snapshot_path, 'w') as snapshot_file:
+      snapshot_file.write(snapshot_content[:10])
+    self.assertEqual(self.snapshot_store.load('permissions'), None)
+
+  def test_save_error(self):
+    """ Verifies that the correct error is generated when a snapshot can't be written.
+    """
+
+    os.rmdir(self.snapshot_directory)
+    self.assertRaises(SnapshotError, self.snapshot_store.save, 'schedule', {})
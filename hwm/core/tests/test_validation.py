@@ -0,0 +1,125 @@
+# Import required modules
+import jsonschema
+from twisted.trial import unittest
+from ..validation import *
+from hwm.command import command
+
+class TestValidatorRegistry(unittest.TestCase):
+  """
+  This test case tests the functionality of the ValidatorRegistry class and the command envelope fast validator.
+  """
+
+  def setUp(self):
+    # Create a new registry so that the global one isn't modified
+    self.registry = ValidatorRegistry()
+    self.test_schema = {
+      "type": "object",
+      "$schema": "http://json-schema.org/draft-03/schema",
+      "properties": {
+        "name": {
+          "type": "string",
+          "required": True
+        }
+      }
+    }
+
+  def test_registry_caches_validators(self):
+    # Make sure unregistered schemas are rejected
+    self.assertRaises(SchemaNotRegistered, self.registry.get_schema, 'test')
+    self.assertRaises(SchemaNotRegistered, self.registry.validate, 'test', {})
+    self.assertTrue(not self.registry.is_registered('test'))
+
+    # Register the schema and make sure the same validator is returned every time
+    self.registry.register('test', self.test_schema)
+    self.assertTrue(self.registry.is_registered('test'))
+    self.assertEqual(self.registry.get_schema('test'), self.test_schema)
+    test_validator = self.registry.get_validator('test')
+    self.assertTrue(test_validator is self.registry.get_validator('test'))
+
+    # Validate some documents
+    self.registry.validate('test', {'name': 'test'})
+    self.assertRaises(jsonschema.ValidationError, self.registry.validate, 'test', {})
+
+    # Re-register the schema and make sure the old validator was discarded
+    self.registry.register('test', self.test_schema)
+    self.assertTrue(test_validator is not self.registry.get_validator('test'))
+
+  def test_registry_fast_validator(self):
+    fast_validator_calls = []
+    def fast_validator(document):
+      fast_validator_calls.append(document)
+
+    # Register a schema with a fast validator and make sure it's used instead of the generic validator
+    self.registry.register('test', self.test_schema, fast_validator = fast_validator)
+    self.registry.validate('test', {})
+    self.assertEqual(fast_validator_calls, [{}])
+
+    # Re-register without the fast validator and make sure the generic validator is used again
+    self.registry.register('test', self.test_schema)
+    self.assertRaises(jsonschema.ValidationError, self.registry.validate, 'test', {})
+    self.assertEqual(len(fast_validator_calls), 1)
+
+  def test_global_registry_schemas(self):
+    # Make sure the modules that own the schemas registered them with the global registry
+    from hwm.network.security import permissions
+    from hwm.sessions import schedule
+    from hwm.hardware.pipelines import manager as pipeline_manager
+    from hwm.hardware.devices import manager as device_manager
+    for schema_name in ['command', 'permissions', 'schedule', 'pipeline', 'device']:
+      self.assertTrue(Validators.is_registered(schema_name), "The '"+schema_name+"' schema was not registered.")
+
+  def test_command_envelope_matches_schema(self):
+    # A series of command envelopes that cover the various parts of the command schema
+    test_commands = [
+      {'command': 'test', 'destination': 'test_pipeline.test_device'},
+      {'command': 'test', 'destination': 'system'},
+      {'command': u'test', 'destination': u'system', 'parameters': {'a': 1}},
+      {'command': 'test', 'destination': 'system', 'parameters': {}},
+      {'command': 'test', 'destination': 'system', 'debug': True},
+      {'command': 'test', 'destination': 'system', 'debug': 1},
+      {'command': 'test', 'destination': 'system', 'debug': 'true'},
+      {'command': 'test', 'destination': 'system', 'timeout': 5},
+      {'command': 'test', 'destination': 'system', 'timeout': 0.5},
+      {'command': 'test', 'destination': 'system', 'timeout': 0},
+      {'command': 'test', 'destination': 'system', 'timeout': -1},
+      {'command': 'test', 'destination': 'system', 'timeout': True},
+      {'command': 'test', 'destination': 'system', 'timeout': '5'},
+      {'command': 'test', 'destination': 'system', 'execute_at': 1400000000.125},
+      {'command': 'test', 'destination': 'system', 'execute_at': 0},
+      {'command': 'test', 'destination': 'system', 'execute_at': -5},
+      {'command': 'test', 'destination': 'system', 'execute_at': None},
+      {'command': 'test', 'destination': 'system', 'idempotency_key': 'retry-1'},
+      {'command': 'test', 'destination': 'system', 'idempotency_key': u'k'*128},
+      {'command': 'test', 'destination': 'system', 'idempotency_key': 'k'*129},
+      {'command': 'test', 'destination': 'system', 'idempotency_key': ''},
+      {'command': 'test', 'destination': 'system', 'idempotency_key': 5},
+      {'command': 'test', 'destination': 'some.bad.destination'},
+      {'command': 'test', 'destination': '.system'},
+      {'command': 'test', 'destination': '-'},
+      {'command': 'test', 'destination': ''},
+      {'command': 'test'},
+      {'destination': 'system'},
+      {'command': 5, 'destination': 'system'},
+      {'command': 'test', 'destination': ['system']},
+      {'command': 'test', 'destination': 'system', 'parameters': []},
+      {'command': 'test', 'destination': 'system', 'parameters': None},
+      {'command': 'test', 'destination': 'system', 'extra': True},
+      {'command': None, 'destination': 'system'},
+      {},
+      [],
+      "test"
+    ]
+
+    # Make sure the fast validator accepts and rejects exactly the same commands as the schema
+    schema_validator = jsonschema.Draft3Validator(command.schema)
+    for test_command in test_commands:
+      schema_valid = schema_validator.is_valid(test_command)
+
+      try:
+        validate_command_envelope(test_command)
+        fast_valid = True
+      except jsonschema.ValidationError:
+        fast_valid = False
+
+      self.assertEqual(schema_valid, fast_valid, "The fast command validator disagreed with the command schema for: "+
+                       repr(test_command))
@@ -0,0 +1,168 @@
+""" @package hwm.core.validation
+Provides a central registry of pre-built JSON schema validators.
+
+This module contains a class that stores the JSON schemas used throughout the hardware manager (commands, permissions,
+schedules, pipelines, devices, and the configuration) and builds a validator for each of them exactly once. Validation
+hot paths, such as the command parser, reuse these validators instead of constructing new ones for every call. Access
+it by importing the Validators variable (defined at the end of the module).
+"""
+
+# Import required modules
+import re, jsonschema
+
+class ValidatorRegistry:
+  """ Stores and provides access to pre-built schema validators.
+
+  This class stores named JSON schemas and lazily builds a single validator for each of them, which is then reused for
+  every subsequent validation. Schemas may also specify a specialized "fast" validator function, which will be used in
+  place of the generic jsonschema validator. Fast validators must accept exactly the same documents as the schema that
+  they replace and must raise jsonschema.ValidationError when a document is rejected.
+
+  @note Modules that own a schema should register it at import time so that it is available to any module that needs
+        to validate against it.
+  """
+
+  def __init__(self):
+    """ Sets up the validator registry.
+    """
+
+    self._schemas = {}
+    self._fast_validators = {}
+    self._validators = {}
+
+  def register(self, schema_name, schema, fast_validator = None):
+    """ Registers a schema with the registry.
+
+    @note If a schema with the same name has already been registered, it will be replaced and its cached validator will
+          be discarded.
+
+    @param schema_name     The name that the schema will be referenced by.
+    @param schema          A dictionary containing the JSON draft 3 schema.
+    @param fast_validator  An optional callable that accepts a document and raises jsonschema.ValidationError if it
+                           does not conform to the schema. If set, it will be used instead of the generic validator.
+    """
+
+    self._schemas[schema_name] = schema
+    self._validators.pop(schema_name, None)
+
+    if fast_validator is not None:
+      self._fast_validators[schema_name] = fast_validator
+    else:
+      self._fast_validators.pop(schema_name, None)
+
+  def is_registered(self, schema_name):
+    """ Checks if the specified schema has been registered.
+
+    @param schema_name  The name of the schema to check.
+    @return Returns True if the schema has been registered and False otherwise.
+    """
+
+    return schema_name in self._schemas
+
+  def get_schema(self, schema_name):
+    """ Returns the specified schema.
+
+    @throw Throws SchemaNotRegistered if the requested schema hasn't been registered.
+
+    @param schema_name  The name of the requested schema.
+    @return Returns the schema dictionary.
+    """
+
+    if schema_name not in self._schemas:
+      raise SchemaNotRegistered("The '"+schema_name+"' schema has not been registered.")
+
+    return self._schemas[schema_name]
+
+  def get_validator(self, schema_name):
+    """ Returns the generic jsonschema validator for the specified schema, building it if needed.
+
+    @throw Throws SchemaNotRegistered if the requested schema hasn't been registered.
+
+    @param schema_name  The name of the requested schema.
+    @return Returns a jsonschema.Draft3Validator instance for the schema.
+    """
+
+    if schema_name not in self._validators:
+      self._validators[schema_name] = jsonschema.Draft3Validator(self.get_schema(schema_name))
+
+    return self._validators[schema_name]
+
+  def validate(self, schema_name, document):
+    """ Validates the provided document against the specified schema.
+
+    This method validates the document using the schema's fast validator if it has one, and its cached jsonschema
+    validator otherwise.
+
+    @throw Throws jsonschema.ValidationError if the document does not conform to the schema.
+    @throw Throws SchemaNotRegistered if the requested schema hasn't been registered.
+
+    @param schema_name  The name of the schema to validate the document against.
+    @param document     The document (typically a dictionary or list) to validate.
+    """
+
+    if schema_name in self._fast_validators:
+      self._fast_validators[schema_name](document)
+    else:
+      self.get_validator(schema_name).validate(document)
+
+## The pattern that command destinations must match. This mirrors the "destination" pattern in the command schema and
+# is searched (not matched) to replicate the jsonschema behavior.
+command_destination_pattern = re.compile("^(\w+\.\w+)|(\w+)$")
+
+def validate_command_envelope(command_dict):
+  """ A fast validator for the command envelope schema.
+
+  This function checks the {command, destination, parameters, debug, timeout, execute_at, idempotency_key} command 
+  shape directly instead of walking the command schema with jsonschema. It accepts exactly the same documents as 
+  hwm.command.command.schema.
+
+  @throw Throws jsonschema.ValidationError if the command does not conform to the command schema.
+
+  @param command_dict  The command dictionary to validate.
+  """
+
+  if not isinstance(command_dict, dict):
+    raise jsonschema.ValidationError("The command is not an object.")
+
+  for field_name in command_dict:
+    if field_name not in ('command', 'destination', 'parameters', 'debug', 'timeout', 'execute_at', 'idempotency_key'):
+      raise jsonschema.ValidationError("Additional properties are not allowed ("+repr(field_name)+" was "+
+                                       "unexpected).")
+
+  if not isinstance(command_dict.get('command'), basestring):
+    raise jsonschema.ValidationError("The 'command' field is required and must be a string.")
+
+  destination = command_dict.get('destination')
+  if not isinstance(destination, basestring):
+    raise jsonschema.ValidationError("The 'destination' field is required and must be a string.")
+  if command_destination_pattern.search(destination) is None:
+    raise jsonschema.ValidationError("The 'destination' field does not match the destination pattern.")
+
+  if 'parameters' in command_dict and not isinstance(command_dict['parameters'], dict):
+    raise jsonschema.ValidationError("The 'parameters' field must be an object.")
+
+  if 'debug' in command_dict and not isinstance(command_dict['debug'], bool):
+    raise jsonschema.ValidationError("The 'debug' field must be a boolean.")
+
+  if 'timeout' in command_dict:
+    timeout = command_dict['timeout']
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, long, float)) or timeout <= 0:
+      raise jsonschema.ValidationError("The 'timeout' field must be a positive number.")
+
+  if 'execute_at' in command_dict:
+    execute_at = command_dict['execute_at']
+    if isinstance(execute_at, bool) or not isinstance(execute_at, (int, long, float)) or execute_at < 0:
+      raise jsonschema.ValidationError("The 'execute_at' field must be a UNIX timestamp.")
+
+  if 'idempotency_key' in command_dict:
+    idempotency_key = command_dict['idempotency_key']
+    if not isinstance(idempotency_key, basestring) or not 1 <= len(idempotency_key) <= 128:
+      raise jsonschema.ValidationError("The 'idempotency_key' field must be a string between 1 and 128 characters.")
+
+# Define validation related exceptions
+class SchemaNotRegistered(Exception):
+  pass
+
+## Stores a 'singleton' instance of the ValidatorRegistry. Because this is a top level module variable, it will only be
+# initialized the first time this module is included.
+Validators = ValidatorRegistry()
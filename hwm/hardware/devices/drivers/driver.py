@@ -13,6 +13,11 @@ class Driver(object):
   common to both virtual and physical devices as well as abstract methods that derived drivers must implement. Note that
   specific driver classes should inherit from either the HardwareDriver or VirtualDriver classes, not this class.
   """
+
+  # The maximum number of the device's commands that may execute at once (None for no limit). Drivers for devices that
+  # can only process one request at a time (e.g. serial devices) should set this to 1. This can be overridden for 
+  # individual devices using the "command_concurrency" device setting.
+  default_command_concurrency = None
   
   def __init__(self, device_configuration, command_parser):
     """ Initializes the new device driver.
@@ -30,6 +35,7 @@ class Driver(object):
     self.id = self.settings['id']
     self.allow_concurrent_use = (False if ('allow_concurrent_use' not in self.settings) else 
                                  self.settings['allow_concurrent_use'])
+    self.command_concurrency = self.settings.get('command_concurrency', self.default_command_concurrency)
     self.associated_pipelines = {}
     self._command_handler = None
     self._command_parser = command_parser
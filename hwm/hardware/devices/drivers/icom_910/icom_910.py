@@ -12,6 +12,7 @@ from hwm.hardware.pipelines import pipeline
 from hwm.hardware.devices.drivers import driver
 from hwm.command import command
 from hwm.command.handlers import handler
+from hwm.command.metadata import *
 
 class ICOM_910(driver.HardwareDriver):
   """ A driver for the ICOM 910 radio.
@@ -29,6 +30,9 @@ class ICOM_910(driver.HardwareDriver):
         TNC is receiving data. This will prevent the ICOM from entering an undefined state.
   """
 
+  # Hamlib can only talk to the radio over its serial connection one request at a time
+  default_command_concurrency = 1
+
   def __init__(self, device_configuration, command_parser):
     """ Sets up the ICOM 910h driver.
 
@@ -141,30 +145,18 @@ class ICOM_910(driver.HardwareDriver):
 
       # Send the command to update the downlink frequency
       new_downlink_freq = target_position['doppler_multiplier'] * self._radio_state['set_rx_freq']
-      command_request = {
-        'command': "set_rx_freq",
-        'destination': self._session_pipeline.id+"."+self.id,
-        'parameters': {
-          'frequency': new_downlink_freq
-        }
-      }
-      command_deferred = self._command_parser.parse_command(command_request, 
-                                                            user_id = self._session_pipeline.current_session.user_id)
+      command_deferred = self._command_parser.invoke_internal(self._session_pipeline.id, self.id, "set_rx_freq",
+                                                              {'frequency': new_downlink_freq},
+                                                              user_id = self._session_pipeline.current_session.user_id)
       results = yield command_deferred
 
       # Send the command to update the uplink frequency
       if results['response']['status'] is not 'error':
         downlink_freq_set = True
       new_uplink_freq = target_position['doppler_multiplier'] * self._radio_state['set_tx_freq']
-      command_request = {
-        'command': "set_tx_freq",
-        'destination': self._session_pipeline.id+"."+self.id,
-        'parameters': {
-          'frequency': new_uplink_freq
-        }
-      }
-      command_deferred = self._command_parser.parse_command(command_request, 
-                                                            user_id = self._session_pipeline.current_session.user_id)
+      command_deferred = self._command_parser.invoke_internal(self._session_pipeline.id, self.id, "set_tx_freq",
+                                                              {'frequency': new_uplink_freq},
+                                                              user_id = self._session_pipeline.current_session.user_id)
       results = yield command_deferred
 
       # Verify the results
@@ -151,17 +151,18 @@ class TestIcom910(unittest.TestCase):
     test_pipeline.id = "test_pipeline"
     test_pipeline.current_session.user_id = "test_user"
 
-    def mock_parse_command(command_request, **keywords):
-      if command_request['command'] == "set_rx_freq":
-        self.assertEqual(command_request['parameters']['frequency'], 5)
-      elif command_request['command'] == "set_tx_freq":
-        self.assertEqual(command_request['parameters']['frequency'], 25)
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      self.assertEqual(user_id, test_pipeline.current_session.user_id)
+      if command_name == "set_rx_freq":
+        self.assertEqual(parameters['frequency'], 5)
+      elif command_name == "set_tx_freq":
+        self.assertEqual(parameters['frequency'], 25)
 
       return defer.succeed({'response':{'status':'okay'}})
 
     # Create a test Icom driver
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = icom_910.ICOM_910(self.standard_icom_config, test_cp)
     test_device._session_pipeline = test_pipeline
     test_device._radio_state['set_rx_freq'] = 20
@@ -188,15 +189,15 @@ class TestIcom910(unittest.TestCase):
     test_pipeline.id = "test_pipeline"
     test_pipeline.current_session.user_id = "test_user"
 
-    def mock_parse_command(command_request, **keywords):
-      if command_request['command'] == "set_rx_freq":
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      if command_name == "set_rx_freq":
         return defer.succeed({'response':{'status':'okay'}})
-      elif command_request['command'] == "set_tx_freq":
+      elif command_name == "set_tx_freq":
         return defer.succeed({'response':{'status':'error'}})
 
     # Create a test Icom driver
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = icom_910.ICOM_910(self.standard_icom_config, test_cp)
     test_device._session_pipeline = test_pipeline
     test_device._radio_state['set_downlink_freq'] = 20
@@ -5,12 +5,13 @@ This module contains the driver and command handler for the MXL Antenna Controll
 # Import required modules
 import logging, time, json
 import urllib, urllib2
-from twisted.internet import task, defer, threads
+from twisted.internet import task, defer
 from twisted.internet.defer import inlineCallbacks
 from hwm.hardware.devices.drivers import driver
 from hwm.hardware.pipelines import pipeline
-from hwm.command import command
+from hwm.command import command, executor
 from hwm.command.handlers import handler
+from hwm.command.metadata import *
 
 class MXL_Antenna_Controller(driver.HardwareDriver):
   """ A driver for the custom MXL antenna controller.
@@ -32,6 +33,7 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     self.update_period = device_configuration['update_period']
     self.controller_api_endpoint = device_configuration['controller_api_endpoint']
     self.controller_api_timeout = device_configuration['controller_api_timeout']
+    self.operation_settle_updates = device_configuration.get('operation_settle_updates', 3)
 
     # Initialize the driver's command handler
     self._command_handler = AntennaControllerHandler(self)
@@ -72,18 +74,17 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
   def cleanup_after_session(self):
     """ Resets the antenna controller to its idle state after the session using it has ended.
 
-    @note The "calibrate_and_park" command executed in this method is run in kernel mode because it must always happen,
-          regardless of the user controlling the session.
+    @note The "calibrate_and_park" command executed in this method is run as an internal (kernel mode) command because
+          it must always happen, regardless of the user controlling the session.
 
     @return Returns the deferred for the "calibrate_and_park" command call that goes out at the end of each session.
     """
 
+    # Stop monitoring the current operation, if any
+    self.end_operation(False, "The session using the antenna ended.")
+
     # Vertically calibrate and park the antenna
-    command_request = {
-      'command': "calibrate_and_park",
-      'destination': self._session_pipeline.id+"."+self.id
-    }
-    command_deferred = self._command_parser.parse_command(command_request, user_id = None, kernel_mode = True)
+    command_deferred = self._command_parser.invoke_internal(self._session_pipeline.id, self.id, "calibrate_and_park")
 
     # Stop the state update LoopingCall
     if self._state_update_loop is not None and self._state_update_loop.running:
@@ -102,6 +103,58 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
 
     return self._controller_state
 
+  def track_operation(self, operation_command, target_position = None, requires_movement = True):
+    """ Monitors an antenna operation (such as a calibration) that continues after its command returns.
+
+    The antenna controller accepts commands like "calibrate" and "park" immediately and then carries them out over the 
+    next few minutes. This method keeps reporting the progress of such a command (see Command.report_progress) each
+    time the state update loop queries the antenna's position, so that users don't have to poll the controller 
+    themselves. The operation is considered complete once the antenna has stopped moving for operation_settle_updates 
+    consecutive state updates (and has reached target_position, if one was provided).
+
+    @note Only one operation is tracked at a time. Tracking a new operation ends the previous one unsuccessfully.
+    @note Operations can only be tracked while the state update loop is running (i.e. during a session).
+
+    @param operation_command  The Command that started the operation.
+    @param target_position    An optional (azimuth, elevation) tuple that the antenna should end up at.
+    @param requires_movement  Whether or not the antenna has to move before the operation can be complete.
+    @return Returns True if the operation is being tracked and False otherwise.
+    """
+
+    if self._state_update_loop is None or not self._state_update_loop.running:
+      return False
+
+    self.end_operation(False, "The operation was interrupted by another command.")
+    self._tracked_operation = {
+      'command': operation_command,
+      'target_position': target_position,
+      'requires_movement': requires_movement,
+      'last_position': (self._controller_state['azimuth'], self._controller_state['elevation']),
+      'moved': False,
+      'settled_updates': 0
+    }
+    operation_command.continue_progress()
+    operation_command.report_progress(self._build_operation_progress())
+
+    return True
+
+  def end_operation(self, success, message = None):
+    """ Stops tracking the current antenna operation and sends its final progress event.
+
+    @param success  Whether or not the operation completed successfully.
+    @param message  An optional message describing how the operation ended.
+    """
+
+    if self._tracked_operation is None:
+      return
+
+    operation_command = self._tracked_operation['command']
+    self._tracked_operation = None
+    final_progress = self._build_operation_progress()
+    if message is not None:
+      final_progress['message'] = message
+    operation_command.finish_progress(success, final_progress)
+
   def process_new_position(self, target_position):
     """ Instructs the antenna controller to point at the specified target.
 
@@ -122,16 +175,13 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     target_elevation = 0 if target_position['elevation']<0 else int(target_position['elevation'])
 
     # Move the antenna
-    command_request = {
-      'command': "move",
-      'destination': self._session_pipeline.id+"."+self.id,
-      'parameters': {
-        'azimuth': int(target_position['azimuth']),
-        'elevation': target_elevation
-      }
+    command_parameters = {
+      'azimuth': int(target_position['azimuth']),
+      'elevation': target_elevation
     }
-    command_deferred = self._command_parser.parse_command(command_request, 
-                                                          user_id = self._session_pipeline.current_session.user_id)
+    command_deferred = self._command_parser.invoke_internal(self._session_pipeline.id, self.id, "move",
+                                                            command_parameters,
+                                                            user_id = self._session_pipeline.current_session.user_id)
 
     return command_deferred
 
@@ -147,12 +197,8 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     """
 
     # Query the antenna controller for it's current orientation
-    command_request = {
-      'command': "get_state",
-      'destination': self._session_pipeline.id+"."+self.id
-    }
-    command_deferred = self._command_parser.parse_command(command_request, 
-                                                          user_id = self._session_pipeline.current_session.user_id)
+    command_deferred = self._command_parser.invoke_internal(self._session_pipeline.id, self.id, "get_state",
+                                                            user_id = self._session_pipeline.current_session.user_id)
     result = yield command_deferred
 
     # Process the results
@@ -160,11 +206,52 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
       self._controller_state['timestamp'] = int(time.time())
       self._controller_state['azimuth'] = result['response']['azimuth']
       self._controller_state['elevation'] = result['response']['elevation']
+      self._update_tracked_operation()
 
       defer.returnValue(self.get_state())
     else:
       defer.returnValue(None)
 
+  def _update_tracked_operation(self):
+    """ Reports the progress of the tracked operation after a state update and checks if it has completed.
+    """
+
+    tracked_operation = self._tracked_operation
+    if tracked_operation is None:
+      return
+
+    # Check if the antenna is still moving
+    current_position = (self._controller_state['azimuth'], self._controller_state['elevation'])
+    if current_position == tracked_operation['last_position']:
+      tracked_operation['settled_updates'] += 1
+    else:
+      tracked_operation['moved'] = True
+      tracked_operation['settled_updates'] = 0
+    tracked_operation['last_position'] = current_position
+
+    # Check if the operation is complete
+    target_position = tracked_operation['target_position']
+    operation_complete = (tracked_operation['settled_updates'] >= self.operation_settle_updates and
+                          (tracked_operation['moved'] or not tracked_operation['requires_movement']) and
+                          (target_position is None or (abs(current_position[0]-target_position[0]) <= 1 and
+                                                       abs(current_position[1]-target_position[1]) <= 1)))
+    if operation_complete:
+      self.end_operation(True)
+    else:
+      tracked_operation['command'].report_progress(self._build_operation_progress())
+
+  def _build_operation_progress(self):
+    """ Builds a progress dictionary for the tracked operation.
+
+    @return Returns a dictionary containing the controller's state and the antenna's last known position.
+    """
+
+    return {
+      'state': self._controller_state['state'],
+      'azimuth': self._controller_state['azimuth'],
+      'elevation': self._controller_state['elevation']
+    }
+
   def _handle_state_update_error(self, failure):
     """ Handles errors that may occur during the state update loop.
 
@@ -193,6 +280,7 @@ class MXL_Antenna_Controller(driver.HardwareDriver):
     self._current_position = None
     self._tracker_service = None
     self._session_pipeline = None
+    self._tracked_operation = None
     self._controller_state = {
       "timestamp": None,
       "azimuth": 0,
@@ -274,6 +362,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     # Check the response and return the park command response
     if response['status'] == "okay":
       self.driver._controller_state['state'] = "parking"
+      self.driver.track_operation(active_command, target_position = (270, 0), requires_movement = False)
       defer.returnValue({'message': "The antenna is being parked."})
     else:
       raise command.CommandError("An error occured while parking the antenna: '"+response['message']+"'")
@@ -309,6 +398,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     # Check the response and return the calibration results
     if response['status'] == "okay":
       self.driver._controller_state['state'] = "calibrating"
+      self.driver.track_operation(active_command)
       defer.returnValue({'message': "The antenna is being calibrated."})
     else:
       raise command.CommandError("An error occured while calibrating the antenna: '"+response['message']+"'")
@@ -344,6 +434,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     # Check the response and return the results
     if response['status'] == "okay":
       self.driver._controller_state['state'] = "calibrating"
+      self.driver.track_operation(active_command)
       defer.returnValue({'message': "The antenna is being vertically calibrated."})
     else:
       raise command.CommandError("An error occured while vertically calibrating the antenna: '"+response['message']+"'")
@@ -379,6 +470,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     # Check the responses
     if responses['status'] == "okay":
       self.driver._controller_state['state'] = "calibrating"
+      self.driver.track_operation(active_command, target_position = (270, 0))
       defer.returnValue({'message': "The antenna is being fully calibrated and will be parked at an Az/El of 270/0."})
     else:
       raise command.CommandError("An error occured while attempting to calibrate and park the antenna: '"+
@@ -423,7 +515,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'get_state', self.name, requires_active_session = True)
+    return build_metadata_dict([], 'get_state', self.name, requires_active_session = True, cache_ttl = 1)
 
   @inlineCallbacks
   def command_stop(self, active_command):
@@ -439,12 +531,13 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
 
     # Build and send the command request
     request = self._build_request("s")
-    command_deferred = self._send_commands([request])
+    command_deferred = self._send_commands([request], active_command.priority)
     response = yield command_deferred
 
     # Check the response
     if response['status'] == "okay":
       self.driver._controller_state['state'] = "stopped"
+      self.driver.end_operation(False, "The antenna was stopped.")
       defer.returnValue({'message': "The antenna controller has been stopped."})
     else:
       raise command.CommandError("An error occured while stopping the antenna: '"+response['message']+"'")
@@ -455,7 +548,7 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'stop', self.name, requires_active_session = True)
+    return build_metadata_dict([], 'stop', self.name, requires_active_session = True, priority = 'emergency')
 
   @inlineCallbacks
   def command_stop_emergency(self, active_command):
@@ -472,12 +565,13 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
 
     # Build and send the command request
     request = self._build_request("S")
-    command_deferred = self._send_commands([request])
+    command_deferred = self._send_commands([request], active_command.priority)
     response = yield command_deferred
 
     # Check the response
     if response['status'] == "okay":
       self.driver._controller_state['state'] = "emergency_stopped"
+      self.driver.end_operation(False, "The antenna was stopped.")
       defer.returnValue({'message': "The antenna has been stopped and placed in emergency mode. It will not respond to "+
                                     "new commands until it receives another emergency stop command."})
     else:
@@ -489,7 +583,8 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     @return Returns a dictionary containing meta-data about the command.
     """
 
-    return build_metadata_dict([], 'stop_emergency', self.name, requires_active_session = True, dangerous = True)
+    return build_metadata_dict([], 'stop_emergency', self.name, requires_active_session = True, dangerous = True,
+                               priority = 'emergency')
 
   def _build_request(self, command, parameters = None):
     """ Constructs a request dictionary for the antenna controller API.
@@ -510,11 +605,13 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
 
     return new_request
 
-  def _send_commands(self, requests):
+  def _send_commands(self, requests, priority = 'normal'):
     """ Sends commands to the antenna controller API.
 
     @param requests  An array containing requests to be sent to the antenna controller command API. Requests will be 
                      sequentially sent in the order provided.
+    @param priority  The priority class of the command sending the requests. Emergency requests are sent using the
+                     emergency thread pool so that they don't wait behind routine requests.
     @return Returns a deferred that will eventually be fired with the command results (or an error message in the event
             of a failure).
     """
@@ -524,25 +621,27 @@ class AntennaControllerHandler(handler.DeviceCommandHandler):
     request_encoded = urllib.urlencode({"request": request_json})
 
     # Query the controller
-    command_deferred = self._query_antenna_controller(request_encoded)
+    command_deferred = self._query_antenna_controller(request_encoded, priority)
     command_deferred.addErrback(self._handle_query_error)
 
     return command_deferred
 
   @inlineCallbacks
-  def _query_antenna_controller(self, encoded_request):
+  def _query_antenna_controller(self, encoded_request, priority = 'normal'):
     """ Asynchronously sends commands to the antenna controller.
 
     This method is used by _send_commands() to send commands to the antenna controller API in a non-blocking fashion.
 
     @param encoded_request  The encoded request JSON ready for transmission.
+    @param priority         The priority class of the command sending the request (see executor.defer_to_thread).
     @return Returns a deferred that will be fired with the request response.
     """
 
     # Query the antenna controller API
     ac_request = urllib2.Request(self.driver.controller_api_endpoint, encoded_request)
     ac_opener = urllib2.build_opener()
-    ac_deferred = threads.deferToThread(ac_opener.open, ac_request, None, self.driver.controller_api_timeout)
+    ac_deferred = executor.defer_to_thread(priority, ac_opener.open, ac_request, None,
+                                           self.driver.controller_api_timeout)
     ac_response = yield ac_deferred
 
     # Parse and return response
@@ -103,10 +103,11 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
   def test_cleanup_after_session(self):
     """ Tests that the antenna controller takes the correct actions once a session has ended. """
 
-    def mock_parse_command(command_request, **keywords):
-      self.assertEqual(command_request['command'], "calibrate_and_park")
-      self.assertEqual(keywords['user_id'], None)
-      self.assertEqual(keywords['kernel_mode'], True)
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      self.assertEqual(pipeline_id, test_pipeline.id)
+      self.assertEqual(destination, "test_device")
+      self.assertEqual(command_name, "calibrate_and_park")
+      self.assertEqual(user_id, None)
 
       return defer.succeed(True)
 
@@ -114,7 +115,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
     test_pipeline = MagicMock()
     test_pipeline.id = "test_pipeline"
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -142,18 +143,18 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
     test_pipeline.id = "test_pipeline"
     test_pipeline.current_session.user_id = "test_user"
 
-    def mock_parse_command(command_request, **keywords):
-      self.assertEqual(command_request['command'], "move")
-      self.assertEqual(command_request['destination'], test_pipeline.id+".test_device")
-      self.assertEqual(command_request['parameters']['azimuth'], 42)
-      self.assertEqual(command_request['parameters']['elevation'], 42)
-      self.assertEqual(keywords['user_id'], test_pipeline.current_session.user_id)
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      self.assertEqual(command_name, "move")
+      self.assertEqual(pipeline_id+"."+destination, test_pipeline.id+".test_device")
+      self.assertEqual(parameters['azimuth'], 42)
+      self.assertEqual(parameters['elevation'], 42)
+      self.assertEqual(user_id, test_pipeline.current_session.user_id)
 
       return defer.succeed(True)
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -189,10 +190,10 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
     test_pipeline.id = "test_pipeline"
     test_pipeline.current_session.user_id = "test_user"
 
-    def mock_parse_command(command_request, **keywords):
-      self.assertEqual(command_request['command'], "get_state")
-      self.assertEqual(command_request['destination'], test_pipeline.id+".test_device")
-      self.assertEqual(keywords['user_id'], test_pipeline.current_session.user_id)
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      self.assertEqual(command_name, "get_state")
+      self.assertEqual(pipeline_id+"."+destination, test_pipeline.id+".test_device")
+      self.assertEqual(user_id, test_pipeline.current_session.user_id)
 
       test_response = {
         'response': {
@@ -206,7 +207,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -229,10 +230,10 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
     test_pipeline.id = "test_pipeline"
     test_pipeline.current_session.user_id = "test_user"
 
-    def mock_parse_command(command_request, **keywords):
-      self.assertEqual(command_request['command'], "get_state")
-      self.assertEqual(command_request['destination'], test_pipeline.id+".test_device")
-      self.assertEqual(keywords['user_id'], test_pipeline.current_session.user_id)
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      self.assertEqual(command_name, "get_state")
+      self.assertEqual(pipeline_id+"."+destination, test_pipeline.id+".test_device")
+      self.assertEqual(user_id, test_pipeline.current_session.user_id)
 
       test_response = {
         'response': {
@@ -244,7 +245,7 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
 
     # Create a test device
     test_cp = MagicMock()
-    test_cp.parse_command = mock_parse_command
+    test_cp.invoke_internal = mock_invoke_internal
     test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
     test_device._session_pipeline = test_pipeline
 
@@ -255,6 +256,54 @@ class TestMXLAntennaControllerDriver(unittest.TestCase):
     # Check results
     self.assertEqual(result, None)
 
+  @inlineCallbacks
+  def test_track_operation(self):
+    """ Verifies that the antenna controller reports the progress of tracked operations each time it updates its state
+    and finishes them once the antenna settles at its target. """
+
+    # Create a mock pipeline to test with
+    test_pipeline = MagicMock()
+    test_pipeline.id = "test_pipeline"
+    antenna_positions = [(100, 10), (200, 5), (270, 0), (270, 0), (270, 0), (270, 0)]
+
+    def mock_invoke_internal(pipeline_id, destination, command_name, parameters = None, user_id = None):
+      antenna_position = antenna_positions.pop(0)
+      return defer.succeed({'response': {'status': 'okay', 'azimuth': antenna_position[0],
+                                         'elevation': antenna_position[1]}})
+
+    # Create a test device
+    test_cp = MagicMock()
+    test_cp.invoke_internal = mock_invoke_internal
+    test_device = mxl_antenna_controller.MXL_Antenna_Controller(self.standard_device_configuration, test_cp)
+    test_device._session_pipeline = test_pipeline
+
+    # Operations can only be tracked while the state update loop is running
+    test_command = MagicMock()
+    self.assertTrue(not test_device.track_operation(test_command))
+    test_device._state_update_loop = MagicMock()
+    test_device._state_update_loop.running = True
+    self.assertTrue(test_device.track_operation(test_command, target_position = (270, 0)))
+    test_command.continue_progress.assert_called_once_with()
+
+    # Update the state until the antenna settles
+    for update_index in range(5):
+      yield test_device._update_state()
+    self.assertEqual(test_command.report_progress.call_count, 6)
+    self.assertEqual(test_command.report_progress.call_args[0][0]['azimuth'], 270)
+    self.assertEqual(test_command.finish_progress.call_count, 0)
+    yield test_device._update_state()
+    self.assertEqual(test_command.finish_progress.call_args[0][0], True)
+    self.assertEqual(test_device._tracked_operation, None)
+
+    # Tracking a new operation interrupts the current one
+    first_command = MagicMock()
+    second_command = MagicMock()
+    test_device.track_operation(first_command)
+    test_device.track_operation(second_command)
+    self.assertEqual(first_command.finish_progress.call_args[0][0], False)
+    test_device.end_operation(False, "Stopped.")
+    self.assertEqual(second_command.finish_progress.call_args[0][1]['message'], "Stopped.")
+
   def _reset_config_entries(self):
     # Reset the recorded configuration entries
     self.config.options = {}
@@ -12,6 +12,7 @@ from hwm.core.configuration import *
 from hwm.hardware.devices.drivers import driver, service
 from hwm.command import command
 from hwm.command.handlers import handler
+from hwm.command.metadata import *
 
 class SGP4TrackerDriver(driver.VirtualDriver):
   """ A virtual driver that provides a SGP4 tracking service.
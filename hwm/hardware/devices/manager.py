@@ -8,8 +8,52 @@ each hardware device and provides an interface that the rest of the application
 # Import required modules
 import logging, jsonschema
 from hwm.core import configuration
+from hwm.core.validation import Validators
 from hwm.hardware.devices.drivers import driver
 
+# Define a schema that species the format of the YAML device configuration. Note that, because YAML is a superset of
+# JSON, the JSON draft 3 schema validator can validate most simple YAML files.
+device_schema = {
+  "type": "array",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "minItems": 1,
+  "additionalItems": False,
+  "items": {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+      "id": {
+        "type": "string",
+        "required": True
+      },
+      "description": {
+        "type": "string",
+        "required": False
+      },
+      "driver": {
+        "type": "string",
+        "required": True
+      },
+      "allow_concurrent_use": {
+        "type": "boolean",
+        "required": False
+      },
+      "command_concurrency": {
+        "type": "integer",
+        "minimum": 1,
+        "required": False
+      },
+      "settings": {
+        "type": "object",
+        "required": False,
+        "additionalProperties": True
+      }
+    }
+  }
+}
+Validators.register('device', device_schema)
+
 class DeviceManager:
   """ Manages access to configured hardware devices.
   
@@ -166,47 +210,9 @@ class DeviceManager:
     @param device_configuration  An array containing the available device configuration.
     """
     
-    # Define a schema that species the format of the YAML pipeline configuration. Note that, because YAML is a superset
-    # of JSON, the JSON draft 3 schema validator can validate most simple YAML files.
-    device_schema = {
-      "type": "array",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "minItems": 1,
-      "additionalItems": False,
-      "items": {
-        "type": "object",
-        "additionalProperties": False,
-        "properties": {
-          "id": {
-            "type": "string",
-            "required": True
-          },
-          "description": {
-            "type": "string",
-            "required": False
-          },
-          "driver": {
-            "type": "string",
-            "required": True
-          },
-          "allow_concurrent_use": {
-            "type": "boolean",
-            "required": False
-          },
-          "settings": {
-            "type": "object",
-            "required": False,
-            "additionalProperties": True
-          }
-        }
-      }
-    }
-    
     # Validate the JSON schema
-    config_validator = jsonschema.Draft3Validator(device_schema)
     try:
-      config_validator.validate(device_configuration)
+      Validators.validate('device', device_configuration)
 
       if self.config.verbose_startup:
         print "- Device configuration validated."
@@ -8,10 +8,71 @@ pipelines.
 # Import required modules
 import logging, jsonschema
 from hwm.core import configuration
+from hwm.core.validation import Validators
 from hwm.hardware.pipelines import pipeline
 from hwm.hardware.devices import manager as device_manager
 from hwm.command import command
 
+# Define a schema that species the format of the YAML pipeline configuration. Note that, because YAML is a superset of
+# JSON, the JSON draft 3 schema validator can validate most simple YAML files.
+pipeline_schema = {
+  "type": "array",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "minItems": 1,
+  "additionalItems": False,
+  "items": {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+      "id": {
+        "type": "string",
+        "required": True
+      },
+      "description": {
+        "type": "string",
+        "required": False
+      },
+      "mode": {
+        "type": "string",
+        "enum": ["transmit", "receive", "transceive"],
+        "required": True
+      },
+      "hardware": {
+        "type": "array",
+        "required": True,
+        "minItems": 1,
+        "additionalItems": False,
+        "items": {
+          "type": "object",
+          "additionalProperties": False,
+          "properties": {
+            "device_id": {
+              "type": "string",
+              "required": True
+            },
+            "pipeline_input": {
+              "type": "boolean",
+              "required": False
+            },
+            "pipeline_output": {
+              "type": "boolean",
+              "required": False
+            }
+          }
+        }
+      },
+      "setup_commands": {
+        "type": "array",
+        "required": False,
+        "additionalItems": False,
+        "items": command.schema
+      }
+    }
+  }
+}
+Validators.register('pipeline', pipeline_schema)
+
 class PipelineManager:
   """ Provides access the collection of available hardware pipelines.
   
@@ -94,6 +155,28 @@ class PipelineManager:
     for pipeline_config in pipeline_settings:
       temp_pipeline = pipeline.Pipeline(pipeline_config, self.device_manager, self.command_parser)
       self.pipelines[temp_pipeline.id] = temp_pipeline
+
+    # Rebuild the command parser's routing table so that it includes the devices in the new pipelines
+    self.command_parser.build_routing_table()
+
+    # Compile the pipeline setup commands so that they don't have to be parsed every time a session starts
+    for temp_pipeline in self.pipelines.itervalues():
+      if temp_pipeline.setup_commands is not None:
+        compile_deferred = self.command_parser.compile_program(temp_pipeline.setup_commands, kernel_mode = True)
+        compile_deferred.addCallback(self._save_setup_program, temp_pipeline)
+  
+  def _save_setup_program(self, setup_program, setup_pipeline):
+    """ Stores a pipeline's compiled setup commands.
+
+    @param setup_program   The CommandProgram compiled from the pipeline's setup commands.
+    @param setup_pipeline  The Pipeline that the program belongs to.
+    """
+
+    if len(setup_program.errors) > 0:
+      logging.error("The setup commands for the '"+setup_pipeline.id+"' pipeline contain "+
+                    str(len(setup_program.errors))+" invalid command(s). Sessions using the pipeline will fail.")
+
+    setup_pipeline.setup_program = setup_program
   
   def _validate_pipeline_schema(self, pipeline_configuration):
     """ Validates the provided pipeline configuration.
@@ -109,69 +192,9 @@ class PipelineManager:
     @param pipeline_configuration  An object containing the pipeline configuration from the YAML configuration files.
     """
     
-    # Define a schema that species the format of the YAML pipeline configuration. Note that, because YAML is a superset
-    # of JSON, the JSON draft 3 schema validator can validate most simple YAML files.
-    pipeline_schema = {
-      "type": "array",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "minItems": 1,
-      "additionalItems": False,
-      "items": {
-        "type": "object",
-        "additionalProperties": False,
-        "properties": {
-          "id": {
-            "type": "string",
-            "required": True
-          },
-          "description": {
-            "type": "string",
-            "required": False
-          },
-          "mode": {
-            "type": "string",
-            "enum": ["transmit", "receive", "transceive"],
-            "required": True
-          },
-          "hardware": {
-            "type": "array",
-            "required": True,
-            "minItems": 1,
-            "additionalItems": False,
-            "items": {
-              "type": "object",
-              "additionalProperties": False,
-              "properties": {
-                "device_id": {
-                  "type": "string",
-                  "required": True
-                },
-                "pipeline_input": {
-                  "type": "boolean",
-                  "required": False
-                },
-                "pipeline_output": {
-                  "type": "boolean",
-                  "required": False
-                }
-              }
-            }
-          },
-          "setup_commands": {
-            "type": "array",
-            "required": False,
-            "additionalItems": False,
-            "items": command.schema
-          }
-        }
-      }
-    }
-    
     # Validate the JSON schema
-    config_validator = jsonschema.Draft3Validator(pipeline_schema)
     try:
-      config_validator.validate(pipeline_configuration)
+      Validators.validate('pipeline', pipeline_configuration)
 
       if self.config.verbose_startup:
         print "- Pipeline configuration validated."
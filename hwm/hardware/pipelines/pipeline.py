@@ -35,6 +35,7 @@ class Pipeline:
     self.id = pipeline_configuration['id']
     self.mode = pipeline_configuration['mode']
     self.setup_commands = pipeline_configuration['setup_commands'] if 'setup_commands' in pipeline_configuration else None
+    self.setup_program = None
     self.produce_telemetry = True
     self.current_session = None
     self.input_device = None
@@ -88,7 +89,8 @@ class Pipeline:
     if self.current_session is not None:
       self.current_session.write_output(output_data)
 
-  def write_telemetry(self, source_id, stream, timestamp, telemetry_datum, binary=False, **extra_headers):
+  def write_telemetry(self, source_id, stream, timestamp, telemetry_datum, binary=False, throttle=True,
+                      **extra_headers):
     """ Passes the provided telemetry datum to the session registered to this pipeline.
 
     Sends the provided telemetry datum and its headers to the session currently using this pipeline. The session will
@@ -97,7 +99,9 @@ class Pipeline:
 
     @note If no session is currently associated with the pipeline, or if the pipeline's telemetry output is currently 
           being throttled, calls to this method will just be ignored (and the data discarded). As a result, it is not 
-          guaranteed that data passed to this method will ever reach the end user. 
+          guaranteed that data passed to this method will ever reach the end user. Small data that the user must 
+          receive (such as a command's final progress event) can be exempted from throttling using the throttle 
+          parameter.
 
     @param source_id        The ID of the device or pipeline that generated the telemetry datum.
     @param stream           A string identifying which of the device's telemetry streams the datum should be associated 
@@ -106,14 +110,20 @@ class Pipeline:
     @param telemetry_datum  The actual telemetry datum. Can take many forms (e.g. a dictionary or binary webcam image).
     @param binary           Whether or not the telemetry payload consists of binary data. If set to true, the data will
                             be encoded before being sent to the user.
+    @param throttle         Whether or not the datum should be discarded if the pipeline's telemetry output is being 
+                            throttled.
     @param **extra_headers  A dictionary containing extra keyword arguments that should be included as additional
                             headers when sending the telemetry datum.
+    @return Returns True if the datum was passed to the session and False if it was discarded.
     """
 
     # Send the telemetry datum to the registered session
-    if self.current_session is not None and self.produce_telemetry:
+    if self.current_session is not None and (self.produce_telemetry or not throttle):
       self.current_session.write_telemetry(source_id, stream, timestamp, telemetry_datum, binary=binary,
                                            **extra_headers)
+      return True
+
+    return False
 
   def register_service(self, service):
     """ Registers services with the pipeline.
@@ -264,6 +274,9 @@ class Pipeline:
     
     This method runs the pipeline setup commands, which are responsible for putting the pipeline in its intended state
     before use by a session.
+
+    @note If the pipeline manager has compiled the setup commands (see the setup_program attribute), the compiled 
+          program will be run. Otherwise, each setup command will be parsed by the command parser.
     
     @param session_preparation_results  The results of the prepare_for_session() call, should always be True (otherwise
                                         the errback chain would have triggered).
@@ -275,6 +288,10 @@ class Pipeline:
 
     running_setup_commands = []
 
+    # Run the compiled pipeline setup commands
+    if self.setup_program is not None:
+      return defer.gatherResults(self.command_parser.run_program(self.setup_program), consumeErrors = True)
+
     # Run the pipeline setup commands 
     if self.setup_commands is not None:
       for temp_command in self.setup_commands:
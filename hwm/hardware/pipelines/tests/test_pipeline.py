@@ -105,11 +105,21 @@ class TestPipeline(unittest.TestCase):
     test_session.write_telemetry.assert_called_once_with("pipeline_test", "test_stream", test_timestamp, "waffles",
                                                          binary=True, test_header=True)
 
+    # Throttled telemetry should be discarded unless it's exempt from throttling
+    test_session.write_telemetry.reset_mock()
+    test_pipeline.produce_telemetry = False
+    self.assertTrue(not test_pipeline.write_telemetry("pipeline_test", "test_stream", test_timestamp, "waffles"))
+    self.assertEqual(test_session.write_telemetry.call_count, 0)
+    self.assertTrue(test_pipeline.write_telemetry("pipeline_test", "test_stream", test_timestamp, "waffles", 
+                                                  throttle=False, test_header=True))
+    test_session.write_telemetry.assert_called_once_with("pipeline_test", "test_stream", test_timestamp, "waffles",
+                                                         binary=False, test_header=True)
+
     # Unregister the session and try writing telemetry data (should have no effect)
     test_pipeline.current_session = None
-    test_pipeline.write_telemetry("pipeline_test", "test_stream", test_timestamp, "waffles", test_header=True)
-    test_session.write_telemetry.assert_called_once_with("pipeline_test", "test_stream", test_timestamp, "waffles",
-                                                         binary=True, test_header=True)
+    self.assertTrue(not test_pipeline.write_telemetry("pipeline_test", "test_stream", test_timestamp, "waffles", 
+                                                      throttle=False, test_header=True))
+    self.assertEqual(test_session.write_telemetry.call_count, 1)
 
   def test_writing_to_pipeline(self):
     """ Verifies that upon receiving data from the session, the pipeline correctly routes it to its input device.
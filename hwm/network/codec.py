@@ -0,0 +1,514 @@
+""" @package hwm.network.codec
+Contains the codecs used to encode and decode messages sent over the hardware manager's network connections.
+
+This module contains the wire codecs that convert commands, command responses, and telemetry points to and from the
+format sent over the network. Each connection negotiates which codec it uses (see hwm.command.connection and
+hwm.network.protocols.utilities.negotiate_codec). The following codecs are available:
+* json: The default codec. Messages are encoded as JSON strings.
+* msgpack: A compact binary codec that implements the MessagePack format (http://msgpack.org). Its messages are 
+  smaller than JSON and can carry binary data (such as webcam images) without BASE64 encoding it first.
+
+@note The MessagePack codec uses the msgpack package if it's installed. Otherwise, it falls back to a pure Python 
+      implementation, which doesn't require any extra packages but is slower to encode and decode than the (C based) 
+      json module. Both support the types that can be represented in JSON as well as binary data (see Binary).
+"""
+
+# Import required modules
+import json, struct
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+class JSONCodec(object):
+  """ Encodes messages as JSON strings.
+  """
+
+  name = 'json'
+  content_type = 'application/json'
+  binary = False
+
+  def encode(self, message):
+    """ Encodes a message.
+
+    @throw Throws CodecError if the message contains a value that can't be represented in JSON.
+
+    @param message  The message to encode (typically a dictionary).
+    @return Returns the encoded message as a string.
+    """
+
+    try:
+      return json.dumps(message)
+    except (TypeError, ValueError) as encode_error:
+      raise CodecError("The message could not be encoded as JSON: "+str(encode_error))
+
+  def decode(self, encoded_message):
+    """ Decodes a message.
+
+    @throw Throws CodecError if the message isn't valid JSON.
+
+    @param encoded_message  The encoded message string.
+    @return Returns the decoded message.
+    """
+
+    try:
+      return json.loads(encoded_message)
+    except ValueError as decode_error:
+      raise CodecError("The message could not be decoded as JSON: "+str(decode_error))
+
+class MessagePackCodec(object):
+  """ Encodes messages using the MessagePack binary format.
+
+  This is the pure Python implementation of the codec. NativeMessagePackCodec is used instead when the msgpack package
+  is installed.
+
+  Python types are encoded as follows:
+  * None, booleans, integers, and floats: Their MessagePack equivalents (floats are always encoded as 64 bit floats).
+  * unicode: A MessagePack string.
+  * str: A MessagePack string if it contains valid UTF-8, otherwise MessagePack binary data.
+  * Binary or bytearray: MessagePack binary data.
+  * list or tuple: A MessagePack array.
+  * dict: A MessagePack map.
+
+  When decoding, MessagePack strings are returned as unicode (the same as the JSON codec) and binary data is returned
+  as a str.
+
+  @note Messages whose arrays and maps are nested more than max_depth levels deep are rejected when decoding, so that
+        a malicious message can't exhaust the interpreter's stack.
+  """
+
+  name = 'msgpack'
+  content_type = 'application/x-msgpack'
+  binary = True
+
+  ## The maximum number of nested arrays and maps that a decoded message can contain
+  max_depth = 100
+
+  def encode(self, message):
+    """ Encodes a message.
+
+    @throw Throws CodecError if the message contains a value that can't be encoded.
+
+    @param message  The message to encode (typically a dictionary).
+    @return Returns the encoded message as a (binary) string.
+    """
+
+    encoded_parts = []
+    self._pack(message, encoded_parts)
+
+    return "".join(encoded_parts)
+
+  def decode(self, encoded_message):
+    """ Decodes a message.
+
+    @throw Throws CodecError if the message isn't a single, complete MessagePack value.
+
+    @param encoded_message  The encoded message string.
+    @return Returns the decoded message.
+    """
+
+    try:
+      message, offset = self._unpack(encoded_message, 0)
+    except (IndexError, struct.error, TypeError, UnicodeDecodeError) as decode_error:
+      raise CodecError("The message could not be decoded as MessagePack: "+str(decode_error))
+
+    if offset != len(encoded_message):
+      raise CodecError("The message could not be decoded as MessagePack: it contains extra data.")
+
+    return message
+
+  def _pack(self, value, encoded_parts):
+    """ Encodes a single value and appends the encoded parts to the provided list.
+
+    @param value          The value to encode.
+    @param encoded_parts  A list that the encoded value's strings will be appended to.
+    """
+
+    if value is None:
+      encoded_parts.append('\xc0')
+    elif value is True:
+      encoded_parts.append('\xc3')
+    elif value is False:
+      encoded_parts.append('\xc2')
+    elif isinstance(value, (int, long)):
+      encoded_parts.append(self._pack_integer(value))
+    elif isinstance(value, float):
+      encoded_parts.append('\xcb'+_DOUBLE.pack(value))
+    elif isinstance(value, (basestring, bytearray)):
+      wire_string = _wire_string(value)
+      if isinstance(wire_string, unicode):
+        self._pack_raw(wire_string.encode('utf-8'), _STRING_HEADERS, encoded_parts)
+      else:
+        self._pack_raw(wire_string, _BINARY_HEADERS, encoded_parts)
+    elif isinstance(value, (list, tuple)):
+      encoded_parts.append(self._pack_length(len(value), 0x90, '\xdc', '\xdd'))
+      for item in value:
+        self._pack(item, encoded_parts)
+    elif isinstance(value, dict):
+      encoded_parts.append(self._pack_length(len(value), 0x80, '\xde', '\xdf'))
+      for item_key, item_value in value.iteritems():
+        self._pack(item_key, encoded_parts)
+        self._pack(item_value, encoded_parts)
+    else:
+      raise CodecError("The message could not be encoded as MessagePack: unsupported type '"+type(value).__name__+"'.")
+
+  def _pack_integer(self, value):
+    """ Encodes an integer using the smallest available MessagePack integer type.
+
+    @param value  The integer to encode.
+    @return Returns the encoded integer.
+    """
+
+    if 0 <= value < 128:
+      return chr(value)
+    elif -32 <= value < 0:
+      return chr(value & 0xff)
+    elif value >= 0:
+      for type_byte, integer_struct, max_value in _UNSIGNED_INTEGERS:
+        if value <= max_value:
+          return type_byte+integer_struct.pack(value)
+    else:
+      for type_byte, integer_struct, min_value in _SIGNED_INTEGERS:
+        if value >= min_value:
+          return type_byte+integer_struct.pack(value)
+
+    raise CodecError("The message could not be encoded as MessagePack: the integer "+str(value)+" is too large.")
+
+  def _pack_raw(self, raw_value, raw_headers, encoded_parts):
+    """ Encodes a string or binary value.
+
+    @param raw_value      The (UTF-8 encoded) value.
+    @param raw_headers    The type headers to use (either _STRING_HEADERS or _BINARY_HEADERS).
+    @param encoded_parts  A list that the encoded value's strings will be appended to.
+    """
+
+    raw_length = len(raw_value)
+    fixed_type, type_8, type_16, type_32 = raw_headers
+    if fixed_type is not None and raw_length < 32:
+      encoded_parts.append(chr(fixed_type | raw_length))
+    elif raw_length <= 0xff:
+      encoded_parts.append(type_8+chr(raw_length))
+    elif raw_length <= 0xffff:
+      encoded_parts.append(type_16+_UINT16.pack(raw_length))
+    else:
+      encoded_parts.append(type_32+_UINT32.pack(raw_length))
+    encoded_parts.append(raw_value)
+
+  def _pack_length(self, length, fixed_type, type_16, type_32):
+    """ Encodes the header of an array or map.
+
+    @param length      The number of items in the array or map.
+    @param fixed_type  The type byte of the fixed length version of the type.
+    @param type_16     The type byte of the version of the type with a 16 bit length.
+    @param type_32     The type byte of the version of the type with a 32 bit length.
+    @return Returns the encoded header.
+    """
+
+    if length < 16:
+      return chr(fixed_type | length)
+    elif length <= 0xffff:
+      return type_16+_UINT16.pack(length)
+    else:
+      return type_32+_UINT32.pack(length)
+
+  def _unpack(self, encoded_message, offset, depth = 0):
+    """ Decodes a single value.
+
+    @param encoded_message  The encoded message.
+    @param offset           The offset of the value in the encoded message.
+    @param depth            The number of arrays and maps that the value is nested in.
+    @return Returns a tuple containing the decoded value and the offset of the next value.
+    """
+
+    type_byte = ord(encoded_message[offset])
+    offset += 1
+
+    # Fixed length types
+    if type_byte <= 0x7f:
+      return type_byte, offset
+    elif type_byte >= 0xe0:
+      return type_byte-0x100, offset
+    elif 0xa0 <= type_byte <= 0xbf:
+      return self._unpack_raw(encoded_message, offset, type_byte & 0x1f, True)
+    elif 0x90 <= type_byte <= 0x9f:
+      return self._unpack_array(encoded_message, offset, type_byte & 0x0f, depth)
+    elif 0x80 <= type_byte <= 0x8f:
+      return self._unpack_map(encoded_message, offset, type_byte & 0x0f, depth)
+
+    # Single byte values
+    if type_byte == 0xc0:
+      return None, offset
+    elif type_byte == 0xc2:
+      return False, offset
+    elif type_byte == 0xc3:
+      return True, offset
+
+    # Numbers
+    if type_byte in _NUMBER_STRUCTS:
+      number_struct = _NUMBER_STRUCTS[type_byte]
+      return number_struct.unpack_from(encoded_message, offset)[0], offset+number_struct.size
+
+    # Variable length types
+    if type_byte in _LENGTH_STRUCTS:
+      length_struct, value_type = _LENGTH_STRUCTS[type_byte]
+      value_length = length_struct.unpack_from(encoded_message, offset)[0]
+      offset += length_struct.size
+      if value_type == 'string':
+        return self._unpack_raw(encoded_message, offset, value_length, True)
+      elif value_type == 'binary':
+        return self._unpack_raw(encoded_message, offset, value_length, False)
+      elif value_type == 'array':
+        return self._unpack_array(encoded_message, offset, value_length, depth)
+      else:
+        return self._unpack_map(encoded_message, offset, value_length, depth)
+
+    raise CodecError("The message could not be decoded as MessagePack: unsupported type 0x%02x." % type_byte)
+
+  def _unpack_raw(self, encoded_message, offset, value_length, is_string):
+    """ Decodes a string or binary value.
+
+    @param encoded_message  The encoded message.
+    @param offset           The offset of the value's data.
+    @param value_length     The length of the value's data.
+    @param is_string        Whether the value is a string (returned as unicode) or binary data (returned as a str).
+    @return Returns a tuple containing the decoded value and the offset of the next value.
+    """
+
+    value_end = offset+value_length
+    if value_end > len(encoded_message):
+      raise IndexError("the message is truncated")
+
+    raw_value = encoded_message[offset:value_end]
+    return (raw_value.decode('utf-8') if is_string else raw_value), value_end
+
+  def _unpack_array(self, encoded_message, offset, item_count, depth):
+    """ Decodes an array.
+
+    @throw Throws CodecError if the array is nested too deeply.
+
+    @param encoded_message  The encoded message.
+    @param offset           The offset of the array's first item.
+    @param item_count       The number of items in the array.
+    @param depth            The number of arrays and maps that the array is nested in.
+    @return Returns a tuple containing the decoded list and the offset of the next value.
+    """
+
+    self._check_depth(depth)
+
+    decoded_array = []
+    for item_index in xrange(item_count):
+      item_value, offset = self._unpack(encoded_message, offset, depth+1)
+      decoded_array.append(item_value)
+
+    return decoded_array, offset
+
+  def _unpack_map(self, encoded_message, offset, item_count, depth):
+    """ Decodes a map.
+
+    @throw Throws CodecError if the map is nested too deeply.
+
+    @param encoded_message  The encoded message.
+    @param offset           The offset of the map's first key.
+    @param item_count       The number of key/value pairs in the map.
+    @param depth            The number of arrays and maps that the map is nested in.
+    @return Returns a tuple containing the decoded dictionary and the offset of the next value.
+    """
+
+    self._check_depth(depth)
+
+    decoded_map = {}
+    for item_index in xrange(item_count):
+      item_key, offset = self._unpack(encoded_message, offset, depth+1)
+      item_value, offset = self._unpack(encoded_message, offset, depth+1)
+      decoded_map[item_key] = item_value
+
+    return decoded_map, offset
+
+  def _check_depth(self, depth):
+    if depth >= self.max_depth:
+      raise CodecError("The message could not be decoded as MessagePack: it is nested more than "+str(self.max_depth)+
+                       " levels deep.")
+
+class NativeMessagePackCodec(MessagePackCodec):
+  """ Encodes messages using the MessagePack binary format with the msgpack package.
+
+  This codec produces the same messages as MessagePackCodec (and accepts the same limits when decoding), but leaves the
+  encoding and decoding to the msgpack package's C extension.
+
+  @note The msgpack package encodes every str as binary data, so the message's strings are converted first (see 
+        _wire_string).
+  """
+
+  def encode(self, message):
+    """ Encodes a message.
+
+    @throw Throws CodecError if the message contains a value that can't be encoded.
+
+    @param message  The message to encode (typically a dictionary).
+    @return Returns the encoded message as a (binary) string.
+    """
+
+    try:
+      return msgpack.packb(_wire_strings(message), use_bin_type=True)
+    except (TypeError, ValueError, OverflowError) as encode_error:
+      raise CodecError("The message could not be encoded as MessagePack: "+str(encode_error))
+
+  def decode(self, encoded_message):
+    """ Decodes a message.
+
+    @throw Throws CodecError if the message isn't a single, complete MessagePack value.
+
+    @param encoded_message  The encoded message string.
+    @return Returns the decoded message.
+    """
+
+    try:
+      message = msgpack.unpackb(encoded_message, raw=False, ext_hook=self._reject_extension)
+    except (TypeError, ValueError, UnicodeDecodeError, msgpack.UnpackException) as decode_error:
+      raise CodecError("The message could not be decoded as MessagePack: "+str(decode_error))
+
+    self._check_nesting(message)
+
+    return message
+
+  def _reject_extension(self, extension_type, extension_data):
+    raise CodecError("The message could not be decoded as MessagePack: unsupported extension type "+
+                     str(extension_type)+".")
+
+  def _check_nesting(self, message):
+    """ Makes sure that a decoded message isn't nested more than max_depth levels deep.
+
+    @throw Throws CodecError if the message is nested too deeply.
+
+    @param message  The decoded message.
+    """
+
+    pending_values = [(message, 0)]
+    while len(pending_values) > 0:
+      value, depth = pending_values.pop()
+      if isinstance(value, dict):
+        value = value.values()
+      elif not isinstance(value, list):
+        continue
+
+      self._check_depth(depth)
+      for item in value:
+        if isinstance(item, (list, dict)):
+          pending_values.append((item, depth+1))
+
+class Binary(str):
+  """ Marks a string as binary data.
+
+  The MessagePack codec encodes Binary strings as binary data even if they happen to contain valid UTF-8.
+  """
+
+  pass
+
+def _wire_string(value):
+  """ Determines how a string is sent by the MessagePack codecs.
+
+  unicode values and str values that contain valid UTF-8 are sent as MessagePack strings. Binary and bytearray values, 
+  and str values that aren't valid UTF-8, are sent as binary data.
+
+  @param value  The string (a basestring or bytearray).
+  @return Returns a unicode string for values that should be sent as MessagePack strings and a str for values that 
+          should be sent as binary data.
+  """
+
+  if isinstance(value, (Binary, bytearray)):
+    return str(value)
+  elif isinstance(value, unicode):
+    return value
+
+  try:
+    return value.decode('utf-8')
+  except UnicodeDecodeError:
+    return value
+
+def _wire_strings(value):
+  """ Converts the strings in a message to the types that they should be sent as (see _wire_string).
+
+  @param value  The message (or a value in it).
+  @return Returns a copy of the value with its strings converted.
+  """
+
+  if isinstance(value, (basestring, bytearray)):
+    return _wire_string(value)
+  elif isinstance(value, (list, tuple)):
+    return [_wire_strings(item) for item in value]
+  elif isinstance(value, dict):
+    return dict((_wire_strings(item_key), _wire_strings(item_value)) for item_key, item_value in value.iteritems())
+
+  return value
+
+def get_codec(codec_name):
+  """ Returns the codec with the specified name.
+
+  @throw Throws CodecNotFound if the codec doesn't exist.
+
+  @param codec_name  The name of the codec (e.g. 'json' or 'msgpack').
+  @return Returns the requested codec.
+  """
+
+  if codec_name not in CODECS:
+    raise CodecNotFound("The requested codec '"+str(codec_name)+"' is not supported.")
+
+  return CODECS[codec_name]
+
+def get_codec_for_content_type(content_type):
+  """ Returns the codec for the specified MIME type.
+
+  @param content_type  A MIME type, optionally followed by parameters (e.g. "application/json; charset=utf-8").
+  @return Returns the codec that uses the content type, or None if there isn't one.
+  """
+
+  if content_type is not None:
+    mime_type = content_type.split(';')[0].strip().lower()
+    for available_codec in CODECS.itervalues():
+      if available_codec.content_type == mime_type:
+        return available_codec
+
+  return None
+
+# Precompile the structs used by the MessagePack codec
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_INT64 = struct.Struct('>q')
+_DOUBLE = struct.Struct('>d')
+_UNSIGNED_INTEGERS = (('\xcc', _UINT8, 0xff), ('\xcd', _UINT16, 0xffff), ('\xce', _UINT32, 0xffffffff),
+                      ('\xcf', _UINT64, 0xffffffffffffffff))
+_SIGNED_INTEGERS = (('\xd0', _INT8, -0x80), ('\xd1', _INT16, -0x8000), ('\xd2', _INT32, -0x80000000),
+                    ('\xd3', _INT64, -0x8000000000000000))
+_STRING_HEADERS = (0xa0, '\xd9', '\xda', '\xdb')
+_BINARY_HEADERS = (None, '\xc4', '\xc5', '\xc6')
+_NUMBER_STRUCTS = {
+  0xca: struct.Struct('>f'), 0xcb: _DOUBLE,
+  0xcc: _UINT8, 0xcd: _UINT16, 0xce: _UINT32, 0xcf: _UINT64,
+  0xd0: _INT8, 0xd1: _INT16, 0xd2: _INT32, 0xd3: _INT64
+}
+_LENGTH_STRUCTS = {
+  0xd9: (_UINT8, 'string'), 0xda: (_UINT16, 'string'), 0xdb: (_UINT32, 'string'),
+  0xc4: (_UINT8, 'binary'), 0xc5: (_UINT16, 'binary'), 0xc6: (_UINT32, 'binary'),
+  0xdc: (_UINT16, 'array'), 0xdd: (_UINT32, 'array'),
+  0xde: (_UINT16, 'map'), 0xdf: (_UINT32, 'map')
+}
+
+## The available codecs, keyed by name
+CODECS = {
+  'json': JSONCodec(),
+  'msgpack': NativeMessagePackCodec() if msgpack is not None else MessagePackCodec()
+}
+
+## The name of the codec that connections use unless they request a different one
+DEFAULT_CODEC = 'json'
+
+# Define codec related exceptions
+class CodecError(Exception):
+  pass
+class CodecNotFound(Exception):
+  pass
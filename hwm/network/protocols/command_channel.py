@@ -0,0 +1,247 @@
+""" @package hwm.network.protocols.command_channel
+This module contains the Twisted Protocol (and related classes) used to accept commands over a persistent connection.
+"""
+
+# Import required modules
+import logging, time
+from twisted.internet.protocol import Protocol, Factory
+from hwm.command import command
+from hwm.network import codec
+from hwm.network.protocols import utilities
+
+class CommandChannel(Protocol):
+  """ Represents a persistent command connection.
+
+  This Protocol provides a long-lived alternative to submitting each command as a separate HTTPS request to the
+  CommandResource. Like the pipeline telemetry stream, it is intended to be wrapped in a WebSocket (using txws) so that
+  it can be used directly from a web browser. Each WebSocket message must contain a single JSON command with an extra
+  "request_id" field:
+
+    {"request_id": "42", "command": "move", "destination": "pipeline.antenna", "parameters": {...}}
+
+  The command is passed to the CommandParser on behalf of the user identified by the connection's TLS certificate, and
+  its response is sent back in a message containing the same request ID:
+
+    {"request_id": "42", "response": {...}}
+
+  Commands are executed as soon as they are received, so responses will be sent in whatever order the commands
+  complete, which may differ from the order they were submitted in.
+
+  Messages are JSON encoded by default. Clients can select a different codec (e.g. the binary 'msgpack' codec) using 
+  the "codec" query argument of the WebSocket URL (see utilities.negotiate_codec).
+
+  @note Any commands received before the TLS handshake has been completed are queued and will be executed once the
+        user's identity is known. If more than max_queued_messages are received before then, the connection is 
+        dropped.
+  """
+
+  ## The maximum number of messages that will be queued while waiting for the user's identity
+  max_queued_messages = 100
+
+  def __init__(self, command_parser):
+    """ Sets up the CommandChannel protocol instance.
+
+    @param command_parser  The CommandParser that will be used to execute the received commands.
+    """
+
+    # Set protocol attributes
+    self.command_parser = command_parser
+    self.user_id = None
+    self.authenticated = False
+    self.codec = codec.get_codec(codec.DEFAULT_CODEC)
+    self._queued_messages = []
+
+  def dataReceived(self, data):
+    """ Receives command messages from the user.
+
+    @note When wrapped by txws, this method will be called once for each complete WebSocket message.
+
+    @param data  A string containing a single JSON command message.
+    """
+
+    if not self.authenticated:
+      # Wait until the user's identity is known
+      if len(self._queued_messages) >= self.max_queued_messages:
+        logging.error("A command channel connection was dropped because it sent more than "+
+                      str(self.max_queued_messages)+" messages before it was authenticated.")
+        self._queued_messages = []
+        self.transport.abortConnection()
+        return
+
+      self._queued_messages.append(data)
+      return
+
+    self._process_message(data)
+
+  def connectionMade(self):
+    """ Sets up the command channel before any data transfer occurs.
+
+    This method calls a function that will wait for the TLS handshake to complete and then load the user's ID from their
+    certificate. The user is authenticated once the WebSocket handshake (which contains the requested codec) has also 
+    been received.
+
+    @return Returns a deferred that will be fired with the user's ID.
+    """
+
+    # Wait for the user's certificate
+    tls_handshake_deferred = utilities.load_user_after_tls_handshake(self)
+    tls_handshake_deferred.addCallback(utilities.wait_for_websocket_handshake, self)
+    tls_handshake_deferred.addCallback(self.authenticate)
+    tls_handshake_deferred.addErrback(self._connection_setup_error)
+
+    return tls_handshake_deferred
+
+  def connectionLost(self, reason = None):
+    """ Called when the connection to the user is lost.
+
+    @note Commands that are still executing will run to completion but their responses will be discarded.
+
+    @param reason  A Failure describing why the connection was lost.
+    """
+
+    self.connected = 0
+    self._queued_messages = []
+
+  def authenticate(self, user_id):
+    """ Associates the connection with the specified user and executes any queued commands.
+
+    This callback is called with the user ID from the client's TLS certificate after the TLS and WebSocket handshakes 
+    are complete. It also selects the codec requested by the user.
+
+    @throw May pass on codec.CodecNotFound exceptions if the user requested an unsupported codec.
+
+    @param user_id  The ID of the connected user.
+    @return Returns the user's ID.
+    """
+
+    self.codec = utilities.negotiate_codec(self)
+    self.user_id = user_id
+    self.authenticated = True
+
+    # Process any messages that were received before the handshake completed
+    queued_messages = self._queued_messages
+    self._queued_messages = []
+    for queued_message in queued_messages:
+      self._process_message(queued_message)
+
+    return user_id
+
+  def _process_message(self, message):
+    """ Parses a command message and passes the command to the command parser.
+
+    @param message  A string containing the encoded command message.
+    """
+
+    # Decode the message and extract its request ID
+    try:
+      command_message = self.codec.decode(message)
+    except codec.CodecError:
+      command_message = None
+
+    if not isinstance(command_message, dict) or 'request_id' not in command_message:
+      self._send_error_response(None, "The command message was malformed or did not contain a request ID.")
+      return
+
+    request_id = command_message.pop('request_id')
+
+    # Execute the command
+    response_deferred = self.command_parser.parse_command(command_message, user_id=self.user_id)
+    response_deferred.addBoth(self._command_response_ready, request_id)
+    response_deferred.addErrback(self._response_failed, request_id)
+
+  def _command_response_ready(self, command_response, request_id):
+    """ Sends a command response back to the user.
+
+    @param command_response  The results of the command. If the command was successful, this will be a dictionary
+                             containing the command response. If the command failed, this will be a Failure object
+                             containing the command response encapsulated in a CommandFailed exception.
+    @param request_id        The request ID of the command.
+    """
+
+    # Extract the command response
+    try:
+      response_dict = command_response.value.results
+    except AttributeError:
+      response_dict = command_response
+
+    self._send_response(request_id, response_dict['response'])
+
+  def _response_failed(self, response_error, request_id):
+    """ Responds to a command whose response couldn't be generated or encoded.
+
+    This errback makes sure that unexpected errors (e.g. a response that the connection's codec can't encode) don't 
+    leave the user waiting for a response forever.
+
+    @param response_error  A Failure object containing the error.
+    @param request_id      The request ID of the command.
+    """
+
+    logging.error("The response to a command channel request could not be sent: "+response_error.getErrorMessage())
+
+    self._send_error_response(request_id, "The command response could not be generated.")
+
+  def _send_error_response(self, request_id, error_message):
+    """ Sends an error response for a message that couldn't be passed to the command parser.
+
+    @param request_id     The request ID of the message, if it had one.
+    @param error_message  A string describing the error.
+    """
+
+    error_command = command.Command(int(time.time()), None, user_id=self.user_id)
+    error_response = error_command.build_command_response(False, {'error_message': error_message})
+
+    self._send_response(request_id, error_response['response'])
+
+  def _send_response(self, request_id, response):
+    """ Writes a response message to the user.
+
+    @param request_id  The request ID that the response is for.
+    @param response    The command's response dictionary.
+    """
+
+    # Drop the response if the user has disconnected
+    if not self.connected:
+      return
+
+    self.transport.write(self.codec.encode({'request_id': request_id, 'response': response}))
+
+  def _connection_setup_error(self, failure):
+    """ Handles errors that arise while waiting for the user's TLS certificate.
+
+    @param failure  A Failure object encapsulating the error.
+    @return Returns None after handling the error.
+    """
+
+    # Close the connection and log the error
+    self.transport.abortConnection()
+    logging.error("An error occured setting up a command channel connection: '"+str(failure.value)+"'")
+
+    return None
+
+class CommandChannelFactory(Factory):
+  """ Constructs CommandChannel protocol instances for persistent command connections.
+  """
+
+  # Setup some factory attributes
+  protocol = CommandChannel
+
+  def __init__(self, command_parser):
+    """ Sets up the CommandChannel protocol factory.
+
+    @param command_parser  The CommandParser that will be used to execute received commands.
+    """
+
+    self.command_parser = command_parser
+
+  def buildProtocol(self, addr):
+    """ Constructs a new CommandChannel protocol.
+
+    @param addr  An object that implements twisted.internet.interfaces.IAddress.
+    @return Returns a new instance of the CommandChannel class representing a new command connection.
+    """
+
+    # Initialize and return a new CommandChannel protocol
+    channel_protocol = self.protocol(self.command_parser)
+    channel_protocol.factory = self
+
+    return channel_protocol
@@ -3,8 +3,9 @@ This module contains the Twisted Protocol (and related classes) used to broadcas
 """
 
 # Import required modules
-import base64, json, logging
+import base64, logging
 from twisted.internet.protocol import Protocol, Factory
+from hwm.network import codec
 from hwm.network.protocols import utilities
 from hwm.sessions import session
 
@@ -17,6 +18,9 @@ class PipelineTelemetry(Protocol):
   pipeline telemetry is inherently message based, and because it needs to be easily accessible by a web browser, this
   Protocol uses the WebSocket protocol.
 
+  Telemetry points are JSON encoded by default. High rate consumers can select a more compact codec (e.g. the binary 
+  'msgpack' codec) using the "codec" query argument of the WebSocket URL (see utilities.negotiate_codec).
+
   @note Because this protocol is inherently one way, any data sent by the user will simply be dropped.
 
   @see https://en.wikipedia.org/wiki/WebSocket
@@ -31,12 +35,13 @@ class PipelineTelemetry(Protocol):
     # Set protocol attributes
     self.session_coordinator = session_coordinator
     self.session = None
+    self.codec = codec.get_codec(codec.DEFAULT_CODEC)
 
   def write_telemetry(self, source_id, stream, timestamp, telemetry_datum, binary=False, **extra_headers):
     """ Sends a telemetry data point to the user.
 
     This method sends the specified telemetry data point to the protocol's connected user. It will first package up the 
-    telemetry point into a JSON string and then send it to the user. 
+    telemetry point into a message using the connection's codec and then send it to the user. 
 
     @param source_id        The ID of the device or pipeline that generated the telemetry datum.
     @param stream           A string identifying which of the device's telemetry streams the datum should be associated 
@@ -49,12 +54,12 @@ class PipelineTelemetry(Protocol):
                             headers when sending the telemetry datum.
     """
 
-    # Assemble a JSON string containing the telemetry point
-    telemetry_json = self._package_telemetry(source_id, stream, timestamp, telemetry_datum, binary=binary, 
-                                             **extra_headers)
+    # Assemble a message containing the telemetry point
+    telemetry_message = self._package_telemetry(source_id, stream, timestamp, telemetry_datum, binary=binary, 
+                                                **extra_headers)
 
     # Send the telemetry point to the user
-    self.transport.write(telemetry_json)
+    self.transport.write(telemetry_message)
 
   def dataReceived(self, data):
     """ Receives any data that the user may try to send over the connection.
@@ -81,6 +86,7 @@ class PipelineTelemetry(Protocol):
 
     # Wait for the user's certificate and load the requested session
     tls_handshake_deferred = utilities.load_session_after_tls_handshake(self)
+    tls_handshake_deferred.addCallback(utilities.wait_for_websocket_handshake, self)
     tls_handshake_deferred.addCallback(self.perform_registrations)
     tls_handshake_deferred.addErrback(self._connection_setup_error)
 
@@ -96,17 +102,19 @@ class PipelineTelemetry(Protocol):
     """ Performs the necessary registrations between the protocol and its associated session.
 
     This callback makes the necessary registrations between the pipeline data protocol, its Session, and its pipeline's
-    telemetry producer. It will be called with session specified in the client's TLS certificate after the TLS handshake
-    is complete.
+    telemetry producer. It will be called with session specified in the client's TLS certificate after the TLS and 
+    WebSocket handshakes are complete. It also selects the codec requested by the user.
 
     @throw May pass along session.ProtocolAlreadyRegistered exceptions when trying to register this protocol with its
            session.
+    @throw May pass along codec.CodecNotFound exceptions if the user requested an unsupported codec.
 
     @param requested_session  The session associated with the protocol.
     @return Returns the newly loaded Session that was passed to this callback.
     """
 
-    # Store the session
+    # Select the codec and store the session
+    self.codec = utilities.negotiate_codec(self)
     self.session = requested_session
 
     # Perform the registrations between the data protocol and its associated session
@@ -120,12 +128,13 @@ class PipelineTelemetry(Protocol):
     return requested_session
 
   def _package_telemetry(self, source_id, stream, timestamp, telemetry_datum, binary=False, **extra_headers):
-    """ Packages a telemetry point into a JSON string.
+    """ Packages a telemetry point into a message using the connection's codec.
 
-    This method packages up the provided telemetry data point into a JSON string in preparation for transmission. The 
-    extra_headers will be included as top level attributes in the resulting JSON object.
+    This method packages up the provided telemetry data point into an encoded message in preparation for transmission.
+    The extra_headers will be included as top level attributes in the resulting object.
 
-    @note If the telemetry point consists of binary data, it will be BASE64 encoded before being returned.
+    @note If the telemetry point consists of binary data, it will be BASE64 encoded unless the connection's codec can 
+          carry binary data directly.
     
     @param source_id        The ID of the device or pipeline that generated the telemetry datum.
     @param stream           A string identifying which of the device's telemetry streams the datum should be associated 
@@ -136,11 +145,13 @@ class PipelineTelemetry(Protocol):
                             be encoded before being sent to the user.
     @param **extra_headers  A dictionary containing extra keyword arguments that should be included as additional
                             headers when sending the telemetry datum.
-    @return Returns a JSON string encapsulating the telemetry data point.
+    @return Returns an encoded message encapsulating the telemetry data point.
     """
 
     # Encode the payload if required
-    if binary:
+    if binary and self.codec.binary:
+      payload = codec.Binary(telemetry_datum)
+    elif binary:
       payload = base64.b64encode(telemetry_datum)
     else:
       payload = telemetry_datum
@@ -157,7 +168,7 @@ class PipelineTelemetry(Protocol):
     # Append the additional headers (if any)
     telemetry_point.update(extra_headers)
 
-    return json.dumps(telemetry_point)
+    return self.codec.encode(telemetry_point)
 
   def _connection_setup_error(self, failure):
     """ Handles errors that arise during the telemetry protocol connection setup.
@@ -0,0 +1,214 @@
+# Import required modules
+import logging, json, txws
+from mock import MagicMock
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+from twisted.internet import defer, reactor
+from hwm.network.protocols import command_channel
+from hwm.network import codec
+from hwm.command import parser
+
+class TestCommandChannelProtocol(unittest.TestCase):
+  """ This test suite tests the functionality of the CommandChannel protocol, which lets users submit commands over a
+  persistent (WebSocket) connection.
+  """
+
+  def setUp(self):
+    # Create a CommandChannelFactory with a mock command parser and build the test protocol
+    self.command_parser = MagicMock()
+    self.command_deferreds = []
+    self.command_parser.parse_command.side_effect = self._mock_parse_command
+    protocol_factory = command_channel.CommandChannelFactory(self.command_parser)
+    self.protocol = protocol_factory.buildProtocol(('127.0.0.1', 0))
+    self.old_connectionMade = self.protocol.connectionMade
+    self.protocol.connectionMade = lambda : None
+
+    # Create a transport that records each message sent by the protocol
+    self.transport = proto_helpers.StringTransport()
+    self.sent_messages = []
+    self.transport.write = lambda data: self.sent_messages.append(json.loads(data))
+    self.transport.getPeerCertificate = lambda : None
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_commands_queued_until_authenticated(self):
+    """ Verifies that commands received before the TLS handshake completes are executed once the user is known.
+    """
+
+    # Connect (before the TLS handshake completes) and send a command
+    self.protocol.makeConnection(self.transport)
+    self.protocol.dataReceived(json.dumps({'request_id': 1, 'command': 'station_time', 'destination': 'system'}))
+    self.assertEqual(self.command_parser.parse_command.call_count, 0)
+
+    # Complete the handshake and make sure the command was executed on behalf of the user
+    self.protocol.authenticate('4')
+    self.command_parser.parse_command.assert_called_once_with({'command': 'station_time', 'destination': 'system'},
+                                                              user_id='4')
+
+    # Additional commands should be executed immediately
+    self.protocol.dataReceived(json.dumps({'request_id': 2, 'command': 'station_time', 'destination': 'system'}))
+    self.assertEqual(self.command_parser.parse_command.call_count, 2)
+
+  def test_user_loaded_from_certificate(self):
+    """ Verifies that the protocol loads the user's ID from their TLS certificate.
+    """
+
+    test_certificate = MagicMock()
+    test_certificate.get_subject.return_value.commonName = "4"
+    self.transport.getPeerCertificate = lambda : test_certificate
+
+    self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
+    self.protocol.makeConnection(self.transport)
+    self.assertTrue(self.protocol.authenticated)
+    self.assertEqual(self.protocol.user_id, "4")
+
+  def test_out_of_order_responses(self):
+    """ Verifies that responses are tagged with their request IDs and sent in the order that the commands complete.
+    """
+
+    self.protocol.makeConnection(self.transport)
+    self.protocol.authenticate('4')
+
+    # Send two commands
+    self.protocol.dataReceived(json.dumps({'request_id': 'first', 'command': 'move', 'destination': 'p.antenna'}))
+    self.protocol.dataReceived(json.dumps({'request_id': 'second', 'command': 'park', 'destination': 'p.antenna'}))
+    self.assertEqual(len(self.command_deferreds), 2)
+
+    # Complete the second command (with an error) and then the first
+    error_response = {'response': {'status': 'error', 'result': {'error_message': 'Test error.'}}}
+    self.command_deferreds[1].errback(parser.CommandFailed('Test error.', error_response))
+    self.command_deferreds[0].callback({'response': {'status': 'okay', 'result': {}}})
+
+    self.assertEqual(self.sent_messages, [
+      {'request_id': 'second', 'response': error_response['response']},
+      {'request_id': 'first', 'response': {'status': 'okay', 'result': {}}}
+    ])
+
+  def test_malformed_messages(self):
+    """ Verifies that the protocol responds with an error to messages that aren't JSON objects containing a request ID.
+    """
+
+    self.protocol.makeConnection(self.transport)
+    self.protocol.authenticate('4')
+
+    for test_message in ["{invalid_json", json.dumps(['test']), json.dumps({'command': 'station_time',
+                                                                            'destination': 'system'})]:
+      self.protocol.dataReceived(test_message)
+
+    self.assertEqual(self.command_parser.parse_command.call_count, 0)
+    self.assertEqual(len(self.sent_messages), 3)
+    for sent_message in self.sent_messages:
+      self.assertEqual(sent_message['request_id'], None)
+      self.assertEqual(sent_message['response']['status'], 'error')
+
+  def test_msgpack_codec(self):
+    """ Verifies that the protocol decodes commands and encodes responses using the codec requested in the WebSocket 
+    URL.
+    """
+
+    msgpack_codec = codec.get_codec('msgpack')
+    self.transport.location = "/?codec=msgpack"
+    self.transport.write = lambda data: self.sent_messages.append(msgpack_codec.decode(data))
+    self.protocol.makeConnection(self.transport)
+    self.protocol.authenticate('4')
+    self.assertTrue(self.transport.do_binary_frames)
+
+    # Send a command and a message that isn't valid MessagePack
+    self.protocol.dataReceived(msgpack_codec.encode({'request_id': 7, 'command': 'station_time', 
+                                                     'destination': 'system'}))
+    self.protocol.dataReceived(json.dumps({'request_id': 8, 'command': 'station_time', 'destination': 'system'}))
+    self.command_parser.parse_command.assert_called_once_with({'command': 'station_time', 'destination': 'system'},
+                                                              user_id='4')
+    self.command_deferreds[0].callback({'response': {'status': 'okay', 'result': {'timestamp': 1.5}}})
+
+    self.assertEqual(self.sent_messages[0]['response']['status'], 'error')
+    self.assertEqual(self.sent_messages[1], {'request_id': 7, 'response': {'status': 'okay', 
+                                                                           'result': {'timestamp': 1.5}}})
+
+  def test_codec_negotiated_after_websocket_handshake(self):
+    """ Verifies that the codec isn't selected until the WebSocket handshake has been received, even if the TLS 
+    handshake completes first.
+    """
+
+    test_certificate = MagicMock()
+    test_certificate.get_subject.return_value.commonName = "4"
+    self.transport.getPeerCertificate = lambda : test_certificate
+    self.transport.state = txws.REQUEST
+    self.transport.location = "/"
+
+    self.protocol.connectionMade = self.old_connectionMade # Restore the actual connectionMade method for this test
+    self.protocol.makeConnection(self.transport)
+    self.assertTrue(not self.protocol.authenticated)
+
+    # Receive the WebSocket handshake before the handshake is checked again
+    def websocket_handshake_received():
+      self.transport.state = txws.FRAMES
+      self.transport.location = "/?codec=msgpack"
+    reactor.callLater(0.1, websocket_handshake_received)
+
+    setup_deferred = defer.Deferred()
+    def check_codec():
+      self.assertTrue(self.protocol.authenticated)
+      self.assertEqual(self.protocol.codec.name, 'msgpack')
+    setup_deferred.addCallback(lambda ignore: check_codec())
+    reactor.callLater(0.3, setup_deferred.callback, None)
+
+    return setup_deferred
+
+  def test_queued_message_limit(self):
+    """ Verifies that connections that send too many messages before they are authenticated are dropped.
+    """
+
+    self.transport.abortConnection = MagicMock()
+    self.protocol.max_queued_messages = 3
+    self.protocol.makeConnection(self.transport)
+    for request_id in range(3):
+      self.protocol.dataReceived(json.dumps({'request_id': request_id, 'command': 'station_time', 
+                                             'destination': 'system'}))
+    self.assertEqual(self.transport.abortConnection.call_count, 0)
+
+    self.protocol.dataReceived(json.dumps({'request_id': 3, 'command': 'station_time', 'destination': 'system'}))
+    self.assertEqual(self.transport.abortConnection.call_count, 1)
+    self.assertEqual(self.protocol._queued_messages, [])
+
+  def test_unexpected_response_errors(self):
+    """ Verifies that the user receives an error response if a command's response can't be generated or encoded.
+    """
+
+    self.protocol.makeConnection(self.transport)
+    self.protocol.authenticate('4')
+    self.protocol.dataReceived(json.dumps({'request_id': 1, 'command': 'station_time', 'destination': 'system'}))
+    self.protocol.dataReceived(json.dumps({'request_id': 2, 'command': 'station_time', 'destination': 'system'}))
+
+    # A failure that doesn't contain a command response
+    self.command_deferreds[0].errback(Exception("Test error."))
+    self.assertEqual(self.sent_messages[0]['request_id'], 1)
+    self.assertEqual(self.sent_messages[0]['response']['status'], 'error')
+
+    # A response that can't be encoded
+    self.command_deferreds[1].callback({'response': {'status': 'okay', 'result': {'value': object()}}})
+    self.assertEqual(self.sent_messages[1]['request_id'], 2)
+    self.assertEqual(self.sent_messages[1]['response']['status'], 'error')
+    self.flushLoggedErrors()
+
+  def test_responses_dropped_after_disconnect(self):
+    """ Verifies that responses for commands that complete after the user disconnects are discarded.
+    """
+
+    self.protocol.makeConnection(self.transport)
+    self.protocol.authenticate('4')
+    self.protocol.dataReceived(json.dumps({'request_id': 1, 'command': 'station_time', 'destination': 'system'}))
+    self.protocol.connectionLost()
+
+    self.command_deferreds[0].callback({'response': {'status': 'okay', 'result': {}}})
+    self.assertEqual(self.sent_messages, [])
+
+  def _mock_parse_command(self, raw_command, user_id = None, kernel_mode = False):
+    """ A mock parse_command method that returns deferreds that the tests can fire manually.
+    """
+
+    command_deferred = defer.Deferred()
+    self.command_deferreds.append(command_deferred)
+
+    return command_deferred
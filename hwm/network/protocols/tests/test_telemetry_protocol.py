@@ -5,6 +5,7 @@ from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 from hwm.network.protocols import telemetry
+from hwm.network import codec
 from hwm.sessions import session
 
 class TestPipelineTelemetryProtocol(unittest.TestCase):
@@ -92,6 +93,32 @@ class TestPipelineTelemetryProtocol(unittest.TestCase):
     self.assertEqual(received_dictionary, telem_point)
     self.assertEqual(base64.b64decode(received_dictionary['telemetry']), test_image_str)
 
+  def test_sending_pipeline_telemetry_msgpack(self):
+    """ Verifies that telemetry is encoded using the codec requested in the WebSocket URL and that binary telemetry is
+    sent without being BASE64 encoded when the codec supports binary data.
+    """
+
+    # Register the protocol on a connection that requested the msgpack codec
+    self.transport.location = "/?codec=msgpack"
+    self.transport.registerProducer = MagicMock()
+    self.protocol.perform_registrations(MagicMock())
+    self.assertEqual(self.protocol.codec.name, 'msgpack')
+    self.assertTrue(self.transport.do_binary_frames)
+
+    # Send a binary telemetry point
+    test_image = open(self.source_data_directory+"/network/protocols/tests/data/mxl_logo.png", "rb")
+    test_image_str = test_image.read()
+    test_image.close()
+    self.protocol.write_telemetry("test_source", "test_stream", 58, test_image_str, binary=True, test_header=True)
+    received_dictionary = codec.get_codec('msgpack').decode(self.transport.value())
+    self.assertEqual(received_dictionary, {'source': "test_source", 'stream': "test_stream", 'generated_at': 58, 
+                                           'binary': True, 'telemetry': test_image_str, 'test_header': True})
+    self.assertTrue(len(self.transport.value()) < len(base64.b64encode(test_image_str)))
+
+    # Unsupported codecs should be rejected
+    self.transport.location = "/?codec=xml"
+    self.assertRaises(codec.CodecNotFound, self.protocol.perform_registrations, MagicMock())
+
   def test_protocol_registrations(self):
     """ This test verifies that the PipelineTelemetry.perform_registrations() callback correctly registers the 
     Protocol with the necessary resources and that it correctly handles possible errors.
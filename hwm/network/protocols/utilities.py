@@ -3,9 +3,11 @@ Contains methods commonly used by the HWM network protocols.
 """
 
 # Import required modules
+import urlparse, txws
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 from hwm.sessions import coordinator
+from hwm.network import codec
 
 def load_session_after_tls_handshake(protocol):
   """ Loads the requested session once the provided Protocol's TLS handshake is complete.
@@ -50,3 +52,84 @@ def load_session_after_tls_handshake(protocol):
   session_deferred = Deferred()
   session_deferred.callback(requested_session)
   return session_deferred
+
+def load_user_after_tls_handshake(protocol):
+  """ Loads the ID of the connected user once the provided Protocol's TLS handshake is complete.
+
+  This function periodically checks if the specified protocol's transport has completed its TLS handshake in the same 
+  way as load_session_after_tls_handshake. Once the handshake is complete, the user's ID will be read from the common 
+  name field of their TLS certificate and returned via a deferred.
+
+  @param protocol  The Protocol that wants to wait for its TLS handshake to complete.
+  @return This function returns a deferred that will eventually be fired with the user's ID.
+  """
+
+  # Try to load the client's TLS certificate
+  user_cert = protocol.transport.getPeerCertificate()
+  if user_cert is None:
+    # Create a deferred and schedule it to fire in a bit so we can check for the certificate again
+    recheck_deferred = Deferred()
+    recheck_deferred.addCallback(load_user_after_tls_handshake)
+    reactor.callLater(0.25, recheck_deferred.callback, protocol)
+    return recheck_deferred
+
+  # Return a deferred fired with the user's ID
+  user_deferred = Deferred()
+  user_deferred.callback(user_cert.get_subject().commonName.decode())
+  return user_deferred
+
+def wait_for_websocket_handshake(handshake_results, protocol):
+  """ Waits for the provided Protocol's WebSocket handshake to be received.
+
+  This callback periodically checks if the txws WebSocketProtocol wrapping the specified protocol has received the 
+  WebSocket handshake (i.e. it has started passing frames to the protocol) in the same way as 
+  load_user_after_tls_handshake. It's intended to be added to the deferred returned by one of the TLS handshake 
+  functions, because the TLS handshake usually completes before the WebSocket handshake has been received.
+
+  @param handshake_results  The results of the TLS handshake (e.g. the user's ID), which are passed through.
+  @param protocol           The Protocol that wants to wait for its WebSocket handshake. If its transport isn't a txws 
+                            WebSocketProtocol, the handshake won't be waited for.
+  @return Returns a deferred that will be fired with handshake_results once the WebSocket handshake has been received.
+  """
+
+  if getattr(protocol.transport, 'state', txws.FRAMES) != txws.FRAMES:
+    # Create a deferred and schedule it to fire in a bit so we can check for the handshake again
+    recheck_deferred = Deferred()
+    recheck_deferred.addCallback(wait_for_websocket_handshake, protocol)
+    reactor.callLater(0.25, recheck_deferred.callback, handshake_results)
+    return recheck_deferred
+
+  handshake_deferred = Deferred()
+  handshake_deferred.callback(handshake_results)
+  return handshake_deferred
+
+def negotiate_codec(protocol):
+  """ Selects the codec that a WebSocket protocol should use to encode and decode its messages.
+
+  This function selects the codec (see hwm.network.codec) requested by the "codec" query argument of the WebSocket URL
+  that the user connected to (e.g. "/?codec=msgpack"). If the URL doesn't specify a codec, the default (JSON) codec will
+  be used. If the selected codec is a binary codec, the WebSocket transport will be configured to send binary frames.
+
+  @note This function must be called after the WebSocket handshake has been received (see 
+        wait_for_websocket_handshake). Until then, txws reports the default location ("/") and the requested codec 
+        would be ignored.
+
+  @throw Throws codec.CodecNotFound if the requested codec isn't supported.
+
+  @param protocol  The Protocol that the codec is being selected for. It should be wrapped by a txws WebSocketProtocol.
+  @return Returns the selected codec.
+  """
+
+  # Load the requested codec from the WebSocket URL
+  location = getattr(protocol.transport, 'location', None)
+  codec_name = codec.DEFAULT_CODEC
+  if isinstance(location, basestring):
+    query_arguments = urlparse.parse_qs(urlparse.urlparse(location).query)
+    codec_name = query_arguments.get('codec', [codec.DEFAULT_CODEC])[0]
+  selected_codec = codec.get_codec(codec_name)
+
+  # Binary messages must be sent in binary WebSocket frames
+  if selected_codec.binary:
+    protocol.transport.do_binary_frames = True
+
+  return selected_codec
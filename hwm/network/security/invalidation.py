@@ -0,0 +1,210 @@
+""" @package hwm.network.security.invalidation
+Receives notifications about changed user permissions from the mercury2 user interface.
+
+This module contains a long-poll subscriber that the permission manager can use to find out when the permissions of
+specific users have changed, so that their cached permissions can be dropped right away instead of after the next
+periodic permission refresh.
+"""
+
+# Import required modules
+import json, jsonschema, logging, urllib
+from twisted.internet import reactor
+from twisted.web import client
+from hwm.core.validation import Validators
+
+# Define the schema that the invalidation responses must conform to
+invalidation_schema = {
+  "type": "object",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "properties": {
+    "cursor": {
+      "type": ["string", "number"],
+      "required": True
+    },
+    "user_ids": {
+      "type": "array",
+      "required": False,
+      "items": {
+        "type": "string"
+      }
+    },
+    "reset": {
+      "type": "boolean",
+      "required": False
+    }
+  }
+}
+Validators.register('permission_invalidations', invalidation_schema)
+
+class PermissionInvalidationSubscriber(object):
+  """ Subscribes to the permission invalidations published by the user interface.
+
+  The subscriber repeatedly requests the subscription location with the following query parameters:
+  * cursor: The cursor from the previous response (empty for the first request). The server uses it to determine which
+    invalidations the subscriber has already received.
+  * timeout: How long (in seconds) the server may hold the request open while waiting for new invalidations.
+
+  The server should respond once the permissions of at least one user have changed since the cursor (or when the timeout
+  expires) with a JSON object containing the new 'cursor' and the 'user_ids' of the users whose permissions changed. If
+  the server can't determine what has changed since the cursor (e.g. because it is too old), it should set 'reset' to
+  true, in which case every user's permissions will be refreshed. A 204 (No Content) response indicates that nothing
+  has changed.
+
+  @note Failed requests are retried after retry_delay seconds, doubling the delay after each consecutive failure (up to
+        max_retry_delay). The periodic permission refreshes keep the cached permissions up to date in the meantime.
+  """
+
+  ## How much longer than the poll timeout to wait for the server to respond before giving up on a request
+  response_grace_period = 10
+
+  def __init__(self, permission_manager, subscription_location, poll_timeout = 60, retry_delay = 5,
+               max_retry_delay = 300, agent = None, clock = None):
+    """ Sets up the subscriber.
+
+    @param permission_manager     The PermissionManager whose cached permissions should be invalidated.
+    @param subscription_location  The URL of the user interface's permission invalidation endpoint.
+    @param poll_timeout           How long (in seconds) the server may hold each request open.
+    @param retry_delay            How long (in seconds) to wait before retrying after a failed request.
+    @param max_retry_delay        The maximum delay (in seconds) between retries.
+    @param agent                  The twisted.web.client.Agent to make the requests with. If None, one will be created.
+    @param clock                  An object that provides a callLater() method (typically the reactor). Used to schedule
+                                  retries and request timeouts.
+    """
+
+    self.permission_manager = permission_manager
+    self.subscription_location = subscription_location
+    self.poll_timeout = poll_timeout
+    self.retry_delay = retry_delay
+    self.max_retry_delay = max_retry_delay
+    self.clock = clock if clock is not None else reactor
+    self.agent = agent if agent is not None else client.Agent(reactor)
+    self.running = False
+    self.cursor = None
+    self.poll_count = 0
+    self.invalidation_count = 0
+    self.failure_count = 0
+    self._consecutive_failures = 0
+    self._request_deferred = None
+    self._delayed_poll = None
+
+  def start(self):
+    """ Starts polling for permission invalidations.
+    """
+
+    if not self.running:
+      self.running = True
+      self._poll()
+
+  def stop(self):
+    """ Stops polling for permission invalidations and cancels the pending request, if any.
+    """
+
+    self.running = False
+    if self._delayed_poll is not None and self._delayed_poll.active():
+      self._delayed_poll.cancel()
+    self._delayed_poll = None
+    if self._request_deferred is not None:
+      self._request_deferred.cancel()
+
+  def _poll(self):
+    """ Requests the invalidations that have been published since the current cursor.
+    """
+
+    self._delayed_poll = None
+    if not self.running:
+      return
+
+    self.poll_count += 1
+    query_string = urllib.urlencode({'cursor': self.cursor if self.cursor is not None else '',
+                                     'timeout': self.poll_timeout})
+    request_url = self.subscription_location+('&' if '?' in self.subscription_location else '?')+query_string
+
+    self._request_deferred = self.agent.request('GET', request_url)
+    timeout_call = self.clock.callLater(self.poll_timeout+self.response_grace_period, self._request_deferred.cancel)
+    self._request_deferred.addBoth(self._cancel_timeout, timeout_call)
+    self._request_deferred.addCallback(self._read_response)
+    self._request_deferred.addCallback(self._process_invalidations)
+    self._request_deferred.addCallbacks(self._poll_complete, self._poll_failed)
+
+  def _cancel_timeout(self, request_results, timeout_call):
+    if timeout_call.active():
+      timeout_call.cancel()
+
+    return request_results
+
+  def _read_response(self, response):
+    """ Reads the body of a subscription response.
+
+    @throw Throws InvalidationError if the server responded with an error.
+
+    @param response  The twisted.web.client Response.
+    @return Returns None for 204 (No Content) responses. Otherwise, returns a deferred that will be fired with the body.
+    """
+
+    if response.code == 204:
+      return None
+    if response.code != 200:
+      raise InvalidationError("The permission invalidation server responded with HTTP "+str(response.code)+".")
+
+    return client.readBody(response)
+
+  def _process_invalidations(self, response_body):
+    """ Invalidates the permissions of the users listed in a subscription response.
+
+    @throw Throws InvalidationError if the response isn't valid.
+
+    @param response_body  The body of the response, or None if nothing has changed.
+    """
+
+    if response_body is None:
+      return
+
+    try:
+      invalidations = json.loads(response_body)
+      Validators.validate('permission_invalidations', invalidations)
+    except (ValueError, jsonschema.ValidationError):
+      raise InvalidationError("The permission invalidation server returned an invalid response.")
+
+    self.cursor = invalidations['cursor']
+    if invalidations.get('reset', False):
+      refresh_deferred = self.permission_manager.reset_user_permissions()
+      refresh_deferred.addErrback(self._refresh_failed)
+
+    user_ids = invalidations.get('user_ids', [])
+    if len(user_ids) > 0:
+      self.permission_manager.invalidate_user_permissions(user_ids)
+      self.invalidation_count += len(user_ids)
+
+  def _poll_complete(self, poll_results):
+    """ Starts the next request after a successful one.
+    """
+
+    self._request_deferred = None
+    self._consecutive_failures = 0
+    self._poll()
+
+  def _poll_failed(self, failure):
+    """ Logs a failed request and schedules a retry.
+
+    @param failure  The Failure describing the error.
+    """
+
+    self._request_deferred = None
+    if not self.running:
+      return
+
+    self.failure_count += 1
+    self._consecutive_failures += 1
+    next_delay = min(self.retry_delay*(2**(self._consecutive_failures-1)), self.max_retry_delay)
+    logging.error("The permission invalidation subscription failed (retrying in "+str(next_delay)+" seconds): "+
+                  failure.getErrorMessage())
+    self._delayed_poll = self.clock.callLater(next_delay, self._poll)
+
+  def _refresh_failed(self, failure):
+    logging.error("The user permissions could not be refreshed after an invalidation reset: "+
+                  failure.getErrorMessage())
+
+# Define invalidation related exceptions
+class InvalidationError(Exception):
+  pass
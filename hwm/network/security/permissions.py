@@ -3,9 +3,76 @@ This module contains a class used to manage and cache user command permissions.
 """
 
 # Include required modules
-import time, json, jsonschema, urllib2, urllib
-from twisted.internet import threads, defer
-from hwm.core import configuration
+import time, json, jsonschema, urllib2, urllib, logging, sys, collections
+from twisted.internet import threads, defer, task, reactor
+from twisted.python import failure
+from hwm.core import configuration, resources
+from hwm.network.security import invalidation
+from hwm.core.validation import Validators
+
+# Define the permission list schema
+permission_list_schema = {
+  "type": "array",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "items": {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+      "generated_at": {
+        "type": "number",
+        "id": "generated_at",
+        "required": True
+      },
+      "user_id": {
+        "type": "string",
+        "id": "user_id",
+        "required": True
+      },
+      "username": {
+        "type": "string",
+        "id": "username",
+        "required": True
+      },
+      "ignore_session_protections": {
+        "type": "boolean",
+        "id": "ignore_session_protections",
+        "required": False
+      },
+      "permitted_commands": {
+        "type": "array",
+        "id": "permitted_commands",
+        "required": True,
+        "items": {
+          "type": "object",
+          "additionalProperties": True,
+          "properties": {
+            "command": {
+              "type": "string",
+              "id": "command",
+              "required": True
+            },
+            "destination": {
+              "type": "string",
+              "id": "destination",
+              "required": True
+            },
+            "pipelines": {
+              "type": "array",
+              "id": "pipelines",
+              "required": False,
+              "minitems": 1,
+              "items": {
+                "type": "string"
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+Validators.register('permissions', permission_list_schema)
 
 class PermissionManager:
   """ Stores and provides access to user permission settings.
@@ -13,9 +80,26 @@ class PermissionManager:
   This class stores user command permission settings for use by the command parser and related classes. All permission
   settings are stored with an associated timestamp. This is used to invalidate permissions after a set amount of time,
   forcing a redownload.
+
+  @note The permissions of every user are refreshed together by loading a snapshot of the entire permissions resource 
+        (see refresh_permissions). Once start_refreshing has been called, this happens periodically. Users that are 
+        missing from a snapshot lose their cached permissions.
+  @note A snapshot only refreshes the users that are already cached. The last snapshot is kept (uncompiled) so that 
+        users who aren't cached can be added to the cache from it the next time they're requested, without loading 
+        their permissions individually.
+  @note Invalidations are counted by a generation number. Loads that were started before a user's permissions were 
+        invalidated don't cache that user's (possibly outdated) permissions, and loads that were started before a reset 
+        (see reset_user_permissions) are started again.
+  @note Only one snapshot refresh and one load per user can be in progress at once. Concurrent requests for the same 
+        permissions wait for the load that's already in progress, and requests for users that aren't cached wait for 
+        the current snapshot refresh (if there is one) instead of starting their own download.
+  @note The cached permissions are stored in a PermissionCache (the permissions attribute), which can be bounded so 
+        that stations with large user directories only keep the permissions of their recently active users.
+  @note If the snapshot_store attribute is set to a SnapshotStore, each newly loaded permissions snapshot will be saved
+        to it so that it can be restored by load_snapshot when the hardware manager restarts.
   """
   
-  def __init__(self, permissions_endpoint, update_frequency):
+  def __init__(self, permissions_endpoint, update_frequency, cache_size = None, cache_ttl = None):
     """ Sets up the permission manager.
     
     @param permissions_endpoint  The location that can be queried to find user command permissions. This can either be
@@ -24,14 +108,28 @@ class PermissionManager:
     @param update_frequency      How often the user's permissions should be updated (i.e. if a user's permissions are 
                                  requested and the cached version is older than this value, update them). Specified in 
                                  seconds.
+    @param cache_size            The maximum number of users to cache permissions for. If None, the cache is unbounded.
+    @param cache_ttl             How long (in seconds) a user's permissions will be cached after they were last used. If
+                                 None, permissions won't expire.
     """
     
     # Set up the manager attributes
-    self.permissions = {}
+    self.permissions = PermissionCache(cache_size, cache_ttl)
     self.use_remote_permissions = permissions_endpoint.startswith('http')
     self.permissions_location = permissions_endpoint
     self.config = configuration.Configuration
     self.update_frequency = update_frequency
+    self.snapshot_fetcher = resources.ConditionalFetcher()
+    self.snapshot_store = None
+    self.invalidation_subscriber = None
+    self._refresh_loop = None
+    self._snapshot_waiters = None
+    self._user_load_waiters = {}
+    self._snapshot_permissions = {}
+    self._snapshot_loaded_at = None
+    self._invalidation_generation = 0
+    self._reset_generation = 0
+    self._invalidated_users = {}
   
   def get_user_permissions(self, user_id):
     """ Returns the permissions structure for the indicated user.
@@ -54,22 +152,174 @@ class PermissionManager:
     current_time = int(time.time())
     permissions_deferred = None
     
-    # Check if the user has cached permissions
-    if user_id not in self.permissions:
-      # Update the user's permissions and return the results in a deferred
-      permissions_deferred = self._update_user_permissions(user_id)
+    # Check if the user has cached permissions (or is in the last snapshot)
+    cached_permissions = self.permissions.lookup(user_id)
+    if cached_permissions is None and self._snapshot_waiters is None:
+      cached_permissions = self._cache_snapshot_permissions(user_id)
+    if cached_permissions is None:
+      if self._snapshot_waiters is not None:
+        # Wait for the snapshot that's currently being loaded
+        permissions_deferred = self._wait_for_load(self._snapshot_waiters)
+        permissions_deferred.addCallback(self._get_snapshot_permissions, user_id)
+      elif user_id in self._user_load_waiters:
+        # Wait for the user's permissions to finish loading
+        permissions_deferred = self._wait_for_load(self._user_load_waiters[user_id])
+      else:
+        # Update the user's permissions and return the results in a deferred
+        self._user_load_waiters[user_id] = []
+        permissions_deferred = self._update_user_permissions(user_id)
+        permissions_deferred.addBoth(self._user_load_complete, user_id)
     else:
-      # Update the permissions in the background, if needed
-      if (current_time - self.permissions[user_id]['loaded_at']) >= self.update_frequency:
-        background_deferred = self._update_user_permissions(user_id)
+      # Refresh the permissions in the background, if needed
+      if (current_time - cached_permissions['loaded_at']) >= self.update_frequency:
+        background_deferred = self.refresh_permissions()
         background_deferred.addErrback(self._background_update_error)
       
       # Create a deferred and fire the user's cached permissions into it
-      permissions_deferred = defer.succeed(self.permissions[user_id].copy())
+      permissions_deferred = defer.succeed(cached_permissions.copy())
     
     # Return the user's permissions via a deferred
     return permissions_deferred
   
+  def refresh_permissions(self):
+    """ Refreshes the permissions of every user.
+
+    This method loads (or downloads) a snapshot of the entire permissions resource, validates it once, and replaces the 
+    cached permissions with it. If a refresh is already in progress, the returned deferred will be fired with its 
+    results instead of starting another one.
+
+    @note The snapshot is fetched using snapshot_fetcher (a ConditionalFetcher). If it hasn't changed since the last 
+          refresh, it won't be parsed or validated again and the cached permissions will just be marked as up to date.
+
+    @throws May errback with PermissionsError or PermissionsInvalidSchema if the snapshot can't be loaded or is invalid.
+            The cached permissions won't be changed if this happens.
+
+    @return Returns a deferred that will be fired with the number of users in the snapshot once it has been saved.
+    """
+
+    if self._snapshot_waiters is not None:
+      return self._wait_for_load(self._snapshot_waiters)
+
+    self._snapshot_waiters = []
+    refresh_deferred = self._start_snapshot_load()
+    refresh_deferred.addBoth(self._snapshot_load_complete)
+
+    return refresh_deferred
+
+  def load_snapshot(self):
+    """ Restores the permissions snapshot that was saved to the snapshot store by a previous run.
+
+    This method lets users execute commands right away after a restart instead of waiting for their permissions to be 
+    downloaded (or, if the permissions resource is unreachable, at all). The restored permissions have already been 
+    validated, so they aren't validated again.
+
+    @note The restored permissions keep the time that they were saved as their load time, so they'll be refreshed as 
+          soon as they're used if they're older than update_frequency.
+    @note This method is intended to be called during startup, before the reactor is running.
+
+    @return Returns True if the permissions were restored and False otherwise.
+    """
+
+    if self.snapshot_store is None:
+      return False
+
+    permissions_snapshot = self.snapshot_store.load('permissions')
+    if permissions_snapshot is None:
+      return False
+
+    self._replace_snapshot(permissions_snapshot[0], int(permissions_snapshot[1]))
+    logging.info("Restored a permissions snapshot with "+str(len(self._snapshot_permissions))+" user(s).")
+
+    return True
+
+  def start_refreshing(self, clock = None):
+    """ Starts refreshing the permissions snapshot every update_frequency seconds.
+
+    @note The first refresh is started immediately. Refresh errors are logged and the cached permissions are kept until
+          the next successful refresh.
+
+    @param clock  The reactor (or a task.Clock for testing) used to schedule the refreshes.
+    """
+
+    self.stop_refreshing()
+    self._refresh_loop = task.LoopingCall(self._scheduled_refresh)
+    self._refresh_loop.clock = clock if clock is not None else reactor
+    self._refresh_loop.start(self.update_frequency)
+
+  def stop_refreshing(self):
+    """ Stops the periodic permission refreshes started by start_refreshing.
+    """
+
+    if self._refresh_loop is not None and self._refresh_loop.running:
+      self._refresh_loop.stop()
+    self._refresh_loop = None
+
+  def subscribe_to_invalidations(self, subscription_location, poll_timeout = 60):
+    """ Starts listening for permission invalidations pushed by the user interface.
+
+    Once subscribed, the cached permissions of users are dropped as soon as the user interface reports that they have 
+    changed, so the permissions-update-period can be much longer without delaying permission changes.
+
+    @param subscription_location  The URL of the user interface's permission invalidation endpoint (see 
+                                  PermissionInvalidationSubscriber).
+    @param poll_timeout           How long (in seconds) the user interface may hold each subscription request open.
+    @return Returns the new PermissionInvalidationSubscriber.
+    """
+
+    self.unsubscribe_from_invalidations()
+    self.invalidation_subscriber = invalidation.PermissionInvalidationSubscriber(self, subscription_location,
+                                                                                 poll_timeout)
+    self.invalidation_subscriber.start()
+
+    return self.invalidation_subscriber
+
+  def unsubscribe_from_invalidations(self):
+    """ Stops the permission invalidation subscription started by subscribe_to_invalidations.
+    """
+
+    if self.invalidation_subscriber is not None:
+      self.invalidation_subscriber.stop()
+    self.invalidation_subscriber = None
+
+  def invalidate_user_permissions(self, user_ids):
+    """ Drops the cached permissions of the specified users.
+
+    The permissions of these users will be loaded again the next time they are requested. They are also removed from 
+    the last snapshot so that their old permissions aren't added back to the cache from it.
+
+    @param user_ids  A list containing the IDs of the users whose permissions have changed.
+    """
+
+    self._invalidation_generation += 1
+    for user_id in user_ids:
+      if user_id in self.permissions:
+        del self.permissions[user_id]
+      self._snapshot_permissions.pop(user_id, None)
+      self._invalidated_users[user_id] = self._invalidation_generation
+
+  def reset_user_permissions(self):
+    """ Refreshes the permissions of every user after their changes have been lost (e.g. by the user interface).
+
+    Unlike refresh_permissions, this method doesn't trust the results of a snapshot refresh or user permission load 
+    that's already in progress. Those are started again once they finish loading, so the returned deferred will be 
+    fired with a snapshot that was loaded after the reset.
+
+    @return Returns a deferred that will be fired with the number of users in the snapshot once it has been saved.
+    """
+
+    self._invalidation_generation += 1
+    self._reset_generation = self._invalidation_generation
+
+    return self.refresh_permissions()
+
+  def get_cache_statistics(self):
+    """ Returns statistics about the permission cache.
+
+    @return Returns a dictionary containing the cache's statistics (see PermissionCache.get_statistics).
+    """
+
+    return self.permissions.get_statistics()
+
   def purge_user_permissions(self, age):
     """ Removes all old permission settings.
     
@@ -92,6 +342,11 @@ class PermissionManager:
       if (current_time - self.permissions[temp_user_id]['loaded_at']) >= age:
         # Delete the permission entry
         del self.permissions[temp_user_id]
+
+    # Don't fill the cache from an old snapshot either
+    if self._snapshot_loaded_at is not None and (current_time - self._snapshot_loaded_at) >= age:
+      self._snapshot_permissions = {}
+      self._snapshot_loaded_at = None
   
   def _update_user_permissions(self, user_id):
     """ Updates the permissions for the indicated user.
@@ -118,7 +373,7 @@ class PermissionManager:
     
     # Validate & save
     defer_download.addCallback(self._validate_permissions, user_id)
-    defer_download.addCallback(self._save_permissions, user_id)
+    defer_download.addCallback(self._save_permissions, user_id, self._invalidation_generation)
     
     return defer_download
   
@@ -185,6 +440,66 @@ class PermissionManager:
     
     return permissions_file
   
+  def _fetch_snapshot(self):
+    """ Loads a snapshot of every user's permissions if it has changed since it was last loaded.
+
+    @throws PermissionsError if the snapshot can't be downloaded or loaded.
+
+    @note This method is intended to be called with threads.deferToThread.
+
+    @return Returns the raw snapshot, or None if it hasn't changed.
+    """
+
+    try:
+      if self.use_remote_permissions:
+        return self.snapshot_fetcher.fetch(self.permissions_location, self.config.get('permissions-update-timeout'))
+      return self.snapshot_fetcher.fetch(self.permissions_location)
+    except Exception:
+      if self.use_remote_permissions:
+        raise PermissionsError('There was an error downloading the permissions snapshot.')
+      raise PermissionsError('There was an error loading the user permissions file.')
+
+  def _start_snapshot_load(self):
+    """ Loads, validates, and saves a snapshot of every user's permissions.
+
+    @return Returns a deferred that will be fired with the number of users in the snapshot once it has been saved.
+    """
+
+    load_deferred = threads.deferToThread(self._fetch_snapshot)
+    load_deferred.addCallback(self._validate_permissions, None)
+    load_deferred.addErrback(self._snapshot_refresh_failed)
+    load_deferred.addCallback(self._save_snapshot, self._invalidation_generation)
+
+    return load_deferred
+
+  def _invalidated_since(self, user_id, load_generation):
+    """ Checks if a user's permissions were invalidated (or reset) after a load started.
+
+    @param user_id          The ID of the user.
+    @param load_generation  The invalidation generation when the load started.
+    @return Returns True if the permissions loaded for the user may be out of date and False otherwise.
+    """
+
+    return self._reset_generation > load_generation or self._invalidated_users.get(user_id, 0) > load_generation
+
+  def _prune_invalidations(self):
+    """ Forgets which users were invalidated once no loads that were started before the invalidations remain.
+    """
+
+    if self._snapshot_waiters is None and len(self._user_load_waiters) == 0:
+      self._invalidated_users = {}
+
+  def _snapshot_refresh_failed(self, failure):
+    """ Makes sure that a snapshot that couldn't be used is loaded again by the next refresh.
+
+    @param failure  The Failure describing why the refresh failed.
+    @return Returns the failure so that it's passed on to the rest of the errback chain.
+    """
+
+    self.snapshot_fetcher.invalidate(self.permissions_location)
+
+    return failure
+
   def _background_update_error(self, update_error):
     """ This callback responds to errors when updating the permissions in the background.
     
@@ -193,8 +508,215 @@ class PermissionManager:
     """
     
     return True
+
+  def _scheduled_refresh(self):
+    """ Runs a periodic permission refresh (see start_refreshing).
+
+    @return Returns a deferred that will be fired once the refresh completes, so that the next refresh isn't scheduled
+            until this one has finished.
+    """
+
+    refresh_deferred = self.refresh_permissions()
+    refresh_deferred.addErrback(self._scheduled_refresh_error)
+
+    return refresh_deferred
+
+  def _scheduled_refresh_error(self, refresh_error):
+    """ Logs a failed periodic permission refresh.
+
+    @param refresh_error  A Failure object containing the error.
+    """
+
+    logging.error("The user permissions could not be refreshed: "+refresh_error.getErrorMessage())
+
+  def _wait_for_load(self, load_waiters):
+    """ Returns a deferred that will be fired with the results of a load that's already in progress.
+
+    @param load_waiters  The list of deferreds waiting for the load.
+    @return Returns a new deferred that will be fired with the results of the load (or its error).
+    """
+
+    waiting_deferred = defer.Deferred()
+    load_waiters.append(waiting_deferred)
+
+    return waiting_deferred
+
+  def _notify_waiters(self, load_results, load_waiters):
+    """ Passes the results of a completed load to every deferred that was waiting for it.
+
+    @param load_results  The results of the load (or a Failure).
+    @param load_waiters  The list of deferreds waiting for the load.
+    """
+
+    for waiting_deferred in load_waiters:
+      if isinstance(load_results, failure.Failure):
+        waiting_deferred.errback(load_results)
+      elif isinstance(load_results, dict):
+        waiting_deferred.callback(load_results.copy())
+      else:
+        waiting_deferred.callback(load_results)
+
+  def _user_load_complete(self, load_results, user_id):
+    """ Passes the results of a user's permission load to the requests that were waiting for it.
+
+    @param load_results  The user's permissions (or a Failure).
+    @param user_id       The ID of the user whose permissions were loaded.
+    @return Returns load_results so that they're passed to the original request.
+    """
+
+    self._notify_waiters(load_results, self._user_load_waiters.pop(user_id, []))
+    self._prune_invalidations()
+
+    return load_results
+
+  def _snapshot_load_complete(self, load_results):
+    """ Passes the results of a snapshot refresh to the requests that were waiting for it.
+
+    @param load_results  The number of users in the snapshot (or a Failure).
+    @return Returns load_results so that they're passed to the request that started the refresh.
+    """
+
+    snapshot_waiters = self._snapshot_waiters
+    self._snapshot_waiters = None
+    self._notify_waiters(load_results, snapshot_waiters)
+    self._prune_invalidations()
+
+    return load_results
+
+  def _get_snapshot_permissions(self, snapshot_results, user_id):
+    """ Returns a user's permissions once the snapshot that their request was waiting for has been loaded.
+
+    @note Users that aren't cached are added to the cache from the snapshot. Users that aren't in the snapshot either 
+          (e.g. because they were invalidated while it was loading) have their permissions loaded individually.
+
+    @param snapshot_results  The results of the snapshot refresh.
+    @param user_id           The ID of the user whose permissions were requested.
+    @return Returns a copy of the user's permissions, or a deferred that will be fired with them.
+    """
+
+    if user_id not in self.permissions:
+      snapshot_permissions = self._cache_snapshot_permissions(user_id)
+      if snapshot_permissions is not None:
+        return snapshot_permissions.copy()
+
+      return self.get_user_permissions(user_id)
+
+    return self.permissions[user_id].copy()
+
+  def _save_snapshot(self, permission_settings, load_generation):
+    """ Replaces the cached permissions with a snapshot of every user's permissions.
+
+    @note If the permissions were reset while the snapshot was loading, it's discarded and loaded again.
+
+    @param permission_settings  An array containing the JSON permission objects for every user, or None if the snapshot
+                                hasn't changed since it was last loaded.
+    @param load_generation      The invalidation generation when the snapshot load started.
+    @return Returns the number of users in the snapshot, or a deferred that will be fired with the number of users in 
+            the reloaded snapshot.
+    """
+
+    if self._reset_generation > load_generation:
+      self.snapshot_fetcher.invalidate(self.permissions_location)
+      return self._start_snapshot_load()
+
+    # Mark the cached permissions as up to date if the snapshot hasn't changed
+    if permission_settings is None:
+      current_time = int(time.time())
+      for user_permissions in self.permissions.itervalues():
+        user_permissions['loaded_at'] = current_time
+      self._snapshot_loaded_at = current_time
+
+      return len(self._snapshot_permissions)
+
+    # Save a snapshot of the permissions in the background
+    if self.snapshot_store is not None:
+      snapshot_deferred = threads.deferToThread(self.snapshot_store.save, 'permissions',
+                                                [user_permissions.copy() for user_permissions in permission_settings])
+      snapshot_deferred.addErrback(self._snapshot_save_failed)
+
+    self._replace_snapshot(permission_settings, int(time.time()), load_generation)
+
+    return len(permission_settings)
+
+  def _replace_snapshot(self, permission_settings, loaded_at, load_generation = None):
+    """ Saves a new permissions snapshot and refreshes the cached users with it.
+
+    @param permission_settings  An array containing the JSON permission objects for every user.
+    @param loaded_at            When the snapshot was loaded (as a unix timestamp).
+    @param load_generation      The invalidation generation when the snapshot load started. Users that were invalidated
+                                since then are left out of the snapshot. If None, every user is saved.
+    """
+
+    self._snapshot_permissions = collections.OrderedDict()
+    for user_permissions in permission_settings:
+      if load_generation is None or not self._invalidated_since(user_permissions['user_id'], load_generation):
+        self._snapshot_permissions[user_permissions['user_id']] = user_permissions
+    self._snapshot_loaded_at = loaded_at
+
+    cached_permissions = {}
+    for user_id in self.permissions.keys():
+      if user_id in self._snapshot_permissions:
+        cached_permissions[user_id] = self._compile_snapshot_permissions(user_id)
+    self.permissions.replace(cached_permissions)
+
+  def _cache_snapshot_permissions(self, user_id):
+    """ Adds a user's permissions from the last snapshot to the cache.
+
+    @param user_id  The ID of the user.
+    @return Returns the user's cached permissions, or None if they aren't in the last snapshot.
+    """
+
+    if user_id not in self._snapshot_permissions:
+      return None
+
+    self.permissions[user_id] = self._compile_snapshot_permissions(user_id)
+
+    return self.permissions[user_id]
+
+  def _compile_snapshot_permissions(self, user_id):
+    """ Compiles a user's permissions from the last snapshot.
+
+    @note The snapshot's copy of the permissions isn't modified, so it can be compiled again if the user is evicted.
+
+    @param user_id  The ID of the user.
+    @return Returns the user's compiled permissions, with the snapshot's load time as their load time.
+    """
+
+    user_permissions = self._compile_user_permissions(self._snapshot_permissions[user_id].copy())
+    user_permissions['loaded_at'] = self._snapshot_loaded_at
+
+    return user_permissions
+
+  def _snapshot_save_failed(self, save_error):
+    """ Logs a permissions snapshot that couldn't be saved.
+
+    @param save_error  A Failure object containing the error.
+    """
+
+    logging.error("The user permissions snapshot could not be saved: "+save_error.getErrorMessage())
+
+  def _compile_user_permissions(self, user_permissions):
+    """ Prepares a user's downloaded permissions to be cached.
+
+    This method compiles the user's permitted commands into a CompiledPermissions index, which is stored in the 
+    'compiled_permissions' field of their permissions, and sets their load time. The existing index is reused if the
+    user's 'generated_at' value hasn't changed since their permissions were last saved.
+
+    @param user_permissions  The user's JSON permission object.
+    @return Returns user_permissions.
+    """
+
+    previous_permissions = self.permissions.get(user_permissions['user_id'], None)
+    if (previous_permissions is not None and 'compiled_permissions' in previous_permissions and
+        previous_permissions['generated_at'] == user_permissions['generated_at']):
+      user_permissions['compiled_permissions'] = previous_permissions['compiled_permissions']
+    else:
+      user_permissions['compiled_permissions'] = CompiledPermissions(user_permissions['permitted_commands'])
+    user_permissions['loaded_at'] = int(time.time())
+
+    return user_permissions
   
-  def _save_permissions(self, permission_settings, user_id):
+  def _save_permissions(self, permission_settings, user_id, load_generation):
     """ Saves the user command execution permission settings in the PermissionManager.
     
     This callback saves the permissions for every user with permissions defined in permission settings.
@@ -204,32 +726,44 @@ class PermissionManager:
           represented in permission_settings, the permissions will be saved for all of them. This prevents frequent file
           loads when operating in offline mode.
     @note If a user already has non-expired permissions in the manager, they will be overwritten by the new values.
+    @note If the permission cache is bounded, the permissions of other users are only saved if they're already cached
+          or if the cache has room for them, so that loading one user's permissions doesn't evict the active users.
+    @note Each user's permitted commands are compiled into a CompiledPermissions index, which is stored in the 
+          'compiled_permissions' field of their permissions. The index is only rebuilt if the user's 'generated_at'
+          value has changed since their permissions were last saved.
+    @note Users whose permissions were invalidated after the load started aren't saved. If the original user was 
+          invalidated, their permissions are loaded again.
     
     @throws PermissionsUserNotFound if the user originally indicated couldn't be located in the loaded permissions
             resource.
     
     @param permission_settings  An array containing the JSON permission objects for users it includes.
     @param user_id              The ID of the user that was initially queried for.
-    @return Returns the permission settings for the user that was originally queried for.
+    @param load_generation      The invalidation generation when the load started.
+    @return Returns the permission settings for the user that was originally queried for, or a deferred that will be 
+            fired with their reloaded permission settings.
     """
     
     target_user_permissions = None
-    current_time = int(time.time())
+
+    if self._invalidated_since(user_id, load_generation):
+      return self._update_user_permissions(user_id)
     
-    # Loop through and save every permission object
+    # Loop through and save every permission object, leaving room for the original user
+    reserved_entries = 0 if user_id in self.permissions else 1
     for user_permissions in permission_settings:
-      self.permissions[user_permissions['user_id']] = user_permissions
-      
-      # Set the load time
-      self.permissions[user_permissions['user_id']]['loaded_at'] = current_time
-      
       if user_permissions['user_id'] == user_id:
         target_user_permissions = user_permissions
+      elif self._invalidated_since(user_permissions['user_id'], load_generation):
+        continue
+      elif user_permissions['user_id'] in self.permissions or self.permissions.has_room(reserved_entries):
+        self.permissions[user_permissions['user_id']] = self._compile_user_permissions(user_permissions)
     
     # Make sure the original user's permissions were downloaded
     if target_user_permissions is None:
       raise PermissionsUserNotFound("The permissions for user '"+user_id+"' could not be found upon loading the latest "
                                     "version of the permissions resource.")
+    self.permissions[user_id] = self._compile_user_permissions(target_user_permissions)
     
     # Return a copy of the user's permission
     return target_user_permissions.copy()
@@ -243,91 +777,296 @@ class PermissionManager:
             permission settings schema.
     @throws Throws PermissionsError if the raw permissions resource can't be parsed.
     
-    @param raw_permissions  A raw, unparsed, permissions resource file (either from net or local machine).
-    @param user_id          The ID of the user who's permissions are being queried for.
-    @return Returns a dictionary containing the parsed permissions.
+    @param raw_permissions  A raw, unparsed, permissions resource file (either from net or local machine) or string. May
+                            be None for snapshots that haven't changed since they were last loaded.
+    @param user_id          The ID of the user who's permissions are being queried for, or None if this is a snapshot of
+                            every user's permissions.
+    @return Returns a dictionary containing the parsed permissions, or None if raw_permissions is None.
     """
     
+    if raw_permissions is None:
+      return None
+
     # Parse the schedule JSON
     try:
-      permission_settings = json.load(raw_permissions)
+      if isinstance(raw_permissions, basestring):
+        permission_settings = json.loads(raw_permissions)
+      else:
+        permission_settings = json.load(raw_permissions)
     except ValueError:
       # Error parsing the permissions JSON
+      if user_id is None:
+        raise PermissionsError('The permissions snapshot did not contain a parsable JSON object.')
       raise PermissionsError('The permissions resource for user \''+user_id+'\' did not contain a parsable JSON object.')
     
-    # Define the schema
-    permission_list_schema = {
-      "type": "array",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "items": {
-        "type": "object",
-        "additionalProperties": False,
-        "properties": {
-          "generated_at": {
-            "type": "number",
-            "id": "generated_at",
-            "required": True
-          },
-          "user_id": {
-            "type": "string",
-            "id": "user_id",
-            "required": True
-          },
-          "username": {
-            "type": "string",
-            "id": "username",
-            "required": True
-          },
-          "ignore_session_protections": {
-            "type": "boolean",
-            "id": "ignore_session_protections",
-            "required": False
-          },
-          "permitted_commands": {
-            "type": "array",
-            "id": "permitted_commands",
-            "required": True,
-            "items": {
-              "type": "object",
-              "additionalProperties": True,
-              "properties": {
-                "command": {
-                  "type": "string",
-                  "id": "command",
-                  "required": True
-                },
-                "destination": {
-                  "type": "string",
-                  "id": "destination",
-                  "required": True
-                },
-                "pipelines": {
-                  "type": "array",
-                  "id": "pipelines",
-                  "required": False,
-                  "minitems": 1,
-                  "items": {
-                    "type": "string"
-                  }
-                }
-              }
-            }
-          }
-        }
-      }
-    }
-  
     # Validate the JSON schema
-    schema_validator = jsonschema.Draft3Validator(permission_list_schema)
     try:
-      schema_validator.validate(permission_settings)
+      Validators.validate('permissions', permission_settings)
     except jsonschema.ValidationError:
       # Invalid permission list JSON
       raise PermissionsInvalidSchema("The provided permission list did not conform to the defined schema.")
     
     return permission_settings
 
+class PermissionCache(object):
+  """ Stores the cached permissions of each user.
+
+  This class is a dictionary of user permissions keyed by user ID that can be bounded in size and age. When it holds 
+  more than max_entries users, the permissions of the least recently used users are evicted. If an entry_ttl is set, 
+  users whose permissions haven't been used for that long are evicted periodically once start_eviction has been called.
+  Evicted users will have their permissions loaded again the next time they're needed.
+
+  @note Only lookup counts as a use of a user's permissions (for the LRU order, TTL, and hit/miss counters). The 
+        dictionary methods don't, so that the permission manager can update the cache without affecting them.
+  @note The memory estimate is approximate. It's the sum of the sizes of each user's permission objects (as reported 
+        by sys.getsizeof), calculated when they're added to the cache.
+  """
+
+  def __init__(self, max_entries = None, entry_ttl = None, clock = None):
+    """ Sets up the cache.
+
+    @param max_entries  The maximum number of users to store permissions for, or None for no limit.
+    @param entry_ttl    How long (in seconds) a user's permissions are kept after they were last used, or None to keep 
+                        them until they are evicted to make room for other users.
+    @param clock        An object that provides seconds() and callLater() methods (typically the reactor).
+    """
+
+    self.max_entries = max_entries
+    self.entry_ttl = entry_ttl
+    self.clock = clock if clock is not None else reactor
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+    self.memory_estimate = 0
+    self._entries = collections.OrderedDict()
+    self._entry_sizes = {}
+    self._last_used = {}
+    self._eviction_loop = None
+
+  def lookup(self, user_id):
+    """ Returns a user's cached permissions and marks them as recently used.
+
+    @param user_id  The ID of the user.
+    @return Returns the user's cached permissions, or None if they aren't cached.
+    """
+
+    user_permissions = self._entries.get(user_id, None)
+    if user_permissions is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    del self._entries[user_id]
+    self._entries[user_id] = user_permissions
+    self._last_used[user_id] = self.clock.seconds()
+
+    return user_permissions
+
+  def replace(self, new_entries):
+    """ Replaces the cached permissions with a snapshot of every user's permissions.
+
+    Users that are cached but missing from the snapshot are removed. Users that are cached and in the snapshot are 
+    updated and keep their position in the LRU order (and their last use time). Users that aren't cached aren't added, 
+    so the snapshot doesn't bring back users that were evicted or expired.
+
+    @param new_entries  A dictionary containing the permissions of every user, keyed by user ID.
+    """
+
+    for user_id in self._entries.keys():
+      if user_id in new_entries:
+        self[user_id] = new_entries[user_id]
+      else:
+        del self[user_id]
+
+  def has_room(self, reserved_entries = 0):
+    """ Checks if the cache can store another user's permissions without evicting anyone.
+
+    @param reserved_entries  The number of entries to keep free for other users.
+    @return Returns True if the cache has room for another user and False otherwise.
+    """
+
+    return self.max_entries is None or len(self._entries)+reserved_entries < self.max_entries
+
+  def evict_expired(self):
+    """ Evicts the permissions of users that haven't been used for longer than entry_ttl.
+
+    @return Returns the number of users that were evicted.
+    """
+
+    if self.entry_ttl is None:
+      return 0
+
+    # Entries are stored in the order that they were last used, so the search can stop at the first unexpired one
+    expired_before = self.clock.seconds()-self.entry_ttl
+    expired_count = 0
+    while len(self._entries) > 0:
+      user_id = next(self._entries.iterkeys())
+      if self._last_used[user_id] > expired_before:
+        break
+      del self[user_id]
+      expired_count += 1
+
+    self.expirations += expired_count
+
+    return expired_count
+
+  def start_eviction(self, eviction_interval = 60):
+    """ Starts periodically evicting expired permissions.
+
+    @param eviction_interval  How often (in seconds) to check for expired permissions.
+    """
+
+    self.stop_eviction()
+    if self.entry_ttl is None:
+      return
+
+    self._eviction_loop = task.LoopingCall(self.evict_expired)
+    self._eviction_loop.clock = self.clock
+    self._eviction_loop.start(eviction_interval, now = False)
+
+  def stop_eviction(self):
+    """ Stops the periodic eviction started by start_eviction.
+    """
+
+    if self._eviction_loop is not None and self._eviction_loop.running:
+      self._eviction_loop.stop()
+    self._eviction_loop = None
+
+  def get_statistics(self):
+    """ Returns statistics about the cache.
+
+    @return Returns a dictionary containing the cache's limits, the number of cached users, the hit, miss, eviction (to
+            make room for other users), and expiration counts, and the estimated size of the cached permissions in 
+            bytes.
+    """
+
+    return {
+      'entries': len(self._entries),
+      'max_entries': self.max_entries,
+      'entry_ttl': self.entry_ttl,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'expirations': self.expirations,
+      'memory_estimate': self.memory_estimate
+    }
+
+  def get(self, user_id, default = None):
+    return self._entries.get(user_id, default)
+
+  def keys(self):
+    return self._entries.keys()
+
+  def values(self):
+    return self._entries.values()
+
+  def itervalues(self):
+    return self._entries.itervalues()
+
+  def items(self):
+    return self._entries.items()
+
+  def iteritems(self):
+    return self._entries.iteritems()
+
+  def __contains__(self, user_id):
+    return user_id in self._entries
+
+  def __iter__(self):
+    return iter(self._entries)
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getitem__(self, user_id):
+    return self._entries[user_id]
+
+  def __setitem__(self, user_id, user_permissions):
+    """ Stores a user's permissions, evicting the least recently used users if the cache is full.
+    """
+
+    if user_id in self._entries:
+      self.memory_estimate -= self._entry_sizes[user_id]
+    else:
+      self._last_used[user_id] = self.clock.seconds()
+    self._entries[user_id] = user_permissions
+    self._entry_sizes[user_id] = _estimate_size(user_permissions)
+    self.memory_estimate += self._entry_sizes[user_id]
+
+    while self.max_entries is not None and len(self._entries) > self.max_entries:
+      del self[next(self._entries.iterkeys())]
+      self.evictions += 1
+
+  def __delitem__(self, user_id):
+    del self._entries[user_id]
+    self.memory_estimate -= self._entry_sizes.pop(user_id)
+    del self._last_used[user_id]
+
+def _estimate_size(value):
+  """ Estimates how much memory a permission object uses.
+
+  @param value  The object to measure. Dictionaries, lists, and CompiledPermissions are measured recursively.
+  @return Returns the estimated size of the object in bytes.
+  """
+
+  object_size = sys.getsizeof(value)
+  if isinstance(value, dict):
+    object_size += sum(_estimate_size(key)+_estimate_size(item) for key, item in value.iteritems())
+  elif isinstance(value, (list, tuple, frozenset)):
+    object_size += sum(_estimate_size(item) for item in value)
+  elif isinstance(value, CompiledPermissions):
+    object_size += _estimate_size(value._index)
+
+  return object_size
+
+class CompiledPermissions(object):
+  """ An index of a user's permitted commands.
+
+  This class compiles the list of commands that a user is allowed to execute (the 'permitted_commands' field of their 
+  permission settings) into a dictionary keyed by (command, destination). This allows the command parser to check if a
+  user can execute a command using a single dictionary lookup instead of scanning all of the user's permission rules.
+
+  @note Instances of this class are not modified after they have been compiled and can be safely shared between copies
+        of a user's permissions.
+  """
+
+  __slots__ = ['_index']
+
+  def __init__(self, permitted_commands):
+    """ Compiles the permitted commands.
+
+    @param permitted_commands  An array containing the user's command permission rules, as defined in the permission 
+                               list schema.
+    """
+
+    # Collect the allowed pipelines for each (command, destination) pair. A value of None means any pipeline is allowed.
+    index = {}
+    for command_permission in permitted_commands:
+      permission_key = (command_permission['command'], command_permission['destination'])
+      if 'pipelines' not in command_permission:
+        index[permission_key] = None
+      elif index.get(permission_key, ()) is not None:
+        index[permission_key] = index.get(permission_key, frozenset()).union(command_permission['pipelines'])
+
+    self._index = index
+
+  def allows(self, command, destination, pipeline = None):
+    """ Checks if the permissions allow the specified command to be executed.
+
+    @param command      The name of the command.
+    @param destination  The destination of the command (the system command handler name or device ID).
+    @param pipeline     The ID of the pipeline that the command is being sent through, if any.
+    @return Returns True if the command is allowed and False otherwise.
+    """
+
+    try:
+      allowed_pipelines = self._index[(command, destination)]
+    except KeyError:
+      return False
+
+    return allowed_pipelines is None or (pipeline is not None and pipeline in allowed_pipelines)
+
 # Define permission related exceptions
 class PermissionsInvalidSchema(Exception):
   pass
@@ -0,0 +1,140 @@
+# Import required modules
+import logging, json, time
+from twisted.trial import unittest
+from twisted.internet import reactor, defer, task
+from twisted.internet.defer import inlineCallbacks
+from twisted.web import server, resource
+from mock import MagicMock
+from hwm.network.security import invalidation, permissions
+
+class TestPermissionInvalidationSubscriber(unittest.TestCase):
+  """ This test suite tests the permission invalidation subscriber, which long-polls the user interface for users whose
+  permissions have changed.
+  """
+
+  def setUp(self):
+    # Start a stand-in invalidation server
+    self.invalidation_resource = InvalidationResource()
+    self.invalidation_server = reactor.listenTCP(0, server.Site(self.invalidation_resource), interface = '127.0.0.1')
+    self.addCleanup(self.invalidation_server.stopListening)
+    self.subscription_url = 'http://127.0.0.1:'+str(self.invalidation_server.getHost().port)+'/invalidations'
+
+    # Set up a permission manager with some cached permissions
+    self.permission_manager = permissions.PermissionManager('test_permissions.json', 3600)
+    for user_id in ['1', '2', '3']:
+      self.permission_manager.permissions[user_id] = {'user_id': user_id, 'loaded_at': int(time.time())}
+    self.permission_manager.refresh_permissions = MagicMock(return_value = defer.succeed(3))
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  @inlineCallbacks
+  def test_push_invalidations(self):
+    """ Verifies that pushed invalidations drop the cached permissions of the listed users and that the subscriber
+    resumes from the latest cursor.
+    """
+
+    subscriber = self.permission_manager.subscribe_to_invalidations(self.subscription_url, 30)
+    self.addCleanup(self.permission_manager.unsubscribe_from_invalidations)
+
+    # Push an invalidation for two users
+    yield self.invalidation_resource.wait_for_request()
+    self.assertEqual(self.invalidation_resource.requests[-1], {'cursor': [''], 'timeout': ['30']})
+    self.invalidation_resource.push({'cursor': 'c1', 'user_ids': ['1', '3', '99']})
+    yield self.invalidation_resource.wait_for_request()
+    self.assertEqual(sorted(self.permission_manager.permissions.keys()), ['2'])
+    self.assertEqual(self.invalidation_resource.requests[-1]['cursor'], ['c1'])
+    self.assertEqual(subscriber.invalidation_count, 3)
+
+    # Poll timeouts and resets
+    self.invalidation_resource.push(None)
+    yield self.invalidation_resource.wait_for_request()
+    self.invalidation_resource.push({'cursor': 'c2', 'reset': True})
+    yield self.invalidation_resource.wait_for_request()
+    self.assertEqual(self.permission_manager.refresh_permissions.call_count, 1)
+    self.assertEqual(self.invalidation_resource.requests[-1]['cursor'], ['c2'])
+
+  @inlineCallbacks
+  def test_retry_failed_requests(self):
+    """ Verifies that failed and invalid responses are retried with an increasing delay.
+    """
+
+    test_clock = task.Clock()
+    subscriber = invalidation.PermissionInvalidationSubscriber(self.permission_manager, self.subscription_url,
+                                                               retry_delay = 5, clock = test_clock)
+    self.addCleanup(subscriber.stop)
+    subscriber.start()
+
+    # Server error
+    yield self.invalidation_resource.wait_for_request()
+    self.invalidation_resource.push({'cursor': 'c1'}, 500)
+    yield self._wait_for_failures(subscriber, 1)
+    self.assertEqual(test_clock.getDelayedCalls()[-1].getTime(), 5)
+
+    # Invalid response
+    test_clock.advance(5)
+    yield self.invalidation_resource.wait_for_request()
+    self.invalidation_resource.push({'user_ids': ['1']})
+    yield self._wait_for_failures(subscriber, 2)
+    self.assertEqual(len(self.permission_manager.permissions), 3)
+    self.assertEqual(test_clock.getDelayedCalls()[-1].getTime(), 15)
+
+    # Recovery
+    test_clock.advance(10)
+    yield self.invalidation_resource.wait_for_request()
+    self.invalidation_resource.push({'cursor': 'c1', 'user_ids': ['2']})
+    yield self.invalidation_resource.wait_for_request()
+    self.assertTrue('2' not in self.permission_manager.permissions)
+    self.assertEqual(subscriber.poll_count, 4)
+
+  @inlineCallbacks
+  def _wait_for_failures(self, subscriber, failure_count):
+    while subscriber.failure_count < failure_count:
+      yield task.deferLater(reactor, 0.01, lambda: None)
+
+class InvalidationResource(resource.Resource):
+  """ A stand-in for the user interface's permission invalidation endpoint that holds each request until the test
+  pushes a response.
+  """
+
+  isLeaf = True
+
+  def __init__(self):
+    resource.Resource.__init__(self)
+    self.requests = []
+    self._pending_request = None
+    self._request_waiter = None
+
+  def render_GET(self, request):
+    self.requests.append(request.args)
+    self._pending_request = request
+    if self._request_waiter is not None:
+      request_waiter, self._request_waiter = self._request_waiter, None
+      request_waiter.callback(request)
+
+    return server.NOT_DONE_YET
+
+  def wait_for_request(self):
+    """ Returns a deferred that will be fired once there is a request waiting for a response.
+    """
+
+    if self._pending_request is not None:
+      return defer.succeed(self._pending_request)
+
+    self._request_waiter = defer.Deferred()
+    return self._request_waiter
+
+  def push(self, invalidations, response_code = 200):
+    """ Responds to the waiting request.
+
+    @param invalidations  The dictionary to respond with, or None to respond with 204 (No Content).
+    @param response_code  The HTTP response code to use if invalidations isn't None.
+    """
+
+    pending_request, self._pending_request = self._pending_request, None
+    if invalidations is None:
+      pending_request.setResponseCode(204)
+    else:
+      pending_request.setResponseCode(response_code)
+      pending_request.write(json.dumps(invalidations))
+    pending_request.finish()
@@ -3,8 +3,12 @@ import logging, time, json
 from pkg_resources import Requirement, resource_filename
 from twisted.trial import unittest
 from twisted.test import proto_helpers
+from twisted.internet import defer, task, threads
+from twisted.internet.defer import inlineCallbacks
+from mock import MagicMock
 from hwm.core.configuration import *
 from hwm.network.security import permissions
+from hwm.core import snapshots
 
 class TestPermissionManager(unittest.TestCase):
   """ This test suite tests the permission manager class, which is used to manage and cache downloaded user command
@@ -169,5 +173,315 @@ class TestPermissionManager(unittest.TestCase):
     update_deferred.addCallback(user_permissions_callback)
     
     return update_deferred
-    
-    
+
+  @inlineCallbacks
+  def test_snapshot_refresh(self):
+    """ Verifies that a snapshot refresh loads the permissions of every user at once, refreshes the cached users, 
+    removes the permissions of users that are no longer in the permissions resource, and lets the other users be cached
+    from the snapshot.
+    """
+
+    # Initialize the permission manager with the permissions of a user that isn't in the permissions file
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    permission_manager.permissions['1'] = {'user_id': '1', 'generated_at': 0, 'loaded_at': 0}
+    permission_manager.permissions['77'] = {'user_id': '77', 'loaded_at': int(time.time())}
+
+    user_count = yield permission_manager.refresh_permissions()
+    self.assertEqual(user_count, 5)
+    self.assertEqual(permission_manager.permissions.keys(), ['1'])
+    self.assertTrue(permission_manager.permissions['1']['compiled_permissions'].allows('station_time', 'system'))
+
+    # Users that aren't cached are added from the snapshot instead of being loaded individually
+    permission_manager._load_local_permissions = MagicMock(wraps=permission_manager._load_local_permissions)
+    user_permissions = yield permission_manager.get_user_permissions('2')
+    self.assertEqual(user_permissions['username'], 'test_user_old')
+    self.assertTrue('compiled_permissions' not in permission_manager._snapshot_permissions['2'])
+    self.assertEqual(sorted(permission_manager.permissions.keys()), ['1', '2'])
+    self.assertEqual(permission_manager._load_local_permissions.call_count, 0)
+
+    # Unchanged snapshots aren't parsed again
+    permission_manager._validate_permissions = MagicMock(wraps=permission_manager._validate_permissions)
+    permission_manager.permissions['1']['loaded_at'] = 42
+    user_count = yield permission_manager.refresh_permissions()
+    self.assertEqual(user_count, 5)
+    self.assertEqual(permission_manager._validate_permissions.call_args[0][0], None)
+    self.assertTrue(permission_manager.permissions['1']['loaded_at'] > 42)
+
+    # A failed refresh keeps the cached permissions
+    permission_manager.permissions_location = self.source_data_directory+'/network/security/tests/data/test_permissions_doesnt_exist.json'
+    yield self.assertFailure(permission_manager.refresh_permissions(), permissions.PermissionsError)
+    self.assertEqual(len(permission_manager.permissions), 2)
+
+  @inlineCallbacks
+  def test_single_flight_loads(self):
+    """ Verifies that concurrent requests for the same permissions share a single load and that requests for users 
+    that aren't cached wait for a snapshot refresh that's already in progress.
+    """
+
+    # Initialize the permission manager
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    permission_manager._load_local_permissions = MagicMock(wraps=permission_manager._load_local_permissions)
+
+    # Concurrent requests for the same user
+    permission_results = yield defer.gatherResults([permission_manager.get_user_permissions('1') for i in range(3)])
+    self.assertEqual(permission_manager._load_local_permissions.call_count, 1)
+    self.assertEqual([user_permissions['username'] for user_permissions in permission_results], ['test_admin']*3)
+    self.assertTrue(permission_results[1] is not permission_results[2])
+
+    # Requests received while a snapshot is being refreshed
+    permission_manager._load_local_permissions.reset_mock()
+    permission_manager.snapshot_fetcher.fetch = MagicMock(wraps=permission_manager.snapshot_fetcher.fetch)
+    del permission_manager.permissions['2']
+    refresh_deferreds = [permission_manager.refresh_permissions(), permission_manager.refresh_permissions()]
+    user_deferred = permission_manager.get_user_permissions('2')
+    missing_user_deferred = permission_manager.get_user_permissions('99')
+    self.assertEqual((yield defer.gatherResults(refresh_deferreds)), [5, 5])
+    self.assertEqual((yield user_deferred)['username'], 'test_user_old')
+    yield self.assertFailure(missing_user_deferred, permissions.PermissionsUserNotFound)
+    self.assertEqual(permission_manager.snapshot_fetcher.fetch.call_count, 1)
+
+    # Only the user that wasn't in the snapshot is loaded individually
+    self.assertEqual(permission_manager._load_local_permissions.call_count, 1)
+
+  @inlineCallbacks
+  def test_invalidations_during_loads(self):
+    """ Verifies that loads that were in progress when a user's permissions were invalidated (or reset) don't cache 
+    the outdated permissions.
+    """
+
+    # Finish the loads manually
+    pending_loads = []
+    def defer_load(load_function, *args):
+      load_deferred = defer.Deferred()
+      pending_loads.append((load_deferred, load_function, args))
+      return load_deferred
+    def finish_load():
+      load_deferred, load_function, args = pending_loads.pop(0)
+      load_deferred.callback(load_function(*args))
+    self.patch(threads, 'deferToThread', defer_load)
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+
+    # Users invalidated during a snapshot refresh are loaded individually
+    refresh_deferred = permission_manager.refresh_permissions()
+    user_deferred = permission_manager.get_user_permissions('1')
+    permission_manager.invalidate_user_permissions(['1'])
+    finish_load()
+    self.assertEqual((yield refresh_deferred), 5)
+    self.assertTrue('1' not in permission_manager._snapshot_permissions)
+    self.assertEqual(len(pending_loads), 1)
+    finish_load()
+    self.assertEqual((yield user_deferred)['username'], 'test_admin')
+    self.assertTrue('1' in permission_manager.permissions)
+
+    # User loads that were in progress when the user was invalidated are started again
+    permission_manager.invalidate_user_permissions(['2'])
+    user_deferred = permission_manager.get_user_permissions('2')
+    permission_manager.invalidate_user_permissions(['2'])
+    finish_load()
+    self.assertTrue('2' not in permission_manager.permissions)
+    waiting_deferred = permission_manager.get_user_permissions('2')
+    self.assertEqual(len(pending_loads), 1)
+    finish_load()
+    self.assertEqual([(yield user_deferred)['user_id'], (yield waiting_deferred)['user_id']], ['2', '2'])
+    self.assertTrue('2' in permission_manager.permissions)
+
+    # Resets restart the snapshot refresh that's in progress
+    permission_manager.snapshot_fetcher.fetch = MagicMock(wraps=permission_manager.snapshot_fetcher.fetch)
+    refresh_deferred = permission_manager.refresh_permissions()
+    reset_deferred = permission_manager.reset_user_permissions()
+    finish_load()
+    self.assertEqual(len(pending_loads), 1)
+    finish_load()
+    self.assertEqual((yield defer.gatherResults([refresh_deferred, reset_deferred])), [5, 5])
+    self.assertEqual(permission_manager.snapshot_fetcher.fetch.call_count, 2)
+    self.assertEqual(permission_manager._invalidated_users, {})
+
+  def test_periodic_refresh(self):
+    """ Verifies that start_refreshing refreshes the permissions snapshot once per update period.
+    """
+
+    # Initialize the permission manager with a fake clock
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 60)
+    permission_manager.refresh_permissions = MagicMock(return_value = defer.succeed(5))
+    test_clock = task.Clock()
+
+    permission_manager.start_refreshing(test_clock)
+    self.assertEqual(permission_manager.refresh_permissions.call_count, 1)
+    test_clock.advance(30)
+    self.assertEqual(permission_manager.refresh_permissions.call_count, 1)
+    test_clock.advance(30)
+    self.assertEqual(permission_manager.refresh_permissions.call_count, 2)
+
+    # Failed refreshes don't stop the schedule
+    permission_manager.refresh_permissions.side_effect = lambda: defer.fail(permissions.PermissionsError("Test error."))
+    test_clock.advance(60)
+    test_clock.advance(60)
+    self.assertEqual(permission_manager.refresh_permissions.call_count, 4)
+
+    permission_manager.stop_refreshing()
+    test_clock.advance(60)
+    self.assertEqual(permission_manager.refresh_permissions.call_count, 4)
+
+  def test_permission_cache(self):
+    """ Verifies that PermissionCache evicts the least recently used and expired permissions and counts its hits, 
+    misses, and evictions.
+    """
+
+    test_clock = task.Clock()
+    permission_cache = permissions.PermissionCache(max_entries = 3, entry_ttl = 100, clock = test_clock)
+    for user_id in ['1', '2', '3']:
+      permission_cache[user_id] = {'user_id': user_id, 'permitted_commands': ['station_time']}
+
+    # Using a user's permissions protects them from the next eviction
+    self.assertEqual(permission_cache.lookup('1')['user_id'], '1')
+    self.assertEqual(permission_cache.lookup('5'), None)
+    permission_cache['4'] = {'user_id': '4'}
+    self.assertEqual(sorted(permission_cache.keys()), ['1', '3', '4'])
+    memory_estimate = permission_cache.memory_estimate
+    self.assertTrue(memory_estimate > 0)
+
+    # Expired permissions are evicted in the background
+    permission_cache.start_eviction(10)
+    test_clock.advance(60)
+    permission_cache.lookup('3')
+    test_clock.advance(50)
+    self.assertEqual(sorted(permission_cache.keys()), ['3'])
+    permission_cache.stop_eviction()
+    test_clock.advance(100)
+    self.assertEqual(len(permission_cache), 1)
+    self.assertTrue(permission_cache.memory_estimate < memory_estimate)
+
+    # Replacing the cached permissions only updates the users that are still cached
+    permission_cache.replace({'1': {'user_id': '1'}, '3': {'user_id': '3', 'generated_at': 1}})
+    self.assertEqual(permission_cache.keys(), ['3'])
+    self.assertEqual(permission_cache['3']['generated_at'], 1)
+
+    cache_statistics = permission_cache.get_statistics()
+    self.assertEqual((cache_statistics['hits'], cache_statistics['misses']), (2, 1))
+    self.assertEqual((cache_statistics['evictions'], cache_statistics['expirations']), (1, 2))
+
+  @inlineCallbacks
+  def test_bounded_snapshot_refresh(self):
+    """ Verifies that snapshot refreshes respect the permission cache's size limit and that users who didn't fit in 
+    the cache can still be loaded.
+    """
+
+    # Initialize the permission manager with a small cache
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600, cache_size = 2)
+    test_clock = task.Clock()
+    permission_manager.permissions = permissions.PermissionCache(2, 100, clock = test_clock)
+    yield permission_manager.get_user_permissions('3')
+
+    user_count = yield permission_manager.refresh_permissions()
+    self.assertEqual(user_count, 5)
+    self.assertEqual(sorted(permission_manager.permissions.keys()), ['1', '3'])
+
+    # Requests waiting for a snapshot add users that didn't fit from the snapshot
+    permission_manager._load_local_permissions = MagicMock(wraps=permission_manager._load_local_permissions)
+    refresh_deferred = permission_manager.refresh_permissions()
+    user_deferred = permission_manager.get_user_permissions('5')
+    yield refresh_deferred
+    self.assertEqual((yield user_deferred)['user_id'], '5')
+    self.assertEqual(len(permission_manager.permissions), 2)
+    self.assertTrue('5' in permission_manager.permissions)
+    self.assertEqual(permission_manager._load_local_permissions.call_count, 0)
+
+    # Expired users aren't brought back by the next snapshot
+    test_clock.advance(150)
+    self.assertEqual(permission_manager.permissions.evict_expired(), 2)
+    permission_manager.snapshot_fetcher.invalidate(permission_manager.permissions_location)
+    yield permission_manager.refresh_permissions()
+    self.assertEqual(len(permission_manager.permissions), 0)
+
+  @inlineCallbacks
+  def test_snapshot_warm_start(self):
+    """ Verifies that permission snapshots are saved to the snapshot store and can be used by a new permission manager
+    without loading the permissions resource.
+    """
+
+    # Save the snapshots synchronously
+    self.patch(threads, 'deferToThread', defer.maybeDeferred)
+    snapshot_store = snapshots.SnapshotStore(self.mktemp())
+
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+    permission_manager.snapshot_store = snapshot_store
+    yield permission_manager.refresh_permissions()
+
+    # Restore the permissions in a manager whose permissions resource doesn't exist
+    restored_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_doesnt_exist.json', 3600)
+    restored_manager.snapshot_store = snapshot_store
+    self.assertTrue(restored_manager.load_snapshot())
+    self.assertEqual(len(restored_manager.permissions), 0)
+    self.assertTrue('compiled_permissions' not in snapshot_store.load('permissions')[0][0])
+
+    user_permissions = yield restored_manager.get_user_permissions('1')
+    self.assertEqual(user_permissions['username'], 'test_admin')
+    self.assertEqual(user_permissions['loaded_at'], int(snapshot_store.load('permissions')[1]))
+    self.assertTrue(user_permissions['compiled_permissions'].allows('station_time', 'system'))
+    self.assertEqual(restored_manager.permissions.keys(), ['1'])
+
+  def test_compiled_permissions(self):
+    """ Verifies that CompiledPermissions correctly determines which commands a set of permission rules allows.
+    """
+
+    compiled_permissions = permissions.CompiledPermissions([
+      {'command': 'station_time', 'destination': 'system'},
+      {'command': 'move', 'destination': 'antenna', 'pipelines': ['pipeline_a']},
+      {'command': 'move', 'destination': 'antenna', 'pipelines': ['pipeline_b']},
+      {'command': 'park', 'destination': 'antenna', 'pipelines': ['pipeline_a']},
+      {'command': 'park', 'destination': 'antenna'}
+    ])
+
+    # Rules without pipeline restrictions allow the command through any pipeline (or none)
+    self.assertTrue(compiled_permissions.allows('station_time', 'system'))
+    self.assertTrue(compiled_permissions.allows('station_time', 'system', 'pipeline_a'))
+    self.assertTrue(compiled_permissions.allows('park', 'antenna', 'pipeline_c'))
+
+    # Pipeline restricted rules should be merged
+    self.assertTrue(compiled_permissions.allows('move', 'antenna', 'pipeline_a'))
+    self.assertTrue(compiled_permissions.allows('move', 'antenna', 'pipeline_b'))
+    self.assertTrue(not compiled_permissions.allows('move', 'antenna', 'pipeline_c'))
+    self.assertTrue(not compiled_permissions.allows('move', 'antenna'))
+
+    # Unknown commands and destinations
+    self.assertTrue(not compiled_permissions.allows('move', 'system'))
+    self.assertTrue(not compiled_permissions.allows('stop', 'antenna', 'pipeline_a'))
+
+  def test_compiled_permissions_reuse(self):
+    """ Verifies that a user's compiled permissions are only rebuilt when their 'generated_at' value changes.
+    """
+
+    # Initialize the permission manager
+    permission_manager = permissions.PermissionManager(self.source_data_directory+'/network/security/tests/data/test_permissions_valid.json', 3600)
+
+    def reload_complete(permission_settings, original_index, regenerated):
+      if regenerated:
+        self.assertTrue(permission_settings['compiled_permissions'] is not original_index)
+      else:
+        self.assertTrue(permission_settings['compiled_permissions'] is original_index)
+
+    def user_permissions_callback(permission_settings):
+      original_index = permission_settings['compiled_permissions']
+      self.assertTrue(original_index.allows('requires_session', 'test_device', 'test_pipeline'))
+      self.assertTrue(not original_index.allows('requires_session', 'test_device', 'test_pipeline3'))
+
+      # Reload the permissions without changing them
+      reload_deferred = permission_manager._update_user_permissions('1')
+      reload_deferred.addCallback(reload_complete, original_index, False)
+
+      # Pretend the saved permissions were generated earlier and reload them again
+      def mark_outdated(permission_settings):
+        permission_manager.permissions['1']['generated_at'] = 0
+        regenerated_deferred = permission_manager._update_user_permissions('1')
+        regenerated_deferred.addCallback(reload_complete, original_index, True)
+        return regenerated_deferred
+      reload_deferred.addCallback(mark_outdated)
+
+      return reload_deferred
+
+    # Force a file load
+    update_deferred = permission_manager.get_user_permissions('1')
+    update_deferred.addCallback(user_permissions_callback)
+
+    return update_deferred
@@ -0,0 +1,88 @@
+# Import required modules
+import logging
+from twisted.trial import unittest
+from hwm.network import codec
+
+class TestCodecs(unittest.TestCase):
+  """ This test suite verifies the functionality of the wire codecs, which encode and decode the messages sent over the
+  hardware manager's network connections.
+  """
+
+  def setUp(self):
+    self.msgpack_codec = codec.MessagePackCodec()
+
+    # Disable logging for most events
+    logging.disable(logging.CRITICAL)
+
+  def test_codec_lookup(self):
+    """ Verifies that codecs can be located by name and content type.
+    """
+
+    self.assertTrue(codec.get_codec('json') is codec.CODECS['json'])
+    self.assertRaises(codec.CodecNotFound, codec.get_codec, 'xml')
+    self.assertTrue(codec.get_codec_for_content_type('application/x-msgpack') is codec.CODECS['msgpack'])
+    self.assertEqual(isinstance(codec.CODECS['msgpack'], codec.NativeMessagePackCodec), codec.msgpack is not None)
+    self.assertTrue(codec.get_codec_for_content_type(' Application/JSON; charset=utf-8') is codec.CODECS['json'])
+    self.assertEqual(codec.get_codec_for_content_type('text/html'), None)
+    self.assertEqual(codec.get_codec_for_content_type(None), None)
+
+  def test_msgpack_round_trip(self):
+    """ Verifies that every supported type survives being encoded and decoded, including the boundaries between the
+    different MessagePack representations.
+    """
+
+    test_message = {
+      u'integers': [0, 127, 128, 255, 256, 65535, 65536, 2**32-1, 2**32, 2**64-1, -1, -32, -33, -128, -129, -32768, 
+                    -32769, -2**31, -2**31-1, -2**63],
+      u'floats': [0.0, -1.5, 1e300],
+      u'constants': [None, True, False],
+      u'strings': [u'', u'a'*31, u'b'*32, u'c'*256, u'd'*65536, u'\u00e9t\u00e9'],
+      u'nested': {u'list': [[], [{}]], u'map': dict((unicode(key_index), key_index) for key_index in range(20))},
+      u'long_list': range(70000)
+    }
+    self.assertEqual(self.msgpack_codec.decode(self.msgpack_codec.encode(test_message)), test_message)
+
+    # Plain strings should be decoded as unicode (like JSON), binary data should be decoded as strings
+    decoded_message = self.msgpack_codec.decode(self.msgpack_codec.encode(['text', codec.Binary('text'), '\xff\x00']))
+    self.assertEqual([type(decoded_value) for decoded_value in decoded_message], [unicode, str, str])
+    self.assertEqual(decoded_message, [u'text', 'text', '\xff\x00'])
+
+  def test_msgpack_format(self):
+    """ Verifies that values are encoded using the smallest MessagePack representation.
+    """
+
+    self.assertEqual(self.msgpack_codec.encode({'a': [1, -1, None]}), '\x81\xa1a\x93\x01\xff\xc0')
+    self.assertEqual(self.msgpack_codec.encode(200), '\xcc\xc8')
+    self.assertEqual(self.msgpack_codec.encode(-200), '\xd1\xff\x38')
+    self.assertEqual(self.msgpack_codec.encode(codec.Binary('ab')), '\xc4\x02ab')
+    self.assertEqual(self.msgpack_codec.encode(1.5), '\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00')
+
+  def test_msgpack_errors(self):
+    """ Verifies that invalid messages and unsupported values are rejected.
+    """
+
+    for invalid_message in ['', '\x92\x01', '\xa5abc', '\x01\x02', '\xc1', '\xd4\x01\x02', '\xa2\xff\xfe']:
+      self.assertRaises(codec.CodecError, self.msgpack_codec.decode, invalid_message)
+    self.assertRaises(codec.CodecError, self.msgpack_codec.decode, '\x91'*5000+'\xc0')
+    self.assertRaises(codec.CodecError, self.msgpack_codec.decode, '\x81\x00'*5000+'\xc0')
+    nested_array = None
+    for nesting_level in range(99):
+      nested_array = [nested_array]
+    self.assertEqual(self.msgpack_codec.decode('\x91'*99+'\xc0'), nested_array)
+    self.assertRaises(codec.CodecError, self.msgpack_codec.decode, '\x91'*101+'\xc0')
+    self.assertRaises(codec.CodecError, self.msgpack_codec.decode, '\x91'*100+'\x81\x00\x90')
+    self.assertRaises(codec.CodecError, self.msgpack_codec.encode, {'value': object()})
+    self.assertRaises(codec.CodecError, self.msgpack_codec.encode, 2**64)
+    self.assertRaises(codec.CodecError, codec.get_codec('json').decode, '{invalid')
+
+class TestNativeMessagePackCodec(TestCodecs):
+  """ This test suite runs the codec tests against the MessagePack codec that uses the msgpack package, which must 
+  produce the same messages as the pure Python implementation.
+  """
+
+  if codec.msgpack is None:
+    skip = "The msgpack package isn't installed."
+
+  def setUp(self):
+    TestCodecs.setUp(self)
+    self.msgpack_codec = codec.NativeMessagePackCodec()
@@ -37,6 +37,9 @@ class SessionCoordinator:
 
     # Register the session coordinator with the command parser so it can check command session requirements
     command_parser.session_coordinator = self
+
+    # Let the schedule compile the reservation setup commands when it's loaded
+    reservation_schedule.command_parser = command_parser
     
     # Initialize coordinator attributes
     self.active_sessions = {} # Sessions that are currently running or being prepared to run
@@ -174,9 +177,11 @@ class SessionCoordinator:
           continue
         
         # Create a session object for the newly active reservation
+        setup_program = self.schedule.setup_programs.get(active_reservation['reservation_id'], None)
         self.active_sessions[active_reservation['reservation_id']] = session.Session(active_reservation, 
                                                                                      requested_pipeline,
-                                                                                     self.command_parser)
+                                                                                     self.command_parser,
+                                                                                     setup_program)
         session_init_deferred = self.active_sessions[active_reservation['reservation_id']].start_session()
         session_init_deferred.addCallbacks(self._session_init_complete,
                                            errback = self._session_init_failed,
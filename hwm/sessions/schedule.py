@@ -5,11 +5,73 @@ This module contains a class that is used to fetch, maintain, and provide access
 """
 
 # Import required modules
-import logging, json, jsonschema, threading, urllib2, time
+import logging, json, jsonschema, threading, time
 from hwm.core.configuration import Configuration
-from twisted.internet import threads
+from hwm.core.validation import Validators
+from hwm.core import resources
+from twisted.internet import threads, defer
 from hwm.command import command
 
+# Define the schema that determines what a valid schedule looks like
+schedule_schema = {
+  "type": "object",
+  "$schema": "http://json-schema.org/draft-03/schema",
+  "required": True,
+  "properties": {
+    "generated_at": {
+      "type": "number",
+      "required": True
+    },
+    "reservations": {
+      "type": "array",
+      "required": True,
+      "items": {
+        "type": "object",
+        "additionalProperties": True,
+        "properties": {
+          "setup_commands": {
+            "type": "array",
+            "required": False,
+            "items": command.schema
+          },
+          "active_services": {
+            "type": "object",
+            "required": False,
+            "additionalProperties": {
+              "type": "string"
+            }
+          },
+          "pipeline_id": {
+            "type": "string",
+            "required": True
+          },
+          "time_end": {
+            "type": "number",
+            "required": True
+          },
+          "time_start": {
+            "type": "number",
+            "required": True
+          },
+          "reservation_id": {
+            "type": "string",
+            "required": True
+          },
+          "user_id": {
+            "type": "string",
+            "required": True
+          },
+          "username": {
+            "type": "string",
+            "required": True
+          }
+        }
+      }
+    }
+  }
+}
+Validators.register('schedule', schedule_schema)
+
 class ScheduleManager:
   """ Represents a reservation access schedule.
   
@@ -25,6 +87,12 @@ class ScheduleManager:
     @param schedule_endpoint  Where to load the reservation schedule from. This can either be a local file or a network 
                               address (such as the mercury2 user interface API). If it begins with 'http', it will be 
                               treated as a network address.
+
+    @note If the command_parser attribute is set (the SessionCoordinator sets it), each reservation's setup commands will
+          be compiled (see CommandParser.compile_program) when the schedule is loaded and stored in the setup_programs 
+          attribute, keyed by reservation ID.
+    @note If the snapshot_store attribute is set to a SnapshotStore, each newly loaded schedule will be saved to it so 
+          that it can be restored by load_snapshot when the hardware manager restarts.
     """
     
     # Set the local configuration object reference
@@ -36,6 +104,12 @@ class ScheduleManager:
     # Set the schedule parameters
     self.schedule_location = schedule_endpoint
     self.schedule = {}
+    self.schedule_fetcher = resources.ConditionalFetcher()
+    self.last_loaded_schedule = None
+    self.setup_programs = {}
+    self._setup_reservations = {}
+    self.command_parser = None
+    self.snapshot_store = None
     self.last_updated = 0
   
   def update_schedule(self):
@@ -44,26 +118,49 @@ class ScheduleManager:
     @note This method loads the schedule from the active source (either a local file or network address) and updates 
           the local copy using callbacks. If use_local_schedule is true, the schedule will be loaded from a local file 
           (specified in the configuration files). If it is false, it will be loaded from the user interface API.
+    @note If the schedule hasn't changed since it was last loaded, it won't be parsed or validated again and the
+          previously loaded schedule will be returned.
     
     @return Returns a deferred that will be called with the result of the file access (the schedule object or a 
             Failure).
     """
     
-    # Setup local variables
-    defer_download = None
-    
     # Attempt to download the schedule
-    if self.use_network_schedule:
-      defer_download = threads.deferToThread(self._download_remote_schedule)
-    else:
-      defer_download = threads.deferToThread(self._download_local_schedule)
+    defer_download = threads.deferToThread(self._download_schedule)
     
     # Add a callback to store the schedule
     defer_download.addCallback(self._validate_schedule)
+    defer_download.addErrback(self._schedule_update_failed)
     defer_download.addCallback(self._save_schedule)
     
     return defer_download
   
+  def load_snapshot(self):
+    """ Restores the schedule that was saved to the snapshot store by a previous run.
+
+    This method lets the session coordinator start reservations before the first schedule update finishes (or if the 
+    schedule can't be loaded). The restored schedule has already been validated, so it isn't validated again.
+
+    @note The schedule's update time isn't changed, so the schedule will still be updated as soon as possible.
+    @note This method is intended to be called during startup, before the reactor is running.
+
+    @return Returns True if a schedule was restored and False otherwise.
+    """
+
+    if self.snapshot_store is None:
+      return False
+
+    schedule_snapshot = self.snapshot_store.load('schedule')
+    if schedule_snapshot is None:
+      return False
+
+    self.last_loaded_schedule = schedule_snapshot[0]
+    self._store_reservations(schedule_snapshot[0])
+    logging.info("Restored a reservation schedule snapshot with "+str(len(schedule_snapshot[0]['reservations']))+
+                 " reservation(s).")
+
+    return True
+
   def get_active_reservations(self):
     """ Returns a list of the currently active reservations (by timestamp).
     
@@ -96,73 +193,16 @@ class ScheduleManager:
     
     @throw Throws ScheduleError if the schedule represented by schedule_load_result isn't valid.
     
-    @param schedule_load_result  The result of the attempted schedule download.
+    @param schedule_load_result  The result of the attempted schedule download. None if the schedule hasn't changed.
     @retun Returns a python object representing the new schedule.
     """
     
-    # Define the schema that determines what a valid schedule looks like
-    schedule_schema = {
-      "type": "object",
-      "$schema": "http://json-schema.org/draft-03/schema",
-      "required": True,
-      "properties": {
-        "generated_at": {
-          "type": "number",
-          "required": True
-        },
-        "reservations": {
-          "type": "array",
-          "required": True,
-          "items": {
-            "type": "object",
-            "additionalProperties": True,
-            "properties": {
-              "setup_commands": {
-                "type": "array",
-                "required": False,
-                "items": command.schema
-              },
-              "active_services": {
-                "type": "object",
-                "required": False,
-                "additionalProperties": {
-                  "type": "string"
-                }
-              },
-              "pipeline_id": {
-                "type": "string",
-                "required": True
-              },
-              "time_end": {
-                "type": "number",
-                "required": True
-              },
-              "time_start": {
-                "type": "number",
-                "required": True
-              },
-              "reservation_id": {
-                "type": "string",
-                "required": True
-              },
-              "user_id": {
-                "type": "string",
-                "required": True
-              },
-              "username": {
-                "type": "string",
-                "required": True
-              }
-            }
-          }
-        }
-      }
-    }
-    
+    if schedule_load_result is None:
+      return None
+
     # Validate the JSON schema
-    schema_validator = jsonschema.Draft3Validator(schedule_schema)
     try:
-      schema_validator.validate(schedule_load_result)
+      Validators.validate('schedule', schedule_load_result)
     except jsonschema.ValidationError:
       # Invalid schedule JSON
       logging.error("The provided schedule did not meet JSON schema requirements: "+self.schedule_location)
@@ -176,92 +216,154 @@ class ScheduleManager:
     @note This method is intended to be used as a callback for the deferred returned by the various schedule download 
           methods.
     
-    @param schedule_load_result  The result of the attempted schedule download.
+    @param schedule_load_result  The result of the attempted schedule download. None if the schedule hasn't changed.
     @return Returns a python object representing the new schedule. Note this returned schedule represents the raw JSON 
-            object before any filters or modifications have been applied.
+            object before any filters or modifications have been applied. If the reservation setup commands are being
+            compiled, it will be returned via a deferred that fires once they have been compiled.
     """
     
     # Set the update time
     self.last_updated = int(time.time())
+    if schedule_load_result is None:
+      return self.last_loaded_schedule
+    self.last_loaded_schedule = schedule_load_result
+
+    # Save a snapshot of the schedule in the background
+    if self.snapshot_store is not None:
+      snapshot_deferred = threads.deferToThread(self.snapshot_store.save, 'schedule', schedule_load_result)
+      snapshot_deferred.addErrback(self._snapshot_save_failed)
+
+    return self._store_reservations(schedule_load_result)
+
+  def _store_reservations(self, schedule_load_result):
+    """ Stores the reservations in a loaded schedule and compiles their setup commands.
+
+    @param schedule_load_result  A python object representing the schedule.
+    @return Returns the schedule, or a deferred that will be fired with it once the setup commands have been compiled.
+    """
     
     # Loop through the schedule and build the dictionary
+    self._setup_reservations = {}
     for schedule_reservation in schedule_load_result['reservations']:
       self.schedule[schedule_reservation['reservation_id']] = schedule_reservation
+      if schedule_reservation.get('setup_commands', None) is not None:
+        self._setup_reservations[schedule_reservation['reservation_id']] = schedule_reservation
+
+    # Discard the setup programs of reservations that have been removed from the schedule or whose setup commands (or 
+    # user) have changed, so that a session that starts before they are recompiled can't run the old commands
+    for reservation_id, setup_program in self.setup_programs.items():
+      if not self._setup_program_current(setup_program, reservation_id):
+        del self.setup_programs[reservation_id]
+
+    # Compile the setup commands that don't have a program
+    compile_deferreds = []
+    for reservation_id, schedule_reservation in self._setup_reservations.iteritems():
+      if self.command_parser is not None and reservation_id not in self.setup_programs:
+        compile_deferred = self.command_parser.compile_program(schedule_reservation['setup_commands'],
+                                                               user_id = schedule_reservation['user_id'])
+        compile_deferred.addCallback(self._save_setup_program, reservation_id)
+        compile_deferreds.append(compile_deferred)
+
+    if len(compile_deferreds) > 0:
+      compile_deferred = defer.DeferredList(compile_deferreds)
+      compile_deferred.addCallback(lambda compile_results: schedule_load_result)
+      return compile_deferred
     
     return schedule_load_result
+
+  def _save_setup_program(self, setup_program, reservation_id):
+    """ Stores a reservation's compiled setup commands.
+
+    @note Programs for reservations that were removed or changed while they were being compiled are discarded.
+
+    @param setup_program   The CommandProgram compiled from the reservation's setup commands.
+    @param reservation_id  The ID of the reservation that the program belongs to.
+    """
+
+    if not self._setup_program_current(setup_program, reservation_id):
+      return
+
+    if len(setup_program.errors) > 0:
+      logging.error("The setup commands for the reservation '"+reservation_id+"' contain "+
+                    str(len(setup_program.errors))+" command(s) that will fail when its session starts.")
+
+    self.setup_programs[reservation_id] = setup_program
   
-  def _download_remote_schedule(self):
-    """ Loads the schedule from the schedule's URL.
+  def _setup_program_current(self, setup_program, reservation_id):
+    """ Checks if a setup program was compiled from the current version of its reservation.
+
+    @param setup_program   The compiled CommandProgram.
+    @param reservation_id  The ID of the reservation that the program belongs to.
+    @return Returns True if the reservation is in the most recently loaded schedule and the program was compiled from 
+            its current setup commands on behalf of its current user, or False otherwise.
+    """
+
+    schedule_reservation = self._setup_reservations.get(reservation_id, None)
+
+    return (schedule_reservation is not None and
+            setup_program.raw_commands == schedule_reservation['setup_commands'] and
+            setup_program.user_id == schedule_reservation['user_id'])
+
+  def _snapshot_save_failed(self, failure):
+    """ Logs a schedule snapshot that couldn't be saved.
+
+    @param failure  The Failure describing the error.
+    """
+
+    logging.error("The reservation schedule snapshot could not be saved: "+failure.getErrorMessage())
+
+  def _download_schedule(self):
+    """ Loads the schedule from the schedule's location if it has changed.
     
-    This method loads the the schedule from a URL (e.g. the mercury2 user interface) and returns it.
+    This method loads the schedule from its URL (e.g. the mercury2 user interface) or from the local disk using the 
+    schedule's ConditionalFetcher and parses it.
     
-    @throw Throws ScheduleError if an error occurs while downloading or parsing the schedule.
+    @throw Throws ScheduleError if an error occurs while downloading, loading, or parsing the schedule.
     
     @note This method is intended to be called with threads.deferToThread. The returned schedule will be passed to the 
           resulting deferred's callback chain.
     
-    @return Returns a python object representing the downloaded schedule.
+    @return Returns a python object representing the schedule, or None if the schedule hasn't changed since it was 
+            last loaded.
     """
     
-    # Setup local variables
-    temp_schedule = None
-    schedule_file = None
-    
-    # Attempt to download the JSON file
+    # Attempt to load the schedule
     try:
-      schedule_request = urllib2.Request(self.schedule_location)
-      schedule_opener = urllib2.build_opener()
-      schedule_file = schedule_opener.open(schedule_request, None, self.config.get('schedule-update-timeout'))
-    except:
-      # Error downloading the file
-      logging.error("There was an error downloading the schedule: "+self.schedule_location)
-      raise ScheduleError('Could not download schedule from remote URL.')
+      if self.use_network_schedule:
+        schedule_content = self.schedule_fetcher.fetch(self.schedule_location,
+                                                       self.config.get('schedule-update-timeout'))
+      else:
+        schedule_content = self.schedule_fetcher.fetch(self.schedule_location)
+    except Exception:
+      # Error loading the file
+      if self.use_network_schedule:
+        logging.error("There was an error downloading the schedule: "+self.schedule_location)
+        raise ScheduleError('Could not download schedule from remote URL.')
+      else:
+        logging.error("There was an error loading the local schedule: "+self.schedule_location)
+        raise ScheduleError('Could not load the schedule from the local disk.')
+
+    if schedule_content is None:
+      return None
     
     # Parse the schedule JSON
     try:
-      temp_schedule = json.load(schedule_file)
+      return json.loads(schedule_content)
     except ValueError:
       # Error parsing the schedule JSON
-      logging.error("Schedule manager could not parse remote schedule file: "+self.schedule_location)
-      raise ScheduleError('Could not parse remote schedule file (invalid JSON).')
-    
-    return temp_schedule
-  
-  def _download_local_schedule(self):
-    """ Loads the schedule from the local disk.
-    
-    This method loads the local schedule from the disk and returns it.
-    
-    @throw Throws ScheduleError if an error occurs while loading or parsing the schedule.
-    
-    @note The schedule file is passed to the constructor and specified by self.schedule_location.
-    @note This method is intended to be called with threads.deferToThread. The returned schedule will be passed to the 
-          resulting deferred's callback chain.
+      logging.error("Schedule manager could not parse schedule file: "+self.schedule_location)
+      raise ScheduleError('Could not parse schedule file (invalid JSON).')
+
+  def _schedule_update_failed(self, failure):
+    """ Makes sure that a schedule that couldn't be used is loaded again by the next update.
     
-    @return Returns a python object representing the schedule if successful.
+    @param failure  The Failure describing why the update failed.
+    @return Returns the failure so that it's passed on to the rest of the errback chain.
     """
     
-    # Setup local variables
-    schedule_file = None
-    temp_schedule = None
-    
-    # Attempt to open the schedule file
-    try:
-      schedule_file = open(self.schedule_location, 'r')
-    except IOError:
-      # Error loading the schedule file
-      logging.error("There was an error loading the local schedule: "+self.schedule_location)
-      raise ScheduleError('Could not load the schedule from the local disk.')
-    
-    # Parse the schedule JSON
-    try:
-      temp_schedule = json.load(schedule_file)
-    except ValueError:
-      # Error parsing the schedule JSON
-      logging.error("Schedule manager could not parse schedule file: "+self.schedule_location)
-      raise ScheduleError('Could not parse local schedule file (invalid JSON).')
+    self.schedule_fetcher.invalidate(self.schedule_location)
     
-    return temp_schedule
+    return failure
 
 # Define schedule related exceptions
 class ScheduleError(Exception):
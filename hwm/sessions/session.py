@@ -17,7 +17,7 @@ class Session:
   as needed.
   """
   
-  def __init__(self, reservation_configuration, session_pipeline, command_parser):
+  def __init__(self, reservation_configuration, session_pipeline, command_parser, setup_program = None):
     """ Initializes the new session.
     
     @note The provided pipeline is not locked when it is passed in. self.start_session needs to be called to lock up the
@@ -27,6 +27,9 @@ class Session:
                                       with this session.
     @param session_pipeline           The Pipeline that this session will use.
     @param command_parser             The CommandParser that will be used to execute the session setup commands.
+    @param setup_program              The CommandProgram compiled from the reservation's setup commands when the 
+                                      schedule was loaded (see ScheduleManager.setup_programs), if any. If None, the 
+                                      setup commands will be parsed when the session starts.
     """
     
     # Set the session attributes
@@ -39,6 +42,7 @@ class Session:
       self.setup_commands = reservation_configuration['setup_commands']
     else:
       self.setup_commands = None
+    self.setup_program = setup_program
     self.data_protocols = []
     self.telemetry_protocols = []
 
@@ -253,6 +257,10 @@ class Session:
     
     running_setup_commands = []
 
+    # Run the compiled session setup commands
+    if self.setup_program is not None:
+      return defer.DeferredList(self.command_parser.run_program(self.setup_program), consumeErrors = True)
+
     # Run the session setup commands
     if self.setup_commands is not None:
       for temp_command in self.setup_commands:
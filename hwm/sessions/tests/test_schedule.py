@@ -1,6 +1,10 @@
 # Import required modules
 from twisted.trial import unittest
+from twisted.internet import defer, threads
+from twisted.internet.defer import inlineCallbacks
+from mock import MagicMock
 from hwm.sessions import schedule
+from hwm.core import snapshots
 from pkg_resources import Requirement, resource_filename
 import logging
 
@@ -35,6 +39,91 @@ class TestSchedule(unittest.TestCase):
     
     return update_deferred
   
+  @inlineCallbacks
+  def test_local_file_load_unchanged(self):
+    """ Verifies that the schedule manager doesn't parse or validate the schedule again if it hasn't changed.
+    """
+
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    first_schedule = yield schedule_manager.update_schedule()
+
+    schedule_manager.last_updated = 0
+    schedule_manager._save_schedule = MagicMock(wraps=schedule_manager._save_schedule)
+    second_schedule = yield schedule_manager.update_schedule()
+    self.assertTrue(second_schedule is first_schedule)
+    self.assertEqual(schedule_manager._save_schedule.call_args[0][0], None)
+    self.assertTrue(schedule_manager.last_updated > 0)
+
+  @inlineCallbacks
+  def test_snapshot_warm_start(self):
+    """ Verifies that loaded schedules are saved to the snapshot store and can be restored by a new schedule manager
+    without being loaded from their source.
+    """
+
+    # Save the snapshots synchronously
+    self.patch(threads, 'deferToThread', defer.maybeDeferred)
+    snapshot_store = snapshots.SnapshotStore(self.mktemp())
+
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    schedule_manager.snapshot_store = snapshot_store
+    loaded_schedule = yield schedule_manager.update_schedule()
+
+    # Restore the schedule from a location that doesn't exist
+    restored_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_doesnt_exist.json')
+    self.assertTrue(not restored_manager.load_snapshot())
+    restored_manager.snapshot_store = snapshot_store
+    self.assertTrue(restored_manager.load_snapshot())
+    self.assertEqual(restored_manager.last_loaded_schedule, loaded_schedule)
+    self.assertEqual(sorted(restored_manager.schedule.keys()), sorted(schedule_manager.schedule.keys()))
+    self.assertEqual(restored_manager.last_updated, 0)
+
+  @inlineCallbacks
+  def test_setup_program_pruning(self):
+    """ Verifies that the compiled setup programs of reservations that are no longer in the schedule (or whose setup 
+    commands or user have changed) are discarded when a new schedule is loaded, even if they are still being compiled.
+    """
+
+    compile_deferreds = []
+    def mock_compile_program(setup_commands, user_id = None):
+      compile_deferreds.append(defer.Deferred())
+      compile_deferreds[-1].addCallback(lambda compile_results: MagicMock(raw_commands = setup_commands,
+                                                                           user_id = user_id, errors = []))
+      return compile_deferreds[-1]
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    schedule_manager.command_parser = MagicMock()
+    schedule_manager.command_parser.compile_program.side_effect = mock_compile_program
+
+    # Compile the setup commands for three reservations
+    test_commands = [{'command': 'station_time', 'destination': 'system'}]
+    test_reservations = [{'reservation_id': 'RES.'+str(reservation_index), 'user_id': '1',
+                          'setup_commands': test_commands} for reservation_index in range(3)]
+    store_deferred = schedule_manager._store_reservations({'reservations': test_reservations})
+    for compile_deferred in compile_deferreds:
+      compile_deferred.callback(None)
+    yield store_deferred
+    self.assertEqual(sorted(schedule_manager.setup_programs.keys()), ['RES.0', 'RES.1', 'RES.2'])
+
+    # Remove one reservation, the setup commands of another, and change the user of the third
+    updated_reservations = [{'reservation_id': 'RES.0', 'user_id': '2', 'setup_commands': test_commands},
+                            {'reservation_id': 'RES.1', 'user_id': '1'}]
+    store_deferred = schedule_manager._store_reservations({'reservations': updated_reservations})
+    self.assertEqual(schedule_manager.setup_programs, {})
+    compile_deferreds[-1].callback(None)
+    yield store_deferred
+    self.assertEqual(schedule_manager.setup_programs['RES.0'].user_id, '2')
+    self.assertEqual(schedule_manager.command_parser.compile_program.call_count, 4)
+
+    # Programs that finish compiling after their reservation has changed should be discarded
+    changed_commands = [{'command': 'device_queues', 'destination': 'system'}]
+    schedule_manager._store_reservations({'reservations': [dict(updated_reservations[0], setup_commands = test_commands+
+                                                                changed_commands)]})
+    schedule_manager._store_reservations({'reservations': [dict(updated_reservations[0],
+                                                                setup_commands = changed_commands)]})
+    compile_deferreds[-2].callback(None)
+    self.assertEqual(schedule_manager.setup_programs, {})
+    compile_deferreds[-1].callback(None)
+    self.assertEqual(schedule_manager.setup_programs['RES.0'].raw_commands, changed_commands)
+
   def test_local_file_load_invalid_schema(self):
     """Verifies that ScheduleManager rejects schedules that don't fit the schedule schema requirements (see included 
     documentation for requirements).
@@ -8,7 +8,7 @@ from hwm.core.configuration import *
 from hwm.hardware.pipelines import pipeline, manager as pipeline_manager
 from hwm.hardware.devices import manager as device_manager
 from hwm.hardware.devices.drivers import driver
-from hwm.command import parser, command
+from hwm.command import parser, command, metadata
 from hwm.command.handlers import system as command_handler
 from hwm.network.security import permissions
 from pkg_resources import Requirement, resource_filename
@@ -369,6 +369,11 @@ class TestSession(unittest.TestCase):
     for device_id in test_pipeline.devices:
       test_pipeline.devices[device_id].prepare_for_session = MagicMock()
 
+    # Give the mock device command handler (used by the pipeline setup commands) real command meta-data
+    mock_command_handler = self.pipeline_manager.get_pipeline.return_value.get_device.return_value.get_command_handler()
+    mock_command_handler.settings_device_time.return_value = metadata.build_metadata_dict([], 'device_time',
+                                                                                          'test_device')
+
     # Define a callback to check the results of the session start procedure
     def check_results(session_start_results, test_session):
       self.assertEqual(session_start_results, None)
@@ -457,6 +462,51 @@ class TestSession(unittest.TestCase):
 
     return schedule_update_deferred
 
+  def test_session_startup_compiled_setup_commands(self):
+    """ Tests that the schedule manager compiles the reservation setup commands when the schedule is loaded and that 
+    sessions started with the compiled commands get the same results as sessions that parse them on startup. This uses 
+    the same reservation as test_session_startup_setup_commands_mixed_success.
+    """
+
+    # Setup the pipeline manager and load the test pipeline
+    self.pipeline_manager = pipeline_manager.PipelineManager(self.device_manager, self.command_parser)
+    test_pipeline = self.pipeline_manager.get_pipeline("test_pipeline")
+    self.assertTrue(test_pipeline.setup_program is not None)
+
+    # Define a callback to check the results of the session start procedure
+    def check_results(session_start_results, test_session):
+      self.assertTrue(test_pipeline.current_session is test_session)
+      self.assertEqual([command_results[0] for command_results in session_start_results], [True, False, True, False])
+      self.assertTrue('timestamp' in session_start_results[0][1]['response']['result'])
+      self.assertTrue(isinstance(session_start_results[1][1].value, parser.CommandFailed))
+      self.assertTrue('some_results' in session_start_results[2][1]['response']['result'])
+      self.assertTrue(isinstance(session_start_results[3][1].value, parser.CommandFailed))
+      self.assertTrue(test_session.is_active)
+
+    # Define a callback to continue the test after the schedule has been loaded
+    def continue_test(reservation_schedule, schedule_manager):
+      # Make sure the setup commands were compiled and that the problems that can be detected early were reported
+      setup_program = schedule_manager.setup_programs['RES.2']
+      self.assertEqual(len(setup_program.steps), 4)
+      self.assertTrue(len(setup_program.errors) > 0)
+
+      # Start a session using the compiled setup commands
+      test_reservation_config = self._load_reservation_config(reservation_schedule, 'RES.2')
+      test_session = session.Session(test_reservation_config, test_pipeline, self.command_parser, setup_program)
+      self.command_parser.parse_command = MagicMock(side_effect = TestSessionError("A setup command was parsed."))
+      session_start_deferred = test_session.start_session()
+      session_start_deferred.addCallback(check_results, test_session)
+
+      return session_start_deferred
+
+    # Load the test schedule, compiling its setup commands
+    schedule_manager = schedule.ScheduleManager(self.source_data_directory+'/sessions/tests/data/test_schedule_valid.json')
+    schedule_manager.command_parser = self.command_parser
+    schedule_update_deferred = schedule_manager.update_schedule()
+    schedule_update_deferred.addCallback(continue_test, schedule_manager)
+
+    return schedule_update_deferred
+
   def _load_test_schedule(self):
     """ Loads a valid test schedule and returns a deferred that will be fired once that schedule has been loaded and 
     parsed. This schedule is used to test the Session class.